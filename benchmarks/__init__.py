@@ -0,0 +1,5 @@
+"""
+Benchmarks of dbc_influxdb against a local InfluxDB stand-in
+
+Run with `python -m benchmarks.run`, see `benchmarks/run.py`.
+"""
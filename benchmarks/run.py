@@ -0,0 +1,254 @@
+"""
+Benchmark suite: throughput and peak memory of uploads, downloads and deletes
+
+Each case generates a synthetic data file (see `benchmarks.synthetic`) and
+measures, against a local InfluxDB stand-in (see `benchmarks.standin`):
+
+    upload        dbcInflux.upload_singlevar() for each variable
+    varscanner    VarScanner.run() for the whole file
+    download      dbcInflux.download() of all variables
+    delete        dbcInflux.delete() of all variables
+
+The stand-in runs in a separate process so that only the client is
+measured. Peak memory is the peak of memory allocated by Python during the
+operation (tracemalloc), tracing slows down the operations but in the same
+way in each run. Results are written as JSON. If a baseline is given,
+operations with lower throughput or higher peak memory than in the baseline
+(more than *tolerance*) are reported and the exit code is 1.
+
+Usage:
+    python -m benchmarks.run --profile quick --output results.json
+    python -m benchmarks.run --profile full --baseline results-v0.14.0.json
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from importlib import metadata
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.standin import serve
+from benchmarks.synthetic import file_frame, filetype_config, unitmapper, var_frames, write_dirconf
+from dbc_influxdb.main import dbcInflux
+from dbc_influxdb.varscanner import VarScanner
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+@dataclass(frozen=True)
+class Case:
+    """One data file: frequency, number of records and number of variables"""
+    freq: str
+    periods: int
+    n_vars: int
+
+    @property
+    def name(self) -> str:
+        return f'{self.freq}-{self.n_vars}vars-{self.periods}'
+
+
+PROFILES = {
+    'quick': [Case('30min', 1_440, 10), Case('10s', 8_640, 10), Case('30min', 336, 100)],
+    'full': [Case('30min', 17_520, 10), Case('30min', 17_520, 100), Case('30min', 17_520, 1000),
+             Case('10s', 8_640, 10), Case('10s', 8_640, 100), Case('10s', 8_640, 1000)],
+}
+
+
+@dataclass
+class Result:
+    """Measurement of one operation in one case"""
+    case: str
+    operation: str
+    freq: str
+    variables: int
+    points: int
+    seconds: float
+    points_per_second: float
+    peak_traced_mb: float = None  # Peak memory allocated by Python during the operation
+    max_rss_mb: float = None  # Peak resident memory of the process so far
+    phases: dict = field(default_factory=dict)
+
+    @property
+    def key(self) -> tuple:
+        return self.case, self.operation
+
+
+def _max_rss_mb() -> float or None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024  # Bytes on macOS, KiB on Linux
+
+
+def measure(func, trace_memory: bool = True) -> tuple[object, float, float or None]:
+    """Run *func* and return its result, duration (seconds) and peak traced memory (MB)"""
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    tic = time.perf_counter()
+    try:
+        value = func()
+    finally:
+        seconds = time.perf_counter() - tic
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+    return value, seconds, peak
+
+
+class _SilentLogger:
+    def info(self, msg):
+        pass
+
+
+def run_case(case: Case, dbc: dbcInflux, conf_db: dict, trace_memory: bool = True) -> list[Result]:
+    file_df = file_frame(n_vars=case.n_vars, periods=case.periods, freq=case.freq)
+    frames = var_frames(file_df=file_df, freq=case.freq)
+    data_vars, filetypeconf = filetype_config(file_df=file_df)
+    bucket = f'bench-{case.name}'
+    start = str(file_df.index[0].tz_localize(None))
+    stop = str(file_df.index[-1].tz_localize(None) + pd.Timedelta(case.freq))
+    points = sum(len(var_df) for var_df, _ in frames)
+    results = []
+
+    def result(operation: str, n_points: int, seconds: float, peak: float, phases: dict) -> Result:
+        r = Result(case=case.name, operation=operation, freq=case.freq, variables=case.n_vars,
+                   points=n_points, seconds=seconds, points_per_second=n_points / seconds if seconds else 0.0,
+                   peak_traced_mb=peak, max_rss_mb=_max_rss_mb(), phases=phases)
+        print(f"{r.case:<28} {r.operation:<12} {r.points:>10} points  {r.seconds:8.2f}s  "
+              f"{r.points_per_second:>12,.0f} points/s  "
+              f"peak {r.peak_traced_mb or float('nan'):8.1f} MB")
+        return r
+
+    def upload():
+        phases = {}
+        for var_df, measurement in frames:
+            report = dbc.upload_singlevar(var_df=var_df.copy(), to_bucket=bucket, to_measurement=measurement,
+                                          timezone_offset_to_utc_hours=1)
+            for phase, seconds in report.stats.phases.items():
+                phases[phase] = phases.get(phase, 0.0) + seconds
+        return phases
+
+    phases, seconds, peak = measure(upload, trace_memory=trace_memory)
+    results.append(result('upload', points, seconds, peak, phases))
+
+    scanner = VarScanner(file_df=file_df, data_vars=data_vars, data_raw_freq=case.freq, freq=case.freq,
+                         config_filetype=filetypeconf['filetype'], filetypeconf=filetypeconf,
+                         conf_unitmapper=unitmapper(), to_bucket=f'{bucket}-varscanner', conf_db=conf_db,
+                         logger=_SilentLogger())
+    _, seconds, peak = measure(scanner.run, trace_memory=trace_memory)
+    results.append(result('varscanner', scanner.stats.counts.get('points', 0), seconds, peak,
+                          dict(scanner.stats.phases)))
+
+    (_, data_detailed, _), seconds, peak = measure(
+        lambda: dbc.download(bucket=bucket, start=start, stop=stop, timezone_offset_to_utc_hours=1),
+        trace_memory=trace_memory)
+    downloaded = sum(len(df) for df in data_detailed.values())
+    if downloaded != points:
+        raise AssertionError(f"Downloaded {downloaded} points from {bucket}, but uploaded {points}.")
+    results.append(result('download', downloaded, seconds, peak, dict(dbc.last_stats.phases)))
+
+    delete_result, seconds, peak = measure(
+        lambda: dbc.delete(bucket=bucket, measurements=True, start=start, stop=stop,
+                           timezone_offset_to_utc_hours=1, data_version='raw', fields=True),
+        trace_memory=trace_memory)
+    delete_result.raise_for_failures()
+    results.append(result('delete', points, seconds, peak, dict(delete_result.stats.phases)))
+    return results
+
+
+def environment() -> dict:
+    try:
+        version = metadata.version('dbc-influxdb')
+    except metadata.PackageNotFoundError:
+        version = 'unknown'
+    return dict(dbc_influxdb=version, python=platform.python_version(), platform=platform.platform(),
+                pandas=pd.__version__, influxdb_client=metadata.version('influxdb-client'))
+
+
+def compare(results: list[Result], baseline: dict, tolerance: float = 0.2) -> list[str]:
+    """Regressions of *results* compared to *baseline* (contents of a results file)
+
+    Returns:
+        list of messages, one per operation with lower throughput or higher
+        peak memory than in the baseline by more than *tolerance* (fraction)
+    """
+    previous = {(r['case'], r['operation']): r for r in baseline.get('results', [])}
+    regressions = []
+    for r in results:
+        base = previous.get(r.key)
+        if not base:
+            continue
+        if r.points_per_second < base['points_per_second'] * (1 - tolerance):
+            regressions.append(f"{r.case} {r.operation}: throughput {r.points_per_second:,.0f} points/s, "
+                               f"baseline {base['points_per_second']:,.0f} points/s")
+        if r.peak_traced_mb and base.get('peak_traced_mb') and \
+                r.peak_traced_mb > base['peak_traced_mb'] * (1 + tolerance):
+            regressions.append(f"{r.case} {r.operation}: peak memory {r.peak_traced_mb:.1f} MB, "
+                               f"baseline {base['peak_traced_mb']:.1f} MB")
+    return regressions
+
+
+def run(cases: list[Case], latency: float = 0.0, trace_memory: bool = True) -> list[Result]:
+    """Run all *cases* against a stand-in in a separate process"""
+    context = multiprocessing.get_context('spawn')
+    url_queue = context.Queue()
+    process = context.Process(target=serve, args=(url_queue, latency), daemon=True)
+    process.start()
+    try:
+        conf_db = dict(url=url_queue.get(timeout=60), token='standin-token', org='standin')
+        with tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db=conf_db)
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            results = []
+            for case in cases:
+                results += run_case(case=case, dbc=dbc, conf_db=conf_db, trace_memory=trace_memory)
+    finally:
+        process.terminate()
+        process.join()
+    return results
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    parser.add_argument('--output', default='benchmark-results.json', help="results file (JSON)")
+    parser.add_argument('--baseline', help="results file of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed loss of throughput or increase of peak memory (fraction)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to each request")
+    parser.add_argument('--no-trace-memory', action='store_true', help="do not measure peak memory")
+    args = parser.parse_args(argv)
+
+    results = run(cases=PROFILES[args.profile], latency=args.latency, trace_memory=not args.no_trace_memory)
+    output = dict(created=pd.Timestamp.now(tz='UTC').isoformat(), profile=args.profile, latency=args.latency,
+                  environment=environment(), results=[asdict(r) for r in results])
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=1)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results=results, baseline=json.load(f), tolerance=args.tolerance)
+        for message in regressions:
+            print(f"(!)REGRESSION: {message}")
+        if regressions:
+            return 1
+        print(f"No regressions compared to {args.baseline}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
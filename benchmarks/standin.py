@@ -0,0 +1,694 @@
+"""
+Local stand-in for the InfluxDB v2 HTTP API
+
+Implements enough of the API for the requests sent by dbc_influxdb, so
+that uploads, downloads and deletes can be run and measured without a
+database server:
+
+    GET  /ping             health check
+    POST /api/v2/write     line protocol (optionally gzipped), any precision
+    POST /api/v2/query     Flux queries built with `FluxQuery`: from, range,
+                           filter (== / or-chains and anchored regex), keep,
+                           drop and pivot, results as annotated CSV; the
+                           continuous aggregates of `dbc_influxdb.aggregates`
+                           (timeShift, aggregateWindow, set, to, group + count),
+                           count() per series (download estimates) and the
+                           checksums of `dbc_influxdb.verify` (window + reduce)
+    POST /api/v2/delete    time range and predicate (`key="value" AND ...`)
+    GET  /api/v2/orgs      the organization of `conf_db()`
+    GET, POST /api/v2/buckets, GET, POST, PATCH, DELETE /api/v2/tasks
+                           buckets and tasks are stored, tasks are never run
+
+All data are kept in memory. Flux functions that are not implemented
+(e.g. `mean()` or schema queries) are answered with HTTP 400, so a
+benchmark never silently measures a wrong result.
+
+Example:
+    with InfluxStandIn() as server:
+        dbc = dbcInflux(dirconf=write_dirconf(folder, conf_db=server.conf_db()))
+"""
+import gzip
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+# Nanoseconds per unit of the write precision
+PRECISION_NS = {'ns': 1, 'us': 1_000, 'ms': 1_000_000, 's': 1_000_000_000}
+
+_ESCAPED = re.compile(r'\\(.)')
+_BUCKET = re.compile(r'from\(bucket:\s*"((?:[^"\\]|\\.)*)"\)')
+_RANGE = re.compile(r'range\(start:\s*([^,]+),\s*stop:\s*(now\(\)|[^)]+)\)')
+_EQUALS = re.compile(r'r\["((?:[^"\\]|\\.)*)"\]\s*==\s*"((?:[^"\\]|\\.)*)"')
+_REGEX = re.compile(r'r\["((?:[^"\\]|\\.)*)"\]\s*=~\s*/(.*)/\s*\)$')
+_COLUMNS = re.compile(r'columns:\s*\[(.*?)\]')
+_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_PREDICATE = re.compile(r'(\w+)\s*=\s*"((?:[^"\\]|\\.)*)"')
+_COLUMN_EQUALS = re.compile(r'^filter\(fn: \(r\) => r\["_field"\] == r\["((?:[^"\\]|\\.)*)"\]\)$')
+_ARGUMENT = re.compile(r'(\w+):\s*("(?:[^"\\]|\\.)*"|[^,)]+)')
+_FIELD_RANGE = re.compile(r'\(r\["_field"\] == "((?:[^"\\]|\\.)*)" '
+                          r'(?:and r\["data_version"\] == "((?:[^"\\]|\\.)*)" )?'
+                          r'and r\["_time"\] >= ([^\s)]+) and r\["_time"\] <= ([^\s)]+)\)')
+_TASK_OPTION = re.compile(r'option task = \{name: "((?:[^"\\]|\\.)*)", every: (\w+)')
+
+_DURATION = re.compile(r'(\d+)(ns|us|ms|d|h|m|s)')
+_DURATION_NS = dict(ns=1, us=1_000, ms=1_000_000, s=1_000_000_000, m=60_000_000_000, h=3_600_000_000_000,
+                    d=86_400_000_000_000)
+
+ORG = dict(id='0000000000000001', name='standin')
+
+# Functions of aggregateWindow()
+CHECKSUMS = ('count', 'sum', 'min', 'max')  # Columns of the checksums of `dbc_influxdb.verify`
+AGGREGATES = ('mean', 'sum', 'min', 'max', 'count', 'first', 'last', 'median')
+
+
+class StandInError(Exception):
+    """Request that the stand-in does not support, answered with HTTP 400"""
+
+
+def _unescape(text: str) -> str:
+    return _ESCAPED.sub(r'\1', text) if '\\' in text else text
+
+
+def _split_unescaped(text: str, sep: str, quoted_strings: bool = False) -> list[str]:
+    """Split *text* at *sep* that is not escaped (and not inside a string, if *quoted_strings*)"""
+    parts = []
+    start = 0
+    quoted = False
+    ix = 0
+    while ix < len(text):
+        c = text[ix]
+        if c == '\\':
+            ix += 2
+            continue
+        if quoted_strings and c == '"':
+            quoted = not quoted
+        elif c == sep and not quoted:
+            parts.append(text[start:ix])
+            start = ix + 1
+        ix += 1
+    parts.append(text[start:])
+    return parts
+
+
+def _field_value(text: str):
+    if text.startswith('"'):
+        return _unescape(text[1:-1])
+    if text[-1] in 'iu' and text[:-1].lstrip('-').isdigit():
+        return int(text[:-1])
+    if text in ('t', 'T', 'true', 'True', 'TRUE'):
+        return True
+    if text in ('f', 'F', 'false', 'False', 'FALSE'):
+        return False
+    return float(text)
+
+
+def parse_line(line: str) -> tuple[str, tuple, dict, int or None]:
+    """Parse one line of line protocol
+
+    Returns:
+        measurement, tags as sorted tuple of (key, value) pairs, fields as
+        dict and the timestamp (None if not given)
+    """
+    if '\\' not in line and '"' not in line:
+        # Fast path, nothing is escaped or quoted
+        parts = line.split(' ')
+        key, fieldset, timestamp = parts if len(parts) == 3 else (parts[0], parts[1], None)
+        measurement, *tagset = key.split(',')
+        tags = tuple(sorted(tuple(t.split('=', 1)) for t in tagset))
+        fields = {k: _field_value(v) for k, v in (f.split('=', 1) for f in fieldset.split(','))}
+        return measurement, tags, fields, int(timestamp) if timestamp else None
+
+    key = _split_unescaped(line, ' ')[0]
+    rest = line[len(key) + 1:]
+    fieldset, _, timestamp = rest.rpartition(' ')
+    if not timestamp.lstrip('-').isdigit():
+        fieldset, timestamp = rest, None
+    measurement, *tagset = _split_unescaped(key, ',')
+    tags = []
+    for tag in tagset:
+        k, v = _split_unescaped(tag, '=')[:2]
+        tags.append((_unescape(k), _unescape(v)))
+    fields = {}
+    for f in _split_unescaped(fieldset, ',', quoted_strings=True):
+        k, v = _split_unescaped(f, '=', quoted_strings=True)[:2]
+        fields[_unescape(k)] = _field_value(v)
+    return _unescape(measurement), tuple(sorted(tags)), fields, int(timestamp) if timestamp else None
+
+
+def _duration_ns(text: str) -> int:
+    """Flux duration, e.g. '30m', '1d' or '-59m59s'"""
+    text = text.strip()
+    sign = -1 if text.startswith('-') else 1
+    return sign * sum(int(n) * _DURATION_NS[unit] for n, unit in _DURATION.findall(text))
+
+
+def _arguments(function: str) -> dict:
+    """Named arguments of a Flux function call, strings are unquoted"""
+    args = function.split('(', 1)[1].rsplit(')', 1)[0]
+    return {k: _unescape(v[1:-1]) if v.startswith('"') else v.strip() for k, v in _ARGUMENT.findall(args)}
+
+
+def _timestamp_ns(text: str) -> int:
+    """Absolute RFC3339 timestamp, now() or duration relative to now, e.g. '-30d'"""
+    text = text.strip()
+    if text == 'now()':
+        return time.time_ns()
+    if text.startswith('-') and text[-1].isalpha():
+        return time.time_ns() - pd.Timedelta(text[1:]).value
+    return pd.Timestamp(text).value
+
+
+def _rfc3339(times_ns: np.ndarray) -> np.ndarray:
+    times = np.asarray(times_ns, dtype='int64').astype('datetime64[ns]')
+    unit = 's' if not (np.asarray(times_ns) % 1_000_000_000).any() else 'ns'
+    return np.char.add(np.datetime_as_string(times, unit=unit), 'Z')
+
+
+def _datatype(values: list) -> str:
+    sample = next((v for v in values if v is not None), 0.0)
+    if isinstance(sample, bool):
+        return 'boolean'
+    if isinstance(sample, int):
+        return 'long'
+    if isinstance(sample, str):
+        return 'string'
+    return 'double'
+
+
+def _csv_column(values: pd.Series, datatype: str) -> pd.Series:
+    if datatype == 'boolean':
+        return values.map({True: 'true', False: 'false'})
+    if datatype == 'long':
+        return values.astype('Int64')
+    return values
+
+
+class Query:
+    """Parsed Flux query, as compiled by `dbc_influxdb.fluxql.FluxQuery`"""
+
+    def __init__(self, flux: str):
+        self.flux = ' '.join(flux.split())
+        match = _BUCKET.search(self.flux)
+        if not match:
+            raise StandInError(f"Query not supported by stand-in: {self.flux[:200]}")
+        self.bucket = _unescape(match.group(1))
+        self.start = None
+        self.stop = None
+        self.filters = []  # (column, function that accepts the column value)
+        self.keep = None
+        self.drop = set()
+        self.pivot = False
+        self.field_equals = None  # Tag that must have the same value as the field name
+        self.shift = 0  # Nanoseconds, timeShift()
+        self.window = None  # (every, offset, fn) of aggregateWindow(), in nanoseconds
+        self.complete_windows = False  # Windows that end with the range are removed
+        self.sets = {}  # Tag values set with set()
+        self.to = None  # Bucket the results are written to
+        self.count = False  # Only the number of results is returned, group() |> count()
+        self.series_count = False  # Number of points per series, count()
+        self.field_ranges = None  # Time ranges per field and data version, filter of `dbc_influxdb.verify`
+        self.checksum_every = None  # Nanoseconds, window() |> reduce() of `dbc_influxdb.verify`
+        for function in self.flux[match.end():].split('|>')[1:]:
+            self._add_function(function.strip())
+        if self.start is None:
+            raise StandInError("Query without range() is not supported by InfluxDB.")
+
+    def _add_function(self, function: str):
+        name = function.split('(', 1)[0]
+        if name == 'range':
+            start, stop = _RANGE.search(function).groups()
+            self.start, self.stop = _timestamp_ns(start), _timestamp_ns(stop)
+        elif name == 'filter':
+            if function == 'filter(fn: (r) => r["_time"] < r["_stop"])':
+                self.complete_windows = True
+                return
+            if 'r["_time"] >=' in function:
+                self.field_ranges = [(_unescape(f), _unescape(v) if v else None, _timestamp_ns(a), _timestamp_ns(b))
+                                     for f, v, a, b in _FIELD_RANGE.findall(function)]
+                return
+            column_equals = _COLUMN_EQUALS.match(function)
+            if column_equals:
+                self.field_equals = _unescape(column_equals.group(1))
+                return
+            regex = _REGEX.search(function)
+            if regex:
+                pattern = re.compile(regex.group(2).replace('\\/', '/'))
+                self.filters.append((_unescape(regex.group(1)),
+                                     lambda v, p=pattern: v is not None and bool(p.match(v))))
+                return
+            conditions = _EQUALS.findall(function)
+            columns = {c for c, _ in conditions}
+            if len(columns) != 1:
+                raise StandInError(f"Filter not supported by stand-in: {function}")
+            values = {_unescape(v) for _, v in conditions}
+            self.filters.append((_unescape(columns.pop()), lambda v, s=values: v in s))
+        elif name == 'keep':
+            self.keep = {_unescape(c) for c in _STRING.findall(_COLUMNS.search(function).group(1))}
+        elif name == 'drop':
+            self.drop |= {_unescape(c) for c in _STRING.findall(_COLUMNS.search(function).group(1))}
+        elif name == 'pivot':
+            self.pivot = True
+        elif name == 'timeShift':
+            self.shift = _duration_ns(_arguments(function)['duration'])
+        elif name == 'aggregateWindow':
+            args = _arguments(function)
+            if args.get('createEmpty') != 'false' or args.get('fn') not in AGGREGATES:
+                raise StandInError(f"aggregateWindow() not supported by stand-in: {function}")
+            self.window = (_duration_ns(args['every']), _duration_ns(args.get('offset', '0s')), args['fn'])
+        elif name == 'window':
+            self.checksum_every = _duration_ns(_arguments(function)['every'])
+        elif name == 'reduce' and self.checksum_every and 'accumulator.count + 1' in function:
+            pass
+        elif name == 'set':
+            args = _arguments(function)
+            self.sets[args['key']] = args['value']
+        elif name == 'to':
+            self.to = _arguments(function)['bucket']
+        elif name == 'group' and self.to and function == 'group()':
+            pass
+        elif name == 'count' and self.to and function == 'count()':
+            self.count = True
+        elif name == 'count' and function == 'count()':
+            self.series_count = True
+            self.drop.add('_time')
+        else:
+            raise StandInError(f"Flux function not supported by stand-in: {name}()")
+
+    def matches_series(self, measurement: str, tags: dict) -> bool:
+        for column, accept in self.filters:
+            if column == '_field':
+                continue
+            value = measurement if column == '_measurement' else tags.get(column)
+            if not accept(value):
+                return False
+        return True
+
+    def time_bounds(self, field: str, tags: dict) -> list or None:
+        """Time ranges of *field* in the filter of `dbc_influxdb.verify`, None if there is no such filter"""
+        if self.field_ranges is None:
+            return None
+        return [(a, b) for f, v, a, b in self.field_ranges if f == field and v in (None, tags.get('data_version'))]
+
+    def matches_field(self, field: str, tags: dict = None) -> bool:
+        if self.field_equals and (tags or {}).get(self.field_equals) != field:
+            return False
+        return all(accept(field) for column, accept in self.filters if column == '_field')
+
+    def transform(self, tags: tuple, points: dict) -> tuple[tuple, dict]:
+        """Points in the time range, shifted, aggregated and with new tag values, as in the query"""
+        times = np.fromiter(points.keys(), dtype='int64', count=len(points))
+        values = pd.Series(list(points.values()), index=times, dtype=object)
+        values = values[(times >= self.start) & (times < self.stop)]
+        values.index = values.index + self.shift
+        if self.window and not values.empty:
+            every, offset, fn = self.window
+            stops = ((values.index - offset) // every + 1) * every + offset
+            stops = np.minimum(stops, self.stop)  # The last window ends with the range
+            if self.complete_windows:
+                values, stops = values[stops < self.stop], stops[stops < self.stop]
+            if fn == 'count':
+                values = values.groupby(stops).size()
+            elif fn in ('mean', 'sum', 'median'):
+                values = getattr(pd.to_numeric(values).groupby(stops), fn)()
+            else:
+                values = getattr(values.groupby(stops), fn)()
+        if self.sets:
+            tags = tuple(sorted({**dict(tags), **self.sets}.items()))
+        return tags, dict(zip(values.index.tolist(), values.tolist()))
+
+    def keeps(self, column: str) -> bool:
+        if column in self.drop:
+            return False
+        return self.keep is None or column in self.keep
+
+
+class Store:
+    """Points in memory: bucket -> (measurement, tags) -> field -> {time: value}"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def write(self, bucket: str, body: str, precision: str = 'ns') -> int:
+        factor = PRECISION_NS[precision]
+        now = time.time_ns()
+        parsed = [parse_line(line) for line in body.splitlines() if line and not line.startswith('#')]
+        with self.lock:
+            series = self.buckets.setdefault(bucket, {})
+            for measurement, tags, fields, timestamp in parsed:
+                t = timestamp * factor if timestamp is not None else now
+                fieldmap = series.setdefault((measurement, tags), {})
+                for field, value in fields.items():
+                    fieldmap.setdefault(field, {})[t] = value
+        return len(parsed)
+
+    def delete(self, bucket: str, start: str, stop: str, predicate: str = '') -> int:
+        """Delete points between *start* and *stop* (both inclusive) that match *predicate*"""
+        conditions = {k: _unescape(v) for k, v in _PREDICATE.findall(predicate or '')}
+        start_ns, stop_ns = _timestamp_ns(start), _timestamp_ns(stop)
+        deleted = 0
+        with self.lock:
+            series = self.buckets.get(bucket, {})
+            for (measurement, tags), fieldmap in list(series.items()):
+                tagdict = dict(tags)
+                if '_measurement' in conditions and conditions['_measurement'] != measurement:
+                    continue
+                if any(tagdict.get(k) != v for k, v in conditions.items() if k not in ('_measurement', '_field')):
+                    continue
+                for field, points in list(fieldmap.items()):
+                    if '_field' in conditions and conditions['_field'] != field:
+                        continue
+                    drop = [t for t in points if start_ns <= t <= stop_ns]
+                    for t in drop:
+                        del points[t]
+                    deleted += len(drop)
+                    if not points:
+                        del fieldmap[field]
+                if not fieldmap:
+                    del series[(measurement, tags)]
+        return deleted
+
+    def points(self, bucket: str = None) -> int:
+        """Number of points in *bucket* or in all buckets"""
+        with self.lock:
+            buckets = [self.buckets.get(bucket, {})] if bucket else list(self.buckets.values())
+            return sum(len(p) for series in buckets for fieldmap in series.values() for p in fieldmap.values())
+
+    def query(self, query: Query) -> str:
+        """Run *query* and return annotated CSV, one table per series (per series and field without pivot)"""
+        with self.lock:
+            selected = []
+            for (measurement, tags), fieldmap in self.buckets.get(query.bucket, {}).items():
+                if not query.matches_series(measurement, dict(tags)):
+                    continue
+                fields = {f: dict(p) for f, p in fieldmap.items() if query.matches_field(f, dict(tags))}
+                for f in list(fields):
+                    bounds = query.time_bounds(f, dict(tags))
+                    if bounds is not None:
+                        fields[f] = {t: v for t, v in fields[f].items() if any(a <= t <= b for a, b in bounds)}
+                if fields:
+                    selected.append((measurement, tags, fields))
+
+        results = {}  # Series after transform, series with the same new tags are merged
+        for measurement, tags, fields in selected:
+            for field, points in fields.items():
+                new_tags, points = query.transform(tags=tags, points=points)
+                if points:
+                    results.setdefault((measurement, new_tags), {}).setdefault(field, {}).update(points)
+        selected = [(measurement, tags, fields) for (measurement, tags), fields in results.items()]
+        if query.series_count:
+            selected = [(measurement, tags, {f: {query.stop: len(p)} for f, p in fields.items()})
+                        for measurement, tags, fields in selected]
+
+        if query.to:
+            with self.lock:
+                series = self.buckets.setdefault(query.to, {})
+                for measurement, tags, fields in selected:
+                    fieldmap = series.setdefault((measurement, tags), {})
+                    for field, points in fields.items():
+                        fieldmap.setdefault(field, {}).update(points)
+        if query.checksum_every:
+            return self._checksums(query=query, selected=selected)
+
+        if query.count:
+            total = sum(len(p) for _, _, fields in selected for p in fields.values())
+            return ('#group,false,false,false\r\n#datatype,string,long,long\r\n'
+                    f'#default,_result,,\r\n,result,table,_value\r\n,,0,{total}\r\n')
+
+        blocks = []
+        for measurement, tags, fields in selected:
+            groups = [fields] if query.pivot else [{f: p} for f, p in fields.items()]
+            for group in groups:
+                block = self._table(query=query, table=len(blocks), measurement=measurement, tags=tags, fields=group)
+                if block:
+                    blocks.append(block)
+        return '\r\n'.join(blocks) + '\r\n'
+
+    @staticmethod
+    def _checksums(query: Query, selected: list) -> str:
+        """Count, sum, min and max per series, field and window, one table per window"""
+        rows = []
+        for measurement, tags, fields in selected:
+            for field, points in fields.items():
+                times = np.fromiter(points.keys(), dtype='int64', count=len(points))
+                values = pd.Series([float(v) for v in points.values()], index=times)
+                windows = times - times % query.checksum_every
+                for window, group in values.groupby(windows):
+                    start, stop = max(window, query.start), min(window + query.checksum_every, query.stop)
+                    rows.append(dict(_start=start, _stop=stop, _field=field, _measurement=measurement, **dict(tags),
+                                     count=len(group), sum=group.sum(), min=group.min(), max=group.max()))
+        if not rows:
+            return '\r\n'
+        df = pd.DataFrame(rows)
+        tagcols = [c for c in df.columns if c not in ('_start', '_stop', '_field', '_measurement', *CHECKSUMS)]
+        df[tagcols] = df[tagcols].fillna('')
+        df['_start'], df['_stop'] = _rfc3339(df['_start'].to_numpy()), _rfc3339(df['_stop'].to_numpy())
+        columns = ['_start', '_stop', '_field', '_measurement', *tagcols, *CHECKSUMS]
+        header = ['#group,false,false,' + ','.join('true' if c not in CHECKSUMS else 'false' for c in columns),
+                  '#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,'
+                  + ','.join(['string'] * (len(columns) - 6)) + ',long,double,double,double',
+                  '#default,_result' + ',' * (len(columns) + 1),
+                  ',result,table,' + ','.join(columns)]
+        df.insert(0, 'table', range(len(df)))
+        df.insert(0, 'result', '')
+        df.insert(0, '', '')
+        lines = df[['', 'result', 'table', *columns]].to_csv(header=False, index=False, float_format='%.17g',
+                                                             lineterminator='\r\n')
+        return '\r\n'.join(header) + '\r\n' + lines
+
+    @staticmethod
+    def _table(query: Query, table: int, measurement: str, tags: tuple, fields: dict) -> str or None:
+        columns = {}
+        for field, points in fields.items():
+            times = np.fromiter(points.keys(), dtype='int64', count=len(points))
+            columns[field] = pd.Series(list(points.values()), index=times, dtype=object, name=field)
+        data = pd.concat(columns, axis=1).sort_index() if len(columns) > 1 \
+            else next(iter(columns.values())).sort_index().to_frame()
+        if data.empty:
+            return None
+
+        # Column name, group flag, datatype, values
+        spec = [('result', 'false', 'string', ''), ('table', 'false', 'long', table),
+                ('_start', 'true', 'dateTime:RFC3339', _rfc3339([query.start])[0]),
+                ('_stop', 'true', 'dateTime:RFC3339', _rfc3339([query.stop])[0]),
+                ('_time', 'false', 'dateTime:RFC3339', _rfc3339(data.index.to_numpy()))]
+        if query.pivot:
+            spec.append(('_measurement', 'true', 'string', measurement))
+            spec += [(k, 'true', 'string', v) for k, v in tags]
+            for field in data.columns:
+                datatype = _datatype(data[field].tolist())
+                spec.append((field, 'false', datatype, _csv_column(data[field], datatype).to_numpy()))
+        else:
+            field = data.columns[0]
+            datatype = _datatype(data[field].tolist())
+            spec.append(('_value', 'false', datatype, _csv_column(data[field], datatype).to_numpy()))
+            spec.append(('_field', 'true', 'string', field))
+            spec.append(('_measurement', 'true', 'string', measurement))
+            spec += [(k, 'true', 'string', v) for k, v in tags]
+        # keep() and drop() run before the pivot, the pivoted fields are kept with '_field' and '_value'
+        pivoted = set(data.columns) if query.pivot and query.keeps('_field') and query.keeps('_value') else set()
+        spec = [s for s in spec if s[0] in ('result', 'table') or s[0] in pivoted or query.keeps(s[0])]
+
+        frame = pd.DataFrame({'': '', **{name: values for name, _, _, values in spec}}, index=range(len(data)))
+        header = ['#group,' + ','.join(s[1] for s in spec),
+                  '#datatype,' + ','.join(s[2] for s in spec),
+                  '#default,_result' + ',' * (len(spec) - 1),
+                  ',' + ','.join(s[0] for s in spec)]
+        rows = frame.to_csv(header=False, index=False, lineterminator='\r\n')
+        return '\r\n'.join(header) + '\r\n' + rows
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # E.g. connections closed by the client pool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, connections are reused by the client pool
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def _send(self, status: int, body: bytes = b'', content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _error(self, status: int, message: str):
+        self._send(status, json.dumps(dict(code='invalid', message=message)).encode())
+
+    def _json(self, status: int, content: dict):
+        self._send(status, json.dumps(content).encode())
+
+    def do_GET(self):
+        server = self.server.standin
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path in ('/ping', '/health'):
+            self._send(204)
+        elif url.path == '/api/v2/orgs':
+            self._json(200, dict(orgs=[ORG]))
+        elif url.path == '/api/v2/buckets':
+            with server.store.lock:
+                names = [n for n in server.store.buckets if params.get('name') in (None, n)]
+            self._json(200, dict(buckets=[server.bucket_json(n) for n in names]))
+        elif url.path == '/api/v2/tasks':
+            tasks = [t for t in server.tasks.values() if params.get('name') in (None, t['name'])]
+            self._json(200, dict(tasks=tasks))
+        else:
+            self._error(404, f"Path not supported by stand-in: {self.path}")
+
+    def do_PATCH(self):
+        server = self.server.standin
+        task_id = urlsplit(self.path).path.rsplit('/', 1)[-1]
+        if task_id not in server.tasks:
+            self._error(404, f"Task not found: {task_id}")
+            return
+        update = json.loads(self._body())
+        server.tasks[task_id] = server.task_json(task_id=task_id, **{**server.tasks[task_id], **update})
+        self._json(200, server.tasks[task_id])
+
+    def do_DELETE(self):
+        server = self.server.standin
+        task_id = urlsplit(self.path).path.rsplit('/', 1)[-1]
+        if server.tasks.pop(task_id, None) is None:
+            self._error(404, f"Task not found: {task_id}")
+        else:
+            self._send(204)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_POST(self):
+        server = self.server.standin
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body()
+        if server.latency:
+            time.sleep(server.latency)
+        server.requests[url.path] = server.requests.get(url.path, 0) + 1
+        try:
+            if url.path == '/api/v2/write':
+                server.store.write(bucket=params['bucket'], body=body.decode('utf-8'),
+                                   precision=params.get('precision', 'ns'))
+                self._send(204)
+            elif url.path == '/api/v2/query':
+                flux = json.loads(body)['query']
+                if flux.strip().startswith('buckets()'):
+                    csv = server.buckets_csv()
+                else:
+                    csv = server.store.query(Query(flux))
+                self._send(200, csv.encode('utf-8'), content_type='text/csv; charset=utf-8')
+            elif url.path == '/api/v2/buckets':
+                name = json.loads(body)['name']
+                with server.store.lock:
+                    server.store.buckets.setdefault(name, {})
+                self._json(201, server.bucket_json(name))
+            elif url.path == '/api/v2/tasks':
+                task_id = f'{len(server.tasks) + 1:016x}'
+                server.tasks[task_id] = server.task_json(task_id=task_id, **json.loads(body))
+                self._json(201, server.tasks[task_id])
+            elif url.path == '/api/v2/delete':
+                request = json.loads(body)
+                server.store.delete(bucket=params['bucket'], start=request['start'], stop=request['stop'],
+                                    predicate=request.get('predicate', ''))
+                self._send(204)
+            else:
+                self._error(404, f"Path not supported by stand-in: {url.path}")
+        except (StandInError, KeyError, ValueError) as e:
+            self._error(400, str(e))
+        except Exception as e:
+            self._error(500, f"Stand-in failed: {e!r}")
+
+
+class InfluxStandIn:
+    """In-memory InfluxDB v2 stand-in, served by a thread on localhost
+
+    Args:
+        port: port to listen on, 0 selects a free port
+        latency: seconds added to each write, query and delete request,
+            to simulate the network round trip to a remote database
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        self.store = Store()
+        self.latency = latency
+        self.requests = {}  # Path: number of requests
+        self.tasks = {}  # ID: task, as returned by the API
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def conf_db(self) -> dict:
+        """Database configuration as in dbconf.yaml"""
+        return dict(url=self.url, token='standin-token', org=ORG['name'])
+
+    @staticmethod
+    def bucket_json(name: str) -> dict:
+        return dict(id=name, name=name, orgID=ORG['id'], type='user', retentionRules=[])
+
+    @staticmethod
+    def task_json(task_id: str, flux: str, status: str = 'active', description: str = '', **_) -> dict:
+        option = _TASK_OPTION.search(flux)
+        if not option:
+            raise StandInError("Task without 'option task = {name: ..., every: ...}'")
+        return dict(id=task_id, orgID=ORG['id'], org=ORG['name'], name=_unescape(option.group(1)),
+                    every=option.group(2), flux=flux, status=status, description=description)
+
+    def buckets_csv(self) -> str:
+        with self.store.lock:
+            names = list(self.store.buckets)
+        rows = ''.join(f',,0,{name}\r\n' for name in names)
+        return ('#group,false,false,false\r\n#datatype,string,long,string\r\n'
+                '#default,_result,,\r\n,result,table,name\r\n' + rows) if names else '\r\n'
+
+    def start(self) -> 'InfluxStandIn':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='influx-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def serve(url_queue, latency: float = 0.0):
+    """Run a stand-in until the process is terminated, its url is put to *url_queue*
+
+    Target for a separate process, so that the stand-in does not share the
+    interpreter (and its memory and GIL) with the measured client.
+    """
+    server = InfluxStandIn(latency=latency)
+    url_queue.put(server.url)
+    server.serve_forever()
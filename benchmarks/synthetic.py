@@ -0,0 +1,106 @@
+"""
+Synthetic site data for benchmarks
+
+Generates data files as read by the file readers of the data flow (one
+column per variable, column index with raw variable name and raw units),
+the matching filetype configuration for `VarScanner`, and single variables
+with the full set of tags (`dbc_influxdb.common.tags`) for
+`dbcInflux.upload_singlevar()`.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+from pandas import DataFrame
+
+from dbc_influxdb.common import tags
+
+# Measurement: raw units
+MEASUREMENTS = {'TA': 'degC', 'RH': '%', 'SW': 'W m-2', 'LW': 'W m-2', 'PA': 'kPa',
+                'TS': 'degC', 'SWC': '%', 'PREC': 'mm', 'WS': 'm s-1', 'WD': 'deg'}
+
+
+def variables(n_vars: int) -> list[tuple[str, str, str]]:
+    """Variable names with position indices, e.g. 'TA_T1_2_1', with measurement and units"""
+    names = list(MEASUREMENTS)
+    result = []
+    for ix in range(n_vars):
+        measurement = names[ix % len(names)]
+        vpos, repl = divmod(ix // len(names), 3)
+        result.append((f'{measurement}_T1_{vpos + 1}_{repl + 1}', measurement, MEASUREMENTS[measurement]))
+    return result
+
+
+def file_frame(n_vars: int, periods: int, freq: str = '30min', start: str = '2024-01-01 00:30:00',
+               timezone: str = 'UTC+01:00', seed: int = 42) -> DataFrame:
+    """Data file with *n_vars* variables and *periods* records
+
+    The timestamp index 'TIMESTAMP_END' is timezone-aware. Each variable is
+    a daily cycle with noise, about 1% of the values are missing.
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start=start, periods=periods, freq=freq, tz=timezone, name='TIMESTAMP_END')
+    seconds = (index.hour * 3600 + index.minute * 60 + index.second).to_numpy()
+    cycle = np.sin(2 * np.pi * seconds / 86400)
+    values = 10 * cycle[:, None] + rng.normal(0, 1, size=(periods, n_vars)) + np.arange(n_vars)
+    values[rng.random(size=values.shape) < 0.01] = np.nan
+    columns = pd.MultiIndex.from_tuples([(name, units) for name, _, units in variables(n_vars)])
+    return DataFrame(values, index=index, columns=columns)
+
+
+def filetype_config(file_df: DataFrame, filetype: str = 'BENCH-RAW-30MIN',
+                    data_version: str = 'raw') -> tuple[dict, dict]:
+    """Filetype configuration for *file_df*, as in the filegroups of the configuration folder
+
+    Returns:
+        data_vars: variable settings, raw variable name as key
+        filetypeconf: filetype settings
+    """
+    measurements = {name: measurement for name, measurement, _ in variables(len(file_df.columns))}
+    data_vars = {name: dict(field=name, measurement=measurements[name], units=units)
+                 for name, units in file_df.columns}
+    filetypeconf = dict(filegroup='10_meteo', data_version=data_version, data_special_format=False,
+                        data_vars_parse_pos_indices=True, data_vars=data_vars, filetype=filetype)
+    return data_vars, filetypeconf
+
+
+def unitmapper() -> dict:
+    return {units: units for units in MEASUREMENTS.values()}
+
+
+def var_frames(file_df: DataFrame, site: str = 'ch-bench', freq: str = '30min',
+               data_version: str = 'raw') -> list[tuple[DataFrame, str]]:
+    """One dataframe per variable with the variable and all tags, as uploaded with `upload_singlevar()`
+
+    The timestamp index is naive, as expected by `upload_singlevar()`.
+
+    Returns:
+        list of (var_df, measurement)
+    """
+    frames = []
+    index = file_df.index.tz_localize(None)
+    for name, measurement, units in variables(len(file_df.columns)):
+        var_df = DataFrame({name: file_df[(name, units)].to_numpy()}, index=index).dropna()
+        _, _, vpos, repl = name.split('_')
+        tagvalues = dict(site=site, varname=name, units=units, raw_varname=name, raw_units=units,
+                         hpos='T1', vpos=vpos, repl=repl, data_raw_freq=freq, freq=freq,
+                         filegroup='10_meteo', config_filetype='BENCH-RAW-30MIN', data_version=data_version,
+                         gain=1, offset=0)
+        for tag in tags:
+            var_df[tag] = tagvalues[tag]
+        frames.append((var_df, measurement))
+    return frames
+
+
+def write_dirconf(folder: str or Path, conf_db: dict) -> Path:
+    """Configuration folder for `dbcInflux`, with the database configuration in '<folder>_secret'"""
+    folder = Path(folder)
+    (folder / 'filegroups').mkdir(parents=True, exist_ok=True)
+    secret = Path(f'{folder}_secret')
+    secret.mkdir(parents=True, exist_ok=True)
+    for file, content in [(folder / 'units.yaml', unitmapper()), (folder / 'dirs.yaml', {}),
+                          (secret / 'dbconf.yaml', conf_db)]:
+        with open(file, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(content, f)
+    return folder
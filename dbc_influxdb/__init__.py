@@ -1 +1,2 @@
 from .main import dbcInflux
+from .aio import AsyncDbcInflux
@@ -0,0 +1,200 @@
+"""
+Continuous aggregates
+
+Measurements of a bucket are downsampled on the server by InfluxDB tasks
+into one bucket per aggregation level, e.g. 'ch-dav_raw_agg30min' and
+'ch-dav_raw_agg1D'. The aggregated points keep all tags, the tag 'freq'
+is set to the aggregation level. The aggregates are defined in the
+database configuration (dbconf.yaml):
+
+    aggregates:
+      ch-dav_raw:
+        every: [30min, 1D]
+        measurements: [TA, SW]  # Optional, all measurements if not given
+        fn: mean  # Optional, Flux aggregate function, default 'mean'
+        timezone_offset_to_utc_hours: 1  # Optional, days start at midnight of this timezone
+
+Timestamps are the end of the averaging interval (TIMESTAMP_END): a value
+at 00:30 belongs to the window from 00:00 to 00:30. Before aggregation,
+all values are therefore shifted by one second into their window and the
+window is labelled with its stop time.
+
+Only variable data are aggregated (the field is the same as the tag
+'varname'): metadata fields and the sidecar measurement of tag profiles
+(see `dbc_influxdb.tagprofiles`) are not copied to the aggregate buckets.
+
+A download with *aggregate_every* (see `dbcInflux.download()`) is routed to
+the coarsest aggregate bucket whose level divides *aggregate_every*, the
+remaining aggregation is done on the server. Aggregates of a finer level
+can only be combined for the functions in `REAGGREGATE` (e.g. the maximum
+of maxima), other functions (e.g. 'mean' and 'median') are only taken
+from the level of *aggregate_every* or computed from the original data.
+"""
+from dataclasses import dataclass
+
+import pandas as pd
+
+import dbc_influxdb.fluxql as fluxql
+
+TASK_PREFIX = 'dbc-agg'
+TASK_DELAY = '5m'  # Tasks run a few minutes after the end of each window, to wait for late uploads
+
+# Flux function that combines aggregates of a finer level, per aggregate function. Only
+# these functions give the same result as an aggregation of the original data.
+REAGGREGATE = {'sum': 'sum', 'min': 'min', 'max': 'max', 'count': 'sum', 'first': 'first', 'last': 'last'}
+
+
+def flux_duration(td: pd.Timedelta) -> str:
+    """Flux duration literal, e.g. '1d', '30m', '-59m59s'"""
+    sign = '-' if td < pd.Timedelta(0) else ''
+    seconds = int(abs(td).total_seconds())
+    if seconds == 0:
+        return '0s'
+    parts = []
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60), ('s', 1)):
+        if seconds >= size:
+            parts.append(f'{seconds // size}{unit}')
+            seconds %= size
+    return sign + ''.join(parts)
+
+
+def _offset(every: pd.Timedelta, timezone_offset_to_utc_hours: int) -> pd.Timedelta:
+    """Offset of the window boundaries from the epoch, so that windows are aligned to the timezone"""
+    return -pd.Timedelta(hours=timezone_offset_to_utc_hours) % every
+
+
+def aggregate_functions(every: str, fn: str = 'mean', timezone_offset_to_utc_hours: int = 0) -> list[str]:
+    """Flux functions that aggregate variable data to windows of *every*, e.g. '30min'
+
+    Windows are aligned to *timezone_offset_to_utc_hours*, e.g. with 1 daily
+    windows start at midnight UTC+01:00. The last window is removed if it ends
+    after the stop of the range (incomplete window). The tag 'freq' is set to
+    *every*.
+    """
+    duration = pd.Timedelta(every)
+    window = f'every: {flux_duration(duration)}, fn: {fn}'
+    offset = _offset(every=duration, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+    if offset:
+        window += f', offset: {flux_duration(offset)}'
+    return ['|> filter(fn: (r) => r["_field"] == r["varname"])',
+            '|> timeShift(duration: -1s)',
+            f'|> aggregateWindow({window}, createEmpty: false)',
+            '|> filter(fn: (r) => r["_time"] < r["_stop"])',
+            f'|> set(key: "freq", value: "{fluxql.escape_string(every)}")']
+
+
+@dataclass(frozen=True)
+class AggregateSpec:
+    """One aggregation level of a bucket
+
+    Attributes:
+        bucket: name of the bucket with the original data
+        every: aggregation level as pandas frequency string, e.g. '30min' or '1D'
+        measurements: measurements that are aggregated, None for all measurements
+        fn: Flux aggregate function, e.g. 'mean', 'max'
+        timezone_offset_to_utc_hours: windows of a day or longer start at midnight of this timezone
+    """
+    bucket: str
+    every: str
+    measurements: tuple = None
+    fn: str = 'mean'
+    timezone_offset_to_utc_hours: int = 0
+
+    @property
+    def duration(self) -> pd.Timedelta:
+        return pd.Timedelta(self.every)
+
+    @property
+    def target_bucket(self) -> str:
+        return f'{self.bucket}_agg{self.every}'
+
+    @property
+    def task_name(self) -> str:
+        return f'{TASK_PREFIX} {self.bucket} {self.every}'
+
+    def covers(self, measurements: list = None) -> bool:
+        """True if the aggregates contain all *measurements* (None: all measurements)"""
+        if self.measurements is None:
+            return True
+        return bool(measurements) and set(measurements) <= set(self.measurements)
+
+    def query(self, start: str, stop: str, org: str) -> str:
+        """Query that aggregates the data between *start* and *stop* and writes them to the target bucket"""
+        query = fluxql.FluxQuery(bucket=self.bucket, start=start, stop=stop, pivot=False) \
+            .where('_measurement', list(self.measurements) if self.measurements else None) \
+            .pipe(*aggregate_functions(every=self.every, fn=self.fn,
+                                       timezone_offset_to_utc_hours=self.timezone_offset_to_utc_hours),
+                  f'|> to(bucket: "{fluxql.escape_string(self.target_bucket)}", org: "{fluxql.escape_string(org)}")')
+        return query.compile()
+
+    def task_flux(self, org: str) -> str:
+        """Flux script of the task that aggregates the last two complete windows on each run
+
+        The range starts one second after a window boundary, so that no window
+        is aggregated from a part of its values.
+        """
+        every = flux_duration(self.duration)
+        shift = _offset(every=self.duration, timezone_offset_to_utc_hours=self.timezone_offset_to_utc_hours) \
+            - self.duration + pd.Timedelta(seconds=1)
+        start = f'date.add(d: {flux_duration(shift)}, ' \
+                f'to: date.sub(d: {every}, from: date.truncate(t: now(), unit: {every})))'
+        return (f'import "date"\n\n'
+                f'option task = {{name: "{fluxql.escape_string(self.task_name)}", every: {every}, '
+                f'offset: {TASK_DELAY}}}\n\n'
+                + self.query(start=start, stop='now()', org=org).replace(' |> ', '\n    |> '))
+
+    def backfill_start(self, start: pd.Timestamp) -> str:
+        """Start of a backfill query: one second after the window boundary before *start* (UTC)"""
+        offset = _offset(every=self.duration, timezone_offset_to_utc_hours=self.timezone_offset_to_utc_hours)
+        start = pd.Timestamp(start).tz_convert('UTC')
+        boundary = (start - offset).floor(self.every) + offset
+        return (boundary + pd.Timedelta(seconds=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def specs_from_conf(conf_db: dict, bucket: str = None) -> list[AggregateSpec]:
+    """Aggregation levels from the section 'aggregates' of the database configuration
+
+    Args:
+        conf_db: database configuration
+        bucket: only the levels of this bucket, all buckets if None
+
+    Returns:
+        list of AggregateSpec, finest level first
+    """
+    conf = conf_db.get('aggregates') if isinstance(conf_db, dict) else None
+    specs = []
+    for name, settings in (conf or {}).items():
+        if bucket and name != bucket:
+            continue
+        levels = settings.get('every', [])
+        levels = [levels] if isinstance(levels, str) else levels
+        measurements = settings.get('measurements')
+        for every in levels:
+            specs.append(AggregateSpec(bucket=name, every=every,
+                                       measurements=tuple(measurements) if measurements else None,
+                                       fn=settings.get('fn', 'mean'),
+                                       timezone_offset_to_utc_hours=settings.get('timezone_offset_to_utc_hours', 0)))
+    return sorted(specs, key=lambda s: (s.bucket, s.duration))
+
+
+def route(specs: list[AggregateSpec], bucket: str, every: str, measurements: list = None,
+          timezone_offset_to_utc_hours: int = 0) -> AggregateSpec or None:
+    """Coarsest aggregation level of *bucket* from which aggregates of *every* can be computed
+
+    The level must divide *every* and contain all *measurements*. Levels of a
+    day or longer must be aligned to the same timezone as the download. Finer
+    levels are only used if their function can be combined, see `REAGGREGATE`.
+
+    Returns:
+        AggregateSpec, or None if the data must be aggregated from the original bucket
+    """
+    target = pd.Timedelta(every)
+    candidates = [s for s in specs
+                  if s.bucket == bucket
+                  and s.covers(measurements)
+                  and s.duration <= target
+                  and target % s.duration == pd.Timedelta(0)
+                  and (s.duration == target or s.fn in REAGGREGATE)
+                  and (_offset(s.duration, s.timezone_offset_to_utc_hours)
+                       == _offset(s.duration, timezone_offset_to_utc_hours))]
+    return max(candidates, key=lambda s: s.duration, default=None)
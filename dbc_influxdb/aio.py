@@ -0,0 +1,265 @@
+"""
+Async API
+
+`AsyncDbcInflux` provides `download`, `upload_singlevar`, `delete` and the
+`show_*` methods of `dbcInflux` as coroutines, using the async client of
+influxdb_client (requires the optional dependency aiohttp). All requests
+of one instance share one client and its connection pool, many downloads
+and uploads (e.g. of different stations) can run concurrently on one event
+loop. Queries are built with the same `FluxQuery` and downloaded tables are
+assembled with the same code as in `dbcInflux`, tag profiles are handled in
+the same way (see `dbc_influxdb.tagprofiles`). CPU-bound work (assembly of
+tables, serialization to line protocol) runs in the default executor of the
+event loop so that it does not block other requests.
+
+Example:
+    async with AsyncDbcInflux(dirconf=DIRCONF) as dbc:
+        results = await asyncio.gather(*[dbc.download(bucket=b, ...) for b in buckets])
+"""
+import asyncio
+import time
+from pathlib import Path
+
+from pandas import DataFrame
+
+import dbc_influxdb.fluxql as fluxql
+from dbc_influxdb.deletion import DeleteOutcome, DeleteResult, plan_delete_predicates
+from dbc_influxdb.frames import assemble_download, field_measurements
+from dbc_influxdb.lineprotocol import frame_to_lines
+from dbc_influxdb.main import dbcInflux, read_configs
+from dbc_influxdb.tagprofiles import (SIDECAR_MEASUREMENT, TagProfile, reattach_metadata, resolve_profile,
+                                      sidecar_lines, sidecar_query, split_metadata, where_fields)
+from dbc_influxdb.upload import UploadReport, detect_field, normalize_timestamps
+
+try:
+    from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+except ImportError:  # aiohttp not installed
+    InfluxDBClientAsync = None
+
+
+class AsyncDbcInflux:
+    """Async counterpart of `dbcInflux`
+
+    The client is created on first use inside the running event loop and
+    closed with `.close()` or when leaving the `async with` block.
+
+    Args:
+        dirconf: folder with configurations, same as for `dbcInflux`
+        max_concurrency: maximum number of requests sent at the same time
+            by this instance, e.g. write batches and delete requests
+        quiet: if True, no progress is printed
+    """
+
+    def __init__(self, dirconf: str, max_concurrency: int = 16, quiet: bool = False):
+        if InfluxDBClientAsync is None:
+            raise ImportError("AsyncDbcInflux requires aiohttp, install with: pip install dbc-influxdb[async]")
+        self.dirconf = Path(dirconf)
+        self.quiet = quiet
+        self.conf_filetypes, \
+            self.conf_unitmapper, \
+            self.conf_dirs, \
+            self.conf_db = read_configs(dirconf=self.dirconf)
+        self._print("Reading configuration files was successful.")
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = InfluxDBClientAsync(url=self.conf_db['url'], token=self.conf_db['token'],
+                                               org=self.conf_db['org'], timeout=999_000, enable_gzip=True,
+                                               connection_pool_maxsize=self.max_concurrency)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _print(self, *args, **kwargs):
+        if not self.quiet:
+            print(*args, **kwargs)
+
+    async def ping(self) -> bool:
+        return await self.client.ping()
+
+    async def _query_data_frame(self, querystring: str) -> list:
+        results = await self.client.query_api().query_data_frame(query=querystring)
+        return results if isinstance(results, list) else [results]
+
+    @staticmethod
+    async def _run_in_executor(func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def download(self,
+                       bucket: str,
+                       start: str,
+                       stop: str,
+                       timezone_offset_to_utc_hours: int,
+                       data_version: list = None,
+                       measurements: list = None,
+                       fields: list = None,
+                       version_priority: list = None,
+                       tag_profile: str or TagProfile = None) -> tuple[DataFrame, dict, dict]:
+        """Get data from database between 'start' and 'stop' dates, see `dbcInflux.download()`"""
+        if isinstance(data_version, str):
+            data_version = [data_version]
+        if version_priority and not data_version:
+            data_version = list(version_priority)
+        profile = resolve_profile(conf_db=self.conf_db, bucket=bucket, name=tag_profile)
+        start_iso = dbcInflux._convert_datestr_to_iso8601(datestr=start,
+                                                          timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        stop_iso = dbcInflux._convert_datestr_to_iso8601(datestr=stop,
+                                                         timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        query = fluxql.FluxQuery(bucket=bucket, start=start_iso, stop=stop_iso) \
+            .where('_measurement', measurements) \
+            .where('data_version', data_version)
+        query = where_fields(query=query, fields=fields, profile=profile)
+        tables = await self._query_data_frame(query.compile())
+        assigned_measurements = field_measurements(tables=tables)
+        data_simple, data_detailed, _ = await self._run_in_executor(
+            lambda: assemble_download(tables=tables, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                      version_priority=version_priority))
+
+        # Metadata that were not written as tags, see `dbc_influxdb.tagprofiles`
+        if data_detailed and (profile.fields or profile.sidecar):
+            sidecar_tables = []
+            if profile.sidecar:
+                sidecar_tables = await self._query_data_frame(
+                    sidecar_query(bucket=bucket, stop=stop_iso, varnames=list(data_detailed)))
+            data_detailed = await self._run_in_executor(
+                lambda: reattach_metadata(data_detailed=data_detailed, sidecar_tables=sidecar_tables,
+                                          profile=profile,
+                                          timezone_offset_to_utc_hours=timezone_offset_to_utc_hours))
+        self._print(f"<-- Downloaded {len(data_detailed)} variables from bucket {bucket} "
+                    f"between {start} and {stop}")
+        return data_simple, data_detailed, assigned_measurements
+
+    async def delete(self,
+                     bucket: str,
+                     measurements: list or str or True,
+                     start: str,
+                     stop: str,
+                     timezone_offset_to_utc_hours: int,
+                     data_version: str or True,
+                     fields: list or str or True) -> DeleteResult:
+        """Delete data from bucket, see `dbcInflux.delete()`
+
+        All delete requests are sent concurrently, limited by *max_concurrency*.
+        """
+        start_iso = dbcInflux._convert_datestr_to_iso8601(datestr=start,
+                                                          timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        stop_iso = dbcInflux._convert_datestr_to_iso8601(datestr=stop,
+                                                         timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        predicates = plan_delete_predicates(measurements=measurements, fields=fields,
+                                            data_version=data_version, start=start_iso, stop=stop_iso)
+        delete_api = self.client.delete_api()
+
+        async def _delete(p) -> DeleteOutcome:
+            async with self._semaphore:
+                tic = time.perf_counter()
+                try:
+                    await delete_api.delete(start=p.start, stop=p.stop, predicate=p.predicate, bucket=bucket)
+                    error = None
+                except Exception as e:
+                    error = e
+                return DeleteOutcome(predicate=p.predicate, start=p.start, stop=p.stop,
+                                     duration=time.perf_counter() - tic, error=error)
+
+        tic = time.perf_counter()
+        outcomes = await asyncio.gather(*[_delete(p) for p in predicates])
+        result = DeleteResult(bucket=bucket, outcomes=list(outcomes), duration=time.perf_counter() - tic)
+        self._print(f"Deleted variables {fields} between {start_iso} and {stop_iso} from measurements "
+                    f"{measurements} in bucket {bucket} ({len(outcomes)} requests in {result.duration:.2f}s).")
+        for failure in result.failures:
+            self._print(f"(!)DELETE FAILED: {failure.predicate}  {failure.error}")
+        return result
+
+    async def upload_singlevar(self,
+                               var_df: DataFrame,
+                               to_bucket: str,
+                               to_measurement: str,
+                               timezone_offset_to_utc_hours: int,
+                               delete_from_db_before_upload: bool = True,
+                               batch_size: int = 5000,
+                               tag_profile: str or TagProfile = None,
+                               duplicates: str = 'last') -> UploadReport:
+        """Upload single variable to database, see `dbcInflux.upload_singlevar()`
+
+        The variable is serialized to line protocol and sent in batches of
+        *batch_size* points, batches are sent concurrently.
+        """
+        field = detect_field(var_df=var_df)
+        profile = resolve_profile(conf_db=self.conf_db, bucket=to_bucket, name=tag_profile)
+        report = UploadReport(bucket=to_bucket, measurement=to_measurement, field=field,
+                              mode='write', points_total=len(var_df))
+
+        # Sorted, unique timestamps, also for the time range that is deleted before upload
+        var_df, report.duplicates, report.unsorted = normalize_timestamps(var_df=var_df, duplicates=duplicates)
+        if report.duplicates or report.unsorted:
+            self._print(f"{field}: {report.duplicates} rows with duplicate timestamps removed "
+                        f"(kept {duplicates}){', timestamps sorted' if report.unsorted else ''}")
+        report.points_written = len(var_df)
+        report.points_skipped = report.points_total - report.points_written
+        if var_df.empty:
+            return report
+
+        if delete_from_db_before_upload:
+            report.mode = 'delete-then-write'
+            measurements = [to_measurement, SIDECAR_MEASUREMENT] if profile.sidecar else [to_measurement]
+            result = await self.delete(bucket=to_bucket, measurements=measurements,
+                                       start=str(var_df.index[0]), stop=str(var_df.index[-1]),
+                                       timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                       data_version=dbcInflux._single_data_version(var_df=var_df),
+                                       fields=[field])
+            result.raise_for_failures()
+
+        var_df = var_df.copy()
+        var_df.index = dbcInflux._add_timestamp_utc(timestamp_index=var_df.index,
+                                                    timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+
+        def _serialize() -> list[str]:
+            points, sidecar = split_metadata(var_df=var_df, field=field, profile=profile)
+            return frame_to_lines(df=points, measurement=to_measurement, tag_columns=profile.tags,
+                                  precision='s') + sidecar_lines(sidecar=sidecar, profile=profile)
+
+        lines = await self._run_in_executor(_serialize)
+
+        write_api = self.client.write_api()
+
+        async def _write(batch: list[str]):
+            async with self._semaphore:
+                await write_api.write(bucket=to_bucket, record='\n'.join(batch), write_precision='s')
+
+        await asyncio.gather(*[_write(lines[ix:ix + batch_size]) for ix in range(0, len(lines), batch_size)])
+        self._print(f"--> UPLOADED TO DATABASE BUCKET {to_bucket}:  {field}  ({len(lines)} points)")
+        return report
+
+    async def show_fields_in_measurement(self, bucket: str, measurement: str, days: int = 9999) -> list:
+        """Show fields (variable names) in measurement"""
+        results = await self._query_data_frame(
+            fluxql.fields_in_measurement(bucket=bucket, measurement=measurement, days=days))
+        return [v for r in results if not r.empty for v in r['_value'].tolist()]
+
+    async def show_fields_in_bucket(self, bucket: str) -> list:
+        """Show fields (variable names) in bucket"""
+        results = await self._query_data_frame(fluxql.fields_in_bucket(bucket=bucket))
+        return [v for r in results if not r.empty for v in r['_value'].tolist()]
+
+    async def show_measurements_in_bucket(self, bucket: str) -> list:
+        """Show measurements in bucket"""
+        results = await self._query_data_frame(fluxql.measurements_in_bucket(bucket=bucket))
+        return [v for r in results if not r.empty for v in r['_value'].tolist()]
+
+    async def show_buckets(self) -> list:
+        """Show all buckets in the database"""
+        results = await self._query_data_frame(fluxql.buckets())
+        return [b for r in results if not r.empty for b in r['name'].tolist() if not b.startswith('_')]
@@ -0,0 +1,233 @@
+"""
+Adaptive write batching
+
+The write API of influxdb_client sends batches of a fixed size. Depending
+on the data (30-minute processed data vs. 10-second raw data, number of
+tags) and on the load of the database, a fixed batch size is either too
+small (many small requests) or too large (slow requests, timeouts).
+
+`AdaptiveWriter` sends pre-serialized line protocol in batches using
+synchronous writes from a small thread pool. After each request the
+`AdaptiveBatchController` adjusts the batch size and the number of
+batches in flight:
+
+- fast requests: batch size and number of batches in flight are increased
+- slow requests: batch size is decreased
+- HTTP 429 (too many requests) and 503 (unavailable): batch size and
+  number of batches in flight are halved, the request is retried after
+  the time given in the Retry-After header or with exponential backoff
+
+The batch size is also limited by a maximum payload size, and the
+overall throughput can be limited to a maximum number of points per
+second to avoid saturating a shared database instance. The ceiling is a
+token bucket: idle time between writes (e.g. while the next file is
+parsed) only allows a burst of *burst_seconds* at full rate.
+
+Errors without HTTP status are only retried if they are connection or
+timeout errors, other errors (e.g. programming errors) are raised
+immediately.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+THROTTLE_STATUS = (429, 503)
+CONNECTION_ERRORS = (Urllib3HTTPError, ConnectionError, TimeoutError)
+
+
+@dataclass
+class BatchingSettings:
+    """Settings for adaptive write batching
+
+    Can be given in the database configuration file (dbconf.yaml) in the
+    section 'batching', e.g. to set a ceiling for the throughput:
+
+        batching:
+          max_points_per_second: 50000
+    """
+    initial_batch_size: int = 5000
+    min_batch_size: int = 500
+    max_batch_size: int = 100_000
+    max_in_flight: int = 4
+    target_latency: float = 2.0  # Seconds per request
+    max_payload_bytes: int = 10_000_000  # Uncompressed line protocol per request
+    max_points_per_second: float = None  # Throughput ceiling, None means no ceiling
+    burst_seconds: float = 1.0  # Points that can be sent at once after idle time, in seconds at the ceiling
+    max_retries: int = 5
+    retry_interval: float = 5.0  # Seconds, first retry delay
+    max_retry_delay: float = 30.0  # Seconds
+    exponential_base: float = 2.0
+
+
+@dataclass
+class WriteStats:
+    """Summary of writes sent by `AdaptiveWriter`"""
+    points: int = 0
+    bytes: int = 0
+    requests: int = 0
+    retries: int = 0
+    throttled: int = 0
+    duration: float = 0.0  # Seconds
+    final_batch_size: int = 0
+    final_in_flight: int = 0
+
+    @property
+    def points_per_second(self) -> float:
+        return self.points / self.duration if self.duration > 0 else 0.0
+
+
+class AdaptiveBatchController:
+    """Adjusts batch size and number of batches in flight from observed requests
+
+    Uses additive increase of the number of batches in flight and
+    multiplicative increase/decrease of the batch size.
+    """
+
+    def __init__(self, settings: BatchingSettings):
+        self.settings = settings
+        self.batch_size = settings.initial_batch_size
+        self.in_flight_limit = 1
+        self._lock = threading.Lock()
+        self._tokens = None  # Points that can be sent without waiting, negative if sending is ahead
+        self._refilled = None
+
+    def next_batch_size(self, avg_line_bytes: float) -> int:
+        """Batch size for the next request, limited by the maximum payload size"""
+        with self._lock:
+            size = self.batch_size
+        if avg_line_bytes > 0:
+            size = min(size, int(self.settings.max_payload_bytes // avg_line_bytes))
+        return max(1, size)
+
+    def record_success(self, latency: float):
+        s = self.settings
+        with self._lock:
+            if latency < 0.5 * s.target_latency:
+                self.batch_size = min(s.max_batch_size, int(self.batch_size * 1.5))
+                self.in_flight_limit = min(s.max_in_flight, self.in_flight_limit + 1)
+            elif latency > s.target_latency:
+                self.batch_size = max(s.min_batch_size, int(self.batch_size * 0.7))
+
+    def record_throttle(self):
+        s = self.settings
+        with self._lock:
+            self.batch_size = max(s.min_batch_size, self.batch_size // 2)
+            self.in_flight_limit = max(1, self.in_flight_limit // 2)
+
+    def throttle_rate(self, points: int):
+        """Wait until sending *points* more points stays below the throughput ceiling"""
+        ceiling = self.settings.max_points_per_second
+        if not ceiling:
+            return
+        burst = ceiling * self.settings.burst_seconds
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is None:
+                self._tokens, self._refilled = burst, now
+            self._tokens = min(burst, self._tokens + (now - self._refilled) * ceiling)
+            self._refilled = now
+            self._tokens -= points
+            wait = -self._tokens / ceiling
+        if wait > 0:
+            time.sleep(wait)
+
+    def retry_delay(self, attempt: int, retry_after: float = None) -> float:
+        s = self.settings
+        if retry_after:
+            return min(float(retry_after), s.max_retry_delay)
+        delay = s.retry_interval * s.exponential_base ** attempt
+        delay = min(delay, s.max_retry_delay)
+        return delay * random.uniform(0.5, 1.0)  # Jitter
+
+
+class AdaptiveWriter:
+    """Send line protocol to the database in adaptively sized batches
+
+    Args:
+        write_api: synchronous write API, i.e., `client.write_api(write_options=SYNCHRONOUS)`
+        settings: batching settings, defaults are used if not given
+    """
+
+    def __init__(self, write_api, settings: BatchingSettings = None):
+        self.write_api = write_api
+        self.settings = settings if settings else BatchingSettings()
+        self.controller = AdaptiveBatchController(settings=self.settings)
+        self.stats = WriteStats()
+        self._stats_lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._in_flight = 0
+
+    def write(self, bucket: str, record: list[str], write_precision: str = 's') -> WriteStats:
+        """Write all lines in *record*, returns the accumulated statistics of this writer
+
+        Raises the first error of a batch that could not be written after all retries.
+        """
+        lines = record
+        if not lines:
+            return self.stats
+        tic = time.perf_counter()
+        avg_line_bytes = sum(len(l) for l in lines[:1000]) / min(len(lines), 1000) + 1
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.settings.max_in_flight) as pool:
+            pos = 0
+            while pos < len(lines):
+                with self._slots:
+                    self._slots.wait_for(lambda: self._in_flight < self.controller.in_flight_limit)
+                    self._in_flight += 1
+                size = self.controller.next_batch_size(avg_line_bytes=avg_line_bytes)
+                batch = lines[pos:pos + size]
+                pos += size
+                self.controller.throttle_rate(points=len(batch))
+                futures.append(pool.submit(self._send, bucket, batch, write_precision))
+                # Fail early instead of sending all remaining batches
+                failed = [f for f in futures if f.done() and f.exception()]
+                if failed:
+                    break
+        for f in futures:
+            f.result()  # Raises errors of failed batches
+        with self._stats_lock:
+            self.stats.duration += time.perf_counter() - tic
+            self.stats.final_batch_size = self.controller.batch_size
+            self.stats.final_in_flight = self.controller.in_flight_limit
+        return self.stats
+
+    def _send(self, bucket: str, batch: list[str], write_precision: str):
+        payload = '\n'.join(batch)
+        try:
+            attempt = 0
+            while True:
+                tic = time.perf_counter()
+                try:
+                    self.write_api.write(bucket=bucket, record=payload, write_precision=write_precision)
+                except Exception as e:
+                    status = getattr(e, 'status', None)
+                    throttled = status in THROTTLE_STATUS
+                    if status is None:
+                        retryable = isinstance(e, CONNECTION_ERRORS)
+                    else:
+                        retryable = throttled or status >= 500
+                    if not retryable or attempt >= self.settings.max_retries:
+                        raise
+                    if throttled:
+                        self.controller.record_throttle()
+                    with self._stats_lock:
+                        self.stats.retries += 1
+                        self.stats.throttled += 1 if throttled else 0
+                    time.sleep(self.controller.retry_delay(attempt=attempt,
+                                                           retry_after=getattr(e, 'retry_after', None)))
+                    attempt += 1
+                    continue
+                self.controller.record_success(latency=time.perf_counter() - tic)
+                with self._stats_lock:
+                    self.stats.points += len(batch)
+                    self.stats.bytes += len(payload)
+                    self.stats.requests += 1
+                return
+        finally:
+            with self._slots:
+                self._in_flight -= 1
+                self._slots.notify_all()
@@ -0,0 +1,148 @@
+"""
+Series cardinality
+
+Each point is written with all tags in `dbc_influxdb.common.tags`. A
+series is one combination of measurement, field and tag values, i.e., a
+change in any tag (e.g. 'gain' written as 1 and later as 1.0, a new
+'config_filetype' or 'raw_units') creates a new series for the same
+variable. Many series per variable increase the index memory of the
+database and slow down queries.
+
+The series of a bucket are found with one server-side query: `first()`
+returns one record per series, only the series keys (measurement, field
+and tags) are downloaded. For each variable, the tags whose values differ
+between its series are reported, and for each tag how many series would
+not exist if the tag had one value per variable. Before an upload, the
+series of a *var_df* can be compared to the series already in the
+database, see `simulate_series()`.
+"""
+from dataclasses import dataclass, field
+
+import pandas as pd
+from pandas import DataFrame
+
+import dbc_influxdb.fluxql as fluxql
+from dbc_influxdb.common import tags
+from dbc_influxdb.upload import detect_field
+
+KEY_COLUMNS = ['_measurement', '_field']
+
+
+@dataclass
+class CardinalityReport:
+    """Series counts of a bucket or of an upload
+
+    Attributes:
+        total_series: number of series
+        by_field: one row per measurement and field, with the number of series
+            and the tags that differ between these series, most series first
+        by_tag: one row per tag, with the number of distinct values, the number
+            of fields in which the tag differs, the number of additional series
+            caused by the tag ('excess_series') and the number of values that are
+            the same number written differently, e.g. '1' and '1.0'
+            ('equivalent_values'), most excess series first
+        new_series: only for simulated uploads, number of series in the upload
+            that do not exist in the database yet
+    """
+    total_series: int
+    by_field: DataFrame = field(default_factory=DataFrame)
+    by_tag: DataFrame = field(default_factory=DataFrame)
+    new_series: int = None
+
+    @property
+    def explosive_tags(self) -> list:
+        """Tags that cause additional series, most additional series first"""
+        if self.by_tag.empty:
+            return []
+        return self.by_tag.loc[self.by_tag['excess_series'] > 0, 'tag'].tolist()
+
+
+def series_query(bucket: str, start: str, stop: str, measurements: list = None, fields: list = None) -> str:
+    """Query that returns one record per series with measurement, field and all tags"""
+    return fluxql.FluxQuery(bucket=bucket, start=start, stop=stop, pivot=False) \
+        .where('_measurement', measurements) \
+        .where('_field', fields) \
+        .pipe('|> first()',
+              '|> drop(columns: ["_start", "_stop", "_time", "_value"])',
+              '|> group()') \
+        .compile()
+
+
+def series_keys(results: list or DataFrame) -> DataFrame:
+    """Series keys from the results of `series_query()`, missing tags are empty strings"""
+    results = results if isinstance(results, list) else [results]
+    results = [r for r in results if not r.empty]
+    if not results:
+        return DataFrame(columns=KEY_COLUMNS)
+    keys = pd.concat(results, ignore_index=True)
+    keys = keys.drop(columns=[c for c in ('result', 'table') if c in keys.columns])
+    return keys.fillna('').drop_duplicates(ignore_index=True)
+
+
+def simulate_series(var_df: DataFrame, measurement: str) -> DataFrame:
+    """Series keys that an upload of *var_df* with `upload_singlevar()` would write
+
+    Tag values are formatted as in the line protocol, e.g. a 'gain' of 1 in a
+    float column is written as '1.0'; missing tags are empty strings.
+    """
+    fieldname = detect_field(var_df=var_df)
+    keys = var_df[[c for c in tags if c in var_df.columns]].drop_duplicates()
+    for col in keys.columns:
+        keys[col] = keys[col].map(lambda v: '' if pd.isna(v) else str(v))
+    keys.insert(0, '_field', fieldname)
+    keys.insert(0, '_measurement', measurement)
+    return keys.drop_duplicates(ignore_index=True)
+
+
+def _equivalent_values(values: pd.Series) -> int:
+    """Number of distinct values that are the same number as another value, e.g. '1' and '1.0'"""
+    numbers = pd.to_numeric(values, errors='coerce')
+    spellings = DataFrame({'value': values, 'number': numbers}).dropna().drop_duplicates()
+    counts = spellings.groupby('number')['value'].nunique()
+    return int(counts[counts > 1].sum())
+
+
+def analyze_series(keys: DataFrame, existing: DataFrame = None) -> CardinalityReport:
+    """Count series per field and find the tags that cause additional series
+
+    Args:
+        keys: series keys, one row per series with the columns '_measurement',
+            '_field' and one column per tag, see `series_keys()` and `simulate_series()`
+        existing: series keys already in the database; if given, the series in
+            *keys* that are not in *existing* are counted as new series
+
+    Returns:
+        CardinalityReport
+    """
+    tag_columns = [c for c in keys.columns if c not in KEY_COLUMNS]
+    keys = keys.fillna('').drop_duplicates(ignore_index=True)
+    by_field = []
+    varying_fields = {t: 0 for t in tag_columns}
+    excess = {t: 0 for t in tag_columns}
+    for (measurement, fieldname), group in keys.groupby(KEY_COLUMNS, sort=False):
+        varying = [t for t in tag_columns if group[t].nunique() > 1]
+        for t in varying:
+            # Series that would not exist if *t* had one value for this field
+            others = [c for c in tag_columns if c != t]
+            excess[t] += len(group) - (len(group[others].drop_duplicates()) if others else 1)
+            varying_fields[t] += 1
+        by_field.append(dict(measurement=measurement, field=fieldname, series=len(group), varying_tags=varying))
+
+    by_field = DataFrame(by_field, columns=['measurement', 'field', 'series', 'varying_tags'])
+    by_field = by_field.sort_values('series', ascending=False, kind='stable', ignore_index=True)
+    by_tag = DataFrame(dict(tag=tag_columns,
+                            distinct_values=[keys[t].nunique() for t in tag_columns],
+                            fields_varying=[varying_fields[t] for t in tag_columns],
+                            excess_series=[excess[t] for t in tag_columns],
+                            equivalent_values=[_equivalent_values(keys[t]) for t in tag_columns]))
+    by_tag = by_tag.sort_values('excess_series', ascending=False, kind='stable', ignore_index=True)
+
+    new_series = None
+    if existing is not None:
+        new_series = len(keys)
+        if not existing.empty:
+            columns = list(keys.columns)
+            existing = existing.reindex(columns=columns).fillna('')
+            known = keys.merge(existing.drop_duplicates(), on=columns, how='left', indicator=True)
+            new_series = int((known['_merge'] == 'left_only').sum())
+    return CardinalityReport(total_series=len(keys), by_field=by_field, by_tag=by_tag, new_series=new_series)
@@ -0,0 +1,219 @@
+"""
+Resumable checkpoints for long operations
+
+A long download, retag or re-upload loop is split into units of work, a
+unit is one field (or one selection of fields) in one time window. The
+checkpoint records each completed unit, a rerun of the same operation with
+the same checkpoint skips completed units and continues with the first
+unit that was not completed.
+
+The checkpoint file (JSON) is rewritten after each completed unit: the
+new content is written to a temporary file, flushed to disk (fsync) and
+renamed, i.e., the file always contains either the previous or the new
+state. The file is locked while it is rewritten and units recorded by
+other processes in the meantime are merged, several processes (e.g. the
+jobs of `dbc run`) can therefore use the same checkpoint file.
+
+Downloaded tables of completed windows are kept in the folder
+'<checkpoint file>.chunks', they are stored before the unit is recorded.
+Tables are stored as parquet files (requires the optional dependency
+pyarrow), otherwise as CSV files with the types of their columns, see
+`write_table()`.
+The chunks of a download with *auto_chunk* are also recorded, a resumed
+download uses the same chunks without estimating the download again.
+
+Units are identified by a scope (the operation and its selection, e.g.
+bucket, query and timezone), the field and the time window. A checkpoint
+can therefore be shared by several operations, e.g. by all variables of
+an upload loop. The scope of an upload includes a digest of the uploaded
+data (see `frame_digest()`), changed data are uploaded again.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import pandas as pd
+from pandas import DataFrame
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import pyarrow
+except ImportError:  # Tables are stored as CSV
+    pyarrow = None
+
+
+def scope_of(*parts) -> str:
+    """Short digest that identifies an operation and its selection, e.g. the query"""
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:16]
+
+
+def frame_digest(df: DataFrame) -> str:
+    """Short digest of the index, columns and values of *df*"""
+    rows = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return scope_of(*df.columns, hashlib.sha1(rows.tobytes()).hexdigest())
+
+
+def write_table(df: DataFrame, path: Path):
+    """Write *df* to *path* (without suffix) as parquet, or as CSV if pyarrow is not installed
+
+    CSV files are written with a JSON file with the index levels and the
+    types of all columns. Timezone-aware timestamps are restored in UTC.
+    """
+    if pyarrow is not None:
+        df.to_parquet(path.with_suffix('.parquet'))
+        return
+    levels = 0 if isinstance(df.index, pd.RangeIndex) else df.index.nlevels
+    flat = df.reset_index() if levels else df
+    dtypes = {str(col): f'datetime64[{dtype.unit}, UTC]' if isinstance(dtype, pd.DatetimeTZDtype) else str(dtype)
+              for col, dtype in flat.dtypes.items()}
+    flat.to_csv(path.with_suffix('.csv'), index=False)
+    with open(path.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(dict(index=list(df.index.names) if levels else [], dtypes=dtypes), f, indent=1)
+
+
+def read_table(path: Path) -> DataFrame:
+    """Table written with `write_table()`, *path* with suffix '.parquet' or '.csv'"""
+    if path.suffix == '.parquet':
+        return pd.read_parquet(path)
+    with open(path.with_suffix('.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    dtypes = meta['dtypes']
+    timestamps = [col for col, dtype in dtypes.items() if dtype.startswith('datetime64')]
+    df = pd.read_csv(path, dtype={col: dtype for col, dtype in dtypes.items() if col not in timestamps},
+                     keep_default_na=False, na_values=[''])
+    for col in timestamps:
+        df[col] = pd.to_datetime(df[col], utc=dtypes[col].endswith('UTC]')).astype(dtypes[col])
+    if meta['index']:
+        df = df.set_index(list(df.columns[:len(meta['index'])]))
+        df.index.names = meta['index']
+    return df
+
+
+@dataclass(frozen=True)
+class Unit:
+    """One unit of work: *field* between *start* and *stop* in *scope*"""
+    scope: str
+    field: str
+    start: str
+    stop: str
+
+    @property
+    def key(self) -> str:
+        return f'{self.scope}|{self.field}|{self.start}|{self.stop}'
+
+
+class Checkpoint:
+    """Completed units of long operations, stored in a JSON file
+
+    Args:
+        path: file path of the checkpoint, created if it does not exist
+    """
+
+    def __init__(self, path: str or Path):
+        self.path = Path(path)
+        self.chunks = self.path.with_name(f'{self.path.name}.chunks')
+        self._lock = threading.Lock()
+        self.units = self._read()
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def is_done(self, unit: Unit) -> bool:
+        return unit.key in self.units
+
+    def result(self, unit: Unit):
+        """Result stored with a completed unit, e.g. the number of written points"""
+        return self.units.get(unit.key, {}).get('result')
+
+    def tables(self, unit: Unit) -> list:
+        """Downloaded tables stored with a completed unit"""
+        folder = self._chunk_folder(unit)
+        return [read_table(file) for file in sorted(folder.iterdir()) if file.suffix in ('.parquet', '.csv')]
+
+    def complete(self, unit: Unit, result=None, tables: list = None):
+        """Record *unit* as completed, with an optional (JSON) *result* and downloaded *tables*
+
+        Units that other processes recorded in the same file are merged.
+        """
+        with self._lock:
+            if tables is not None:
+                # Written to a temporary folder that replaces the tables of an earlier run
+                folder = self._chunk_folder(unit)
+                tmp = folder.with_name(f'{folder.name}.{os.getpid()}.tmp')
+                shutil.rmtree(tmp, ignore_errors=True)
+                tmp.mkdir(parents=True)
+                for ix, table in enumerate(tables):
+                    write_table(df=table, path=tmp / f'table-{ix:06d}')
+                shutil.rmtree(folder, ignore_errors=True)
+                os.replace(tmp, folder)
+            with self._file_lock():
+                # Only the completed unit is added, units removed by other processes stay removed
+                units = self._read()
+                units[unit.key] = dict(completed=pd.Timestamp.now(tz='UTC').isoformat(), result=result)
+                self.units = units
+                self._write()
+
+    def clear(self):
+        """Remove the checkpoint file and all stored tables, e.g. after the operation finished"""
+        with self._lock, self._file_lock():
+            self.units = {}
+            self.path.unlink(missing_ok=True)
+            shutil.rmtree(self.chunks, ignore_errors=True)
+        self._lockfile.unlink(missing_ok=True)
+
+    def _chunk_folder(self, unit: Unit) -> Path:
+        return self.chunks / scope_of(unit.key)
+
+    @property
+    def _lockfile(self) -> Path:
+        return self.path.with_name(f'{self.path.name}.lock')
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock of the checkpoint file across processes"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._lockfile, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.01)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read(self) -> dict:
+        if not self.path.is_file():
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('units', {})
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dict(units=self.units), f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
@@ -0,0 +1,359 @@
+"""
+Command-line interface: the `dbc` console script
+
+Single operations are run with a subcommand, batches of operations are
+described in a job file (YAML) and run over a pool of workers:
+
+    dbc download --dirconf configs --bucket ch-dav_raw --measurements TA \
+        --start "2024-01-01 00:00:00" --stop "2024-02-01 00:00:00" --output ta.csv
+    dbc run jobs.yaml --concurrency 8
+
+Job file:
+
+    dirconf: /path/to/configs
+    concurrency: 4  # Jobs that run at the same time, default: number of CPUs
+    executor: process  # 'process' (default, uses all cores) or 'thread'
+    defaults:  # Settings of all jobs, can be overwritten in each job
+      timezone_offset_to_utc_hours: 1
+    jobs:
+      - name: export-{site}
+        command: export  # download, export, upload, delete or show
+        foreach:  # One job per value (per combination of values)
+          site: [ch-dav, ch-lae]
+        bucket: "{site}_processed"
+        start: "2024-01-01 00:00:00"
+        stop: "2025-01-01 00:00:00"
+        output: "exports/{site}"
+
+All other settings of a job are passed to the `dbcInflux` method of the
+command, e.g. `data_version`, `fields` or `aggregate_every` for downloads.
+With `checkpoint: <file>`, a failed download or upload job continues where
+it stopped when it is run again (see `dbc_influxdb.checkpoint`).
+If a key in *foreach* is a list setting (e.g. `fields`), each job gets a
+list with one value. Commands:
+
+    download    `dbcInflux.download()`, data_simple is written to *output* (.csv or .parquet)
+    export      `dbcInflux.download()`, one file per variable with all tags is written to
+                the folder *output*, together with the measurement of each variable
+    upload      upload the variables of an export folder (*path*) to *to_bucket* with
+                `dbcInflux.upload_singlevar()`, tags can be changed with *tags*
+    delete      `dbcInflux.delete()`, *data_version* (one version), *measurements* and
+                *fields* are required, 'all' selects all measurements or fields
+    show        buckets, measurements (of *bucket*) or fields (of *bucket* and *measurement*)
+
+A summary with the duration and throughput of each job is printed, the
+exit code is 1 if a job failed.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import pandas as pd
+import yaml
+
+from dbc_influxdb.checkpoint import Checkpoint
+from dbc_influxdb.common import tags
+
+COMMANDS = ('download', 'export', 'upload', 'delete', 'show')
+LIST_SETTINGS = ('measurements', 'fields', 'data_version', 'version_priority')
+DELETE_SETTINGS = ('data_version', 'measurements', 'fields')  # Required, nothing is deleted by default
+MEASUREMENTS_FILE = 'measurements.yaml'
+
+
+@dataclass
+class JobResult:
+    """Outcome of one job"""
+    name: str
+    command: str
+    ok: bool
+    seconds: float
+    points: int = 0  # Records downloaded, written or listed
+    error: str = None
+
+    @property
+    def points_per_second(self) -> float:
+        return self.points / self.seconds if self.seconds else 0.0
+
+
+def expand_jobs(jobfile: dict) -> list[dict]:
+    """Jobs of a job file, with defaults applied and *foreach* expanded
+
+    Returns:
+        list of jobs, each job is a dict with 'name', 'command', 'dirconf'
+        and the settings of the command
+    """
+    defaults = jobfile.get('defaults') or {}
+    jobs = []
+    for ix, entry in enumerate(jobfile.get('jobs') or [], 1):
+        entry = {**defaults, **entry}
+        foreach = entry.pop('foreach', None) or {}
+        keys = list(foreach)
+        for values in itertools.product(*(foreach[k] if isinstance(foreach[k], list) else [foreach[k]]
+                                          for k in keys)):
+            placeholders = dict(zip(keys, values))
+            job = {k: _fill(v, placeholders) for k, v in entry.items()}
+            for key, value in placeholders.items():
+                if key in job or key in LIST_SETTINGS:
+                    job[key] = [value] if key in LIST_SETTINGS else value
+            job.setdefault('name', f"job{ix}" + ''.join(f"-{v}" for v in values))
+            job.setdefault('dirconf', jobfile.get('dirconf'))
+            if job.get('command') not in COMMANDS:
+                raise ValueError(f"Job {job['name']}: unknown command {job.get('command')!r}, expected one of {COMMANDS}")
+            if not job['dirconf']:
+                raise ValueError(f"Job {job['name']}: no 'dirconf' given")
+            jobs.append(job)
+    names = [j['name'] for j in jobs]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Job names must be unique, found {duplicates}")
+    return jobs
+
+
+def _fill(value, placeholders: dict):
+    """Insert *placeholders* into strings, e.g. '{site}_raw'"""
+    if isinstance(value, str):
+        return value.format(**placeholders) if placeholders and '{' in value else value
+    if isinstance(value, list):
+        return [_fill(v, placeholders) for v in value]
+    if isinstance(value, dict):
+        return {k: _fill(v, placeholders) for k, v in value.items()}
+    return value
+
+
+def _all_or_list(value):
+    """'all' (or True) selects all measurements or fields in deletes"""
+    if value is True or value == 'all' or value == ['all']:
+        return True
+    return [value] if isinstance(value, str) else value
+
+
+def write_frame(df: pd.DataFrame, path: str or Path):
+    """Write *df* as parquet (requires pyarrow) or CSV, depending on the file extension"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == '.parquet':
+        df.to_parquet(path)
+    else:
+        df.to_csv(path)
+
+
+def read_export(folder: str or Path) -> tuple[dict, dict]:
+    """Variables of an export folder, see command 'export'
+
+    Returns:
+        data_detailed: dict with variable names as keys and dataframes with
+            variable data and tags as values
+        measurements: dict with variable names as keys and measurements as values
+    """
+    folder = Path(folder)
+    with open(folder / MEASUREMENTS_FILE, 'r', encoding='utf-8') as f:
+        measurements = yaml.safe_load(f) or {}
+    data_detailed = {}
+    for field in measurements:
+        path = folder / f'{field}.parquet'
+        if path.exists():
+            df = pd.read_parquet(path)
+        else:
+            # Tags are read as text, as they are stored in the database
+            df = pd.read_csv(folder / f'{field}.csv', index_col=0, parse_dates=[0],
+                             dtype={t: str for t in tags})
+        data_detailed[field] = df
+    return data_detailed, measurements
+
+
+def _settings(job: dict, *reserved: str) -> dict:
+    """Settings of *job* that are passed to the `dbcInflux` method"""
+    settings = {k: v for k, v in job.items() if k not in ('name', 'command', 'dirconf') + reserved}
+    if settings.get('checkpoint'):
+        settings['checkpoint'] = Checkpoint(settings['checkpoint'])
+    return settings
+
+
+def _download(dbc, job: dict) -> int:
+    settings = _settings(job, 'output', 'format')
+    data_simple, data_detailed, measurements = dbc.download(**settings)
+    if job['command'] == 'download':
+        if job.get('output'):
+            write_frame(data_simple, job['output'])
+        return int(data_simple.count().sum())
+
+    folder = Path(job['output'])
+    folder.mkdir(parents=True, exist_ok=True)
+    suffix = '.parquet' if job.get('format') == 'parquet' else '.csv'
+    for field, df in data_detailed.items():
+        write_frame(df, folder / f'{field}{suffix}')
+    with open(folder / MEASUREMENTS_FILE, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(measurements, f)
+    return sum(len(df) for df in data_detailed.values())
+
+
+def _upload(dbc, job: dict) -> int:
+    settings = _settings(job, 'path', 'tags')
+    data_detailed, measurements = read_export(job['path'])
+    points = 0
+    for field, var_df in data_detailed.items():
+        # Tags that the data never had (e.g. 'site' and 'offset' of data uploaded by
+        # `VarScanner`) are added without value, missing tags are not written
+        for tag in tags:
+            if tag not in var_df.columns:
+                var_df[tag] = None
+        for tag, value in (job.get('tags') or {}).items():
+            var_df[tag] = value
+        report = dbc.upload_singlevar(var_df=var_df, to_measurement=measurements[field], **settings)
+        points += report.points_written
+    return points
+
+
+def _delete(dbc, job: dict) -> int:
+    settings = _settings(job)
+    missing = [k for k in DELETE_SETTINGS if not settings.get(k)]
+    if missing:
+        raise ValueError(f"Delete jobs need {missing}, use 'all' to select all measurements or fields")
+    settings['measurements'] = _all_or_list(settings['measurements'])
+    settings['fields'] = _all_or_list(settings['fields'])
+    # Lists with one version, e.g. from *foreach* or the command line
+    data_version = settings['data_version']
+    data_version = data_version[0] if isinstance(data_version, list) and len(data_version) == 1 else data_version
+    if not isinstance(data_version, str) or data_version == 'all':
+        raise ValueError(f"Delete jobs need one data version, got {settings['data_version']!r}")
+    settings['data_version'] = data_version
+    dbc.delete(**settings).raise_for_failures()
+    return 0
+
+
+def _show(dbc, job: dict) -> int:
+    what = job.get('what', 'buckets')
+    if what == 'buckets':
+        items = dbc.show_buckets()
+    elif what == 'measurements':
+        items = dbc.show_measurements_in_bucket(bucket=job['bucket'])
+    elif what == 'fields':
+        items = dbc.show_fields_in_bucket(bucket=job['bucket'], measurement=job.get('measurement'))
+    else:
+        raise ValueError(f"Cannot show {what!r}, expected 'buckets', 'measurements' or 'fields'")
+    return len(items)
+
+
+RUNNERS = dict(download=_download, export=_download, upload=_upload, delete=_delete, show=_show)
+
+
+def run_job(job: dict, quiet: bool = True) -> JobResult:
+    """Run one job, errors are returned in the result"""
+    from dbc_influxdb.main import dbcInflux
+
+    tic = time.perf_counter()
+    try:
+        dbc = dbcInflux(dirconf=job['dirconf'], quiet=quiet)
+        points = RUNNERS[job['command']](dbc, job)
+    except Exception as e:
+        return JobResult(name=job['name'], command=job['command'], ok=False,
+                         seconds=time.perf_counter() - tic, error=f"{type(e).__name__}: {e}")
+    return JobResult(name=job['name'], command=job['command'], ok=True,
+                     seconds=time.perf_counter() - tic, points=points)
+
+
+def run_jobs(jobs: list[dict], concurrency: int = None, executor: str = 'process',
+             quiet: bool = True) -> list[JobResult]:
+    """Run *jobs* over a pool of *concurrency* workers (default: number of CPUs)
+
+    Returns:
+        list of JobResult, in the order of *jobs*
+    """
+    concurrency = max(1, min(concurrency or os.cpu_count() or 1, len(jobs) or 1))
+    if executor not in ('process', 'thread'):
+        raise ValueError(f"Unknown executor {executor!r}, expected 'process' or 'thread'")
+    pool = ProcessPoolExecutor if executor == 'process' and concurrency > 1 else ThreadPoolExecutor
+    with pool(max_workers=concurrency) as workers:
+        futures = [workers.submit(run_job, job, quiet) for job in jobs]
+        results = []
+        for future in futures:
+            result = future.result()
+            status = 'ok' if result.ok else f'FAILED  {result.error}'
+            print(f"[{len(results) + 1}/{len(jobs)}] {result.name}: {status}", flush=True)
+            results.append(result)
+    return results
+
+
+def summary(results: list[JobResult]) -> str:
+    """Table with the duration and throughput of each job"""
+    lines = [f"{'job':<30} {'command':<9} {'status':<7} {'seconds':>9} {'points':>12} {'points/s':>12}"]
+    for r in results:
+        lines.append(f"{r.name:<30} {r.command:<9} {'ok' if r.ok else 'FAILED':<7} {r.seconds:9.2f} "
+                     f"{r.points:>12,} {r.points_per_second:>12,.0f}")
+    failed = sum(not r.ok for r in results)
+    lines.append(f"{len(results)} jobs, {failed} failed, {sum(r.points for r in results):,} points")
+    return '\n'.join(lines)
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='dbc', description="Database communication with InfluxDB v2.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="run the jobs of a job file")
+    run.add_argument('jobfile', help="job file (YAML)")
+    run.add_argument('--concurrency', type=int, help="jobs that run at the same time")
+    run.add_argument('--executor', choices=('process', 'thread'), help="run jobs in processes or threads")
+    run.add_argument('--only', nargs='+', help="run only the jobs with these names")
+    run.add_argument('--verbose', action='store_true', help="print the progress of each job")
+
+    for name in COMMANDS:
+        sub = commands.add_parser(name, help=f"{name}, see `dbc_influxdb.cli`")
+        sub.add_argument('--dirconf', required=True, help="folder with configurations")
+        sub.add_argument('--bucket')
+        sub.add_argument('--start', help="e.g. '2024-01-01 00:00:00'")
+        sub.add_argument('--stop', help="e.g. '2024-02-01 00:00:00', not included")
+        sub.add_argument('--timezone-offset-to-utc-hours', type=int, default=1)
+        sub.add_argument('--measurements', nargs='+')
+        sub.add_argument('--fields', nargs='+')
+        sub.add_argument('--data-version', nargs='+')
+        sub.add_argument('--output', help="file (download) or folder (export)")
+        sub.add_argument('--path', help="export folder (upload)")
+        sub.add_argument('--to-bucket', help="bucket (upload)")
+        sub.add_argument('--what', default='buckets', help="buckets, measurements or fields (show)")
+        sub.add_argument('--measurement', help="measurement (show fields)")
+    return parser
+
+
+def _job_from_args(args: argparse.Namespace) -> dict:
+    """Job for a single command given on the command line"""
+    job = dict(name=args.command, command=args.command, dirconf=args.dirconf)
+    if args.command == 'show':
+        job.update(what=args.what, bucket=args.bucket, measurement=args.measurement)
+        return job
+    if args.command == 'upload':
+        job.update(path=args.path, to_bucket=args.to_bucket,
+                   timezone_offset_to_utc_hours=args.timezone_offset_to_utc_hours)
+        return job
+    job.update(bucket=args.bucket, start=args.start, stop=args.stop,
+               timezone_offset_to_utc_hours=args.timezone_offset_to_utc_hours,
+               measurements=args.measurements, fields=args.fields)
+    job['data_version'] = args.data_version
+    if args.command != 'delete':
+        job['output'] = args.output
+    return {k: v for k, v in job.items() if v is not None}
+
+
+def main(argv: list = None) -> int:
+    args = _parser().parse_args(argv)
+    if args.command == 'run':
+        with open(args.jobfile, 'r', encoding='utf-8') as f:
+            jobfile = yaml.safe_load(f) or {}
+        jobs = expand_jobs(jobfile)
+        if args.only:
+            jobs = [j for j in jobs if j['name'] in args.only]
+        results = run_jobs(jobs=jobs, concurrency=args.concurrency or jobfile.get('concurrency'),
+                           executor=args.executor or jobfile.get('executor', 'process'),
+                           quiet=not args.verbose)
+    else:
+        results = [run_job(_job_from_args(args), quiet=False)]
+    print(summary(results))
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
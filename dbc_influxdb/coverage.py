@@ -0,0 +1,116 @@
+"""
+Coverage index of variables in the database
+
+The coverage index contains the number of records per variable (field) and
+time window, e.g. per day. The records are counted on the server with
+`aggregateWindow(fn: count)`, only one row per series and window is
+downloaded. The index can be cached in a local file. When the cache is
+refreshed, only windows starting with the last cached window are counted
+again.
+"""
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+from pandas import DataFrame
+
+import dbc_influxdb.fluxql as fluxql
+from dbc_influxdb.common import convert_ts_to_timezone
+
+COVERAGE_COLUMNS = ['measurement', 'field', 'window', 'count']
+
+
+def flux_duration(resolution: str) -> str:
+    """Convert pandas frequency string to Flux duration, e.g. '1D' to '86400s'"""
+    seconds = int(pd.to_timedelta(resolution).total_seconds())
+    return f'{seconds}s'
+
+
+def coverage_query(bucket: str, start_iso: str, stop_iso: str, measurements: list, data_version: list,
+                   resolution: str, timezone_offset_to_utc_hours: int) -> str:
+    """Count records per series and time window
+
+    Windows are aligned to the given timezone, e.g. days start at midnight CET
+    for *timezone_offset_to_utc_hours=1*.
+    """
+    every = flux_duration(resolution)
+    offset = f'{-timezone_offset_to_utc_hours}h'
+    return fluxql.FluxQuery(bucket=bucket, start=start_iso, stop=stop_iso, pivot=False) \
+        .where('_measurement', measurements) \
+        .where('data_version', data_version) \
+        .pipe(f'|> aggregateWindow(every: {every}, offset: {offset}, fn: count, '
+              f'createEmpty: false, timeSrc: "_start")',
+              fluxql.keepstring(columns=['_time', '_value', '_field', '_measurement'])) \
+        .compile()
+
+
+def counts_to_long(results: DataFrame or list, timezone_offset_to_utc_hours: int) -> DataFrame:
+    """Sum counts of all series of the same field per window"""
+    results = pd.concat(results, ignore_index=True) if isinstance(results, list) else results
+    if results is None or results.empty:
+        return DataFrame(columns=COVERAGE_COLUMNS)
+    window = convert_ts_to_timezone(timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                    timestamp_index=results['_time']).dt.tz_localize(None)
+    long = pd.DataFrame({'measurement': results['_measurement'].values,
+                         'field': results['_field'].values,
+                         'window': window.values,
+                         'count': results['_value'].astype('int64').values})
+    return long.groupby(['measurement', 'field', 'window'], as_index=False)['count'].sum()
+
+
+def merge_incremental(cached: DataFrame, fresh: DataFrame, since: pd.Timestamp) -> DataFrame:
+    """Replace all cached windows starting with *since* by freshly counted windows"""
+    if cached is None or cached.empty:
+        return fresh.reset_index(drop=True)
+    kept = cached[cached['window'] < since]
+    return pd.concat([kept, fresh], ignore_index=True) \
+        .sort_values(['measurement', 'field', 'window']).reset_index(drop=True)
+
+
+def to_wide(long: DataFrame) -> DataFrame:
+    """Coverage index: one row per window, one column per field, number of records as values"""
+    if long.empty:
+        return DataFrame()
+    wide = long.pivot_table(index='window', columns='field', values='count', aggfunc='sum', fill_value=0)
+    wide.columns.name = None
+    return wide.astype('int64')
+
+
+class CoverageCache:
+    """Local CSV file with the coverage index of one bucket and selection
+
+    Args:
+        cache_dir: folder for cache files, created if it does not exist
+        bucket: name of bucket in database
+        measurements: list of measurements or None for all measurements
+        data_version: list of data versions or None for all data versions
+        resolution: size of the time windows, e.g. '1D'
+        timezone_offset_to_utc_hours: timezone of the windows
+    """
+
+    def __init__(self, cache_dir: str or Path, bucket: str, measurements: list, data_version: list,
+                 resolution: str, timezone_offset_to_utc_hours: int):
+        selection = repr((sorted(measurements) if measurements else None,
+                          sorted(data_version) if data_version else None,
+                          resolution, timezone_offset_to_utc_hours))
+        key = hashlib.sha1(selection.encode('utf-8')).hexdigest()[:10]
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.path = cache_dir / f'coverage_{bucket}_{key}.csv'
+
+    def load(self) -> DataFrame:
+        if not self.path.is_file():
+            return DataFrame(columns=COVERAGE_COLUMNS)
+        return pd.read_csv(self.path, parse_dates=['window'])
+
+    def save(self, long: DataFrame):
+        tmp = self.path.with_suffix('.tmp')
+        long.to_csv(tmp, index=False)
+        tmp.replace(self.path)
+
+    @staticmethod
+    def refresh_start(cached: DataFrame) -> pd.Timestamp or None:
+        """Start of the last cached window, this window is counted again because it can be incomplete"""
+        if cached is None or cached.empty:
+            return None
+        return cached['window'].max()
@@ -4,9 +4,14 @@ from influxdb_client import InfluxDBClient
 # from influxdb_client import WriteOptions
 
 
-def get_client(conf_db: dict):
+def get_client(conf_db: dict, connection_pool_maxsize: int = None, timeout: int = 999_000):
+    """Create client, *connection_pool_maxsize* is needed if the client is shared by threads
+
+    *timeout* is the timeout of each request in milliseconds.
+    """
+    kwargs = dict(connection_pool_maxsize=connection_pool_maxsize) if connection_pool_maxsize else {}
     client = InfluxDBClient(url=conf_db['url'], token=conf_db['token'], org=conf_db['org'],
-                            timeout=999_000, enable_gzip=True)
+                            timeout=timeout, enable_gzip=True, **kwargs)
     return client
 
 
@@ -18,6 +23,14 @@ def get_delete_api(client):
     delete_api = client.delete_api()
     return delete_api
 
+def get_tasks_api(client):
+    tasks_api = client.tasks_api()
+    return tasks_api
+
+def get_buckets_api(client):
+    buckets_api = client.buckets_api()
+    return buckets_api
+
 # def get_write_api(client):
 #     write_api = client.write_api(write_options=WriteOptions(
 #         batch_size=5000, flush_interval=10_000, jitter_interval=2_000, retry_interval=5_000,
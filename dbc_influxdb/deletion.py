@@ -0,0 +1,141 @@
+"""
+Planning and execution of delete requests
+
+InfluxDB delete predicates only support `AND` combinations of
+`key="value"` expressions, i.e., each (measurement, field) pair that
+should be deleted needs its own request. The predicates are therefore
+planned up front and then sent concurrently over one shared client.
+
+docs:
+- https://docs.influxdata.com/influxdb/v2/reference/syntax/delete-predicate/
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+
+@dataclass
+class DeletePredicate:
+    """One delete request: predicate and time range"""
+    predicate: str
+    start: str
+    stop: str
+
+
+@dataclass
+class DeleteOutcome:
+    """Result of one delete request"""
+    predicate: str
+    start: str
+    stop: str
+    duration: float  # Seconds
+    error: Exception = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class DeleteResult:
+    """Collected results of all delete requests sent in one call"""
+    bucket: str
+    outcomes: list = field(default_factory=list)
+    duration: float = 0.0  # Seconds, wall-clock time for all requests
+    stats: object = None  # OperationStats with phase durations and counts
+
+    @property
+    def failures(self) -> list:
+        return [o for o in self.outcomes if not o.ok]
+
+    @property
+    def ok(self) -> bool:
+        return len(self.failures) == 0
+
+    def raise_for_failures(self):
+        """Raise the first error if any of the delete requests failed"""
+        if not self.ok:
+            failed = [f.predicate for f in self.failures]
+            raise Exception(f"{len(failed)} of {len(self.outcomes)} delete requests "
+                            f"failed in bucket {self.bucket}: {failed}") from self.failures[0].error
+
+
+def escape_predicate_value(value) -> str:
+    """Escape double quotes and backslashes in predicate values"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def predicate_string(**conditions) -> str:
+    """Assemble delete predicate from key-value pairs, e.g. _measurement="TA" AND varname="TA_T1_2_1" """
+    return ' AND '.join(f'{k}="{escape_predicate_value(v)}"' for k, v in conditions.items())
+
+
+def plan_delete_predicates(measurements: list or True,
+                           fields: list or True,
+                           data_version: str,
+                           start: str,
+                           stop: str) -> list[DeletePredicate]:
+    """Plan all delete requests needed for the given measurements and fields
+
+    Since the variable name is also stored as tag 'varname', deleting specific
+    fields across all measurements does not require knowing the measurements,
+    and deleting all fields in all measurements only requires the data version.
+
+    Args:
+        measurements: list of measurements, a single measurement as str, or True for all
+        fields: list of fields, a single field as str, or True for all
+        data_version: version ID of the data that should be deleted
+        start: start datetime in ISO 8601 format
+        stop: stop datetime in ISO 8601 format
+
+    Returns:
+        list of planned delete requests
+    """
+    measurements = [measurements] if isinstance(measurements, str) else measurements
+    fields = [fields] if isinstance(fields, str) else fields
+    measurements_all = measurements is True
+    fields_all = fields is True
+
+    conditions = []
+    if measurements_all and fields_all:
+        conditions.append(dict(data_version=data_version))
+    elif measurements_all:
+        for f in fields:
+            conditions.append(dict(varname=f, data_version=data_version))
+    elif fields_all:
+        for m in measurements:
+            conditions.append(dict(_measurement=m, data_version=data_version))
+    else:
+        for m in measurements:
+            for f in fields:
+                conditions.append(dict(_measurement=m, varname=f, data_version=data_version))
+
+    return [DeletePredicate(predicate=predicate_string(**c), start=start, stop=stop) for c in conditions]
+
+
+def run_delete_predicates(delete_api, bucket: str, predicates: list[DeletePredicate],
+                          max_workers: int = 4) -> DeleteResult:
+    """Send planned delete requests concurrently using a bounded thread pool
+
+    All requests share the same *delete_api* (and therefore the same client
+    and connection pool). Errors are collected per request instead of
+    aborting the remaining requests.
+    """
+
+    def _delete(p: DeletePredicate) -> DeleteOutcome:
+        tic = time.perf_counter()
+        try:
+            delete_api.delete(start=p.start, stop=p.stop, predicate=p.predicate, bucket=bucket)
+            error = None
+        except Exception as e:
+            error = e
+        return DeleteOutcome(predicate=p.predicate, start=p.start, stop=p.stop,
+                             duration=time.perf_counter() - tic, error=error)
+
+    tic = time.perf_counter()
+    if len(predicates) <= 1 or max_workers <= 1:
+        outcomes = [_delete(p) for p in predicates]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(predicates))) as pool:
+            outcomes = list(pool.map(_delete, predicates))
+    return DeleteResult(bucket=bucket, outcomes=outcomes, duration=time.perf_counter() - tic)
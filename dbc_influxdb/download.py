@@ -0,0 +1,43 @@
+"""
+Downloads from several buckets
+
+A `DownloadSpec` describes the download from one bucket, e.g. of one site.
+`dbcInflux.download_many()` runs the queries of all specs concurrently
+over one shared client and aligns the data of all sites on one common
+timestamp index.
+"""
+from dataclasses import dataclass
+
+import dbc_influxdb.fluxql as fluxql
+from dbc_influxdb.tagprofiles import TagProfile, resolve_profile, where_fields
+
+
+@dataclass
+class DownloadSpec:
+    """Download from one bucket, see `dbcInflux.download()` for the arguments
+
+    Example:
+        DownloadSpec(bucket='ch-dav_processed', start='2023-01-01 00:00:01', stop='2023-02-01 00:00:01',
+                     fields=['TA_T1_35_1'], data_version='meteoscreening_diive', site='ch-dav')
+    """
+    bucket: str
+    start: str
+    stop: str
+    data_version: list or str = None
+    measurements: list = None
+    fields: list = None
+    site: str = None  # Name of the site in the returned data, by default the bucket name
+    tag_profile: str or TagProfile = None  # By default the profile of the bucket in the database configuration
+
+    def __post_init__(self):
+        if isinstance(self.data_version, str):
+            self.data_version = [self.data_version]
+        if not self.site:
+            self.site = self.bucket
+
+    def query(self, start_iso: str, stop_iso: str, profile: TagProfile = None) -> str:
+        query = fluxql.FluxQuery(bucket=self.bucket, start=start_iso, stop=stop_iso) \
+            .where('_measurement', self.measurements) \
+            .where('data_version', self.data_version)
+        return where_fields(query=query, fields=self.fields, profile=profile if profile else resolve_profile()) \
+            .compile()
@@ -0,0 +1,77 @@
+"""
+Cost estimate for downloads
+
+Before a download, the number of points per series is counted on the
+server (`count()` is pushed down to the storage engine and only returns
+one row per series). From the counts, the number of rows, series and the
+approximate memory needed for the downloaded tables are estimated, and
+the time range is split into chunks of a maximum number of rows.
+"""
+import math
+from dataclasses import dataclass, field
+
+import pandas as pd
+from pandas import DataFrame
+
+from dbc_influxdb.common import tags
+
+# Columns needed to assemble downloaded tables (tag projection)
+DOWNLOAD_COLUMNS = ['_time', '_value', '_field', '_measurement'] + tags
+
+# Rough memory per downloaded row: numeric columns (timestamps, value, table id)
+# plus one string object per tag and per other string column
+BYTES_PER_ROW = 8 * 6 + 64 * (len(tags) + 3)
+
+
+@dataclass
+class DownloadEstimate:
+    """Estimated size of a download"""
+    rows: int = 0  # Number of points, each variable is downloaded in its own rows
+    series: int = 0  # Number of series (tables), i.e., unique combinations of field and tags
+    fields: int = 0
+    bytes: int = 0  # Approximate memory of the downloaded tables
+    chunks: list = field(default_factory=list)  # Time windows (start, stop) of the suggested chunk plan
+    per_field: DataFrame = field(default_factory=DataFrame)  # Points and series per field
+
+    def __str__(self):
+        return (f"{self.rows} rows in {self.series} series of {self.fields} fields, "
+                f"approx. {self.bytes / 1024 ** 2:.0f} MB, {len(self.chunks)} chunks")
+
+
+def estimate_from_counts(counts: DataFrame, start: str, stop: str, max_rows_per_chunk: int) -> DownloadEstimate:
+    """Create estimate from the result of a grouped count() query
+
+    Args:
+        counts: one row per series, with the number of points in column '_value'
+        start: start date of the download, e.g. '2022-07-04 00:30:00'
+        stop: stop date of the download, e.g. '2022-07-05 12:00:00'
+        max_rows_per_chunk: maximum number of rows per chunk
+
+    Returns:
+        DownloadEstimate
+    """
+    if counts is None or counts.empty:
+        return DownloadEstimate(chunks=[(start, stop)])
+    rows = int(counts['_value'].sum())
+    per_field = counts.groupby(['_measurement', '_field'])['_value'].agg(['sum', 'size']) \
+        .rename(columns={'sum': 'points', 'size': 'series'})
+    return DownloadEstimate(rows=rows,
+                            series=len(counts),
+                            fields=counts['_field'].nunique(),
+                            bytes=rows * BYTES_PER_ROW,
+                            chunks=plan_chunks(start=start, stop=stop, rows=rows,
+                                               max_rows_per_chunk=max_rows_per_chunk),
+                            per_field=per_field)
+
+
+def plan_chunks(start: str, stop: str, rows: int, max_rows_per_chunk: int) -> list[tuple[str, str]]:
+    """Split time range into windows of equal length with at most *max_rows_per_chunk* rows each
+
+    Assumes that data are distributed evenly over the time range.
+    """
+    num_chunks = max(1, math.ceil(rows / max_rows_per_chunk)) if max_rows_per_chunk else 1
+    if num_chunks == 1:
+        return [(start, stop)]
+    bounds = pd.date_range(pd.Timestamp(start), pd.Timestamp(stop), periods=num_chunks + 1).floor('s')
+    bounds = [start] + [b.strftime('%Y-%m-%d %H:%M:%S') for b in bounds[1:-1]] + [stop]
+    return [(bounds[i], bounds[i + 1]) for i in range(num_chunks) if bounds[i] != bounds[i + 1]]
@@ -1,14 +1,131 @@
+"""
+FluxQL query strings
+
+Besides the string helpers, queries can be built as structured `FluxQuery`
+objects. `FluxQuery.compile()` orders the filters so that filters on the
+indexed `_measurement` and `_field` columns come first, uses an anchored
+regular expression instead of a long chain of `or` comparisons for large
+lists of values (regex filters on tags are pushed down to the storage
+engine) and escapes all values. Compiled query templates are memoized,
+repeated downloads (e.g. of consecutive time windows) only need to insert
+the time range.
+"""
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+# Lists with more values than this are filtered with an anchored regex
+SET_FILTER_THRESHOLD = 10
+
+# Filters are applied in this order, other columns (tags) follow
+PUSHDOWN_ORDER = ('_measurement', '_field')
+
+_RANGE_START = '__DBC_RANGE_START__'
+_RANGE_STOP = '__DBC_RANGE_STOP__'
+
+
+def escape_string(value) -> str:
+    """Escape value for use in a Flux string literal"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def escape_regex(value) -> str:
+    """Escape value for literal use in a Flux regular expression"""
+    return ''.join(f'\\{c}' if c in '\\.+*?()|[]{}^$/' else c for c in str(value))
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """Filter on one column: the column value must be one of *values*"""
+    column: str
+    values: tuple
+
+    def compile(self) -> str:
+        col = f'r["{escape_string(self.column)}"]'
+        if len(self.values) > SET_FILTER_THRESHOLD:
+            pattern = '|'.join(escape_regex(v) for v in self.values)
+            return f'|> filter(fn: (r) => {col} =~ /^(?:{pattern})$/)'
+        conditions = ' or '.join(f'{col} == "{escape_string(v)}"' for v in self.values)
+        return f'|> filter(fn: (r) => {conditions})'
+
+
+@dataclass(frozen=True)
+class FluxQuery:
+    """Structured query: bucket, time range, filters and pivot
+
+    Example:
+        FluxQuery(bucket='ch-dav_raw', start=start_iso, stop=stop_iso)
+            .where('_measurement', ['TA'])
+            .where('_field', ['TA_T1_2_1'])
+            .compile()
+    """
+    bucket: str
+    start: str
+    stop: str
+    predicates: tuple = ()
+    keep: tuple = None  # Columns that are kept (projection), None keeps all columns
+    functions: tuple = ()  # Additional functions, e.g. '|> count()', applied after filters
+    pivot: bool = True
+
+    def where(self, column: str, values: list or None) -> 'FluxQuery':
+        """Add filter for *column*, nothing is added if *values* is empty or None"""
+        if not values:
+            return self
+        values = tuple(dict.fromkeys(values))  # Unique, order preserved
+        return replace(self, predicates=self.predicates + (Predicate(column=column, values=values),))
+
+    def project(self, columns: list) -> 'FluxQuery':
+        """Keep only *columns* (before pivot)"""
+        return replace(self, keep=tuple(dict.fromkeys(columns)))
+
+    def pipe(self, *functions: str) -> 'FluxQuery':
+        """Append functions to the query, e.g. '|> count()'"""
+        return replace(self, functions=self.functions + tuple(functions))
+
+    def with_range(self, start: str, stop: str) -> 'FluxQuery':
+        return replace(self, start=start, stop=stop)
+
+    def ordered_predicates(self) -> tuple:
+        """Filters on indexed columns first, then all other filters in given order"""
+
+        def rank(p: Predicate) -> int:
+            return PUSHDOWN_ORDER.index(p.column) if p.column in PUSHDOWN_ORDER else len(PUSHDOWN_ORDER)
+
+        return tuple(sorted(self.predicates, key=rank))
+
+    def compile(self) -> str:
+        template = _compile_template(bucket=self.bucket, predicates=self.ordered_predicates(),
+                                     keep=self.keep, functions=self.functions, pivot=self.pivot)
+        return template.replace(_RANGE_START, self.start).replace(_RANGE_STOP, self.stop)
+
+
+@lru_cache(maxsize=256)
+def _compile_template(bucket: str, predicates: tuple, keep: tuple, functions: tuple, pivot: bool) -> str:
+    parts = [bucketstring(bucket=bucket), rangestring(start=_RANGE_START, stop=_RANGE_STOP)]
+    parts += [p.compile() for p in predicates]
+    if keep:
+        parts.append(keepstring(columns=keep))
+    parts += list(functions)
+    if pivot:
+        parts.append(pivotstring())
+    return ' '.join(parts)
+
+
 def dropstring():
     return f'|> drop(columns: ["_start", "_stop"])'
     # return f'|> drop(columns: ["_start", "_stop", "_measurement"])'
 
 
+def keepstring(columns: tuple or list) -> str:
+    cols = ', '.join(f'"{escape_string(c)}"' for c in columns)
+    return f'|> keep(columns: [{cols}])'
+
+
 def pivotstring():
     return f'|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")'
 
 
 def bucketstring(bucket: str) -> str:
-    return f'from(bucket: "{bucket}")'
+    return f'from(bucket: "{escape_string(bucket)}")'
 
 
 def rangestring(start: str, stop: str) -> str:
@@ -19,9 +136,9 @@ def filterstring(queryfor: str, querylist: list, type: str) -> str:
     filterstring = ''  # Query string
     for ix, var in enumerate(querylist):
         if ix == 0:
-            filterstring += f'|> filter(fn: (r) => r["{queryfor}"] == "{var}"'
+            filterstring += f'|> filter(fn: (r) => r["{queryfor}"] == "{escape_string(var)}"'
         else:
-            filterstring += f' {type} r["{queryfor}"] == "{var}"'
+            filterstring += f' {type} r["{queryfor}"] == "{escape_string(var)}"'
     filterstring = f"{filterstring})"  # Needs bracket at end
     return filterstring
 
@@ -0,0 +1,323 @@
+"""
+Assembly of downloaded tables into dataframes
+
+Shared by all download methods: the tables returned by the database query
+(one table per variable and tag set) are converted to the requested
+timezone and merged into one dataframe with all variables (data_simple)
+and one dataframe per variable that also contains the tags (data_detailed).
+Downloads from several buckets are aligned on one common timestamp index.
+"""
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from dbc_influxdb.common import tags, convert_ts_to_timezone
+from dbc_influxdb.stats import OperationStats, phase_of, variable_of
+from dbc_influxdb.tagprofiles import SIDECAR_MEASUREMENT
+
+
+def assemble_download(tables: list, timezone_offset_to_utc_hours: int,
+                      version_priority: list = None, stats: OperationStats = None) -> tuple[DataFrame, dict, list]:
+    """Merge downloaded tables into data_simple and data_detailed
+
+    Args:
+        tables: list of dataframes returned by the query, each table contains
+            data for one variable with one set of tags
+        timezone_offset_to_utc_hours: convert the UTC timestamp from the
+            database to this timezone offset
+        version_priority: list of data versions, highest priority first. If given,
+            overlapping records of the same variable in different data versions are
+            resolved by this ranking (see `resolve_versions()`), otherwise the last
+            table wins.
+        stats: if given, the durations of the phases 'timezone' and 'merge' are
+            added to the stats
+
+    Returns:
+        data_simple: dataframe with all variables, without tags
+        data_detailed: dict with variable names as keys and dataframes with
+            variable data and tags as values
+        found_measurements: list of the measurement of each table
+    """
+    # Empty tables are returned if no data were found
+    tables = data_tables(tables)
+
+    if version_priority:
+        return _assemble_by_version(tables=tables, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                    version_priority=version_priority, stats=stats)
+
+    # Each table in tables contains data for one variable
+    found_measurements = []
+    data_detailed = {}  # Stores variables and their tags
+    data_simple = DataFrame()  # Stores variables
+    for ix, table in enumerate(tables):
+
+        found_measurement = list(set(table['_measurement'].tolist()))
+        if len(found_measurement) != 1:
+            raise ValueError(f"Found {len(found_measurement)} measurements, but only one allowed")
+        found_measurements.append(found_measurement[0])
+
+        # Detect of which variable the frame contains data
+        # Here it is useful that the variable name is also available as tag 'varname'.
+        # field_in_table = [f for f in fields if f in table.columns]
+        list_of_fields = list(set(table['varname'].tolist()))
+
+        # Current table must contain one single variable name
+        if len(list_of_fields) != 1:
+            raise ValueError(f"Expected one field, got {list_of_fields}")
+
+        field_in_table = list_of_fields[0]
+        key = field_in_table
+
+        with variable_of(stats, key):
+            table = _prepare_table(table=table, key=key, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                   stats=stats)
+
+            # Collect variables without tags in a separate (simplified) dataframe.
+            # This dataframe only contains the timestamp and the data column of each var.
+            # :: refactored in v0.7.0
+            # Add new column if column does not exist in current df
+            incomingdata = pd.DataFrame(table[key])
+            with phase_of(stats, 'merge_simple'):
+                data_simple = data_simple.combine_first(incomingdata)
+                data_simple = data_simple[~data_simple.index.duplicated(keep='last')]
+            # if ix == 0:
+            #     data_simple = table[[key]].copy()
+            # else:
+            #     if key not in data_simple.columns:
+            #         data_simple[key] = table[[key]].copy()
+            #     else:
+            #         # If var already exists as column in df, merge
+            #         # incoming data with the data that are already in df.
+            #         incomingdata = pd.DataFrame(table[key])
+            #         data_simple = data_simple.combine_first(incomingdata)
+            #
+            #         # Remove duplicates from incoming data
+            #         data_simple = data_simple[~data_simple.index.duplicated(keep='last')]
+
+            # Store frame in dict with the field (variable name) as key
+            # This way the table (data) of each variable can be accessed by
+            # field name, i.e., variable name.
+            # Important: variables with different sets of tags are downloaded
+            # in their own table. Therefore, if a variable TA_T1_X_1 has e.g.
+            # different time resolutions it is downloaded as multiple tables.
+            # Since the table is stored with the name of the variable, it is
+            # thus necessary to check whether a table with the name of the
+            # var already exists in the dict 'data_detailed'. If yes, the table
+            # is added (.combine_first) to the already existing table. It is also
+            # necessary to check whether there are index duplicated present
+            # after the table merging.
+            # :: added in v0.7.0
+            if key not in data_detailed:
+                # Add table df as new dict entry
+                data_detailed[key] = table
+            else:
+                with phase_of(stats, 'merge_detailed'):
+                    data_detailed[key] = data_detailed[key].combine_first(table)
+                    data_detailed[key] = data_detailed[key][~data_detailed[key].index.duplicated(keep='last')]
+
+    return data_simple, data_detailed, found_measurements
+
+
+def data_tables(tables: list) -> list:
+    """Tables that contain variable data
+
+    Empty tables, tables of the sidecar measurement (see `dbc_influxdb.tagprofiles`)
+    and tables that only contain metadata fields are removed.
+    """
+    return [t for t in tables
+            if not t.empty
+            and not (t['_measurement'] == SIDECAR_MEASUREMENT).all()
+            and t['varname'].iloc[0] in t.columns]
+
+
+def _prepare_table(table: DataFrame, key: str, timezone_offset_to_utc_hours: int,
+                   stats: OperationStats = None) -> DataFrame:
+    """Timestamp index in the requested timezone, only the field and tag columns are kept"""
+
+    # table.drop(columns=['result', 'table', '_measurement'], inplace=True)
+
+    # Queries are always returned w/ UTC timestamp
+    # Create timestamp columns
+    with phase_of(stats, 'copy'):
+        table.rename(columns={"_time": "TIMESTAMP_UTC_END"}, inplace=True)
+        table['TIMESTAMP_END'] = table['TIMESTAMP_UTC_END'].copy()
+
+    with phase_of(stats, 'timezone'):
+        # TIMEZONE: convert timestamp index to required timezone
+        table['TIMESTAMP_END'] = convert_ts_to_timezone(
+            timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+            timestamp_index=table['TIMESTAMP_END'])
+
+        # Remove timezone info in timestamp from TIMESTAMP_END
+        # -> download clean timestamp without timestamp info
+        table['TIMESTAMP_END'] = table['TIMESTAMP_END'].dt.tz_localize(None)  # Timezone!
+
+    with phase_of(stats, 'copy'):
+        # Set TIMESTAMP_END as the main index
+        table.set_index("TIMESTAMP_END", inplace=True)
+        table.sort_index(inplace=True)
+
+        # Remove duplicated index entries, v0.4.1
+        # This can happen if the variable is logged in a new file, but the
+        # old file is still active and also contains data for the var.
+        # In this case, keep the last data entry.
+        table = table[~table.index.duplicated(keep='last')]
+
+        # Remove timezone info from UTC timestamp, header already states it's UTC
+        table['TIMESTAMP_UTC_END'] = table['TIMESTAMP_UTC_END'].dt.tz_localize(None)  # Timezone!
+
+        # # Remove UTC timestamp from columns
+        # table.drop('TIMESTAMP_UTC_END', axis=1, inplace=True)
+
+        # Keep all columns that are either the field or database tags
+        keepcols = [col for col in table.columns if col in tags]
+        keepcols.append(key)
+        table = table[keepcols].copy()
+    return table
+
+
+def _assemble_by_version(tables: list, timezone_offset_to_utc_hours: int,
+                         version_priority: list, stats: OperationStats = None) -> tuple[DataFrame, dict, list]:
+    """Assemble the tables of each data version separately, then resolve overlaps by priority"""
+    by_version = {}
+    for table in tables:
+        version = table['data_version'].iloc[0] if 'data_version' in table.columns else None
+        by_version.setdefault(version, []).append(table)
+
+    found_measurements = []
+    detailed_by_version = {}
+    for version, version_tables in by_version.items():
+        _, detailed, measurements = assemble_download(tables=version_tables,
+                                                      timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                                      stats=stats)
+        detailed_by_version[version] = detailed
+        found_measurements += measurements
+
+    with phase_of(stats, 'merge_versions'):
+        data_detailed = resolve_versions(detailed_by_version=detailed_by_version,
+                                         version_priority=version_priority)
+    data_simple = pd.concat([df[[key]] for key, df in data_detailed.items()], axis=1) if data_detailed \
+        else DataFrame()
+    return data_simple, data_detailed, found_measurements
+
+
+def resolve_versions(detailed_by_version: dict, version_priority: list) -> dict:
+    """Merge the data of several data versions by priority
+
+    For each variable, the values of all versions are stacked in one array
+    (one column per version, ordered by priority). For each timestamp, the
+    first version with a value (not missing) wins. The tags of the returned records,
+    including 'data_version', are the tags of the winning version.
+
+    Args:
+        detailed_by_version: dict with data versions as keys and data_detailed
+            dicts (variable name: dataframe with data and tags) as values
+        version_priority: list of data versions, highest priority first;
+            versions that are not in the list have the lowest priority
+
+    Returns:
+        data_detailed with one dataframe per variable
+    """
+    ranked = sorted(detailed_by_version,
+                    key=lambda v: version_priority.index(v) if v in version_priority else len(version_priority))
+    keys = list(dict.fromkeys(k for v in ranked for k in detailed_by_version[v]))
+    data_detailed = {}
+    for key in keys:
+        frames = [(v, detailed_by_version[v][key]) for v in ranked if key in detailed_by_version[v]]
+        if len(frames) == 1:
+            data_detailed[key] = frames[0][1]
+            continue
+        index = frames[0][1].index
+        for _, df in frames[1:]:
+            index = index.union(df.index)
+        stacked = np.full((len(index), len(frames)), np.nan)
+        present = np.zeros((len(index), len(frames)), dtype=bool)
+        for col, (_, df) in enumerate(frames):
+            rows = index.get_indexer(df.index)
+            stacked[rows, col] = pd.to_numeric(df[key], errors='coerce').to_numpy()
+            present[rows, col] = True
+        # First version with a value wins, if no version has a value the first
+        # version with a record (missing value) is kept
+        available = ~np.isnan(stacked)
+        winner = np.where(available.any(axis=1), available.argmax(axis=1), present.argmax(axis=1))
+        parts = []
+        for col, (_, df) in enumerate(frames):
+            won = index[winner == col]
+            parts.append(df.loc[df.index.isin(won)])
+        data_detailed[key] = pd.concat(parts).sort_index()
+    return data_detailed
+
+
+def version_periods(data_detailed: dict) -> DataFrame:
+    """Periods in which each data version was used, e.g. after a download with *version_priority*
+
+    Returns:
+        dataframe with one row per variable and uninterrupted period of the same data
+        version, with columns 'field', 'data_version', 'start', 'end' and 'records'
+    """
+    periods = []
+    for key, df in data_detailed.items():
+        if df.empty or 'data_version' not in df.columns:
+            continue
+        versions = df['data_version']
+        run = (versions != versions.shift()).cumsum()
+        grouped = pd.DataFrame({'data_version': versions, 'ts': df.index, 'run': run.values}).groupby('run')
+        summary = grouped.agg(data_version=('data_version', 'first'), start=('ts', 'first'),
+                              end=('ts', 'last'), records=('ts', 'size'))
+        summary.insert(0, 'field', key)
+        periods.append(summary)
+    if not periods:
+        return DataFrame(columns=['field', 'data_version', 'start', 'end', 'records'])
+    return pd.concat(periods, ignore_index=True)
+
+
+def field_measurements(tables: list) -> dict:
+    """Measurement of each variable, taken from the downloaded tables
+
+    Replaces the schema queries per measurement that were needed before to
+    detect the measurement of each variable.
+    """
+    assigned_measurements = {}
+    for table in tables:
+        if table.empty or 'varname' not in table.columns:
+            continue
+        if (table['_measurement'] == SIDECAR_MEASUREMENT).all():
+            continue
+        for varname, measurement in table[['varname', '_measurement']].drop_duplicates().itertuples(index=False):
+            assigned_measurements[varname] = measurement
+    return assigned_measurements
+
+
+def align_frames(frames: dict) -> DataFrame:
+    """Align dataframes on their common (union) timestamp index
+
+    The values of all frames are copied into one array that is allocated
+    once, instead of joining the frames one after the other.
+
+    Args:
+        frames: dict with keys (e.g. site names) and dataframes with timestamp
+            index and one column per variable as values
+
+    Returns:
+        dataframe with the union of all timestamps as index and columns
+        (key, variable)
+    """
+    frames = {key: df for key, df in frames.items() if not df.empty}
+    if not frames:
+        return DataFrame()
+    index = frames[next(iter(frames))].index
+    for df in list(frames.values())[1:]:
+        index = index.union(df.index)
+    index = index.sort_values()
+    index.name = 'TIMESTAMP_END'
+
+    columns = [(key, col) for key, df in frames.items() for col in df.columns]
+    numeric = all(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+                  for df in frames.values() for dtype in df.dtypes)
+    values = np.full((len(index), len(columns)), np.nan, dtype='float64' if numeric else object)
+    pos = 0
+    for df in frames.values():
+        rows = index.get_indexer(df.index)
+        values[rows, pos:pos + df.shape[1]] = df.to_numpy()
+        pos += df.shape[1]
+    return DataFrame(values, index=index, columns=pd.MultiIndex.from_tuples(columns, names=['site', 'field']))
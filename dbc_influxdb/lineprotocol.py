@@ -0,0 +1,30 @@
+"""
+Serialization of dataframes to InfluxDB line protocol
+
+Uses the same serializer as the write API of influxdb_client, so that
+pre-serialized data can be stored (e.g. in the write spool) or sent in
+batches without serializing them again.
+"""
+from influxdb_client.client.write.dataframe_serializer import data_frame_to_list_of_points
+from influxdb_client.client.write_api import PointSettings
+from pandas import DataFrame
+
+
+def frame_to_lines(df: DataFrame, measurement: str, tag_columns: list, precision: str = 's') -> list[str]:
+    """Serialize dataframe with timezone-aware timestamp index to line protocol
+
+    Args:
+        df: data with one or more field columns and tag columns
+        measurement: name of measurement, e.g. 'TA'
+        tag_columns: names of the columns that are stored as tags, columns
+            that are not in *df* are ignored
+        precision: precision of the timestamps, 's' for seconds
+
+    Returns:
+        list of line protocol strings, one per row
+    """
+    if df.empty:
+        return []
+    return data_frame_to_list_of_points(df, PointSettings(), precision=precision,
+                                        data_frame_measurement_name=measurement,
+                                        data_frame_tag_columns=tag_columns)
@@ -1,32 +1,86 @@
 # https://www.geeksforgeeks.org/getter-and-setter-in-python/
 import fnmatch
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import dateutil.parser as parser
 import pandas as pd
 import yaml
-from influxdb_client import WriteOptions
+from influxdb_client import TaskCreateRequest, TaskUpdateRequest, WriteOptions
+from influxdb_client.client.write_api import SYNCHRONOUS
 from pandas import DataFrame
 
 import dbc_influxdb.fluxql as fluxql
+from dbc_influxdb.aggregates import (REAGGREGATE, TASK_PREFIX, AggregateSpec, aggregate_functions, route,
+                                     specs_from_conf)
+from dbc_influxdb.batching import AdaptiveWriter, BatchingSettings
+from dbc_influxdb.cardinality import CardinalityReport, analyze_series, series_keys, series_query, simulate_series
+from dbc_influxdb.checkpoint import Checkpoint, Unit, frame_digest, scope_of
 from dbc_influxdb.common import tags, convert_ts_to_timezone
-from dbc_influxdb.db import get_client, get_query_api, get_delete_api
+from dbc_influxdb.coverage import CoverageCache, counts_to_long, coverage_query, merge_incremental, to_wide
+from dbc_influxdb.db import get_buckets_api, get_client, get_query_api, get_delete_api, get_tasks_api
+from dbc_influxdb.deletion import DeleteResult, plan_delete_predicates, run_delete_predicates
+from dbc_influxdb.download import DownloadSpec
+from dbc_influxdb.estimate import DOWNLOAD_COLUMNS, DownloadEstimate, estimate_from_counts
+from dbc_influxdb.frames import align_frames, assemble_download, data_tables, field_measurements
+from dbc_influxdb.lineprotocol import frame_to_lines
+from dbc_influxdb.manifest import UploadManifest
+from dbc_influxdb.resilience import CircuitBreaker, ReadPolicy, call_with_retry
+from dbc_influxdb.retag import RetagResult, RetagRules, retag_query, time_chunks
+from dbc_influxdb.snapshot import DROP_COLUMNS, RestoreResult, SnapshotWriter, restore_snapshot, snapshot_lines
+from dbc_influxdb.spool import SpoolReplayResult, WriteSpool
+from dbc_influxdb.stats import OperationStats, emit, phase_of
+from dbc_influxdb.sync import SyncStore, series_watermarks
+from dbc_influxdb.tagprofiles import (SIDECAR_MEASUREMENT, TagProfile, metadata_as_text, query_fields,
+                                      reattach_metadata, resolve_profile, sidecar_lines, sidecar_query,
+                                      split_metadata, where_fields)
+from dbc_influxdb.upload import (UploadReport, detect_field, normalize_timestamps, plan_upsert,
+                                 upsert_delete_predicates)
+from dbc_influxdb.verify import VerifyResult, local_checksums, uploaded_range, verify_upload
 
 
 class dbcInflux:
     script_id = "dbc"
 
     def __init__(self,
-                 dirconf: str):
+                 dirconf: str,
+                 read_policy: ReadPolicy = None,
+                 quiet: bool = False,
+                 stats_sinks: list = None,
+                 profile_memory: bool = False):
+        """
+        Args:
+            dirconf: folder with configurations
+            read_policy: timeouts and retries of queries, by default taken from section
+                'read' of the database configuration (dbconf.yaml) or the default policy
+            quiet: if True, no progress is printed, e.g. when stats are collected with
+                *stats_sinks* instead
+            stats_sinks: list of sinks that receive the stats (phase durations and counts)
+                of each operation, see `dbc_influxdb.stats`. The stats of the last
+                operation are also available in `.last_stats`.
+            profile_memory: if True, the stats also contain the peak and retained memory
+                of each phase and of each variable (`OperationStats.memory` and
+                `OperationStats.memory_by_variable`), e.g. to find the step of a download
+                that needs the most memory. Slows down all operations.
+        """
 
         self.dirconf = Path(dirconf)
+        self.quiet = quiet
+        self.stats_sinks = stats_sinks if stats_sinks else []
+        self.profile_memory = profile_memory
+        self.last_stats = None
 
         self.conf_filetypes, \
             self.conf_unitmapper, \
             self.conf_dirs, \
             self.conf_db = self._read_configs()
 
+        self.read_policy = read_policy if read_policy else ReadPolicy(**self.conf_db.get('read', {}))
+        self.circuit_breaker = CircuitBreaker(failure_threshold=self.read_policy.failure_threshold,
+                                              reset_timeout=self.read_policy.reset_timeout)
+
         self._test_connection_to_db()
 
         # self.client = get_client(self.conf_db)
@@ -36,7 +90,8 @@ class dbcInflux:
         self._measurements = None
         self._fields = None
 
-    def _add_timestamp_utc(self, timestamp_index, timezone_offset_to_utc_hours) -> pd.DatetimeIndex:
+    @staticmethod
+    def _add_timestamp_utc(timestamp_index, timezone_offset_to_utc_hours) -> pd.DatetimeIndex:
         # Needs to be in format '2022-05-27 00:00:00+01:00' for InfluxDB
         sign = '+' if timezone_offset_to_utc_hours >= 0 else '-'
         timezone_offset_to_utc_hours = str(timezone_offset_to_utc_hours).zfill(2) \
@@ -51,7 +106,16 @@ class dbcInflux:
                          to_bucket: str,
                          to_measurement: str,
                          timezone_offset_to_utc_hours: int,
-                         delete_from_db_before_upload: bool = True):
+                         delete_from_db_before_upload: bool = True,
+                         upsert: bool = False,
+                         upsert_block: str = '1D',
+                         manifest: UploadManifest = None,
+                         spool: WriteSpool = None,
+                         batching: BatchingSettings = None,
+                         tag_profile: str or TagProfile = None,
+                         checkpoint: Checkpoint = None,
+                         verify: bool = False,
+                         duplicates: str = 'last') -> UploadReport:
         """Upload single variable to database.
         
         The database needs to know the timezone because all data in the db are
@@ -66,34 +130,117 @@ class dbcInflux:
                 deleted before uploading. All data with the same variable name are deleted. 
                 Implemented to avoid duplicate uploads of the same data in cases where data
                 remained the same, but one of the tags has changed.
+            upsert: if True, the data already stored in the database between the start and
+                end dates of *var_df* are downloaded and compared to *var_df*. Only time blocks
+                that contain changed values or tags are uploaded, and only tag series that do
+                not exist in *var_df* anymore are deleted. Replaces *delete_from_db_before_upload*.
+            upsert_block: size of the time blocks that are compared and (re-)uploaded in
+                *upsert* mode, given as pandas frequency string, e.g. '1D'
+            manifest: local manifest of already uploaded data. Time blocks that were
+                already uploaded with the same content are skipped, no data are deleted
+                from the database (*delete_from_db_before_upload* is ignored). Cannot be
+                combined with *upsert*.
+            spool: local write spool. If given, the data are serialized and stored in the
+                spool instead of being sent to the database, see `.replay_spool()`. No
+                connection to the database is needed and no data are deleted from the
+                database (*delete_from_db_before_upload* is ignored). Cannot be combined
+                with *upsert*.
+            batching: settings for adaptive write batching. If given, the batch size and the
+                number of batches in flight are adjusted from the observed request latency and
+                HTTP 429/503 responses, optionally with a ceiling in points per second. If not
+                given, the section 'batching' of the database configuration is used if available,
+                otherwise the data are written with fixed batches of 5000 points.
+            tag_profile: name of the tag profile that decides which metadata are written as
+                tags, as fields or to the sidecar measurement, see `dbc_influxdb.tagprofiles`.
+                If not given, the profile of *to_bucket* in the database configuration is
+                used, otherwise all metadata are written as tags (profile 'full').
+            checkpoint: if given, the upload of the variable between the first and last
+                timestamp of *var_df* is recorded in the checkpoint after it was successful.
+                If it was already recorded with the same data, e.g. in an earlier run of an
+                upload loop over many variables, nothing is uploaded, see `dbc_influxdb.checkpoint`.
+            verify: if True, the number, sum, minimum and maximum of the values per day are
+                compared with the data in the database after the upload, with one aggregate
+                query (no download), see `dbc_influxdb.verify`. Windows that differ are
+                reported in *report.verify*. Ignored with *spool*.
+            duplicates: rows with the same timestamp in *var_df*, e.g. from overlapping files:
+                'last' keeps the last row (default), 'first' the first row, 'error' raises
+                ValueError. Data are also sorted by timestamp before upload, see
+                `dbc_influxdb.upload.normalize_timestamps()`.
 
         Returns:
-            Nothing, only uploads to database.
+            UploadReport with the number of written and skipped points.
 
         """
-        data_cols = var_df.columns.to_list()
-
-        # Check if data contain all tag columns
-        cols_not_in_data = [l for l in tags if l not in data_cols]
-        if len(cols_not_in_data) > 0:
-            raise Exception(f"Data do not contain required tag columns: {cols_not_in_data}")
-
-        # Detect field name (variable name)
-        # The field name is the name of the column that is not part of the tags
-        field = [l for l in data_cols if l not in tags]
-        if len(field) > 1:
-            raise Exception(f"Only one field (variable name) allowed, found {field}.")
-
-        if delete_from_db_before_upload:
+        field = [detect_field(var_df=var_df)]
+        profile = resolve_profile(conf_db=self.conf_db, bucket=to_bucket, name=tag_profile)
+
+        report = UploadReport(bucket=to_bucket, measurement=to_measurement, field=field[0],
+                              mode='write', points_total=len(var_df))
+        stats = OperationStats(operation='upload', labels=dict(bucket=to_bucket, field=field[0]),
+                               profile_memory=self.profile_memory)
+        report.stats = stats
+
+        if upsert and (manifest is not None or spool is not None):
+            raise ValueError("Option 'upsert' cannot be combined with 'manifest' or 'spool'.")
+
+        # Sorted, unique timestamps, also for the time range that is deleted before upload
+        with stats.phase('prepare'):
+            var_df, report.duplicates, report.unsorted = normalize_timestamps(var_df=var_df,
+                                                                              duplicates=duplicates)
+        if report.duplicates or report.unsorted:
+            stats.add(duplicates=report.duplicates)
+            self._print(f"{field}: {report.duplicates} rows with duplicate timestamps removed "
+                       f"(kept {duplicates}){', timestamps sorted' if report.unsorted else ''}")
+
+        # Other data versions or changed data (values, tags) are uploaded again
+        data_versions = sorted(var_df['data_version'].astype(str).unique()) if 'data_version' in var_df else []
+        unit = Unit(scope=scope_of('upload', to_bucket, to_measurement, timezone_offset_to_utc_hours,
+                                   data_versions, frame_digest(var_df) if checkpoint is not None else ''),
+                    field=field[0], start=str(var_df.index[0]) if len(var_df) else '',
+                    stop=str(var_df.index[-1]) if len(var_df) else '')
+        if checkpoint is not None and checkpoint.is_done(unit):
+            report.mode = 'checkpoint'
+            report.points_skipped = report.points_total
+            stats.add(points=0, points_skipped=report.points_skipped)
+            self._print(f"--> ALREADY UPLOADED TO DATABASE BUCKET {to_bucket} (checkpoint):  {field}")
+            self._finish_stats(stats)
+            return report
+
+        # Checksums of all data, including data that are not written again (manifest, upsert)
+        checksums, uploaded = None, None
+        if verify and spool is None:
+            utc_df = var_df[[c for c in field + ['data_version'] if c in var_df.columns]].set_axis(
+                self._add_timestamp_utc(timestamp_index=var_df.index,
+                                        timezone_offset_to_utc_hours=timezone_offset_to_utc_hours))
+            checksums = local_checksums(var_df=utc_df, field=field[0])
+            uploaded = uploaded_range(var_df=utc_df, field=field[0], measurement=to_measurement)
+
+        if spool is not None:
+            report.mode = 'spool'
+
+        elif manifest is not None:
+            report.mode = 'manifest'
+
+        elif upsert:
+            report.mode = 'upsert'
+            with stats.phase('upsert'):
+                upsert_df = var_df
+                var_df = self._upsert_changed_blocks(var_df=var_df, to_bucket=to_bucket,
+                                                     to_measurement=to_measurement, field=field[0],
+                                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                                     block=upsert_block, report=report, profile=profile)
+
+        elif delete_from_db_before_upload:
+            report.mode = 'delete-then-write'
             start = str(var_df.index[0])
             stop = str(var_df.index[-1])
-            data_version = list(set(var_df['data_version'].tolist()))
-            if len(data_version) > 1:
-                raise ValueError('Multiple data versions not supported')
-            data_version = data_version[0]
-            self.delete(bucket=to_bucket, measurements=[to_measurement],
-                        start=start, stop=stop, timezone_offset_to_utc_hours=1,
-                        data_version=data_version, fields=field)
+            data_version = self._single_data_version(var_df=var_df)
+            measurements = [to_measurement, SIDECAR_MEASUREMENT] if profile.sidecar else [to_measurement]
+            with stats.phase('delete'):
+                result = self.delete(bucket=to_bucket, measurements=measurements, start=start, stop=stop,
+                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                     data_version=data_version, fields=field)
+            result.raise_for_failures()
 
         # Add timezone info to timestamp
         # var_df.index.tz
@@ -103,34 +250,303 @@ class dbcInflux:
         # var_df.index = self._add_timezone_info(timestamp_index=var_df.index,
         #                                        timezone_of_timestamp=timezone_of_timestamp)
 
+        # Skip blocks that were already uploaded with the same content
+        manifest_result = None
+        if manifest is not None:
+            with stats.phase('manifest'):
+                manifest_result = manifest.filter_unchanged(df=var_df, bucket=to_bucket,
+                                                            measurement=to_measurement,
+                                                            field=field[0], tag_columns=tags)
+            var_df = manifest_result.write_df
+            report.blocks_skipped = manifest_result.blocks_skipped
+
+        report.points_written = len(var_df)
+        report.points_skipped = report.points_total - report.points_written
+        stats.add(points=report.points_written, points_skipped=report.points_skipped)
+        if var_df.empty:
+            self._print(f"--> NO CHANGES, NOTHING UPLOADED TO DATABASE BUCKET {to_bucket}:  {field}")
+            return self._complete_upload(report=report, unit=unit, checkpoint=checkpoint, manifest=manifest,
+                                         manifest_result=manifest_result, checksums=checksums,
+                                         uploaded=uploaded, stats=stats)
+
+        # Metadata that are not written as tags, see `dbc_influxdb.tagprofiles`
+        var_df, sidecar = split_metadata(var_df=var_df, field=field[0], profile=profile)
+        if upsert and profile.sidecar:
+            # Sidecar points of the whole range were deleted, see `._upsert_changed_blocks()`
+            upsert_df = upsert_df.set_axis(self._add_timestamp_utc(
+                timestamp_index=upsert_df.index, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours))
+            _, sidecar = split_metadata(var_df=upsert_df, field=field[0], profile=profile)
+        metadata_lines = sidecar_lines(sidecar=sidecar, profile=profile)
+        stats.add(metadata_points=len(metadata_lines))
+
+        if spool is not None:
+            with stats.phase('serialize'):
+                lines = frame_to_lines(df=var_df, measurement=to_measurement, tag_columns=profile.tags,
+                                       precision='s') + metadata_lines
+            with stats.phase('write'):
+                spool.append(bucket=to_bucket, lines=lines, precision='s')
+            self._print(f"--> SPOOLED FOR DATABASE BUCKET {to_bucket}:  {field}  ({len(lines)} points)")
+            return self._complete_upload(report=report, unit=unit, checkpoint=checkpoint, manifest=manifest,
+                                         manifest_result=manifest_result, checksums=checksums,
+                                         uploaded=uploaded, stats=stats)
+
         # Database clients
-        print("Connecting to database ...")
+        self._print("Connecting to database ...")
         client = get_client(conf_db=self.conf_db)
 
+        batching = batching if batching else self._batching_settings_from_conf()
+        if batching:
+            # Adaptive batches, sent with synchronous writes
+            self._print(f"--> UPLOAD TO DATABASE BUCKET {to_bucket}:  {field} ", end=" ")
+            with stats.phase('serialize'):
+                lines = frame_to_lines(df=var_df, measurement=to_measurement, tag_columns=profile.tags,
+                                       precision='s') + metadata_lines
+            write_api = client.write_api(write_options=SYNCHRONOUS)
+            try:
+                with stats.phase('write'):
+                    report.write_stats = AdaptiveWriter(write_api=write_api, settings=batching).write(
+                        bucket=to_bucket, record=lines, write_precision='s')
+            finally:
+                write_api.close()
+                client.close()
+            stats.add(bytes=report.write_stats.bytes, requests=report.write_stats.requests,
+                      retries=report.write_stats.retries)
+            self._print(f"Upload finished ({report.write_stats.points_per_second:.0f} points/s, "
+                       f"final batch size {report.write_stats.final_batch_size}).")
+            return self._complete_upload(report=report, unit=unit, checkpoint=checkpoint, manifest=manifest,
+                                         manifest_result=manifest_result, checksums=checksums,
+                                         uploaded=uploaded, stats=stats)
+
         # The WriteApi in batching mode (default mode) is suppose to run as a singleton.
         # To flush all your data you should wrap the execution using with
         # client.write_api(...) as write_api: statement or call write_api.close()
         # at the end of your script.
         # https://influxdb-client.readthedocs.io/en/stable/usage.html#write
-        with client.write_api(write_options=WriteOptions(batch_size=5000,
-                                                         flush_interval=10_000,
-                                                         jitter_interval=2_000,
-                                                         retry_interval=5_000,
-                                                         max_retries=5,
-                                                         max_retry_delay=30_000,
-                                                         exponential_base=2)) as write_api:
+        write_errors = []
+        # Serialization happens in the write API and is included in phase 'write'
+        with stats.phase('write'), \
+                client.write_api(write_options=WriteOptions(batch_size=5000,
+                                                            flush_interval=10_000,
+                                                            jitter_interval=2_000,
+                                                            retry_interval=5_000,
+                                                            max_retries=5,
+                                                            max_retry_delay=30_000,
+                                                            exponential_base=2),
+                                 error_callback=lambda conf, data, exception: write_errors.append(exception)
+                                 ) as write_api:
 
             # Write to db
             # Output also the source file to log
-            print(f"--> UPLOAD TO DATABASE BUCKET {to_bucket}:  {field} ", end=" ")
+            self._print(f"--> UPLOAD TO DATABASE BUCKET {to_bucket}:  {field} ", end=" ")
 
             write_api.write(to_bucket,
                             record=var_df,
                             data_frame_measurement_name=to_measurement,
-                            data_frame_tag_columns=tags,
+                            data_frame_tag_columns=profile.tags,
                             write_precision='s')
+            if metadata_lines:
+                write_api.write(to_bucket, record=metadata_lines, write_precision='s')
 
-            print("Upload finished.")
+            self._print("Upload finished.")
+        client.close()
+
+        if write_errors:
+            raise Exception(f"Upload of {field} to bucket {to_bucket} failed: {write_errors[0]}") \
+                from write_errors[0]
+        return self._complete_upload(report=report, unit=unit, checkpoint=checkpoint, manifest=manifest,
+                                     manifest_result=manifest_result, checksums=checksums,
+                                     uploaded=uploaded, stats=stats)
+
+    def _complete_upload(self, report: UploadReport, unit: Unit, checkpoint: Checkpoint or None,
+                         manifest: UploadManifest or None, manifest_result, checksums, uploaded,
+                         stats: OperationStats) -> UploadReport:
+        """Bookkeeping after a successful upload (or spool) of *report*, the same for all write paths
+
+        Verifies the upload if *checksums* are given, then remembers the uploaded
+        blocks in the manifest and the unit in the checkpoint, only after the
+        data were written.
+        """
+        if checksums is not None:
+            self._verify_upload(bucket=report.bucket, checksums=[checksums], ranges=[uploaded], report=report)
+        if manifest_result is not None:
+            manifest.commit(bucket=report.bucket, measurement=report.measurement, field=report.field,
+                            entries=manifest_result.entries)
+        if checkpoint is not None:
+            checkpoint.complete(unit, result=report.points_written)
+        self._finish_stats(stats)
+        return report
+
+    def _print(self, *args, **kwargs):
+        if not self.quiet:
+            print(*args, **kwargs)
+
+    def _finish_stats(self, stats: OperationStats) -> OperationStats:
+        """Finish stats of an operation and send them to all sinks"""
+        self.last_stats = stats.finish()
+        emit(stats=stats, sinks=self.stats_sinks)
+        return stats
+
+    def _read(self, func, description: str = 'query', stats: OperationStats = None):
+        """Run query function, retried after transient errors, see `dbc_influxdb.resilience`"""
+        return call_with_retry(func, policy=self.read_policy, breaker=self.circuit_breaker,
+                               description=description,
+                               on_retry=(lambda: stats.add(retries=1)) if stats else None,
+                               printer=self._print)
+
+    def _verify_upload(self, bucket: str, checksums: list, ranges: list, report: UploadReport) -> VerifyResult:
+        """Compare checksums of uploaded data with the database, see `dbc_influxdb.verify`"""
+        client = get_client(self.conf_db, timeout=self.read_policy.timeout_ms('verify'))
+        try:
+            with phase_of(report.stats, 'verify'):
+                result = self._read(lambda: verify_upload(query_api=get_query_api(client), bucket=bucket,
+                                                          checksums=checksums, ranges=ranges),
+                                    description="verify query", stats=report.stats)
+        finally:
+            client.close()
+        report.verify = result
+        if result.ok:
+            self._print(f"Verified {result.points} points in {result.windows} windows: OK")
+        else:
+            self._print(f"(!)VERIFICATION FAILED for {result.mismatched_fields} in bucket {bucket}, "
+                       f"{len(result.mismatches)} windows differ:\n{result.mismatches.to_string()}")
+        return result
+
+    def _query_data_frame(self, querystring: str, operation: str, stats: OperationStats = None):
+        """Run query with the timeout of *operation* (e.g. 'show'), retried after transient errors"""
+        client = get_client(self.conf_db, timeout=self.read_policy.timeout_ms(operation))
+        query_api = get_query_api(client)
+        try:
+            with phase_of(stats, 'query'):
+                return self._read(lambda: query_api.query_data_frame(query=querystring),
+                                  description=f"{operation} query", stats=stats)
+        finally:
+            client.close()
+
+    def _reattach_metadata(self, bucket: str, stop_iso: str, data_detailed: dict, profile: TagProfile,
+                           timezone_offset_to_utc_hours: int, stats: OperationStats = None) -> dict:
+        """Add the metadata that were not written as tags to *data_detailed*, see `dbc_influxdb.tagprofiles`"""
+        if not data_detailed or not (profile.fields or profile.sidecar):
+            return data_detailed
+        sidecar_tables = []
+        if profile.sidecar:
+            sidecar_tables = self._query_data_frame(
+                querystring=sidecar_query(bucket=bucket, stop=stop_iso, varnames=list(data_detailed)),
+                operation='download', stats=stats)
+            sidecar_tables = sidecar_tables if isinstance(sidecar_tables, list) else [sidecar_tables]
+        with phase_of(stats, 'metadata'):
+            return reattach_metadata(data_detailed=data_detailed, sidecar_tables=sidecar_tables, profile=profile,
+                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+
+    def _batching_settings_from_conf(self) -> BatchingSettings or None:
+        """Adaptive batching settings from section 'batching' in the database configuration"""
+        conf = self.conf_db.get('batching') if isinstance(self.conf_db, dict) else None
+        return BatchingSettings(**conf) if conf else None
+
+    @staticmethod
+    def _single_data_version(var_df: DataFrame) -> str:
+        """Return the data version of *var_df*, only one data version is allowed"""
+        data_version = list(set(var_df['data_version'].tolist()))
+        if len(data_version) > 1:
+            raise ValueError('Multiple data versions not supported')
+        return data_version[0]
+
+    def _upsert_changed_blocks(self,
+                               var_df: DataFrame,
+                               to_bucket: str,
+                               to_measurement: str,
+                               field: str,
+                               timezone_offset_to_utc_hours: int,
+                               block: str,
+                               report: UploadReport,
+                               profile: TagProfile = None) -> DataFrame:
+        """Compare *var_df* to the data in the database and return only changed blocks
+
+        Stale tag series and points that no longer exist in *var_df* are deleted
+        from the database before the changed blocks are returned for upload. Tag
+        series are identified by the tags of *profile* (default: all tags), metadata
+        in fields and in the sidecar measurement are compared like values. If any
+        block changed, the sidecar points of the whole range are deleted and must
+        be rewritten for the whole range.
+        """
+        profile = profile if profile else resolve_profile()
+        metadata_columns = [c for c in profile.fields + profile.sidecar if c in var_df.columns]
+        data_version = self._single_data_version(var_df=var_df)
+        start = str(var_df.index[0])
+        stop = str(var_df.index[-1] + pd.Timedelta(seconds=1))  # Range stop is exclusive
+
+        existing_df = self._query_existing_var(bucket=to_bucket, measurement=to_measurement, field=field,
+                                               data_version=data_version, start=start, stop=stop,
+                                               timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                               profile=profile)
+        plan = plan_upsert(new_df=metadata_as_text(df=var_df, profile=profile), existing_df=existing_df,
+                           field=field, tag_columns=profile.tags, block=block, metadata_columns=metadata_columns)
+
+        def to_iso(datestr: str) -> str:
+            return self._convert_datestr_to_iso8601(datestr=datestr,
+                                                    timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+
+        predicates = upsert_delete_predicates(plan=plan, measurement=to_measurement, field=field,
+                                              data_version=data_version, start=to_iso(start),
+                                              stop=to_iso(str(var_df.index[-1])), block=block, to_iso=to_iso,
+                                              sidecar=bool(profile.sidecar))
+        if predicates:
+            client = get_client(self.conf_db)
+            result = run_delete_predicates(delete_api=get_delete_api(client), bucket=to_bucket,
+                                           predicates=predicates)
+            client.close()
+            result.raise_for_failures()
+
+        report.blocks_written = list(plan.changed_blocks)
+        report.blocks_skipped = plan.num_blocks - len(plan.changed_blocks)
+        report.deleted_series = plan.stale_tagsets
+        self._print(f"UPSERT {field}: {len(plan.changed_blocks)} of {plan.num_blocks} blocks changed, "
+                   f"{len(plan.write_df)} of {len(var_df)} points to upload, "
+                   f"{len(plan.stale_tagsets)} stale tag series deleted.")
+        return var_df[var_df.index.isin(plan.write_df.index)].copy()
+
+    def _query_existing_var(self,
+                            bucket: str,
+                            measurement: str,
+                            field: str,
+                            data_version: str,
+                            start: str,
+                            stop: str,
+                            timezone_offset_to_utc_hours: int,
+                            profile: TagProfile = None) -> DataFrame:
+        """Get data and tags of one variable from the database, for all tag sets
+
+        Other than in `.download()`, rows of different tag sets are kept, the
+        returned timestamp index can therefore contain the same timestamp
+        multiple times. Metadata that are not stored as tags (see *profile*)
+        are reattached as text, as in `.download()`.
+        """
+        profile = profile if profile else resolve_profile()
+        start_iso = self._convert_datestr_to_iso8601(datestr=start,
+                                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        stop_iso = self._convert_datestr_to_iso8601(datestr=stop,
+                                                    timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        querystring = fluxql.FluxQuery(bucket=bucket, start=start_iso, stop=stop_iso) \
+            .where('_measurement', [measurement]) \
+            .where('_field', query_fields(fields=[field], profile=profile)) \
+            .where('data_version', [data_version]) \
+            .compile()
+
+        tables = self._query_data_frame(querystring=querystring, operation='download')
+
+        tables = [tables] if not isinstance(tables, list) else tables
+        tables = [t for t in tables if not t.empty]
+        if not tables:
+            return DataFrame(columns=tags + [field])
+        existing_df = pd.concat(tables, ignore_index=True)
+        existing_df['TIMESTAMP_END'] = convert_ts_to_timezone(
+            timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+            timestamp_index=existing_df['_time']).dt.tz_localize(None)
+        existing_df.set_index('TIMESTAMP_END', inplace=True)
+        existing_df = self._reattach_metadata(bucket=bucket, stop_iso=stop_iso, data_detailed={field: existing_df},
+                                              profile=profile,
+                                              timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)[field]
+        existing_df = existing_df.reindex(columns=tags + [field])
+        return existing_df
 
     def download(self,
                  bucket: str,
@@ -140,7 +556,13 @@ class dbcInflux:
                  data_version: list = None,
                  measurements: list = None,
                  fields: list = None,
-                 verify_freq: str = False) -> tuple[DataFrame, dict, dict]:
+                 verify_freq: str = False,
+                 auto_chunk: bool = False,
+                 max_rows_per_chunk: int = 2_000_000,
+                 version_priority: list = None,
+                 tag_profile: str or TagProfile = None,
+                 aggregate_every: str = None,
+                 checkpoint: Checkpoint = None) -> tuple[DataFrame, dict, dict]:
         """
         Get data from database between 'start' and 'stop' dates
 
@@ -167,21 +589,50 @@ class dbcInflux:
             verify_freq: checks if the downloaded data has the expected frequency, given
                 as str in the format of pandas frequency strings, e.g., '30T' for 30-minute
                 data.
+            auto_chunk: if True, the size of the download is estimated first (see
+                `.estimate_download()`) and the time range is downloaded in chunks of at
+                most *max_rows_per_chunk* rows. Only the columns needed to assemble the
+                tables (time, value, field, measurement and tags) are downloaded. Ignored
+                if *aggregate_every* is given.
+            max_rows_per_chunk: maximum number of rows per chunk if *auto_chunk* is True
+            version_priority: list of data versions, highest priority first, e.g.
+                ['meteoscreening_mst', 'meteoscreening_diive']. Records of the same variable
+                that exist in several data versions are taken from the version with the
+                highest priority, the winning version is stored in the 'data_version' column
+                of data_detailed (see `dbc_influxdb.frames.version_periods()`). If
+                *data_version* is not given, the versions in *version_priority* are downloaded.
+            tag_profile: name of the tag profile the data were uploaded with, see
+                `dbc_influxdb.tagprofiles`. If not given, the profile of *bucket* in the
+                database configuration is used. Metadata that were written as fields or
+                to the sidecar measurement are added to data_detailed as if they were tags.
+            aggregate_every: if given, the data are aggregated on the server to windows of this
+                size (pandas frequency string, e.g. '30min' or '1D'), the tag 'freq' is set to
+                *aggregate_every*. The function of the aggregates of *bucket* is used ('mean' if
+                none are configured). The query is routed to the coarsest aggregate bucket of
+                *bucket* that can be used, see `.create_aggregates()` and `dbc_influxdb.aggregates`.
+            checkpoint: if given, the tables of each downloaded time window (chunk) are stored
+                in the checkpoint. A rerun of the same download with the same checkpoint reads
+                completed windows from the checkpoint and only queries the remaining windows,
+                see `dbc_influxdb.checkpoint`. Most useful with *auto_chunk*.
 
         """
 
         if isinstance(data_version, str):
             data_version = [data_version]
+        if version_priority and not data_version:
+            data_version = list(version_priority)
+        stats = OperationStats(operation='download', labels=dict(bucket=bucket), profile_memory=self.profile_memory)
+        profile = resolve_profile(conf_db=self.conf_db, bucket=bucket, name=tag_profile)
 
         fields_str = fields if fields else "ALL"
         measurements_str = measurements if measurements else "ALL"
-        print(f"\nDOWNLOADING\n"
-              f"    from bucket {bucket}\n"
-              f"    variables {fields_str}\n"
-              f"    from measurements {measurements_str}\n"
-              f"    from data version {data_version}\n"
-              f"    between {start} and {stop}\n"
-              f"    with timezone offset to UTC of {timezone_offset_to_utc_hours}")
+        self._print(f"\nDOWNLOADING\n"
+                   f"    from bucket {bucket}\n"
+                   f"    variables {fields_str}\n"
+                   f"    from measurements {measurements_str}\n"
+                   f"    from data version {data_version}\n"
+                   f"    between {start} and {stop}\n"
+                   f"    with timezone offset to UTC of {timezone_offset_to_utc_hours}")
 
         # InfluxDB needs ISO 8601 date format (in requested timezone) for query
         start_iso = self._convert_datestr_to_iso8601(datestr=start,
@@ -189,223 +640,548 @@ class dbcInflux:
         stop_iso = self._convert_datestr_to_iso8601(datestr=stop,
                                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
 
-        # Assemble query
-        bucketstring = fluxql.bucketstring(bucket=bucket)
-        rangestring = fluxql.rangestring(start=start_iso, stop=stop_iso)
-
-        # Measurements
-        # # Check if measurements is boolean and True
-        # measurements_all = False
-        # if measurements and isinstance(measurements, bool):
-        #     measurements = self.show_measurements_in_bucket(bucket=bucket, verbose=False)
-        #     measurements_all = True
-        if measurements:
-            measurementstring = fluxql.filterstring(queryfor='_measurement', querylist=measurements, type='or')
-        else:
-            measurementstring = ''  # Empty means all measurements
-
-        # Fields
-        # if fields and isinstance(fields, bool):
-        #     # Get all fields if True
-        #     fields = []
-        #     for m in measurements:
-        #         res = self.show_fields_in_measurement(bucket=bucket, measurement=m)
-        #         fields = fields + res
-        #     [print(f) for f in fields];
-        # else:
-        #     # Fields already defined in param
-        #     pass
-        if fields:
-            fieldstring = fluxql.filterstring(queryfor='_field', querylist=fields, type='or')
-        else:
-            fieldstring = ''  # Empty means all fields
-
-        # dropstring = fluxql.dropstring()
-        pivotstring = fluxql.pivotstring()
-
-        dataversionstring = ''
-        if data_version:
-            dataversionstring = fluxql.filterstring(queryfor='data_version', querylist=data_version, type='or')
-            querystring = f"{bucketstring} {rangestring} {measurementstring} " \
-                          f"{dataversionstring} {fieldstring} {pivotstring}"
-        else:
-            # keepstring = f'|> keep(columns: ["_time", "_field", "_value", "units", "freq"])'
-            querystring = f"{bucketstring} {rangestring} {measurementstring} " \
-                          f"{fieldstring} {pivotstring}"
+        # Aggregates are taken from the coarsest aggregate bucket that can be used,
+        # the remaining aggregation is done on the server
+        query_bucket = bucket
+        functions = []
+        if aggregate_every:
+            specs = specs_from_conf(conf_db=self.conf_db, bucket=bucket)
+            spec = route(specs=specs, bucket=bucket, every=aggregate_every, measurements=measurements,
+                         timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+            # Original data are aggregated with the function of the aggregate buckets
+            fn = specs[0].fn if specs else 'mean'
+            if spec:
+                query_bucket = spec.target_bucket
+                fn = REAGGREGATE.get(spec.fn, spec.fn)
+            if not spec or spec.duration != pd.Timedelta(aggregate_every):
+                functions = aggregate_functions(every=aggregate_every, fn=fn,
+                                                timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+            self._print(f"Aggregates {aggregate_every} from bucket {query_bucket}")
 
-        print(f"Using querystring:\n{querystring}")
+        # Assemble query
+        # Filters on measurements and fields are applied first (indexed), empty
+        # lists mean all measurements, data versions and fields, respectively.
+        query = fluxql.FluxQuery(bucket=query_bucket, start=start_iso, stop=stop_iso, functions=tuple(functions)) \
+            .where('_measurement', measurements) \
+            .where('data_version', data_version)
+        query = where_fields(query=query, fields=fields, profile=profile)
+
+        # Time windows that are downloaded one after the other
+        # Aggregates are small and windows must not be split, they are not chunked
+        windows = [(start_iso, stop_iso)]
+        scope = scope_of('download', query.with_range(start='', stop='').compile(), timezone_offset_to_utc_hours)
+        if auto_chunk and not aggregate_every:
+            # The chunks of a resumed download are taken from the checkpoint
+            plan = Unit(scope=scope, field=f'chunks of {max_rows_per_chunk} rows', start=start_iso, stop=stop_iso)
+            if checkpoint is not None and checkpoint.is_done(plan):
+                windows = [tuple(w) for w in checkpoint.result(plan)]
+            else:
+                estimate = self.estimate_download(bucket=bucket, start=start, stop=stop,
+                                                  timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                                  data_version=data_version, measurements=measurements,
+                                                  fields=fields, max_rows_per_chunk=max_rows_per_chunk)
+                windows = [tuple(self._convert_datestr_to_iso8601(
+                    datestr=d, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+                    for d in chunk) for chunk in estimate.chunks]
+                if checkpoint is not None:
+                    checkpoint.complete(plan, result=windows)
+            query = query.project(DOWNLOAD_COLUMNS)
+
+        self._print(f"Using querystring:\n{query.compile()}")
 
         # Run database query
-        client = get_client(self.conf_db)
+        # Failed queries are retried per time window (chunk)
+        client = get_client(self.conf_db, timeout=self.read_policy.timeout_ms('download'))
         query_api = get_query_api(client)
-        tables = query_api.query_data_frame(query=querystring)  # List of DataFrames
+        tables = []
+        for ix, (window_start, window_stop) in enumerate(windows, 1):
+            unit = Unit(scope=scope, field=','.join(fields) if fields else '*', start=window_start, stop=window_stop)
+            if checkpoint is not None and checkpoint.is_done(unit):
+                self._print(f"Chunk {ix} of {len(windows)} already downloaded (checkpoint): "
+                           f"{window_start} to {window_stop}")
+                tables += checkpoint.tables(unit)
+                stats.add(chunks_resumed=1)
+                continue
+            if len(windows) > 1:
+                self._print(f"Downloading chunk {ix} of {len(windows)}: {window_start} to {window_stop}")
+            querystring = query.with_range(start=window_start, stop=window_stop).compile()
+            with stats.phase('query'):
+                results = self._read(lambda: query_api.query_data_frame(query=querystring),
+                                     description=f"download of chunk {ix} ({window_start} to {window_stop})",
+                                     stats=stats)
+
+            # In case only one single variable is downloaded, the query returns
+            # a single dataframe. If multiple variables are downloaded, the query
+            # returns a list of dataframes. To keep these two options consistent,
+            # single dataframes are converted to a list, in which case the list
+            # contains only one element: the dataframe of the single variable.
+            results = results if isinstance(results, list) else [results]
+            if checkpoint is not None:
+                checkpoint.complete(unit, tables=results)
+            tables += results
         client.close()
-        print("Used querystring:", querystring)
-        print("querystring was constructed from:")
-        print(f"    bucketstring: {bucketstring}")
-        print(f"    rangestring: {rangestring}")
-        print(f"    measurementstring: {measurementstring}")
-        print(f"    dataversionstring: {dataversionstring}")
-        print(f"    fieldstring: {fieldstring}")
-        # print(f"    dropstring: {dropstring}")
-        print(f"    pivotstring: {pivotstring}")
-        print("Download finished.")
-
-        # In case only one single variable is downloaded, the query returns
-        # a single dataframe. If multiple variables are downloaded, the query
-        # returns a list of dataframes. To keep these two options consistent,
-        # single dataframes are converted to a list, in which case the list
-        # contains only one element: the dataframe of the single variable.
-        tables = [tables] if not isinstance(tables, list) else tables
+        self._print("Download finished.")
 
-        # # Check units and frequencies
-        # units, freq = self._check_if_same_units_freq(results=results, field=field)
-
-        # Each table in tables contains data for one variable
-        found_measurements = []
-        data_detailed = {}  # Stores variables and their tags
-        data_simple = DataFrame()  # Stores variables
-        for ix, table in enumerate(tables):
-
-            found_measurement = list(set(table['_measurement'].tolist()))
-            if len(found_measurement) != 1:
-                raise ValueError(f"Found {len(found_measurement)} measurements, but only one allowed")
-            found_measurements.append(found_measurement[0])
-
-            # table.drop(columns=['result', 'table', '_measurement'], inplace=True)
-
-            # Queries are always returned w/ UTC timestamp
-            # Create timestamp columns
-            table.rename(columns={"_time": "TIMESTAMP_UTC_END"}, inplace=True)
-            table['TIMESTAMP_END'] = table['TIMESTAMP_UTC_END'].copy()
-
-            # TIMEZONE: convert timestamp index to required timezone
-            table['TIMESTAMP_END'] = convert_ts_to_timezone(
-                timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
-                timestamp_index=table['TIMESTAMP_END'])
-
-            # Remove timezone info in timestamp from TIMESTAMP_END
-            # -> download clean timestamp without timestamp info
-            table['TIMESTAMP_END'] = table['TIMESTAMP_END'].dt.tz_localize(None)  # Timezone!
-
-            # Set TIMESTAMP_END as the main index
-            table.set_index("TIMESTAMP_END", inplace=True)
-            table.sort_index(inplace=True)
-
-            # Remove duplicated index entries, v0.4.1
-            # This can happen if the variable is logged in a new file, but the
-            # old file is still active and also contains data for the var.
-            # In this case, keep the last data entry.
-            table = table[~table.index.duplicated(keep='last')]
-
-            # Remove timezone info from UTC timestamp, header already states it's UTC
-            table['TIMESTAMP_UTC_END'] = table['TIMESTAMP_UTC_END'].dt.tz_localize(None)  # Timezone!
-
-            # # Remove UTC timestamp from columns
-            # table.drop('TIMESTAMP_UTC_END', axis=1, inplace=True)
-
-            # Detect of which variable the frame contains data
-            # Here it is useful that the variable name is also available as tag 'varname'.
-            # field_in_table = [f for f in fields if f in table.columns]
-            list_of_fields = list(set(table['varname'].tolist()))
-
-            # Current table must contain one single variable name
-            if len(list_of_fields) != 1:
-                raise ValueError(f"Expected one field, got {list_of_fields}")
-
-            field_in_table = list_of_fields[0]
-            key = field_in_table
-
-            # Keep all columns that are either the field or database tags
-            keepcols = [col for col in table.columns if col in tags]
-            keepcols.append(key)
-            table = table[keepcols].copy()
-
-            # Collect variables without tags in a separate (simplified) dataframe.
-            # This dataframe only contains the timestamp and the data column of each var.
-            # :: refactored in v0.7.0
-            # Add new column if column does not exist in current df
-            incomingdata = pd.DataFrame(table[key])
-            data_simple = data_simple.combine_first(incomingdata)
-            data_simple = data_simple[~data_simple.index.duplicated(keep='last')]
-            # if ix == 0:
-            #     data_simple = table[[key]].copy()
-            # else:
-            #     if key not in data_simple.columns:
-            #         data_simple[key] = table[[key]].copy()
-            #     else:
-            #         # If var already exists as column in df, merge
-            #         # incoming data with the data that are already in df.
-            #         incomingdata = pd.DataFrame(table[key])
-            #         data_simple = data_simple.combine_first(incomingdata)
-            #
-            #         # Remove duplicates from incoming data
-            #         data_simple = data_simple[~data_simple.index.duplicated(keep='last')]
-
-            # Store frame in dict with the field (variable name) as key
-            # This way the table (data) of each variable can be accessed by
-            # field name, i.e., variable name.
-            # Important: variables with different sets of tags are downloaded
-            # in their own table. Therefore, if a variable TA_T1_X_1 has e.g.
-            # different time resolutions it is downloaded as multiple tables.
-            # Since the table is stored with the name of the variable, it is
-            # thus necessary to check whether a table with the name of the
-            # var already exists in the dict 'data_detailed'. If yes, the table
-            # is added (.combine_first) to the already existing table. It is also
-            # necessary to check whether there are index duplicated present
-            # after the table merging.
-            # :: added in v0.7.0
-            if key not in data_detailed:
-                # Add table df as new dict entry
-                data_detailed[key] = table
-            else:
-                data_detailed[key] = data_detailed[key].combine_first(table)
-                data_detailed[key] = data_detailed[key][~data_detailed[key].index.duplicated(keep='last')]
+        stats.add(chunks=len(windows), tables=len(tables), rows=sum(len(t) for t in tables))
+
+        # Measurement of each variable is known from the tables, no schema queries needed
+        with stats.phase('measurements'):
+            assigned_measurements = field_measurements(tables=tables)
+        data_simple, data_detailed, _ = assemble_download(
+            tables=tables, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+            version_priority=version_priority, stats=stats)
+        stats.add(variables=len(data_detailed))
+
+        data_detailed = self._reattach_metadata(bucket=bucket, stop_iso=stop_iso, data_detailed=data_detailed,
+                                                profile=profile,
+                                                timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                                stats=stats)
 
         # Info
-        print(f"Downloaded data for {len(data_detailed)} variables:")
+        self._print(f"Downloaded data for {len(data_detailed)} variables:")
         for key, val in data_detailed.items():
             num_records = len(data_detailed[key])
             first_date = data_detailed[key].index[0]
             last_date = data_detailed[key].index[-1]
-            print(f"<-- {key}  "
-                  f"({num_records} records)  "
-                  f"first date: {first_date}  "
-                  f"last date: {last_date}")
-
-        if not measurements:
-            found_measurements = list(set(found_measurements))
-            measurements = found_measurements
-
-        assigned_measurements = self._detect_measurement_for_field(bucket=bucket,
-                                                                   measurementslist=measurements,
-                                                                   varnameslist=list(data_detailed.keys()))
+            self._print(f"<-- {key}  "
+                       f"({num_records} records)  "
+                       f"first date: {first_date}  "
+                       f"last date: {last_date}")
+            if version_priority:
+                winners = val['data_version'].value_counts().to_dict()
+                self._print(f"    records per data version: {winners}")
 
         # TODO hier weiter check verify frequency
         if verify_freq:
             from varscanner import infer_freq
             freq, freqfrom = infer_freq(df_index=data_simple.index)
 
+        self._finish_stats(stats)
+        return data_simple, data_detailed, assigned_measurements
+
+    def download_many(self,
+                      specs: list[DownloadSpec],
+                      timezone_offset_to_utc_hours: int,
+                      max_workers: int = 4) -> tuple[DataFrame, dict, dict]:
+        """Download from several buckets (sites) concurrently
+
+        The queries of all specs run concurrently over one shared client. The
+        data of all sites are aligned on one common TIMESTAMP_END index.
+
+        Args:
+            specs: list of downloads, one per bucket, see `DownloadSpec`
+            timezone_offset_to_utc_hours: convert the UTC timestamp from the
+                database to this timezone offset, e.g. 1 for CET; also the
+                timezone of the start and stop dates in *specs*
+            max_workers: number of queries that run at the same time
+
+        Returns:
+            data_simple: dataframe with all variables of all sites, columns are
+                (site, field)
+            data_detailed: dict with site names as keys and dicts with variable
+                names as keys and dataframes with variable data and tags as values
+            assigned_measurements: dict with site names as keys and dicts with
+                variable names as keys and measurements as values
+        """
+        sites = [spec.site for spec in specs]
+        if len(set(sites)) != len(sites):
+            raise ValueError(f"Site names must be unique, got {sites}")
+
+        def run(spec: DownloadSpec) -> tuple:
+            profile = resolve_profile(conf_db=self.conf_db, bucket=spec.bucket, name=spec.tag_profile)
+            stop_iso = self._convert_datestr_to_iso8601(datestr=spec.stop,
+                                                        timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+            querystring = spec.query(
+                start_iso=self._convert_datestr_to_iso8601(datestr=spec.start,
+                                                           timezone_offset_to_utc_hours=timezone_offset_to_utc_hours),
+                stop_iso=stop_iso, profile=profile)
+            results = self._read(lambda: query_api.query_data_frame(query=querystring),
+                                 description=f"download from bucket {spec.bucket}")
+            tables = results if isinstance(results, list) else [results]
+            measurements = field_measurements(tables=tables)
+            simple, detailed, _ = assemble_download(tables=tables,
+                                                    timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+            detailed = self._reattach_metadata(bucket=spec.bucket, stop_iso=stop_iso, data_detailed=detailed,
+                                               profile=profile,
+                                               timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+            self._print(f"<-- {spec.site}: downloaded {len(detailed)} variables from bucket {spec.bucket}")
+            return simple, detailed, measurements
+
+        client = get_client(self.conf_db, connection_pool_maxsize=max_workers,
+                            timeout=self.read_policy.timeout_ms('download'))
+        query_api = get_query_api(client)
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results = dict(zip(sites, pool.map(run, specs)))
+        finally:
+            client.close()
+
+        data_simple = align_frames({site: r[0] for site, r in results.items()})
+        data_detailed = {site: r[1] for site, r in results.items()}
+        assigned_measurements = {site: r[2] for site, r in results.items()}
+        self._print(f"Downloaded {data_simple.shape[1]} variables from {len(specs)} sites, "
+                   f"{len(data_simple)} records.")
         return data_simple, data_detailed, assigned_measurements
 
+    def estimate_download(self,
+                          bucket: str,
+                          start: str,
+                          stop: str,
+                          timezone_offset_to_utc_hours: int,
+                          data_version: list = None,
+                          measurements: list = None,
+                          fields: list = None,
+                          max_rows_per_chunk: int = 2_000_000) -> DownloadEstimate:
+        """Estimate the size of a download without downloading the data
+
+        Runs a `count()` query grouped by series on the server, the query only
+        returns one row per series. Takes the same arguments as `.download()`.
+
+        Args:
+            bucket: name of bucket in database
+            start: start date, e.g. '2022-07-04 00:30:00'
+            stop: stop date, e.g. '2022-07-05 12:00:00'
+            timezone_offset_to_utc_hours: timezone of *start* and *stop*, e.g. 1 for CET
+            data_version: version ID of the data, e.g. ['meteoscreening']
+            measurements: list of measurements in database, e.g. ['TA', 'SW']
+            fields: list of fields (variable names)
+            max_rows_per_chunk: maximum number of rows per chunk in the suggested chunk plan
+
+        Returns:
+            DownloadEstimate with estimated rows, series, bytes and chunk plan
+        """
+        if isinstance(data_version, str):
+            data_version = [data_version]
+        start_iso = self._convert_datestr_to_iso8601(datestr=start,
+                                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        stop_iso = self._convert_datestr_to_iso8601(datestr=stop,
+                                                    timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        querystring = fluxql.FluxQuery(bucket=bucket, start=start_iso, stop=stop_iso, pivot=False) \
+            .where('_measurement', measurements) \
+            .where('data_version', data_version) \
+            .where('_field', fields) \
+            .pipe('|> count()') \
+            .compile()
+
+        counts = self._query_data_frame(querystring=querystring, operation='estimate')
+        counts = pd.concat(counts, ignore_index=True) if isinstance(counts, list) else counts
+
+        estimate = estimate_from_counts(counts=counts, start=start, stop=stop,
+                                        max_rows_per_chunk=max_rows_per_chunk)
+        self._print(f"Download estimate for bucket {bucket} between {start} and {stop}: {estimate}")
+        return estimate
+
+    def coverage(self,
+                 bucket: str,
+                 measurements: list = None,
+                 data_version: list or str = None,
+                 resolution: str = '1D',
+                 timezone_offset_to_utc_hours: int = 0,
+                 start: str = '1970-01-01 00:00:00',
+                 cache_dir: str = None) -> DataFrame:
+        """Number of records per variable and time window
+
+        Records are counted on the server with `aggregateWindow(fn: count)`.
+        If *cache_dir* is given, the coverage index is stored in a local file
+        and on the next call only windows starting with the last cached window
+        are counted again, i.e., only new days are added.
+
+        Args:
+            bucket: name of bucket in database
+            measurements: list of measurements, e.g. ['TA', 'SW'], None for all measurements
+            data_version: version ID of the data, e.g. ['raw'], None for all data versions
+            resolution: size of the time windows as pandas frequency string, e.g. '1D'
+            timezone_offset_to_utc_hours: timezone of the returned windows, windows are
+                aligned to this timezone, e.g. with 1 days start at midnight CET
+            start: first date that is counted if no cache exists yet, e.g. '2020-01-01 00:00:00'
+            cache_dir: folder where the coverage index is cached
+
+        Returns:
+            dataframe with the start of each window as index, one column per field and
+            the number of records as values
+        """
+        if isinstance(data_version, str):
+            data_version = [data_version]
+
+        cache = None
+        cached = None
+        if cache_dir:
+            cache = CoverageCache(cache_dir=cache_dir, bucket=bucket, measurements=measurements,
+                                  data_version=data_version, resolution=resolution,
+                                  timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+            cached = cache.load()
+        since = CoverageCache.refresh_start(cached=cached)
+        if since is not None:
+            start = str(since)
+
+        start_iso = self._convert_datestr_to_iso8601(datestr=start,
+                                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        querystring = coverage_query(bucket=bucket, start_iso=start_iso, stop_iso='now()',
+                                     measurements=measurements, data_version=data_version,
+                                     resolution=resolution,
+                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        results = self._query_data_frame(querystring=querystring, operation='coverage')
+
+        fresh = counts_to_long(results=results, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        long = merge_incremental(cached=cached, fresh=fresh, since=since) if since is not None else fresh
+        if cache:
+            cache.save(long)
+        self._print(f"Coverage of bucket {bucket}: {long['field'].nunique()} fields, "
+                   f"counted {len(fresh)} windows since {start}.")
+        return to_wide(long)
+
+    def analyze_cardinality(self,
+                            bucket: str,
+                            measurements: list = None,
+                            fields: list = None,
+                            timezone_offset_to_utc_hours: int = 0,
+                            start: str = '1970-01-01 00:00:00') -> CardinalityReport:
+        """Count series per measurement and field and find the tags that cause additional series
+
+        A new series is created whenever one of the tags of a variable changes,
+        e.g. 'gain' written as 1 and later as 1.0. Only the series keys are
+        downloaded (one record per series), see `dbc_influxdb.cardinality`.
+
+        Args:
+            bucket: name of bucket in database
+            measurements: list of measurements, e.g. ['TA', 'SW'], None for all measurements
+            fields: list of fields (variable names), None for all fields
+            timezone_offset_to_utc_hours: timezone of *start*
+            start: only series with data after this date are counted
+
+        Returns:
+            CardinalityReport with series per field and the tags that cause additional series
+        """
+        keys = self._series_keys(bucket=bucket, measurements=measurements, fields=fields,
+                                 timezone_offset_to_utc_hours=timezone_offset_to_utc_hours, start=start)
+        report = analyze_series(keys=keys)
+        self._print(f"Found {report.total_series} series of {len(report.by_field)} fields in bucket {bucket}.")
+        if report.explosive_tags:
+            self._print(f"Tags that cause additional series: {report.explosive_tags}")
+        return report
+
+    def simulate_cardinality(self,
+                             var_df: DataFrame,
+                             to_bucket: str,
+                             to_measurement: str) -> CardinalityReport:
+        """Series of the variable after an upload of *var_df* with `.upload_singlevar()`
+
+        The series of *var_df* are compared to the series of the same variable
+        that already exist in the database, nothing is written.
+
+        Returns:
+            CardinalityReport of the variable after the upload, *new_series* is the
+            number of series that the upload would add
+        """
+        pending = simulate_series(var_df=var_df, measurement=to_measurement)
+        existing = self._series_keys(bucket=to_bucket, measurements=[to_measurement],
+                                     fields=pending['_field'].unique().tolist())
+        report = analyze_series(keys=pd.concat([existing, pending], ignore_index=True), existing=existing)
+        self._print(f"Upload to bucket {to_bucket} would add {report.new_series} series "
+                   f"({report.total_series} series after upload).")
+        return report
+
+    def _series_keys(self, bucket: str, measurements: list = None, fields: list = None,
+                     timezone_offset_to_utc_hours: int = 0, start: str = '1970-01-01 00:00:00') -> DataFrame:
+        start_iso = self._convert_datestr_to_iso8601(datestr=start,
+                                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        querystring = series_query(bucket=bucket, start=start_iso, stop='now()',
+                                   measurements=measurements, fields=fields)
+        return series_keys(self._query_data_frame(querystring=querystring, operation='cardinality'))
+
+    def sync(self,
+             bucket: str,
+             store: str or Path,
+             start: str,
+             timezone_offset_to_utc_hours: int,
+             data_version: list or str = None,
+             measurements: list = None,
+             fields: list = None,
+             overlap: str = '1h',
+             stale_after: str = '1D',
+             tag_profile: str or TagProfile = None) -> tuple[DataFrame, dict]:
+        """Incremental download into a local store
+
+        The store remembers the last timestamp (watermark) of each series, i.e.,
+        of each field and set of tags. The first call downloads all data since
+        *start*, later calls only download data newer than the oldest watermark
+        minus *overlap*, e.g. to also get data that arrived late in the database.
+        New data are appended to the store, data in the overlap replace stored
+        data. Requires the optional dependency pyarrow (parquet files).
+
+        Series whose watermark is older than the newest watermark by more than
+        *stale_after* (e.g. a decommissioned sensor, or the old tag set after a
+        change of gain or units) are stale: they do not move the start of the
+        query back, otherwise each sync would download their whole history again.
+
+        Series that are new in the database but have data older than the
+        oldest watermark, and data of stale series that are older than the
+        oldest watermark of the other series, are only downloaded after the
+        store is removed.
+
+        Args:
+            bucket: name of bucket in database
+            store: folder of the local store, created if it does not exist
+            start: start date of the first download, e.g. '2022-07-04 00:30:00'
+            timezone_offset_to_utc_hours: convert the UTC timestamp from the
+                database to this timezone offset, e.g. 1 for CET
+            data_version: version ID of the data, e.g. ['meteoscreening']
+            measurements: list of measurements in database, e.g. ['TA', 'SW']
+            fields: list of fields (variable names)
+            overlap: data downloaded again before the oldest watermark, given
+                as pandas timedelta string, e.g. '1h'
+            stale_after: series whose watermark is older than the newest watermark
+                by more than this pandas timedelta string are not considered for
+                the start of the query, None to consider all series
+            tag_profile: name of the tag profile the data were uploaded with, see
+                `.download()`. Series are identified by the tags of the profile,
+                metadata in fields and in the sidecar measurement are reattached.
+
+        Returns:
+            data_simple: dataframe with all variables in the store, without tags
+            data_detailed: dict with variable names as keys and dataframes with
+                variable data and tags as values
+        """
+        if isinstance(data_version, str):
+            data_version = [data_version]
+        profile = resolve_profile(conf_db=self.conf_db, bucket=bucket, name=tag_profile)
+        store = SyncStore(path=store, selection=dict(bucket=bucket, data_version=data_version,
+                                                     measurements=measurements, fields=fields,
+                                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours))
+        start_iso = store.query_start(overlap=overlap, stale_after=stale_after)
+        if not start_iso:
+            start_iso = self._convert_datestr_to_iso8601(datestr=start,
+                                                         timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        query = fluxql.FluxQuery(bucket=bucket, start=start_iso, stop='now()') \
+            .where('_measurement', measurements) \
+            .where('data_version', data_version)
+        querystring = where_fields(query=query, fields=fields, profile=profile).project(DOWNLOAD_COLUMNS).compile()
+
+        results = self._query_data_frame(querystring=querystring, operation='download')
+        tables = results if isinstance(results, list) else [results]
+
+        # Watermarks need the UTC timestamps of the tables before assembly
+        watermarks = series_watermarks(tables=data_tables(tables), tag_columns=profile.tags)
+        _, new_detailed, _ = assemble_download(tables=tables,
+                                               timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        new_detailed = self._reattach_metadata(bucket=bucket, stop_iso='now()', data_detailed=new_detailed,
+                                               profile=profile,
+                                               timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+        store.append(data_detailed=new_detailed, watermarks=watermarks)
+        num_new = sum(len(df) for df in new_detailed.values())
+        self._print(f"Synced bucket {bucket} since {start_iso}: {num_new} new records "
+                   f"for {len(new_detailed)} variables.")
+        return store.read()
+
+    def create_aggregates(self,
+                          bucket: str,
+                          backfill_start: str = None,
+                          timezone_offset_to_utc_hours: int = 0) -> list[AggregateSpec]:
+        """Create or update the tasks that continuously aggregate *bucket*
+
+        The aggregation levels are defined in the section 'aggregates' of the
+        database configuration, see `dbc_influxdb.aggregates`. Missing aggregate
+        buckets are created. Tasks only aggregate new data, data that are already
+        in *bucket* are aggregated once if *backfill_start* is given.
+
+        Args:
+            bucket: name of bucket with the original data
+            backfill_start: if given, all data since this date are aggregated
+                immediately, e.g. '2020-01-01 00:00:00'
+            timezone_offset_to_utc_hours: timezone of *backfill_start*, e.g. 1 for CET
+
+        Returns:
+            list of the aggregation levels of *bucket*
+        """
+        specs = specs_from_conf(conf_db=self.conf_db, bucket=bucket)
+        if not specs:
+            raise ValueError(f"No aggregates defined for bucket {bucket} in the database configuration.")
+        org = self.conf_db['org']
+        client = get_client(self.conf_db, timeout=self.read_policy.timeout_ms('aggregate'))
+        try:
+            buckets_api = get_buckets_api(client)
+            tasks_api = get_tasks_api(client)
+            for spec in specs:
+                if buckets_api.find_bucket_by_name(spec.target_bucket) is None:
+                    buckets_api.create_bucket(bucket_name=spec.target_bucket, org=org)
+                    self._print(f"Created bucket {spec.target_bucket}.")
+                flux = spec.task_flux(org=org)
+                existing = tasks_api.find_tasks(name=spec.task_name)
+                if existing:
+                    tasks_api.update_task_request(task_id=existing[0].id,
+                                                  task_update_request=TaskUpdateRequest(flux=flux, status='active'))
+                else:
+                    tasks_api.create_task(task_create_request=TaskCreateRequest(
+                        flux=flux, org=org, status='active',
+                        description=f"Aggregates {spec.bucket} to {spec.every} ({spec.fn})"))
+                self._print(f"Task '{spec.task_name}' aggregates to bucket {spec.target_bucket}.")
+
+                if backfill_start:
+                    start_iso = self._convert_datestr_to_iso8601(
+                        datestr=backfill_start, timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
+                    # Only the number of aggregated points is returned
+                    querystring = spec.query(start=spec.backfill_start(start=pd.Timestamp(start_iso)),
+                                             stop='now()', org=org) + ' |> group() |> count()'
+                    query_api = get_query_api(client)
+                    tables = self._read(lambda: query_api.query(query=querystring),
+                                        description=f"backfill of {spec.target_bucket}")
+                    points = sum(record.get_value() for table in tables for record in table.records)
+                    self._print(f"Backfilled {points} points since {start_iso} to bucket {spec.target_bucket}.")
+        finally:
+            client.close()
+        return specs
+
+    def aggregate_tasks(self, bucket: str = None) -> list:
+        """Tasks that aggregate *bucket* (all buckets if None), see `.create_aggregates()`"""
+        client = get_client(self.conf_db, timeout=self.read_policy.timeout_ms('show'))
+        try:
+            tasks = self._read(lambda: get_tasks_api(client).find_tasks(), description="tasks query")
+        finally:
+            client.close()
+        prefix = f'{TASK_PREFIX} {bucket} ' if bucket else f'{TASK_PREFIX} '
+        return [t for t in tasks if t.name.startswith(prefix)]
+
+    def delete_aggregates(self, bucket: str) -> int:
+        """Delete the tasks that aggregate *bucket*, the aggregate buckets and their data are kept
+
+        Returns:
+            number of deleted tasks
+        """
+        tasks = self.aggregate_tasks(bucket=bucket)
+        client = get_client(self.conf_db)
+        try:
+            tasks_api = get_tasks_api(client)
+            for task in tasks:
+                tasks_api.delete_task(task_id=task.id)
+        finally:
+            client.close()
+        self._print(f"Deleted {len(tasks)} aggregate tasks of bucket {bucket}.")
+        return len(tasks)
+
     def delete(self,
                bucket: str,
-               measurements: list or True,
+               measurements: list or str or True,
                start: str,
                stop: str,
                timezone_offset_to_utc_hours: int,  # v0.3.0
                data_version: str or True,
-               fields: list or True) -> None:
+               fields: list or str or True,
+               max_workers: int = 4) -> DeleteResult:
         """
         Delete data from bucket
 
+        All delete requests are planned first and then sent concurrently
+        using a bounded thread pool over one single client.
+
         Args:
             bucket: name of bucket in database
-            measurements: list or True
+            measurements: list, str or True
                 If list, list of measurements in database, e.g. ['TA', 'SW']
+                If str, one single measurement, e.g. 'TA'
                 If True, all *fields* in all *measurements* will be deleted
-            fields: list or True
+            fields: list, str or True
                 If list, list of fields (variable names) to delete
+                If str, one single field
                 If True, all data in *fields* in *measurements* will be deleted.
             start: start datetime, e.g. '2022-07-04 00:30:00'
             stop: stop datetime, e.g. '2022-07-05 12:00:00'
@@ -416,6 +1192,7 @@ class dbcInflux:
                 2 Jun 2024 12:00 CET should be deleted, then *timezone_offset_to_utc_hours=1*.
             data_version: version ID of the data that should be deleted,
                 e.g. 'meteoscreening_diive', 'raw', 'myID', ...
+            max_workers: maximum number of delete requests sent at the same time
 
         Examples:
 
@@ -425,17 +1202,20 @@ class dbcInflux:
             Delete all variables of a specific measurement:
                 measurements=['TA'], fields=True
 
-
             Delete specific variables in specific measurements:
                 measurements=['TA', 'SW'], fields=['TA_T1_1_1', 'SW_T1_1_1']
 
+            Delete many variables of one measurement:
+                measurements='TA', fields=['TA_T1_1_1', 'TA_T1_2_1', 'TA_T1_3_1']
+
             Delete specific variables in across all measurements:
                 measurements=True, fields=['TA_T1_1_1', 'SW_T1_1_1']
-                This basically searches the variables across all measurements
-                and the deletes them.
+                The variable name is also stored as tag 'varname', therefore
+                the variables are deleted across all measurements without
+                having to search the measurements first.
 
         Returns:
-            -
+            DeleteResult with the duration and error (if any) of each delete request
 
         docs:
         - https://influxdb-client.readthedocs.io/en/stable/usage.html#delete-data
@@ -449,53 +1229,240 @@ class dbcInflux:
         stop_iso = self._convert_datestr_to_iso8601(datestr=stop,
                                                     timezone_offset_to_utc_hours=timezone_offset_to_utc_hours)
 
-        # Run database query
+        stats = OperationStats(operation='delete', labels=dict(bucket=bucket), profile_memory=self.profile_memory)
+
+        # Plan all delete requests before sending any of them
+        with stats.phase('plan'):
+            predicates = plan_delete_predicates(measurements=measurements, fields=fields,
+                                                data_version=data_version, start=start_iso, stop=stop_iso)
+
+        # Run database requests
         client = get_client(self.conf_db)
         delete_api = get_delete_api(client)
+        with stats.phase('delete'):
+            result = run_delete_predicates(delete_api=delete_api, bucket=bucket,
+                                           predicates=predicates, max_workers=max_workers)
+        client.close()
+        stats.add(requests=len(result.outcomes), failures=len(result.failures))
+        result.stats = self._finish_stats(stats)
 
-        # Check if measurements is boolean and True
-        measurements_all = False
-        if measurements and isinstance(measurements, bool):
-            measurements = self.show_measurements_in_bucket(bucket=bucket, verbose=False)
-            measurements_all = True
-
-        # Delete
-        kwargs = dict(start=start_iso, stop=stop_iso, bucket=bucket)
-        for measurement in measurements:
-
-            # Delete all variables (fields) in measurement
-            if fields and isinstance(fields, bool):
-                predicate_str = (f'_measurement="{measurement}" '
-                                 f'AND data_version="{data_version}"')
-                delete_api.delete(predicate=predicate_str, **kwargs)
-
-            # Delete given variables (fields) in measurement
-            elif isinstance(fields, list):
-                for field in fields:
-                    predicate_str = (f'_measurement="{measurement}" '
-                                     f'AND varname="{field}" '
-                                     f'AND data_version="{data_version}"')
-                    delete_api.delete(predicate=predicate_str, **kwargs)
-
-        if measurements_all:
-            measurements_str = "ALL"
-        elif isinstance(measurements, list):
-            measurements_str = measurements
-        else:
-            measurements_str = None
+        measurements_str = "ALL" if measurements is True else measurements
+        fields_str = "ALL" if fields is True else fields
+        self._print(f"Deleted variables {fields_str} between {start_iso} and {stop_iso} "
+                   f"from measurements {measurements_str} in bucket {bucket} "
+                   f"({len(result.outcomes)} requests in {result.duration:.2f}s).")
+        for failure in result.failures:
+            self._print(f"(!)DELETE FAILED: {failure.predicate}  {failure.error}")
 
-        if fields and isinstance(fields, bool):
-            fields_str = "ALL"
-        elif isinstance(fields, list):
-            fields_str = fields
-        else:
-            fields_str = None
+        return result
+
+    def replay_spool(self, spool: WriteSpool, batch_size: int = 50_000,
+                     batching: BatchingSettings = None) -> SpoolReplayResult:
+        """Upload all data stored in the local write spool to the database
+
+        Segments are sent oldest first with synchronous writes and are deleted
+        from the spool after they were written successfully. If the database
+        is not reachable, replay stops and the remaining segments are kept
+        for the next replay.
+
+        Args:
+            spool: local write spool, see `.upload_singlevar()`
+            batch_size: number of points (lines) sent per request
+            batching: settings for adaptive write batching, if given (or available in the
+                database configuration) *batch_size* is adjusted during replay
 
-        print(f"Deleted variables {fields_str} between {start_iso} and {stop_iso} "
-              f"from measurements {measurements_str} in bucket {bucket}.")
+        Returns:
+            SpoolReplayResult with the number of written points and segments
+        """
+        client = get_client(self.conf_db)
+        write_api = client.write_api(write_options=SYNCHRONOUS)
+        batching = batching if batching else self._batching_settings_from_conf()
+        writer = AdaptiveWriter(write_api=write_api, settings=batching) if batching else write_api
+        result = spool.replay(write_api=writer, batch_size=batch_size)
+        write_api.close()
         client.close()
+        self._print(f"Replayed {result.segments_written} spool segments ({result.points_written} points) "
+                   f"to buckets {sorted(result.buckets)} in {result.duration:.2f}s.")
+        if not result.ok:
+            self._print(f"(!)REPLAY STOPPED, {result.segments_remaining} segments remain in spool: {result.error}")
+        return result
+
+    def retag(self,
+              from_bucket: str,
+              to_bucket: str,
+              start: str,
+              stop: str,
+              timezone_offset_to_utc_hours: int,
+              rules: RetagRules,
+              measurements: list = None,
+              fields: list = None,
+              data_version: list or str = None,
+              chunk: str = '30D',
+              batching: BatchingSettings = None,
+              checkpoint: Checkpoint = None) -> RetagResult:
+        """Copy data to another bucket and change tags and field names on the way
+
+        If all *rules* can be expressed in Flux, the data are changed and written
+        to *to_bucket* on the server (`map()` and `to()`), only the number of
+        written points is returned. Rules with a *transform* function are applied
+        on the client: data are downloaded in long format, changed in pandas and
+        written as line protocol. In both cases the time range between *start* and
+        *stop* is processed in chunks of length *chunk*.
+
+        Args:
+            from_bucket: name of bucket the data are read from
+            to_bucket: name of bucket the changed data are written to
+            start: start date, e.g. '2023-01-01 00:00:01'
+            stop: stop date, e.g. '2023-02-01 00:00:01', not included
+            timezone_offset_to_utc_hours: timezone of *start* and *stop*, e.g. 1 for CET
+            rules: changes of tags and field names, see `RetagRules`
+            measurements: list of measurements, None for all measurements
+            fields: list of fields (variable names), None for all fields
+            data_version: version ID of the data, None for all data versions
+            chunk: length of the time chunks as pandas timedelta string, e.g. '30D'
+            batching: settings for adaptive write batching (client-side rules only)
+            checkpoint: if given, each completed chunk is recorded in the checkpoint. A rerun
+                of the same retag with the same checkpoint skips completed chunks, see
+                `dbc_influxdb.checkpoint`.
+
+        Returns:
+            RetagResult with the number of processed chunks and written points
+        """
+        if isinstance(data_version, str):
+            data_version = [data_version]
+        tic = time.perf_counter()
+        result = RetagResult(from_bucket=from_bucket, to_bucket=to_bucket, server_side=rules.server_side)
+        query = fluxql.FluxQuery(bucket=from_bucket, start='', stop='', pivot=False) \
+            .where('_measurement', measurements) \
+            .where('data_version', data_version) \
+            .where('_field', fields)
+
+        # Transform functions are identified by name, not by their address
+        scope = scope_of('retag', to_bucket, query.compile(), rules.rename_fields, rules.replace_in_fields,
+                         rules.map_tags, rules.set_tags, rules.rename_varname,
+                         getattr(rules.transform, '__qualname__', None), timezone_offset_to_utc_hours)
 
-        return None
+        client = get_client(self.conf_db)
+        query_api = get_query_api(client)
+        writer = None
+        try:
+            if not rules.server_side:
+                write_api = client.write_api(write_options=SYNCHRONOUS)
+                batching = batching if batching else self._batching_settings_from_conf()
+                writer = AdaptiveWriter(write_api=write_api, settings=batching)
+
+            for chunk_start, chunk_stop in time_chunks(start=start, stop=stop, chunk=chunk):
+                unit = Unit(scope=scope, field=','.join(fields) if fields else '*', start=chunk_start, stop=chunk_stop)
+                if checkpoint is not None and checkpoint.is_done(unit):
+                    result.chunks += 1
+                    result.chunks_resumed += 1
+                    result.points += checkpoint.result(unit)
+                    self._print(f"Chunk between {chunk_start} and {chunk_stop} already retagged (checkpoint)")
+                    continue
+                window = query.with_range(
+                    start=self._convert_datestr_to_iso8601(datestr=chunk_start,
+                                                           timezone_offset_to_utc_hours=timezone_offset_to_utc_hours),
+                    stop=self._convert_datestr_to_iso8601(datestr=chunk_stop,
+                                                          timezone_offset_to_utc_hours=timezone_offset_to_utc_hours))
+                if rules.server_side:
+                    querystring = retag_query(query=window, to_bucket=to_bucket, rules=rules)
+                    counts = self._read(lambda: query_api.query_data_frame(query=querystring),
+                                        description=f"retag between {chunk_start} and {chunk_stop}")
+                    counts = pd.concat(counts) if isinstance(counts, list) else counts
+                    points = int(counts['_value'].sum()) if not counts.empty else 0
+                else:
+                    points = 0
+                    for df in query_api.query_data_frame_stream(query=window.compile()):
+                        if df.empty:
+                            continue
+                        df = rules.apply(df.drop(columns=[c for c in DROP_COLUMNS if c in df.columns]))
+                        for measurement, group in df.groupby('_measurement'):
+                            lines = snapshot_lines(df=group.drop(columns='_measurement'), measurement=measurement)
+                            writer.write(bucket=to_bucket, record=lines, write_precision='ns')
+                            points += len(lines)
+                if checkpoint is not None:
+                    checkpoint.complete(unit, result=points)
+                result.chunks += 1
+                result.points += points
+                self._print(f"Retagged {points} points from {from_bucket} to {to_bucket} "
+                           f"between {chunk_start} and {chunk_stop}")
+        finally:
+            if writer:
+                writer.write_api.close()
+            client.close()
+        result.duration = time.perf_counter() - tic
+        self._print(f"Retag finished: {result.points} points in {result.chunks} chunks "
+                   f"({'server-side' if result.server_side else 'client-side'}) in {result.duration:.2f}s.")
+        return result
+
+    def snapshot(self, bucket: str, path: str or Path, measurements: list = None) -> dict:
+        """Export all series of a bucket to a local snapshot
+
+        Query results are streamed to compressed parquet files, partitioned by
+        measurement and year, including tags and measurement of each series.
+        Requires the optional dependency pyarrow.
+
+        Args:
+            bucket: name of bucket in database
+            path: folder of the snapshot, must not contain a snapshot yet
+            measurements: list of measurements, None for all measurements in the bucket
+
+        Returns:
+            number of exported points per measurement
+        """
+        measurements = measurements if measurements else self.show_measurements_in_bucket(bucket=bucket,
+                                                                                           verbose=False)
+        client = get_client(self.conf_db)
+        query_api = get_query_api(client)
+        try:
+            with SnapshotWriter(path=path, bucket=bucket) as writer:
+                for measurement in measurements:
+                    querystring = fluxql.FluxQuery(bucket=bucket, start='0', stop='now()', pivot=False) \
+                        .where('_measurement', [measurement]) \
+                        .compile()
+                    for df in query_api.query_data_frame_stream(query=querystring):
+                        writer.add(df)
+                    # Only the buffers of the current measurement are kept in memory
+                    writer.finish_measurement(measurement)
+                    self._print(f"Snapshot of bucket {bucket}: exported measurement {measurement}")
+        finally:
+            client.close()
+        self._print(f"Snapshot of bucket {bucket} finished: {sum(writer.points.values())} points "
+                   f"in {len(writer.files)} files in {path}")
+        return writer.points
+
+    def restore(self, path: str or Path, to_bucket: str, tag_overrides: dict = None,
+                measurements: list = None, batching: BatchingSettings = None) -> RestoreResult:
+        """Write a snapshot (see `.snapshot()`) to a bucket
+
+        Snapshot files are serialized to line protocol and written with adaptive
+        batching, i.e., several batches are sent in parallel.
+
+        Args:
+            path: folder of the snapshot
+            to_bucket: name of bucket in database the data are written to
+            tag_overrides: dict with tag names as keys and new tag values as values,
+                e.g. {'data_version': 'raw'}
+            measurements: only restore these measurements, None for all measurements
+            batching: settings for adaptive write batching, by default taken from the
+                database configuration or the default settings
+
+        Returns:
+            RestoreResult with the number of written files and points
+        """
+        batching = batching if batching else self._batching_settings_from_conf()
+        client = get_client(self.conf_db)
+        write_api = client.write_api(write_options=SYNCHRONOUS)
+        try:
+            writer = AdaptiveWriter(write_api=write_api, settings=batching)
+            result = restore_snapshot(path=path, writer=writer, to_bucket=to_bucket,
+                                      tag_overrides=tag_overrides, measurements=measurements)
+        finally:
+            write_api.close()
+            client.close()
+        self._print(f"Restored {result.points} points from {result.files} snapshot files to bucket {to_bucket} "
+                   f"in {result.duration:.2f}s ({result.write_stats.points_per_second:.0f} points/s).")
+        return result
 
     def show_configs_unitmapper(self) -> dict:
         return self.conf_unitmapper
@@ -512,88 +1479,62 @@ class dbcInflux:
     def show_fields_in_measurement(self, bucket: str, measurement: str, days: int = 9999, verbose: int = 1) -> list:
         """Show fields (variable names) in measurement"""
         query = fluxql.fields_in_measurement(bucket=bucket, measurement=measurement, days=days)
-        client = get_client(self.conf_db)
-        query_api = get_query_api(client)
-        results = query_api.query_data_frame(query=query)
-        client.close()
+        results = self._query_data_frame(querystring=query, operation='show')
         fieldslist = results['_value'].tolist()
         if verbose > 0:
-            print(f"{'=' * 40}\nFields in measurement {measurement} of bucket {bucket}:")
+            self._print(f"{'=' * 40}\nFields in measurement {measurement} of bucket {bucket}:")
             for ix, f in enumerate(fieldslist, 1):
-                print(f"#{ix}  {bucket}  {measurement}  {f}")
-            print(f"Found {len(fieldslist)} fields in measurement {measurement} of bucket {bucket}.\n{'=' * 40}")
+                self._print(f"#{ix}  {bucket}  {measurement}  {f}")
+            self._print(f"Found {len(fieldslist)} fields in measurement {measurement} of bucket {bucket}.\n{'=' * 40}")
         return fieldslist
 
     def show_fields_in_bucket(self, bucket: str, measurement: str = None, verbose: bool = True) -> list:
         """Show fields (variable names) in bucket (optional: for specific measurement)"""
         query = fluxql.fields_in_bucket(bucket=bucket)
-        client = get_client(self.conf_db)
-        query_api = get_query_api(client)
-        results = query_api.query_data_frame(query=query)
-        client.close()
+        results = self._query_data_frame(querystring=query, operation='show')
         fieldslist = results['_value'].tolist()
         if verbose:
-            print(f"{'=' * 40}\nFields in bucket {bucket}:")
+            self._print(f"{'=' * 40}\nFields in bucket {bucket}:")
             for ix, f in enumerate(fieldslist, 1):
-                print(f"#{ix}  {bucket}  {f}")
-            print(f"Found {len(fieldslist)} variables (fields) in bucket {bucket}.\n{'=' * 40}")
+                self._print(f"#{ix}  {bucket}  {f}")
+            self._print(f"Found {len(fieldslist)} variables (fields) in bucket {bucket}.\n{'=' * 40}")
         return fieldslist
 
     def show_measurements_in_bucket(self, bucket: str, verbose: bool = True) -> list:
         """Show measurements in bucket"""
         query = fluxql.measurements_in_bucket(bucket=bucket)
-        client = get_client(self.conf_db)
-        query_api = get_query_api(client)
-        results = query_api.query_data_frame(query=query)
-        client.close()
+        results = self._query_data_frame(querystring=query, operation='show')
         measurements = results['_value'].tolist()
         if verbose:
-            print(f"{'=' * 40}\nMeasurements in bucket {bucket}:")
+            self._print(f"{'=' * 40}\nMeasurements in bucket {bucket}:")
             for ix, m in enumerate(measurements, 1):
-                print(f"#{ix}  {bucket}  {m}")
-            print(f"Found {len(measurements)} measurements in bucket {bucket}.\n{'=' * 40}")
+                self._print(f"#{ix}  {bucket}  {m}")
+            self._print(f"Found {len(measurements)} measurements in bucket {bucket}.\n{'=' * 40}")
         return measurements
 
     def show_buckets(self) -> list:
         """Show all buckets in the database"""
         query = fluxql.buckets()
-        client = get_client(self.conf_db)
-        query_api = get_query_api(client)
-        results = query_api.query_data_frame(query=query)
-        client.close()
+        results = self._query_data_frame(querystring=query, operation='show')
         results.drop(columns=['result', 'table'], inplace=True)
         bucketlist = results['name'].tolist()
         bucketlist = [x for x in bucketlist if not x.startswith('_')]
         for ix, b in enumerate(bucketlist, 1):
-            print(f"#{ix}  {b}")
-        print(f"Found {len(bucketlist)} buckets in database.")
+            self._print(f"#{ix}  {b}")
+        self._print(f"Found {len(bucketlist)} buckets in database.")
         return bucketlist
 
     def _read_configs(self):
-
-        # # Search in this file's folder
-        # _dir_main = Path(__file__).parent.resolve()
-
-        # Config locations
-        _dir_filegroups = self.dirconf / 'filegroups'
-        _file_unitmapper = self.dirconf / 'units.yaml'
-        _file_dirs = self.dirconf / 'dirs.yaml'
-        _file_dbconf = Path(f"{self.dirconf}_secret") / 'dbconf.yaml'
-
-        # Read configs
-        conf_filetypes = get_conf_filetypes(folder=_dir_filegroups)
-        conf_unitmapper = read_configfile(config_file=_file_unitmapper)
-        conf_dirs = read_configfile(config_file=_file_dirs)
-        conf_db = read_configfile(config_file=_file_dbconf)
-        print("Reading configuration files was successful.")
-        return conf_filetypes, conf_unitmapper, conf_dirs, conf_db
+        configs = read_configs(dirconf=self.dirconf)
+        self._print("Reading configuration files was successful.")
+        return configs
 
     def _test_connection_to_db(self):
         """Connect to database"""
         client = get_client(self.conf_db)
         client.ping()
         client.close()
-        print("Connection to database works.")
+        self._print("Connection to database works.")
 
     @staticmethod
     def _convert_datestr_to_iso8601(datestr: str, timezone_offset_to_utc_hours: int) -> str:
@@ -640,25 +1581,26 @@ class dbcInflux:
             # data = yaml.load(f, Loader=SafeLoader)
         return data
 
-    def _detect_measurement_for_field(self, bucket: str, measurementslist: list, varnameslist: list) -> dict:
-        """Detect measurement group of variable
 
-        Helper function because the query in FluxQL (InfluxDB query language) does not return
-        the measurement group of the field. Used e.g. in diive meteoscreening, where info
-        about the measurement group is important.
+def read_configs(dirconf: Path) -> tuple[dict, dict, dict, dict]:
+    """Read configurations for filetypes, units, directories and database"""
 
-        :param bucket: name of database bucket, e.g. "ch-dav_raw"
-        :param measurementslist: list of measurements, e.g. "['TA', 'SW', 'LW']"
-        :param varnameslist: list of variable names, e.g. "[TA_T1_35_1, SW_IN_T1_35_1]"
-        :return:
-        """
-        assigned_measurements = {}
-        for m in measurementslist:
-            fieldslist = self.show_fields_in_measurement(bucket=bucket, measurement=m)
-            for var in varnameslist:
-                if var in fieldslist:
-                    assigned_measurements[var] = m
-        return assigned_measurements
+    # # Search in this file's folder
+    # _dir_main = Path(__file__).parent.resolve()
+
+    # Config locations
+    dirconf = Path(dirconf)
+    _dir_filegroups = dirconf / 'filegroups'
+    _file_unitmapper = dirconf / 'units.yaml'
+    _file_dirs = dirconf / 'dirs.yaml'
+    _file_dbconf = Path(f"{dirconf}_secret") / 'dbconf.yaml'
+
+    # Read configs
+    conf_filetypes = get_conf_filetypes(folder=_dir_filegroups)
+    conf_unitmapper = read_configfile(config_file=_file_unitmapper)
+    conf_dirs = read_configfile(config_file=_file_dirs)
+    conf_db = read_configfile(config_file=_file_dbconf)
+    return conf_filetypes, conf_unitmapper, conf_dirs, conf_db
 
 
 def get_conf_filetypes(folder: Path, ext: str = 'yaml') -> dict:
@@ -0,0 +1,160 @@
+"""
+Local manifest of uploaded data
+
+The manifest is a small SQLite database that stores a content digest for
+each time block of each uploaded series, keyed by bucket, measurement,
+field, tag set and time block. When the same data are uploaded again,
+e.g. when raw files are re-ingested over overlapping file sets, blocks
+with an unchanged digest are skipped before they are serialized and sent
+to the database.
+
+The digest of a block is the (wrapping) sum of the 64-bit hashes of all
+its rows (timestamp and value) together with the number of points, which
+makes it independent of the order of the rows.
+
+Entries are also keyed by the sub-range of the block that was covered by
+the upload (first and last timestamp). Files that each cover part of a
+block, e.g. two files of the same day, keep their own entry and are both
+skipped when they are uploaded again. Entries whose sub-range lies within
+a newly written sub-range are replaced.
+"""
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+@dataclass
+class ManifestFilterResult:
+    """Data that still need to be written, plus the manifest entries to commit after writing"""
+    write_df: DataFrame
+    entries: DataFrame = field(default_factory=DataFrame)  # Digests of the written blocks
+    points_written: int = 0
+    points_skipped: int = 0
+    blocks_written: int = 0
+    blocks_skipped: int = 0
+
+
+def block_digests(df: DataFrame, field: str, tag_columns: list, block: str = '1D') -> tuple[DataFrame, DataFrame]:
+    """Calculate content digest per tag set and time block
+
+    Args:
+        df: data with timestamp index, *field* column and tag columns
+        field: name of the column with variable data
+        tag_columns: names of the columns that are stored as tags
+        block: time block size, given as pandas frequency string
+
+    Returns:
+        tuple of two dataframes: one row per input row with columns 'tagset_hash',
+        'block' and 'row_hash'; and one row per (tagset_hash, block) with
+        columns 'tagset_hash', 'block', 'first', 'last' (covered sub-range of the
+        block), 'digest' and 'points'
+    """
+    tag_columns = [t for t in tag_columns if t in df.columns]
+    index = pd.DatetimeIndex(df.index)
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+
+    taghash = pd.util.hash_pandas_object(df[tag_columns].astype(str), index=False).values
+    rowhash = pd.util.hash_pandas_object(
+        pd.DataFrame({'ts': index.asi8, 'value': df[field].values}), index=False).values
+
+    rows = pd.DataFrame({
+        'tagset_hash': taghash.astype(str),
+        'block': index.floor(block).strftime('%Y-%m-%dT%H:%M:%S'),
+        'ts': index.strftime('%Y-%m-%dT%H:%M:%S'),
+        'row_hash': rowhash,
+    })
+    grouped = rows.groupby(['tagset_hash', 'block'], sort=False)
+    digests = grouped['row_hash'].agg(lambda x: np.sum(x.values, dtype=np.uint64)).to_frame('rowsum')
+    digests['first'] = grouped['ts'].min()
+    digests['last'] = grouped['ts'].max()
+    digests['points'] = grouped.size()
+    digests['digest'] = [f'{int(s):016x}-{p}' for s, p in zip(digests['rowsum'], digests['points'])]
+    return rows.drop(columns='ts'), digests[['first', 'last', 'digest', 'points']].reset_index()
+
+
+class UploadManifest:
+    """SQLite manifest of uploaded blocks
+
+    Args:
+        path: file path of the SQLite database, created if it does not exist
+        block: time block size, given as pandas frequency string, e.g. '1D'
+    """
+
+    def __init__(self, path: str or Path, block: str = '1D'):
+        self.path = Path(path)
+        self.block = block
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS manifest ('
+            'bucket TEXT, measurement TEXT, field TEXT, tagset_hash TEXT, block TEXT, '
+            'first TEXT, last TEXT, digest TEXT, points INTEGER, '
+            'PRIMARY KEY (bucket, measurement, field, tagset_hash, block, first, last))')
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def _stored_digests(self, bucket: str, measurement: str, field: str) -> DataFrame:
+        with self._lock:
+            return pd.read_sql_query(
+                'SELECT tagset_hash, block, first, last, digest FROM manifest '
+                'WHERE bucket = ? AND measurement = ? AND field = ?',
+                self._conn, params=(bucket, measurement, field))
+
+    def filter_unchanged(self, df: DataFrame, bucket: str, measurement: str, field: str,
+                         tag_columns: list) -> ManifestFilterResult:
+        """Remove all blocks from *df* that were already uploaded with the same content
+
+        The manifest is not updated here, the returned entries need to be
+        committed with `.commit()` after the upload was successful.
+        """
+        if df.empty:
+            return ManifestFilterResult(write_df=df)
+        rows, digests = block_digests(df=df, field=field, tag_columns=tag_columns, block=self.block)
+        stored = self._stored_digests(bucket=bucket, measurement=measurement, field=field)
+        merged = digests.merge(stored, on=['tagset_hash', 'block', 'first', 'last'], how='left',
+                               suffixes=('', '_stored'))
+        unchanged = merged['digest'] == merged['digest_stored']
+
+        changed = merged.loc[~unchanged, ['tagset_hash', 'block']]
+        keep = pd.MultiIndex.from_frame(rows[['tagset_hash', 'block']]).isin(
+            pd.MultiIndex.from_frame(changed))
+        write_df = df[keep]
+        return ManifestFilterResult(write_df=write_df,
+                                    entries=merged.loc[~unchanged, ['tagset_hash', 'block', 'first', 'last',
+                                                                    'digest', 'points']],
+                                    points_written=len(write_df),
+                                    points_skipped=len(df) - len(write_df),
+                                    blocks_written=int((~unchanged).sum()),
+                                    blocks_skipped=int(unchanged.sum()))
+
+    def commit(self, bucket: str, measurement: str, field: str, entries: DataFrame):
+        """Store digests of successfully uploaded blocks
+
+        Entries of the same blocks whose sub-range lies within the uploaded
+        sub-range were overwritten in the database and are removed.
+        """
+        if entries is None or entries.empty:
+            return
+        records = [(bucket, measurement, field, r.tagset_hash, r.block, r.first, r.last, r.digest, int(r.points))
+                   for r in entries.itertuples(index=False)]
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM manifest WHERE bucket = ? AND measurement = ? AND field = ? '
+                'AND tagset_hash = ? AND block = ? AND first >= ? AND last <= ?',
+                [r[:7] for r in records])
+            self._conn.executemany('INSERT INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', records)
+            self._conn.commit()
@@ -0,0 +1,148 @@
+"""
+Retries, timeouts and circuit breaker for reads
+
+Queries are idempotent and can be repeated after a transient error (e.g.
+HTTP 502, 503, 429 or a connection reset). `ReadPolicy` defines the
+timeout of each type of operation and how often and after which delay a
+failed query is retried (exponential backoff with jitter). Downloads in
+chunks (see `dbcInflux.download(auto_chunk=True)`) only repeat the query
+of the failed chunk.
+
+`CircuitBreaker` counts consecutive failed queries. After too many
+failures the circuit opens and all further queries fail immediately with
+`CircuitOpenError`, instead of waiting for the timeout of an unhealthy
+server. After a cool-down period one query is let through again, the
+circuit is closed when it succeeds.
+"""
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Seconds per type of operation
+DEFAULT_TIMEOUTS = {'download': 999.0, 'show': 60.0, 'estimate': 300.0, 'coverage': 600.0, 'cardinality': 600.0,
+                    'aggregate': 3600.0, 'verify': 600.0}
+
+
+class CircuitOpenError(Exception):
+    """Raised when queries are not sent because the database failed repeatedly"""
+
+
+@dataclass
+class ReadPolicy:
+    """Timeouts and retries for reads
+
+    Can be given in the database configuration file (dbconf.yaml) in the
+    section 'read', e.g.:
+
+        read:
+          max_retries: 5
+          timeouts:
+            download: 1800
+    """
+    timeouts: dict = field(default_factory=lambda: dict(DEFAULT_TIMEOUTS))  # Seconds per operation
+    default_timeout: float = 999.0  # Seconds, for operations not in *timeouts*
+    max_retries: int = 3
+    retry_interval: float = 2.0  # Seconds, first retry delay
+    max_retry_delay: float = 60.0  # Seconds
+    exponential_base: float = 2.0
+    failure_threshold: int = 5  # Consecutive failures that open the circuit
+    reset_timeout: float = 30.0  # Seconds the circuit stays open
+
+    def __post_init__(self):
+        self.timeouts = {**DEFAULT_TIMEOUTS, **self.timeouts}
+
+    def timeout_ms(self, operation: str) -> int:
+        """Timeout of *operation* in milliseconds, as needed by the client"""
+        return int(self.timeouts.get(operation, self.default_timeout) * 1000)
+
+    def retry_delay(self, attempt: int) -> float:
+        delay = min(self.retry_interval * self.exponential_base ** attempt, self.max_retry_delay)
+        return delay * random.uniform(0.5, 1.0)  # Jitter
+
+
+class CircuitBreaker:
+    """Fail fast after *failure_threshold* consecutive failures for *reset_timeout* seconds"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self):
+        if self.state == 'open':
+            raise CircuitOpenError(f"Database queries failed {self.failures} times in a row, "
+                                   f"not sending queries for {self.reset_timeout:.0f}s.")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for errors after which a query can be repeated"""
+    status = getattr(error, 'status', None)
+    if status is not None:
+        return status in RETRY_STATUS
+    return isinstance(error, (Urllib3HTTPError, ConnectionError, TimeoutError))
+
+
+def call_with_retry(func, policy: ReadPolicy, breaker: CircuitBreaker = None, description: str = 'query',
+                    on_retry=None, printer=print):
+    """Call *func* (without arguments) and retry it after transient errors
+
+    Args:
+        func: function that runs the query, e.g. `lambda: query_api.query_data_frame(query=q)`
+        policy: number of retries and delays
+        breaker: circuit breaker shared by all queries of the same database
+        description: shown in the log when the query is retried
+        on_retry: function without arguments that is called before each retry, e.g. to count retries
+        printer: function that shows the retry messages, e.g. a quiet-aware print function
+
+    Returns:
+        return value of *func*
+    """
+    attempt = 0
+    while True:
+        if breaker:
+            breaker.before_call()
+        try:
+            result = func()
+        except Exception as e:
+            retryable = is_retryable(e)
+            if breaker and retryable:
+                breaker.record_failure()
+            if not retryable or attempt >= policy.max_retries:
+                raise
+            delay = policy.retry_delay(attempt=attempt)
+            printer(f"(!)Retrying {description} in {delay:.1f}s after error: {e}")
+            if on_retry:
+                on_retry()
+            time.sleep(delay)
+            attempt += 1
+            continue
+        if breaker:
+            breaker.record_success()
+        return result
@@ -0,0 +1,143 @@
+"""
+Retagging of data between buckets
+
+`RetagRules` describe how tags and field names are changed when data are
+copied from one bucket to another, e.g. renaming '_T1B2_' fields, setting
+'site' and 'data_version' or normalizing frequency strings ('30T' to
+'30min'). Rules that Flux can express are compiled to a `map()` function
+and executed on the server, together with `to()` that writes the data to
+the target bucket, i.e., the data never leave the database. Rules with a
+custom `transform` function are applied on the client instead: the data
+are downloaded in long format, changed with vectorized pandas operations
+and written as line protocol.
+
+In both cases the time range is processed in chunks.
+"""
+import re
+from dataclasses import dataclass, field
+
+import pandas as pd
+from pandas import DataFrame
+
+import dbc_influxdb.fluxql as fluxql
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+@dataclass
+class RetagRules:
+    """Changes of tags and field names
+
+    Rules are applied in this order: *rename_fields*, *replace_in_fields*,
+    *map_tags*, *set_tags*, *transform*.
+
+    Example:
+        RetagRules(replace_in_fields={'_T1B2_': '_T1_'},
+                   map_tags={'freq': {'30T': '30min', '10S': '10s'}},
+                   set_tags={'site': 'ch-cha', 'data_version': 'meteoscreening_diive'})
+    """
+    rename_fields: dict = field(default_factory=dict)  # Old field name: new field name
+    replace_in_fields: dict = field(default_factory=dict)  # Substring in field names: replacement
+    map_tags: dict = field(default_factory=dict)  # Tag: {old value: new value}
+    set_tags: dict = field(default_factory=dict)  # Tag: new value for all data
+    rename_varname: bool = True  # Tag 'varname' follows the changed field name
+    transform: callable = None  # Function on long-format dataframe, only on the client
+
+    @property
+    def server_side(self) -> bool:
+        """True if all rules can be executed in Flux"""
+        return self.transform is None
+
+    @property
+    def changes_field(self) -> bool:
+        return bool(self.rename_fields or self.replace_in_fields)
+
+    def to_flux(self) -> str:
+        """Compile rules to a Flux `map()` function"""
+        if not self.server_side:
+            raise ValueError("Rules with a transform function can not be executed in Flux.")
+        assignments = {}
+        if self.changes_field:
+            fieldexpr = _mapping_expr(column='_field', mapping=self.rename_fields)
+            for old, new in self.replace_in_fields.items():
+                fieldexpr = (f'strings.replaceAll(v: {fieldexpr}, t: "{fluxql.escape_string(old)}", '
+                             f'u: "{fluxql.escape_string(new)}")')
+            assignments['_field'] = fieldexpr
+            if self.rename_varname:
+                assignments['varname'] = fieldexpr
+        for tag, mapping in self.map_tags.items():
+            assignments[tag] = _mapping_expr(column=tag, mapping=mapping)
+        for tag, value in self.set_tags.items():
+            assignments[tag] = f'"{fluxql.escape_string(value)}"'
+        if not assignments:
+            return ''
+        items = ', '.join(f'{_record_key(k)}: {v}' for k, v in assignments.items())
+        return f'|> map(fn: (r) => ({{r with {items}}}))'
+
+    def apply(self, df: DataFrame) -> DataFrame:
+        """Apply rules to downloaded data in long format (columns '_field', '_value' and tags)"""
+        df = df.copy()
+        if self.changes_field:
+            newfield = df['_field'].replace(self.rename_fields) if self.rename_fields else df['_field']
+            for old, new in self.replace_in_fields.items():
+                newfield = newfield.str.replace(old, new, regex=False)
+            df['_field'] = newfield
+            if self.rename_varname:
+                df['varname'] = newfield
+        for tag, mapping in self.map_tags.items():
+            if tag in df.columns:
+                df[tag] = df[tag].replace(mapping)
+        for tag, value in self.set_tags.items():
+            df[tag] = str(value)
+        if self.transform:
+            df = self.transform(df)
+        return df
+
+
+@dataclass
+class RetagResult:
+    """Summary of a retag run"""
+    from_bucket: str
+    to_bucket: str
+    server_side: bool
+    chunks: int = 0
+    chunks_resumed: int = 0  # Chunks skipped because they were completed in an earlier run
+    points: int = 0
+    duration: float = 0.0  # Seconds
+
+
+def _record_key(key: str) -> str:
+    return key if _IDENTIFIER.match(key) else f'"{fluxql.escape_string(key)}"'
+
+
+def _mapping_expr(column: str, mapping: dict) -> str:
+    """Flux conditional expression that maps values of *column*, other values are kept"""
+    col = f'r["{fluxql.escape_string(column)}"]'
+    expr = col
+    for old, new in reversed(list(mapping.items())):
+        expr = f'if {col} == "{fluxql.escape_string(old)}" then "{fluxql.escape_string(new)}" else {expr}'
+    return f'({expr})' if mapping else expr
+
+
+def retag_query(query: fluxql.FluxQuery, to_bucket: str, rules: RetagRules) -> str:
+    """Server-side retag: select data with *query*, change tags and write to *to_bucket*
+
+    Only the number of written points per series is returned to the client.
+    """
+    mapfn = rules.to_flux()
+    query = query.pipe(*([mapfn] if mapfn else []),
+                       f'|> to(bucket: "{fluxql.escape_string(to_bucket)}")',
+                       '|> count()')
+    querystring = query.compile()
+    if 'strings.' in mapfn:
+        querystring = f'import "strings" {querystring}'
+    return querystring
+
+
+def time_chunks(start: str, stop: str, chunk: str) -> list[tuple[str, str]]:
+    """Split range between two dates into windows of length *chunk*"""
+    bounds = list(pd.date_range(pd.Timestamp(start), pd.Timestamp(stop), freq=pd.to_timedelta(chunk)))
+    if not bounds or bounds[-1] != pd.Timestamp(stop):
+        bounds.append(pd.Timestamp(stop))
+    fmt = '%Y-%m-%d %H:%M:%S'
+    return [(bounds[i].strftime(fmt), bounds[i + 1].strftime(fmt)) for i in range(len(bounds) - 1)]
@@ -0,0 +1,196 @@
+"""
+Bucket snapshots
+
+A snapshot contains all series of a bucket in compressed parquet files
+(requires the optional dependency pyarrow), partitioned by measurement and
+year. Data are stored in long format as returned by the database: one row
+per point with the columns '_time', '_field', '_value' and one column per
+tag. The query results are streamed table by table, the bucket is never
+held in memory as a whole.
+
+Snapshot layout:
+    snapshot/snapshot.json                          bucket, files and points
+    snapshot/<measurement>/<year>/part-*.parquet    data
+
+During restore, each file is serialized to line protocol and sent with
+adaptive batching (see `dbc_influxdb.batching`), the next file is read and
+serialized while the current file is written.
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+from pandas import DataFrame
+
+from dbc_influxdb.batching import WriteStats
+from dbc_influxdb.lineprotocol import frame_to_lines
+
+META_FILE = 'snapshot.json'
+
+# Columns of query results that are not stored
+DROP_COLUMNS = ['result', 'table', '_start', '_stop']
+
+# Points per part file
+PART_ROWS = 1_000_000
+
+
+@dataclass
+class RestoreResult:
+    """Summary of a restore"""
+    bucket: str
+    files: int = 0
+    points: int = 0
+    duration: float = 0.0  # Seconds
+    write_stats: WriteStats = field(default_factory=WriteStats)
+
+
+def tag_columns_of(df: DataFrame) -> list:
+    """All columns of a snapshot frame that are tags"""
+    return [c for c in df.columns if c not in ('_time', '_field', '_value', '_measurement')]
+
+
+class SnapshotWriter:
+    """Write streamed query results to partitioned parquet files
+
+    Frames are buffered per measurement, year and type of values (number,
+    string, bool), a part file is written once a buffer reaches *part_rows*
+    rows, when all data of the measurement were added (`.finish_measurement()`)
+    and when the writer is closed.
+
+    Args:
+        path: folder of the snapshot, must not contain a snapshot yet
+        bucket: name of the bucket the data are from
+        part_rows: number of rows per part file
+    """
+
+    def __init__(self, path: str or Path, bucket: str, part_rows: int = PART_ROWS):
+        self.path = Path(path)
+        if (self.path / META_FILE).is_file():
+            raise FileExistsError(f"Folder {self.path} already contains a snapshot.")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.bucket = bucket
+        self.part_rows = part_rows
+        self.files = []
+        self.points = {}
+        self._buffers = {}
+        self._counter = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    def add(self, df: DataFrame):
+        """Add one frame of query results (long format)"""
+        if df is None or df.empty:
+            return
+        df = df.drop(columns=[c for c in DROP_COLUMNS if c in df.columns])
+        for (measurement, year), group in df.groupby([df['_measurement'], df['_time'].dt.year], sort=False):
+            key = (measurement, int(year), group['_value'].dtype.kind)
+            buffer = self._buffers.setdefault(key, [])
+            buffer.append(group.drop(columns='_measurement'))
+            if sum(len(b) for b in buffer) >= self.part_rows:
+                self._flush(key)
+
+    def finish_measurement(self, measurement: str):
+        """Write the remaining buffers of *measurement*, e.g. before the next measurement is queried"""
+        for key in [k for k in self._buffers if k[0] == measurement]:
+            self._flush(key)
+
+    def close(self):
+        """Write remaining buffers and the snapshot metadata"""
+        for key in list(self._buffers):
+            self._flush(key)
+        meta = dict(bucket=self.bucket, created=pd.Timestamp.now(tz='UTC').isoformat(),
+                    points=self.points, files=self.files)
+        tmp = self.path / f'{META_FILE}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=1)
+        tmp.replace(self.path / META_FILE)
+
+    def _flush(self, key: tuple):
+        frames = self._buffers.pop(key, [])
+        if not frames:
+            return
+        measurement, year, _ = key
+        df = pd.concat(frames, ignore_index=True)
+        folder = self.path / str(measurement) / str(year)
+        folder.mkdir(parents=True, exist_ok=True)
+        self._counter += 1
+        file = folder / f'part-{self._counter:06d}.parquet'
+        tmp = file.with_suffix('.tmp')
+        df.to_parquet(tmp, compression='zstd', index=False)
+        tmp.replace(file)
+        self.files.append(file.relative_to(self.path).as_posix())
+        self.points[measurement] = self.points.get(measurement, 0) + len(df)
+
+
+def read_meta(path: str or Path) -> dict:
+    meta_file = Path(path) / META_FILE
+    if not meta_file.is_file():
+        raise FileNotFoundError(f"No snapshot found in {path}.")
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def snapshot_lines(df: DataFrame, measurement: str, tag_overrides: dict = None,
+                   precision: str = 'ns') -> list[str]:
+    """Serialize one snapshot file to line protocol
+
+    Args:
+        df: snapshot data in long format
+        measurement: name of the measurement of the data
+        tag_overrides: dict with tag names as keys and new tag values as
+            values, e.g. {'data_version': 'raw'}; tags that do not exist yet
+            are added
+        precision: precision of the timestamps in the line protocol
+    """
+    if df.empty:
+        return []
+    if tag_overrides:
+        df = df.assign(**tag_overrides)
+    tag_columns = tag_columns_of(df)
+    lines = []
+    for fieldname, group in df.groupby('_field', sort=False):
+        group = group.set_index('_time').rename(columns={'_value': fieldname}).drop(columns='_field')
+        lines += frame_to_lines(df=group, measurement=measurement, tag_columns=tag_columns, precision=precision)
+    return lines
+
+
+def restore_snapshot(path: str or Path, writer, to_bucket: str, tag_overrides: dict = None,
+                     measurements: list = None) -> RestoreResult:
+    """Write all files of a snapshot to *to_bucket*
+
+    Args:
+        path: folder of the snapshot
+        writer: `AdaptiveWriter` used to send the line protocol
+        to_bucket: name of the bucket the data are written to
+        tag_overrides: see `snapshot_lines()`
+        measurements: only restore these measurements, None for all measurements
+    """
+    tic = time.perf_counter()
+    meta = read_meta(path)
+    files = [f for f in meta['files'] if not measurements or f.split('/')[0] in measurements]
+    result = RestoreResult(bucket=to_bucket)
+
+    def serialize(file: str) -> list[str]:
+        measurement = file.split('/')[0]
+        df = pd.read_parquet(Path(path) / file)
+        return snapshot_lines(df=df, measurement=measurement, tag_overrides=tag_overrides)
+
+    # Serialize the next file while the current file is written
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(serialize, files[0]) if files else None
+        for ix in range(len(files)):
+            lines = pending.result()
+            pending = pool.submit(serialize, files[ix + 1]) if ix + 1 < len(files) else None
+            result.write_stats = writer.write(bucket=to_bucket, record=lines, write_precision='ns')
+            result.files += 1
+            result.points += len(lines)
+    result.duration = time.perf_counter() - tic
+    return result
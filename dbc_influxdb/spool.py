@@ -0,0 +1,127 @@
+"""
+Durable local write spool
+
+Instead of sending data directly to the database, serialized line protocol
+is appended to a local directory as compressed segment files. Each segment
+is written to a temporary file, flushed to disk (fsync) and then renamed,
+i.e., a segment is either complete or not there at all. Segments are sent
+to the database with `replay()` once the database is reachable, and deleted
+after they were written successfully.
+
+Each segment starts with one header line (JSON, prefixed with '#') that
+contains the bucket and the timestamp precision of the data.
+"""
+import gzip
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+@dataclass
+class SpoolReplayResult:
+    """Summary of one spool replay"""
+    segments_written: int = 0
+    points_written: int = 0
+    segments_remaining: int = 0
+    duration: float = 0.0  # Seconds
+    error: Exception = None
+    buckets: set = field(default_factory=set)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class WriteSpool:
+    """Directory with compressed line protocol segments waiting for upload
+
+    Args:
+        directory: folder where segments are stored, created if it does not exist
+        segment_points: maximum number of points (lines) per segment file
+    """
+    suffix = '.lp.gz'
+
+    def __init__(self, directory: str or Path, segment_points: int = 100_000):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_points = segment_points
+        self._counter = itertools.count()
+
+    def append(self, bucket: str, lines: list[str], precision: str = 's') -> list[Path]:
+        """Append line protocol to spool, returns the paths of the new segment files"""
+        segments = []
+        for ix in range(0, len(lines), self.segment_points):
+            segments.append(self._write_segment(bucket=bucket, precision=precision,
+                                                lines=lines[ix:ix + self.segment_points]))
+        if segments:
+            self._fsync_directory()
+        return segments
+
+    def segments(self) -> list[Path]:
+        """Committed segment files, oldest first"""
+        return sorted(self.directory.glob(f'*{self.suffix}'))
+
+    def pending_points(self) -> int:
+        return sum(self.read_segment(s)[0]['points'] for s in self.segments())
+
+    @staticmethod
+    def read_segment(path: Path) -> tuple[dict, list[str]]:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline()[1:])
+            lines = f.read().splitlines()
+        return header, lines
+
+    def replay(self, write_api, batch_size: int = 50_000) -> SpoolReplayResult:
+        """Send all segments to the database, oldest first
+
+        *write_api* must write synchronously, i.e., raise an exception if the
+        write fails. Replay stops at the first failed segment, the failed and
+        all later segments remain in the spool.
+        """
+        result = SpoolReplayResult()
+        tic = time.perf_counter()
+        segments = self.segments()
+        for ix, segment in enumerate(segments):
+            header, lines = self.read_segment(segment)
+            try:
+                for start in range(0, len(lines), batch_size):
+                    write_api.write(bucket=header['bucket'], record=lines[start:start + batch_size],
+                                    write_precision=header['precision'])
+            except Exception as e:
+                result.error = e
+                result.segments_remaining = len(segments) - ix
+                break
+            segment.unlink()
+            result.segments_written += 1
+            result.points_written += len(lines)
+            result.buckets.add(header['bucket'])
+        self._fsync_directory()
+        result.duration = time.perf_counter() - tic
+        return result
+
+    def _write_segment(self, bucket: str, precision: str, lines: list[str]) -> Path:
+        name = f'{time.time_ns():020d}-{os.getpid()}-{next(self._counter):06d}'
+        tmp = self.directory / f'{name}.tmp'
+        final = self.directory / f'{name}{self.suffix}'
+        header = json.dumps(dict(bucket=bucket, precision=precision, points=len(lines)))
+        with open(tmp, 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                gz.write(f'#{header}\n'.encode('utf-8'))
+                gz.write('\n'.join(lines).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, final)
+        return final
+
+    def _fsync_directory(self):
+        """Make renames durable, not supported on Windows"""
+        if os.name == 'nt':
+            return
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
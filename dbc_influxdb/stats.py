@@ -0,0 +1,287 @@
+"""
+Timing and metrics of operations
+
+Each operation (download, upload, delete, ...) records the duration of
+its phases (e.g. query, timezone conversion, merge, serialize, write) and
+counts (rows, points, bytes, retries) in an `OperationStats` object. When
+the operation is finished, the stats are passed to all sinks. A sink is any
+callable that accepts an `OperationStats` object, e.g. a function
+(callback), `LoggingSink` or `PrometheusTextSink`.
+
+With *profile_memory*, each phase (and the processing of each variable)
+also records its peak and retained memory: memory allocated by Python is
+traced with tracemalloc and the resident memory (RSS) of the process is
+sampled in a background thread. Tracing slows down the operation and
+measures the whole process, it is meant for finding the step that needs
+the most memory (e.g. to choose chunk sizes), not for production runs.
+
+Example:
+    prometheus = PrometheusTextSink(path='/var/lib/node_exporter/dbc.prom')
+    dbc = dbcInflux(dirconf=DIRCONF, quiet=True, stats_sinks=[LoggingSink(), prometheus])
+    dbc.download(...)
+    print(dbc.last_stats)
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MB = 1024 ** 2
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss() -> int or None:
+    """Resident memory of this process in bytes, None if not available"""
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+@dataclass
+class MemoryUsage:
+    """Memory of one phase or variable in MB, accumulated over all times it was entered"""
+    peak: float = 0.0  # Highest traced memory above the memory at the start, maximum of all calls
+    retained: float = 0.0  # Traced memory at the end minus at the start (e.g. size of the result), sum of all calls
+    rss_peak: float = None  # Highest sampled resident memory of the process
+    calls: int = 0
+
+    def add(self, peak: float, retained: float, rss_peak: float or None):
+        self.peak = max(self.peak, peak)
+        self.retained += retained
+        if rss_peak is not None:
+            self.rss_peak = max(self.rss_peak or 0.0, rss_peak)
+        self.calls += 1
+
+
+class MemoryProfiler:
+    """Traced memory (tracemalloc) and sampled RSS, with a peak that can be reset
+
+    Args:
+        interval: seconds between RSS samples
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self._started_tracing = False
+        self._rss_peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if current_rss() is not None:
+            self._rss_peak = current_rss()
+            self._thread = threading.Thread(target=self._sample_rss, name='dbc-rss-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _sample_rss(self):
+        while not self._stop.wait(self.interval):
+            self._rss_peak = max(self._rss_peak, current_rss())
+
+    def sample(self) -> tuple[int, int, int or None]:
+        """Current and peak traced memory and peak RSS since the last reset, in bytes"""
+        current, peak = tracemalloc.get_traced_memory()
+        rss = current_rss()
+        if rss is None:
+            return current, peak, None
+        self._rss_peak = max(self._rss_peak, rss)
+        return current, peak, self._rss_peak
+
+    def reset_peak(self):
+        tracemalloc.reset_peak()
+        self._rss_peak = current_rss() or 0
+
+
+@dataclass
+class OperationStats:
+    """Durations of phases (seconds) and counts of one operation"""
+    operation: str
+    labels: dict = field(default_factory=dict)  # e.g. bucket and field
+    phases: dict = field(default_factory=dict)
+    counts: dict = field(default_factory=dict)
+    duration: float = 0.0  # Seconds, total
+    profile_memory: bool = False
+    memory: dict = field(default_factory=dict)  # Phase: MemoryUsage, only with *profile_memory*
+    memory_by_variable: dict = field(default_factory=dict)  # Variable: MemoryUsage, only with *profile_memory*
+    _tic: float = field(default_factory=time.perf_counter, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    _profiler: MemoryProfiler = field(default=None, repr=False, compare=False)
+    _frames: list = field(default_factory=list, repr=False, compare=False)  # Open phases: [start, peak, rss]
+
+    @contextmanager
+    def phase(self, name: str):
+        """Add the duration of the block to phase *name*, phases can be entered several times"""
+        tic = time.perf_counter()
+        try:
+            with self._track_memory(target=self.memory, name=name):
+                yield self
+        finally:
+            elapsed = time.perf_counter() - tic
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def variable(self, name: str):
+        """Record the memory needed to process variable *name*, only with *profile_memory*"""
+        return self._track_memory(target=self.memory_by_variable, name=name)
+
+    @contextmanager
+    def _track_memory(self, target: dict, name: str):
+        if not self.profile_memory:
+            yield
+            return
+        with self._lock:
+            if self._profiler is None:
+                self._profiler = MemoryProfiler()
+                self._profiler.start()
+            if self._frames:
+                # Peak of the enclosing phase up to here, the peak is reset for this phase
+                self._update_frame(self._frames[-1], *self._profiler.sample()[1:])
+            self._profiler.reset_peak()
+            current, _, rss = self._profiler.sample()
+            frame = [current, current, rss]
+            self._frames.append(frame)
+        try:
+            yield
+        finally:
+            with self._lock:
+                current, peak, rss = self._profiler.sample()
+                self._update_frame(frame, peak, rss)
+                self._frames.remove(frame)
+                if self._frames:
+                    self._update_frame(self._frames[-1], frame[1], frame[2])
+                self._profiler.reset_peak()
+                usage = target.setdefault(name, MemoryUsage())
+                usage.add(peak=(frame[1] - frame[0]) / MB, retained=(current - frame[0]) / MB,
+                          rss_peak=frame[2] / MB if frame[2] is not None else None)
+
+    @staticmethod
+    def _update_frame(frame: list, peak: int, rss: int or None):
+        frame[1] = max(frame[1], peak)
+        if rss is not None:
+            frame[2] = max(frame[2] or 0, rss)
+
+    def add(self, **counts):
+        """Add to counts, e.g. `stats.add(rows=100, retries=1)`"""
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+
+    def finish(self) -> 'OperationStats':
+        self.duration = time.perf_counter() - self._tic
+        if self._profiler is not None:
+            self._profiler.stop()
+            self._profiler = None
+        return self
+
+    def to_dict(self) -> dict:
+        d = dict(operation=self.operation, labels=dict(self.labels), duration=self.duration,
+                 phases=dict(self.phases), counts=dict(self.counts))
+        if self.profile_memory:
+            d['memory'] = {k: asdict(v) for k, v in self.memory.items()}
+            d['memory_by_variable'] = {k: asdict(v) for k, v in self.memory_by_variable.items()}
+        return d
+
+    def __str__(self):
+        labels = ' '.join(f'{k}={v}' for k, v in self.labels.items())
+
+        def phase_str(name: str, seconds: float) -> str:
+            usage = self.memory.get(name)
+            return f'{name} {seconds:.3f}s' + (f' (peak {usage.peak:.1f}MB)' if usage else '')
+
+        phases = ', '.join(phase_str(k, v) for k, v in self.phases.items())
+        counts = ', '.join(f'{k}={v}' for k, v in self.counts.items())
+        return f"[stats] {self.operation} {labels} {self.duration:.3f}s | {phases} | {counts}"
+
+
+def phase_of(stats: OperationStats or None, name: str):
+    """Phase context of *stats*, or a context that does nothing if *stats* is None"""
+    return stats.phase(name) if stats is not None else nullcontext()
+
+
+def variable_of(stats: OperationStats or None, name: str):
+    """Variable context of *stats*, or a context that does nothing if *stats* is None"""
+    return stats.variable(name) if stats is not None else nullcontext()
+
+
+def emit(stats: OperationStats, sinks: list):
+    for sink in sinks or []:
+        sink(stats)
+
+
+class LoggingSink:
+    """Log stats of each operation as one line"""
+
+    def __init__(self, logger: logging.Logger = None, level: int = logging.INFO):
+        self.logger = logger if logger else logging.getLogger('dbc_influxdb')
+        self.level = level
+
+    def __call__(self, stats: OperationStats):
+        self.logger.log(self.level, str(stats))
+
+
+class PrometheusTextSink:
+    """Accumulate stats as counters in Prometheus text exposition format
+
+    If *path* is given, the file is rewritten after each operation, e.g. for
+    the textfile collector of the node exporter.
+    """
+
+    def __init__(self, path: str or Path = None, prefix: str = 'dbc'):
+        self.path = Path(path) if path else None
+        self.prefix = prefix
+        self._operations = {}
+        self._seconds = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stats: OperationStats):
+        op = stats.operation
+        with self._lock:
+            self._operations[op] = self._operations.get(op, 0) + 1
+            key = (op, 'total')
+            self._seconds[key] = self._seconds.get(key, 0.0) + stats.duration
+            for phase, seconds in stats.phases.items():
+                self._seconds[(op, phase)] = self._seconds.get((op, phase), 0.0) + seconds
+            for name, value in stats.counts.items():
+                self._counts[(op, name)] = self._counts.get((op, name), 0) + value
+            text = self.render()
+        if self.path:
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(text, encoding='utf-8')
+            tmp.replace(self.path)
+
+    def render(self) -> str:
+        p = self.prefix
+        lines = [f'# TYPE {p}_operations_total counter']
+        lines += [f'{p}_operations_total{{operation="{op}"}} {n}' for op, n in self._operations.items()]
+        lines.append(f'# TYPE {p}_phase_seconds_total counter')
+        lines += [f'{p}_phase_seconds_total{{operation="{op}",phase="{phase}"}} {s:.6f}'
+                  for (op, phase), s in self._seconds.items()]
+        lines.append(f'# TYPE {p}_count_total counter')
+        lines += [f'{p}_count_total{{operation="{op}",name="{name}"}} {v}'
+                  for (op, name), v in self._counts.items()]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,159 @@
+"""
+Local store for incremental (watermark-based) downloads
+
+The store remembers the last timestamp (watermark) of each series, i.e.,
+of each combination of field and tag set. A sync only queries data newer
+than the oldest watermark minus an overlap (for data that arrive late) and
+appends the new data to the store. Series whose watermark is much older
+than the newest watermark (stale series, e.g. of a decommissioned sensor or
+the old tag set after a change of units) do not move the start of the
+query back. Data are stored per field as parquet
+files (requires the optional dependency pyarrow), each sync appends one
+part file per field. Parts are compacted into one file once there are too
+many of them.
+
+Store layout:
+    store/meta.json                 selection and watermarks
+    store/<field>/part-*.parquet    data and tags of the field
+"""
+import json
+import time
+from pathlib import Path
+
+import pandas as pd
+from pandas import DataFrame
+
+from dbc_influxdb.common import tags
+
+MAX_PARTS = 20  # Parts per field before compaction
+
+
+def series_watermarks(tables: list, tag_columns: list = None) -> dict:
+    """Latest timestamp (UTC, ISO 8601) of each series in the downloaded tables
+
+    Series are identified by their variable name and the values of all tags,
+    or of *tag_columns* (the tags of a tag profile, see `dbc_influxdb.tagprofiles`).
+    """
+    watermarks = {}
+    for table in tables:
+        if table.empty:
+            continue
+        tagcols = [t for t in (tag_columns if tag_columns else tags) if t in table.columns]
+        keys = table[tagcols].astype(str).agg('|'.join, axis=1) if tagcols else pd.Series('', index=table.index)
+        latest = table.groupby(keys.values)['_time'].max()
+        for key, ts in latest.items():
+            iso = pd.Timestamp(ts).tz_convert('UTC').isoformat()
+            if key not in watermarks or iso > watermarks[key]:
+                watermarks[key] = iso
+    return watermarks
+
+
+class SyncStore:
+    """Local columnar store with watermarks per series
+
+    A store can only be used for one selection of data, i.e., the same
+    bucket, measurements, fields, data versions and timezone.
+
+    Args:
+        path: folder of the store, created if it does not exist
+        selection: dict describing the synced data, e.g. bucket and fields
+    """
+
+    def __init__(self, path: str or Path, selection: dict):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._metafile = self.path / 'meta.json'
+        self.meta = self._read_meta()
+        selection = json.loads(json.dumps(selection))  # Lists and tuples compare equal after reading
+        if self.meta.get('selection', selection) != selection:
+            raise ValueError(f"Store {self.path} is used for {self.meta['selection']}, not {selection}.")
+        self.meta['selection'] = selection
+        self.meta.setdefault('watermarks', {})
+
+    @property
+    def watermarks(self) -> dict:
+        return self.meta['watermarks']
+
+    def query_start(self, overlap: str, stale_after: str = None) -> str or None:
+        """Start of the next query: oldest watermark minus *overlap*, None if nothing is stored yet
+
+        Args:
+            overlap: data downloaded again before the oldest watermark, pandas timedelta string
+            stale_after: watermarks that are older than the newest watermark by more than
+                this pandas timedelta string are ignored, None to use all watermarks
+        """
+        if not self.watermarks:
+            return None
+        watermarks = [pd.Timestamp(w) for w in self.watermarks.values()]
+        if stale_after is not None:
+            newest = max(watermarks)
+            watermarks = [w for w in watermarks if newest - w <= pd.to_timedelta(stale_after)]
+        oldest = min(watermarks)
+        return (oldest - pd.to_timedelta(overlap)).isoformat()
+
+    def append(self, data_detailed: dict, watermarks: dict):
+        """Store new data of each field and update watermarks"""
+        stamp = time.time_ns()
+        for field, df in data_detailed.items():
+            if df.empty:
+                continue
+            folder = self._field_folder(field)
+            folder.mkdir(exist_ok=True)
+            df.to_parquet(folder / f'part-{stamp:020d}.parquet')
+        for key, iso in watermarks.items():
+            if key not in self.watermarks or iso > self.watermarks[key]:
+                self.watermarks[key] = iso
+        self._write_meta()
+
+    def fields(self) -> list:
+        return sorted(p.name for p in self.path.iterdir() if p.is_dir())
+
+    def read(self, fields: list = None) -> tuple[DataFrame, dict]:
+        """Combined data of all syncs
+
+        Returns:
+            data_simple: dataframe with all variables, without tags
+            data_detailed: dict with variable names as keys and dataframes with
+                variable data and tags as values
+        """
+        fields = fields if fields else self.fields()
+        data_detailed = {}
+        for field in fields:
+            df = self._read_field(field)
+            if df is not None:
+                data_detailed[field] = df
+        if not data_detailed:
+            return DataFrame(), data_detailed
+        data_simple = pd.concat([df[[field]] for field, df in data_detailed.items()], axis=1).sort_index()
+        return data_simple, data_detailed
+
+    def _read_field(self, field: str) -> DataFrame or None:
+        folder = self._field_folder(field)
+        parts = sorted(folder.glob('part-*.parquet')) if folder.is_dir() else []
+        if not parts:
+            return None
+        df = pd.concat([pd.read_parquet(p) for p in parts])
+        df = df.sort_index(kind='stable')
+        # Later syncs overwrite overlapping data of earlier syncs
+        df = df[~df.index.duplicated(keep='last')]
+        if len(parts) > MAX_PARTS:
+            compacted = folder / f'part-{time.time_ns():020d}.parquet'
+            df.to_parquet(compacted)
+            for p in parts:
+                p.unlink()
+        return df
+
+    def _field_folder(self, field: str) -> Path:
+        return self.path / str(field).replace('/', '_').replace('\\', '_')
+
+    def _read_meta(self) -> dict:
+        if not self._metafile.is_file():
+            return {}
+        with open(self._metafile, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self):
+        tmp = self._metafile.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=1)
+        tmp.replace(self._metafile)
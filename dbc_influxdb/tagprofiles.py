@@ -0,0 +1,249 @@
+"""
+Tag profiles
+
+By default, all metadata in `dbc_influxdb.common.tags` are written as tags
+on every point. Values that are rarely queried but change often (e.g.
+'gain', 'raw_units' or 'config_filetype') then create new series and make
+each line longer. A tag profile moves such metadata out of the tags:
+
+    fields      written as fields next to the variable on every point, not
+                part of the series key
+    sidecar     written to the measurement 'dbc_metadata', one point per
+                series and uninterrupted range of the same metadata values
+
+All other metadata stay tags. The profile is selected by name, either per
+bucket in the database configuration or per filetype with the setting
+'tag_profile'. Custom profiles are defined in the database configuration:
+
+    tag_profiles:
+      lean:
+        fields: [gain, offset]
+        sidecar: [raw_varname, raw_units, config_filetype]
+    bucket_tag_profiles:
+      ch-xyz_raw: lean
+
+`dbcInflux.download()`, `.download_many()` and `.sync()` reattach the
+metadata in fields and in the sidecar measurement, *data_detailed* has
+the same columns as with the profile 'full'. Metadata fields have a fixed type (see `NUMERIC_METADATA`),
+e.g. a gain of 1 is written and returned as '1.0'. Uploads with upsert
+compare the metadata in fields and in the sidecar measurement in the same
+way, and rewrite all sidecar points of the uploaded range if any block
+changed.
+"""
+from dataclasses import dataclass
+
+import pandas as pd
+from pandas import DataFrame
+
+import dbc_influxdb.fluxql as fluxql
+from dbc_influxdb.common import tags, convert_ts_to_timezone
+from dbc_influxdb.lineprotocol import frame_to_lines
+
+SIDECAR_MEASUREMENT = 'dbc_metadata'
+RANGE_STOP = 'range_stop'  # Field of sidecar points, last timestamp of the range (UTC, seconds)
+DEFAULT_PROFILE = 'full'
+
+# Needed as tags to filter downloads and deletes
+REQUIRED_TAGS = ('varname', 'data_version')
+
+# Metadata fields written as floats, all other metadata fields are written as strings. A field
+# needs the same type in all points of a measurement, e.g. a gain of 1 (int) and 0.5 (float)
+# would be a field type conflict.
+NUMERIC_METADATA = ('gain', 'offset')
+
+
+@dataclass(frozen=True)
+class TagProfile:
+    """Which metadata are written as tags, as fields and to the sidecar measurement
+
+    Attributes:
+        name: name of the profile
+        fields: metadata written as fields on every point
+        sidecar: metadata written once per series and range to the sidecar measurement
+    """
+    name: str
+    fields: tuple = ()
+    sidecar: tuple = ()
+
+    def __post_init__(self):
+        object.__setattr__(self, 'fields', tuple(self.fields))
+        object.__setattr__(self, 'sidecar', tuple(self.sidecar))
+        moved = self.fields + self.sidecar
+        unknown = [m for m in moved if m not in tags]
+        if unknown:
+            raise ValueError(f"Tag profile '{self.name}': unknown metadata {unknown}, expected one of {tags}")
+        if len(set(moved)) != len(moved):
+            raise ValueError(f"Tag profile '{self.name}': metadata can be either field or sidecar, got {moved}")
+        required = [m for m in moved if m in REQUIRED_TAGS]
+        if required:
+            raise ValueError(f"Tag profile '{self.name}': {required} must be written as tags")
+
+    @property
+    def tags(self) -> list:
+        """Metadata written as tags"""
+        return [t for t in tags if t not in self.fields and t not in self.sidecar]
+
+
+PROFILES = {
+    'full': TagProfile(name='full'),
+    'compact': TagProfile(name='compact', sidecar=('raw_varname', 'raw_units', 'config_filetype', 'gain', 'offset')),
+}
+
+
+def resolve_profile(conf_db: dict = None, bucket: str = None, name: str or TagProfile = None) -> TagProfile:
+    """Tag profile *name*, or the profile of *bucket* in the database configuration
+
+    Args:
+        conf_db: database configuration with the optional sections 'tag_profiles'
+            (custom profiles) and 'bucket_tag_profiles' (profile name per bucket)
+        bucket: name of bucket, used if *name* is not given
+        name: name of a built-in or custom profile, or a TagProfile
+
+    Returns:
+        TagProfile, 'full' if no profile is configured
+    """
+    if isinstance(name, TagProfile):
+        return name
+    conf_db = conf_db if isinstance(conf_db, dict) else {}
+    if not name:
+        name = (conf_db.get('bucket_tag_profiles') or {}).get(bucket, DEFAULT_PROFILE)
+    custom = conf_db.get('tag_profiles') or {}
+    if name in custom:
+        return TagProfile(name=name, **custom[name])
+    if name in PROFILES:
+        return PROFILES[name]
+    raise ValueError(f"Unknown tag profile '{name}', available: {sorted(PROFILES) + sorted(custom)}")
+
+
+def _as_text(values: pd.Series) -> pd.Series:
+    """Values formatted as in the line protocol, missing values are kept"""
+    return values.map(lambda v: v if pd.isna(v) else str(v))
+
+
+def typed_metadata_fields(df: DataFrame, profile: TagProfile) -> DataFrame:
+    """Metadata fields of *profile* in *df* with a fixed type: float for `NUMERIC_METADATA`, else text"""
+    columns = [c for c in profile.fields if c in df.columns]
+    if not columns:
+        return df
+    return df.assign(**{c: df[c].astype('float64') if c in NUMERIC_METADATA else _as_text(df[c]).astype(object)
+                        for c in columns})
+
+
+def metadata_as_text(df: DataFrame, profile: TagProfile) -> DataFrame:
+    """Metadata of *profile* in *df* formatted as they are downloaded, see `reattach_metadata()`"""
+    df = typed_metadata_fields(df=df, profile=profile)
+    columns = [c for c in profile.fields + profile.sidecar if c in df.columns]
+    return df.assign(**{c: _as_text(df[c]).astype(object) for c in columns})
+
+
+def split_metadata(var_df: DataFrame, field: str, profile: TagProfile) -> tuple[DataFrame, DataFrame]:
+    """Split *var_df* into the points to write and the sidecar points
+
+    Args:
+        var_df: variable data and metadata with timezone-aware timestamp index
+        field: name of the data column
+        profile: tag profile
+
+    Returns:
+        points: *var_df* without the sidecar metadata; with metadata fields, records
+            without value are removed (otherwise points with only metadata are written)
+            and metadata fields have a fixed type, see `typed_metadata_fields()`
+        sidecar: one row per uninterrupted range of the same tags and sidecar metadata,
+            indexed by the first timestamp of the range, with the tags, the sidecar
+            metadata (as text) and the last timestamp of the range in column 'range_stop'
+    """
+    points = var_df.drop(columns=[c for c in profile.sidecar if c in var_df.columns])
+    if profile.fields:
+        points = typed_metadata_fields(df=points[points[field].notna()], profile=profile)
+
+    columns = [c for c in profile.sidecar if c in var_df.columns]
+    if not columns or var_df.empty:
+        return points, DataFrame()
+    keys = [c for c in profile.tags if c in var_df.columns] + columns
+    values = var_df[keys].apply(_as_text)
+    text = values.fillna('')
+    run = (text != text.shift()).any(axis=1).cumsum().to_numpy()
+    positions = pd.Series(range(len(var_df))).groupby(run)
+    sidecar = values.iloc[positions.first().to_numpy()].copy()
+    sidecar[RANGE_STOP] = [int(ts.timestamp()) for ts in var_df.index[positions.last().to_numpy()]]
+    return points, sidecar
+
+
+def sidecar_lines(sidecar: DataFrame, profile: TagProfile) -> list[str]:
+    """Line protocol of the sidecar points from `split_metadata()`"""
+    return frame_to_lines(df=sidecar, measurement=SIDECAR_MEASUREMENT, tag_columns=profile.tags, precision='s')
+
+
+def query_fields(fields: list, profile: TagProfile) -> list or None:
+    """Fields to download for the variables *fields*, including metadata fields"""
+    return fields + [f for f in profile.fields if f not in fields] if fields else fields
+
+
+def where_fields(query: fluxql.FluxQuery, fields: list, profile: TagProfile) -> fluxql.FluxQuery:
+    """Filter *query* on the variables *fields* (all if not given) and their metadata fields"""
+    query = query.where('_field', query_fields(fields=fields, profile=profile))
+    if profile.fields and fields:
+        # Metadata fields are shared by all variables of a measurement
+        query = query.where('varname', fields)
+    return query
+
+
+def sidecar_query(bucket: str, stop: str, varnames: list) -> str:
+    """Query for all sidecar points of *varnames* before *stop*
+
+    Ranges can start before the start of the download, the query therefore
+    starts at the earliest possible date.
+    """
+    return fluxql.FluxQuery(bucket=bucket, start='1970-01-01T00:00:00Z', stop=stop) \
+        .where('_measurement', [SIDECAR_MEASUREMENT]) \
+        .where('varname', varnames) \
+        .compile()
+
+
+def reattach_metadata(data_detailed: dict, sidecar_tables: list, profile: TagProfile,
+                      timezone_offset_to_utc_hours: int) -> dict:
+    """Add the metadata fields and sidecar metadata to downloaded variables
+
+    Metadata fields are formatted as text, as they would be as tags. Sidecar
+    metadata are assigned to the records of the same series (tags) within the
+    range of each sidecar point, ranges that start later win.
+
+    Args:
+        data_detailed: dict with variable names as keys and dataframes with
+            variable data and tags as values, see `dbc_influxdb.frames.assemble_download()`
+        sidecar_tables: results of `sidecar_query()`
+        profile: tag profile
+        timezone_offset_to_utc_hours: timezone of the index of *data_detailed*
+
+    Returns:
+        data_detailed with all metadata, columns are ordered as in the download
+        (metadata sorted by name, then the variable)
+    """
+    sidecar = [t for t in sidecar_tables if not t.empty]
+    sidecar = pd.concat(sidecar, ignore_index=True) if sidecar else DataFrame(columns=['varname'])
+
+    def local(ts: pd.Series) -> pd.Series:
+        return convert_ts_to_timezone(timezone_offset_to_utc_hours=timezone_offset_to_utc_hours,
+                                      timestamp_index=ts).dt.tz_localize(None)
+
+    if not sidecar.empty:
+        sidecar['start'] = local(pd.to_datetime(sidecar['_time'], utc=True))
+        sidecar['stop'] = local(pd.to_datetime(sidecar[RANGE_STOP].astype('int64'), unit='s', utc=True))
+        sidecar = sidecar.sort_values('start', kind='stable')
+
+    for key, df in data_detailed.items():
+        df = df.copy()
+        for col in profile.fields:
+            if col in df.columns:
+                df[col] = _as_text(df[col]).astype(object)
+        columns = [c for c in profile.sidecar if c in sidecar.columns]
+        for col in columns:
+            df[col] = pd.Series(None, index=df.index, dtype=object)
+        for _, point in sidecar[sidecar['varname'] == key].iterrows():
+            mask = (df.index >= point['start']) & (df.index <= point['stop'])
+            for tag in profile.tags:
+                if tag in df.columns and tag in point.index and pd.notna(point[tag]):
+                    mask &= (df[tag] == point[tag]).to_numpy()
+            df.loc[mask, columns] = [point[c] if pd.notna(point[c]) else None for c in columns]
+        data_detailed[key] = df[sorted(c for c in df.columns if c != key) + [key]]
+    return data_detailed
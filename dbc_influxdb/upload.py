@@ -0,0 +1,276 @@
+"""
+Helpers for uploading variables to the database
+
+Upsert: instead of deleting the whole time range of a variable and
+rewriting every point, the data that should be uploaded are compared
+to the data already stored in the database. Only time blocks that
+contain changed values or tags are written, and only tag series that
+are no longer present in the new data are deleted.
+
+Timestamps: before serialization, data are sorted by timestamp and rows
+with duplicate timestamps (e.g. from overlapping files) are removed or
+rejected, see `normalize_timestamps()`.
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from dbc_influxdb.common import tags
+from dbc_influxdb.deletion import DeletePredicate, predicate_string
+from dbc_influxdb.tagprofiles import SIDECAR_MEASUREMENT
+
+
+@dataclass
+class UploadReport:
+    """Summary of one variable upload"""
+    bucket: str
+    measurement: str
+    field: str
+    mode: str  # 'write', 'delete-then-write', 'upsert', 'manifest', 'spool' or 'checkpoint'
+    points_total: int = 0
+    points_written: int = 0
+    points_skipped: int = 0
+    blocks_written: list = field(default_factory=list)
+    blocks_skipped: int = 0
+    deleted_series: list = field(default_factory=list)  # Tag sets of deleted stale series
+    write_stats: object = None  # WriteStats if uploaded with adaptive batching
+    stats: object = None  # OperationStats with phase durations and counts
+    verify: object = None  # VerifyResult if uploaded with verify=True
+    duplicates: int = 0  # Rows with duplicate timestamps that were removed
+    unsorted: bool = False  # True if the timestamps were sorted before upload
+
+
+def detect_field(var_df: DataFrame) -> str:
+    """Check that data contain all tag columns and return the name of the field (variable name)"""
+    data_cols = var_df.columns.to_list()
+
+    # Check if data contain all tag columns
+    cols_not_in_data = [l for l in tags if l not in data_cols]
+    if len(cols_not_in_data) > 0:
+        raise Exception(f"Data do not contain required tag columns: {cols_not_in_data}")
+
+    # Detect field name (variable name)
+    # The field name is the name of the column that is not part of the tags
+    field = [l for l in data_cols if l not in tags]
+    if len(field) > 1:
+        raise Exception(f"Only one field (variable name) allowed, found {field}.")
+    return field[0]
+
+
+DUPLICATE_POLICIES = ('last', 'first', 'error')
+
+
+def normalize_timestamps(var_df: DataFrame, duplicates: str = 'last') -> tuple[DataFrame, int, bool]:
+    """Sort *var_df* by timestamp and handle rows with duplicate timestamps
+
+    The check is one vectorized pass over the timestamps, data that are
+    already sorted and unique (the usual case) are returned unchanged.
+    Sorted data are also written faster by the database.
+
+    Args:
+        var_df: data with timestamp index
+        duplicates: 'last' keeps the last row of each timestamp in the order of
+            *var_df* (e.g. from the newer of two overlapping files, as in downloads),
+            'first' keeps the first row, 'error' raises ValueError
+
+    Returns:
+        sorted *var_df* with unique timestamps, number of removed rows, and
+        True if *var_df* was not sorted
+    """
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown policy for duplicate timestamps '{duplicates}', "
+                         f"expected one of {DUPLICATE_POLICIES}")
+    times = pd.DatetimeIndex(var_df.index).asi8
+    steps = np.diff(times)
+    if (steps > 0).all():
+        return var_df, 0, False
+
+    unsorted = bool((steps < 0).any())
+    if unsorted:
+        order = np.argsort(times, kind='stable')  # Rows of the same timestamp stay in their order
+        times = times[order]
+        var_df = var_df.iloc[order]
+    same = times[1:] == times[:-1]
+    num_duplicates = int(same.sum())
+    if num_duplicates and duplicates == 'error':
+        examples = var_df.index[1:][same].unique()[:5].tolist()
+        raise ValueError(f"Data contain {num_duplicates} duplicate timestamps, e.g. {examples}")
+    if num_duplicates:
+        keep = np.ones(len(times), dtype=bool)
+        if duplicates == 'last':
+            keep[:-1][same] = False
+        else:
+            keep[1:][same] = False
+        var_df = var_df[keep]
+    return var_df, num_duplicates, unsorted
+
+
+@dataclass
+class UpsertPlan:
+    """Result of comparing new data to existing data in the database"""
+    write_df: DataFrame  # Rows of all changed blocks
+    changed_blocks: pd.DatetimeIndex  # Start of changed blocks that need to be written
+    replace_blocks: pd.DatetimeIndex  # Subset of changed blocks that have points missing in new data
+    stale_tagsets: list  # Tag sets in the database that do not exist in the new data
+    num_blocks: int
+
+
+def _tagset_hash(df: DataFrame, tag_columns: list) -> pd.Series:
+    """Hash the tag set of each row, tags are compared as strings (as stored in the database)"""
+    tagdf = df[tag_columns].astype(str)
+    return pd.util.hash_pandas_object(tagdf, index=False)
+
+
+def _metadata_hash(df: DataFrame, metadata_columns: list) -> pd.Series:
+    """Hash the metadata of each row that are not stored as tags, missing metadata are hashed as ''"""
+    if not len(metadata_columns):
+        return pd.Series(0, index=df.index, dtype='uint64')
+    metadf = df.reindex(columns=list(metadata_columns)).astype(object)
+    return _tagset_hash(metadf.where(metadf.notna(), ''), list(metadata_columns))
+
+
+def plan_upsert(new_df: DataFrame,
+                existing_df: DataFrame,
+                field: str,
+                tag_columns: list,
+                block: str = '1D',
+                metadata_columns: list = ()) -> UpsertPlan:
+    """Compare new data to existing data and find changed blocks and stale tag series
+
+    Both dataframes must have the same (timezone-naive) timestamp index and
+    contain the *field* column plus all *tag_columns*. The existing data can
+    contain more than one row per timestamp if the variable was stored with
+    different tag sets.
+
+    Args:
+        new_df: data that should be uploaded
+        existing_df: data found in the database for the same time range
+        field: name of the column with variable data
+        tag_columns: names of the columns that are stored as tags
+        block: time block size (pandas frequency string), blocks are the
+            unit in which data are (re-)written
+        metadata_columns: names of columns with metadata that are not stored
+            as tags (see `dbc_influxdb.tagprofiles`), compared as strings like
+            the value but not part of the tag set; missing metadata are equal
+            to missing metadata
+
+    Returns:
+        UpsertPlan
+    """
+    ts = 'TIMESTAMP_END'
+    new = pd.DataFrame({
+        ts: new_df.index,
+        '_taghash': _tagset_hash(new_df, tag_columns).values,
+        '_value': new_df[field].values,
+        '_metahash': _metadata_hash(new_df, metadata_columns).values,
+    })
+    new['_block'] = new[ts].dt.floor(block)
+    num_blocks = new['_block'].nunique()
+
+    if existing_df is None or existing_df.empty:
+        return UpsertPlan(write_df=new_df,
+                          changed_blocks=pd.DatetimeIndex(new['_block'].unique()),
+                          replace_blocks=pd.DatetimeIndex([]),
+                          stale_tagsets=[],
+                          num_blocks=num_blocks)
+
+    existing_taghash = _tagset_hash(existing_df, tag_columns)
+    existing = pd.DataFrame({
+        ts: existing_df.index,
+        '_taghash': existing_taghash.values,
+        '_value_db': existing_df[field].values,
+        '_metahash_db': _metadata_hash(existing_df, metadata_columns).values,
+    })
+    existing['_block'] = existing[ts].dt.floor(block)
+
+    # Missing values are not written, i.e. they are compared as rows that do not exist:
+    # a missing value without a point in the database is unchanged, a missing value
+    # with a point in the database is a point that has to be deleted (see below)
+    written = new[new['_value'].notna()]
+
+    # Rows of new data: unchanged if the same timestamp and tag set exists with the same value
+    merged = written.merge(existing[[ts, '_taghash', '_value_db', '_metahash_db']], on=[ts, '_taghash'],
+                           how='left', indicator=True)
+    found = (merged['_merge'] == 'both').values
+    same = ((merged['_value'] == merged['_value_db']) & (merged['_metahash'] == merged['_metahash_db'])).values
+    changed_rows = ~(found & same)
+    changed_blocks = set(merged.loc[changed_rows, '_block'].unique())
+
+    # Points in the database that belong to a current tag set but are missing in the new data
+    new_taghashes = set(written['_taghash'].unique())
+    current = existing['_taghash'].isin(new_taghashes)
+    matched = existing[[ts, '_taghash']].merge(written[[ts, '_taghash']], on=[ts, '_taghash'],
+                                               how='left', indicator=True)
+    missing = current.values & existing['_value_db'].notna().values & (matched['_merge'] == 'left_only').values
+    replace_blocks = set(existing.loc[missing, '_block'].unique())
+    changed_blocks = changed_blocks | replace_blocks
+
+    # Tag series in the database that do not exist in the new data
+    stale = existing_df.loc[~current.values, tag_columns].drop_duplicates()
+    stale_tagsets = [{k: v for k, v in row.items() if pd.notna(v)}
+                     for row in stale.astype(object).to_dict(orient='records')]
+
+    changed_blocks = pd.DatetimeIndex(sorted(changed_blocks))
+    write_df = new_df[new['_block'].isin(changed_blocks).values]
+    return UpsertPlan(write_df=write_df,
+                      changed_blocks=changed_blocks,
+                      replace_blocks=pd.DatetimeIndex(sorted(replace_blocks)),
+                      stale_tagsets=stale_tagsets,
+                      num_blocks=num_blocks)
+
+
+def upsert_delete_predicates(plan: UpsertPlan,
+                             measurement: str,
+                             field: str,
+                             data_version: str,
+                             start: str,
+                             stop: str,
+                             block: str,
+                             to_iso,
+                             sidecar: bool = False) -> list[DeletePredicate]:
+    """Delete requests needed before the changed blocks of *plan* are written
+
+    Args:
+        plan: result from `plan_upsert`
+        measurement: measurement of the variable
+        field: variable name
+        data_version: data version of the variable
+        start: start of the uploaded range in ISO 8601 format
+        stop: stop of the uploaded range in ISO 8601 format
+        block: time block size that was used for *plan*
+        to_iso: function that converts a timestamp string to ISO 8601
+            format in the timezone of the uploaded data
+        sidecar: if True, the variable has metadata in the sidecar measurement,
+            its sidecar points are deleted over the whole uploaded range if any
+            block changed (and are then rewritten for the whole range)
+
+    Returns:
+        list of planned delete requests
+    """
+    predicates = []
+
+    # Stale tag series are removed over the whole uploaded range
+    for tagset in plan.stale_tagsets:
+        conditions = dict(_measurement=measurement)
+        conditions.update(tagset)
+        conditions['varname'] = field
+        conditions['data_version'] = data_version
+        predicates.append(DeletePredicate(predicate=predicate_string(**conditions), start=start, stop=stop))
+
+    # Blocks with points that no longer exist in the new data are cleared before rewriting
+    for blockstart in plan.replace_blocks:
+        # Delete ranges include the stop date, data are stored with second precision
+        blockstop = blockstart + pd.tseries.frequencies.to_offset(block) - pd.Timedelta(seconds=1)
+        predicates.append(DeletePredicate(
+            predicate=predicate_string(_measurement=measurement, varname=field, data_version=data_version),
+            start=to_iso(str(blockstart)),
+            stop=to_iso(str(blockstop))))
+
+    # Sidecar ranges can span several blocks, they are replaced as a whole
+    if sidecar and len(plan.changed_blocks):
+        predicates.append(DeletePredicate(
+            predicate=predicate_string(_measurement=SIDECAR_MEASUREMENT, varname=field, data_version=data_version),
+            start=start, stop=stop))
+    return predicates
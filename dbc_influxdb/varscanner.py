@@ -1,9 +1,18 @@
 import warnings
 
 import pandas as pd
+from dbc_influxdb.batching import AdaptiveWriter, BatchingSettings
 from dbc_influxdb.common import tags
-from dbc_influxdb.db import get_client
+from dbc_influxdb.db import get_client, get_query_api
+from dbc_influxdb.lineprotocol import frame_to_lines
+from dbc_influxdb.manifest import UploadManifest
+from dbc_influxdb.spool import WriteSpool
+from dbc_influxdb.stats import OperationStats, emit
+from dbc_influxdb.tagprofiles import resolve_profile, sidecar_lines, split_metadata
+from dbc_influxdb.upload import normalize_timestamps
+from dbc_influxdb.verify import local_checksums, uploaded_range, verify_upload
 from influxdb_client import WriteOptions
+from influxdb_client.client.write_api import SYNCHRONOUS
 from pandas import DataFrame
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -24,7 +33,14 @@ class VarScanner:
             to_bucket: str,
             conf_db: dict,
             ingest: bool = True,
-            logger=None
+            logger=None,
+            manifest: UploadManifest = None,
+            spool: WriteSpool = None,
+            batching: BatchingSettings = None,
+            stats_sinks: list = None,
+            profile_memory: bool = False,
+            verify: bool = False,
+            duplicates: str = 'last'
     ):
         self.file_df = file_df
         self.data_vars = data_vars
@@ -37,38 +53,119 @@ class VarScanner:
         self.ingest = ingest  # If False, no upload to database, for testing purposes to run only VarScanner
         self.conf_db = conf_db
         self.log = logger if logger else None
+        self.manifest = manifest  # If given, blocks that were already uploaded with the same content are skipped
+        self._manifest_pending = []  # Manifest entries that are committed after successful upload
+        self.spool = spool  # If given, data are stored in the local spool instead of uploading to the database
+        self._write_errors = []
+        self.stats = OperationStats(operation='varscanner', labels=dict(bucket=to_bucket, filetype=config_filetype),
+                                    profile_memory=profile_memory)  # Memory per phase and variable
+        self.stats_sinks = stats_sinks if stats_sinks else []
+        self.verify = verify  # If True, checksums of uploaded variables are compared with the database after upload
+        self._verify_checksums = []
+        self._verify_ranges = []
+        self.verify_result = None  # VerifyResult, see `dbc_influxdb.verify`
+        self.duplicates = duplicates  # Rows with the same timestamp: keep 'last', 'first' or 'error'
+
+        # Adaptive write batching, from the database configuration if not given
+        if not batching and isinstance(conf_db, dict) and conf_db.get('batching'):
+            batching = BatchingSettings(**conf_db['batching'])
+        self.batching = batching
+
+        # Metadata written as tags, fields or to the sidecar measurement, from the
+        # filetype setting 'tag_profile' or the profile of the bucket
+        self.tag_profile = resolve_profile(conf_db=conf_db, bucket=to_bucket, name=filetypeconf.get('tag_profile'))
 
         self.varscanner_df = self._init_varscanner_df()
         self.vars_empty_not_uploaded = []
 
     def run(self):
+        if self.spool:
+            # Data are serialized to the local spool, no database connection needed
+            self._loopvars(write_api=None)
+            self._commit_manifest()
+            self._end_log()
+            return
+
         # Database clients
         client = get_client(conf_db=self.conf_db)
-
-        # write_api = get_write_api(client=client)
-
-        # The WriteApi in batching mode (default mode) is suppose to run as a singleton.
-        # To flush all your data you should wrap the execution using with
-        # client.write_api(...) as write_api: statement or call write_api.close()
-        # at the end of your script.
-        # https://influxdb-client.readthedocs.io/en/stable/usage.html#write
-        with client.write_api(write_options=WriteOptions(batch_size=5000,
-                                                         flush_interval=10_000,
-                                                         jitter_interval=2_000,
-                                                         retry_interval=5_000,
-                                                         max_retries=5,
-                                                         max_retry_delay=30_000,
-                                                         exponential_base=2)) as write_api:
-            # Loop through vars
-            self._loopvars(write_api=write_api)
+        try:
+            if self.batching:
+                # Adaptive batches, sent with synchronous writes
+                write_api = client.write_api(write_options=SYNCHRONOUS)
+                writer = AdaptiveWriter(write_api=write_api, settings=self.batching)
+                try:
+                    self._loopvars(write_api=writer)
+                finally:
+                    write_api.close()
+                self.stats.add(bytes=writer.stats.bytes, requests=writer.stats.requests,
+                               retries=writer.stats.retries)
+            else:
+                # write_api = get_write_api(client=client)
+
+                # The WriteApi in batching mode (default mode) is suppose to run as a singleton.
+                # To flush all your data you should wrap the execution using with
+                # client.write_api(...) as write_api: statement or call write_api.close()
+                # at the end of your script.
+                # https://influxdb-client.readthedocs.io/en/stable/usage.html#write
+                with client.write_api(write_options=WriteOptions(batch_size=5000,
+                                                                 flush_interval=10_000,
+                                                                 jitter_interval=2_000,
+                                                                 retry_interval=5_000,
+                                                                 max_retries=5,
+                                                                 max_retry_delay=30_000,
+                                                                 exponential_base=2),
+                                      error_callback=self._on_write_error) as write_api:
+                    # Loop through vars
+                    self._loopvars(write_api=write_api)
+
+            # All batches are flushed when the write API is closed
+            self._verify(client=client)
+        finally:
+            client.close()
+        self._commit_manifest()
 
         # self.varscanner_df.sort_values(by='raw_varname', axis=0, inplace=True)
         # self.varscanner_df.index = arange(1, len(self.varscanner_df) + 1)  # Reset index, starting at 1
         self._end_log()
 
+    def _on_write_error(self, conf, data, exception):
+        self._write_errors.append(exception)
+        self.stats.add(write_errors=1)
+        logtxt = f"{self.script_id} (!)UPLOAD ERROR: {exception}"
+        self.log.info(logtxt) if self.log else print(logtxt)
+
+    def _verify(self, client):
+        """Compare checksums of all uploaded variables with the database, see `dbc_influxdb.verify`"""
+        if not self.verify or not self._verify_ranges:
+            return
+        with self.stats.phase('verify'):
+            self.verify_result = verify_upload(query_api=get_query_api(client), bucket=self.to_bucket,
+                                               checksums=self._verify_checksums, ranges=self._verify_ranges)
+        result = self.verify_result
+        if result.ok:
+            logtxt = f"{self.script_id} Verified {result.points} points of {result.fields} variables " \
+                     f"in {result.windows} windows: OK"
+        else:
+            self.stats.add(verify_mismatches=len(result.mismatches))
+            logtxt = f"{self.script_id} (!)VERIFICATION FAILED for {result.mismatched_fields}, " \
+                     f"{len(result.mismatches)} windows differ:\n{result.mismatches.to_string()}"
+        self.log.info(logtxt) if self.log else print(logtxt)
+
+    def _commit_manifest(self):
+        """Remember uploaded blocks in manifest, only if all uploads were successful"""
+        if not self.manifest:
+            return
+        if self._write_errors:
+            logtxt = f"{self.script_id} (!)Manifest not updated because of {len(self._write_errors)} upload errors."
+            self.log.info(logtxt) if self.log else print(logtxt)
+            return
+        for pending in self._manifest_pending:
+            self.manifest.commit(**pending)
+        self._manifest_pending = []
+
     def _end_log(self):
         """Show some results in log file"""
-        pass
+        emit(stats=self.stats.finish(), sinks=self.stats_sinks)
         # print(f"{self.class_id} Found unique variables across all files:")
         # for ix, file in self.varscanner_df.iterrows():
         #     print(f"     Var #{ix}: {dict(file)}")
@@ -112,8 +209,9 @@ class VarScanner:
             # Ingest var into database
             elif is_greenlit:
                 newvar['greenlit'] = 'greenlit'  # Stored but not used as tag
-                self._ingest(df=self.file_df, newvar=newvar,
-                             counter=counter, numvars=numvars, write_api=write_api)
+                with self.stats.variable(newvar['field']):
+                    self._ingest(df=self.file_df, newvar=newvar,
+                                 counter=counter, numvars=numvars, write_api=write_api)
 
             # todo Add var to found vars in overview of found variables
             self.varscanner_df = pd.concat([self.varscanner_df, pd.DataFrame.from_dict([newvar])],
@@ -125,6 +223,11 @@ class VarScanner:
             self.log.info(f"{self.script_id} *** database bucket: {newvar['db_bucket']}.")
             self.log.info(f"{self.script_id} *** first date: {newvar['first_date']}")
             self.log.info(f"{self.script_id} *** last date: {newvar['last_date']}")
+            if self.manifest and 'points_written' in self.varscanner_df.columns:
+                self.log.info(f"{self.script_id} *** points written: "
+                              f"{int(self.varscanner_df['points_written'].sum())}, "
+                              f"skipped (already in database): "
+                              f"{int(self.varscanner_df['points_skipped'].sum())}")
             # self.logger.info(logtxt) if self.logger else print(logtxt)
 
     def _log_no_data(self, var):
@@ -133,11 +236,99 @@ class VarScanner:
 
     def _ingest(self, df: pd.DataFrame, newvar, counter: int, numvars: int,
                 write_api):
-        """Collect variable data and tags and upload to database
+        """Collect variable data and tags and upload to database"""
+
+        with self.stats.phase('prepare'):
+            var_df = self._var_df(df=df, newvar=newvar)
+
+        # Checksums of all data, including blocks that are skipped by the manifest
+        if self.verify and self.ingest and not self.spool:
+            self._verify_checksums.append(local_checksums(var_df=var_df, field=newvar['field']))
+            self._verify_ranges.append(uploaded_range(var_df=var_df, field=newvar['field'],
+                                                      measurement=newvar['measurement']))
+
+        # Skip blocks that were already uploaded with the same content
+        newvar['points_skipped'] = 0
+        newvar['points_written'] = len(var_df)
+        if self.manifest:
+            with self.stats.phase('manifest'):
+                result = self.manifest.filter_unchanged(df=var_df, bucket=newvar['db_bucket'],
+                                                        measurement=newvar['measurement'],
+                                                        field=newvar['field'], tag_columns=tags)
+            var_df = result.write_df
+            newvar['points_skipped'] = result.points_skipped
+            newvar['points_written'] = result.points_written
+            if self.ingest:
+                self._manifest_pending.append(dict(bucket=newvar['db_bucket'], measurement=newvar['measurement'],
+                                                   field=newvar['field'], entries=result.entries))
+            if var_df.empty:
+                logtxt = f"{self.script_id} " \
+                         f"--> ALREADY IN DATABASE BUCKET {newvar['db_bucket']}, SKIPPED:  " \
+                         f"{newvar['raw_varname']} as {newvar['field']}  " \
+                         f"Var #{counter} of {numvars}"
+                self.log.info(logtxt) if self.log else print(logtxt)
+                self.stats.add(variables=1, points_skipped=newvar['points_skipped'])
+                return
+
+        self.stats.add(variables=1, points=newvar['points_written'], points_skipped=newvar['points_skipped'])
+
+        # Metadata that are not written as tags, see `dbc_influxdb.tagprofiles`
+        profile = self.tag_profile
+        var_df, sidecar = split_metadata(var_df=var_df, field=newvar['field'], profile=profile)
+        metadata_lines = sidecar_lines(sidecar=sidecar, profile=profile)
+
+        if self.ingest and self.spool:
+            # Write to local spool, uploaded later with dbcInflux.replay_spool()
+            with self.stats.phase('serialize'):
+                lines = frame_to_lines(df=var_df, measurement=newvar['measurement'], tag_columns=profile.tags,
+                                       precision='s') + metadata_lines
+            with self.stats.phase('write'):
+                self.spool.append(bucket=newvar['db_bucket'], lines=lines, precision='s')
+            logtxt = f"{self.script_id} " \
+                     f"--> SPOOLED FOR DATABASE BUCKET {newvar['db_bucket']}:  " \
+                     f"{newvar['raw_varname']} as {newvar['field']}  " \
+                     f"Var #{counter} of {numvars}  " \
+                     f"({len(lines)} points)"
+            self.log.info(logtxt) if self.log else print(logtxt)
 
-        New df that contains the variable (field) and tags (all other columns)
+        elif self.ingest:
+            # Write to db
+            # Output also the source file to log
+            logtxt = f"{self.script_id} " \
+                     f"--> UPLOAD TO DATABASE BUCKET {newvar['db_bucket']}:  " \
+                     f"{newvar['raw_varname']} as {newvar['field']}  " \
+                     f"Var #{counter} of {numvars}  " \
+                     f"({newvar['points_written']} points written, {newvar['points_skipped']} skipped)"
+            self.log.info(logtxt) if self.log else print(logtxt)
 
-        """
+            if isinstance(write_api, AdaptiveWriter):
+                with self.stats.phase('serialize'):
+                    lines = frame_to_lines(df=var_df, measurement=newvar['measurement'],
+                                           tag_columns=profile.tags, precision='s') + metadata_lines
+                try:
+                    with self.stats.phase('write'):
+                        write_api.write(newvar['db_bucket'], record=lines, write_precision='s')
+                except Exception as e:
+                    self._on_write_error(conf=None, data=None, exception=e)
+            else:
+                # Batching write API: serialization is included in phase 'write'
+                with self.stats.phase('write'):
+                    write_api.write(newvar['db_bucket'],
+                                    record=var_df,
+                                    data_frame_measurement_name=newvar['measurement'],
+                                    data_frame_tag_columns=profile.tags,
+                                    write_precision='s')
+                    if metadata_lines:
+                        write_api.write(newvar['db_bucket'], record=metadata_lines, write_precision='s')
+        else:
+            logtxt = f"{self.script_id} " \
+                     f"XXX ingest={self.ingest} SELECTED XXX NO UPLOAD XXX TO DATABASE BUCKET {newvar['db_bucket']}:  " \
+                     f"{newvar['raw_varname']} as {newvar['field']}  " \
+                     f"Var #{counter} of {numvars}"
+            self.log.info(logtxt) if self.log else print(logtxt)
+
+    def _var_df(self, df: pd.DataFrame, newvar) -> pd.DataFrame:
+        """New df that contains the variable (field) and tags (all other columns)"""
 
         # Initiate dataframe that will collect data and tags for current var
 
@@ -152,6 +343,15 @@ class VarScanner:
         varcol = (newvar[varcol], newvar['raw_units'])  # Column name to access var in df
         var_df = pd.DataFrame(index=df.index, data=df[varcol])
 
+        # Sorted, unique timestamps, e.g. files that were merged from overlapping files
+        var_df, newvar['duplicates'], unsorted = normalize_timestamps(var_df=var_df, duplicates=self.duplicates)
+        if newvar['duplicates'] or unsorted:
+            self.stats.add(duplicates=newvar['duplicates'])
+            logtxt = f"{self.script_id} {newvar['field']}: {newvar['duplicates']} rows with duplicate " \
+                     f"timestamps removed (kept {self.duplicates})" \
+                     f"{', timestamps sorted' if unsorted else ''}"
+            self.log.info(logtxt) if self.log else print(logtxt)
+
         # Apply gain (gain = 1 if no gain is specified in filetype settings)
         # if newvar['gain'] != 1:
         #     print(newvar['gain'])
@@ -190,27 +390,7 @@ class VarScanner:
         var_df['config_filetype'] = newvar['config_filetype']
         var_df['data_version'] = newvar['data_version']
         var_df['gain'] = newvar['gain']
-
-        if self.ingest:
-            # Write to db
-            # Output also the source file to log
-            logtxt = f"{self.script_id} " \
-                     f"--> UPLOAD TO DATABASE BUCKET {newvar['db_bucket']}:  " \
-                     f"{newvar['raw_varname']} as {newvar['field']}  " \
-                     f"Var #{counter} of {numvars}"
-            self.log.info(logtxt) if self.log else print(logtxt)
-
-            write_api.write(newvar['db_bucket'],
-                            record=var_df,
-                            data_frame_measurement_name=newvar['measurement'],
-                            data_frame_tag_columns=tags,
-                            write_precision='s')
-        else:
-            logtxt = f"{self.script_id} " \
-                     f"XXX ingest={self.ingest} SELECTED XXX NO UPLOAD XXX TO DATABASE BUCKET {newvar['db_bucket']}:  " \
-                     f"{newvar['raw_varname']} as {newvar['field']}  " \
-                     f"Var #{counter} of {numvars}"
-            self.log.info(logtxt) if self.log else print(logtxt)
+        return var_df
 
     def _init_varentry(self, rawvar) -> dict:
         """Collect variable info"""
@@ -0,0 +1,191 @@
+"""
+Verification of uploads with server-side checksums
+
+After an upload, the number, sum, minimum and maximum of the values of each
+field are computed per time window (UTC, default one day), locally from the
+uploaded dataframes and on the server with one single query. The query
+only returns one row per series and window (`window()` and `reduce()`), no
+data are downloaded again.
+
+Windows whose checksums differ, e.g. because points were lost by the
+batching write API or another upload changed the data in the meantime, are
+reported as mismatches. Only the uploaded time range of each field and data
+version is compared, timestamps are compared with the precision of the
+upload (seconds).
+"""
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+import dbc_influxdb.fluxql as fluxql
+from dbc_influxdb.aggregates import flux_duration
+
+VERIFY_WINDOW = '1D'
+CHECKSUMS = ('count', 'sum', 'min', 'max')
+
+# Checksums of one window, float() also accepts fields that were written as integers
+CHECKSUM_REDUCE = ('|> reduce(identity: {count: 0, sum: 0.0, min: math.maxfloat, max: -math.maxfloat}, '
+                   'fn: (r, accumulator) => ({count: accumulator.count + 1, '
+                   'sum: accumulator.sum + float(v: r._value), '
+                   'min: if float(v: r._value) < accumulator.min then float(v: r._value) else accumulator.min, '
+                   'max: if float(v: r._value) > accumulator.max then float(v: r._value) else accumulator.max}))')
+
+
+@dataclass(frozen=True)
+class UploadedRange:
+    """Time range (UTC) of one uploaded field and data version"""
+    measurement: str
+    field: str
+    start: pd.Timestamp
+    stop: pd.Timestamp  # Last uploaded timestamp, included
+    data_version: str = None  # None for all data versions
+
+    def condition(self) -> str:
+        version = '' if self.data_version is None \
+            else f'and r["data_version"] == "{fluxql.escape_string(self.data_version)}" '
+        return (f'(r["_field"] == "{fluxql.escape_string(self.field)}" {version}'
+                f'and r["_time"] >= {_rfc3339(self.start)} and r["_time"] <= {_rfc3339(self.stop)})')
+
+
+@dataclass
+class VerifyResult:
+    """Comparison of local and server-side checksums"""
+    bucket: str
+    fields: int = 0
+    windows: int = 0
+    points: int = 0  # Points expected in the database
+    mismatches: DataFrame = field(default_factory=DataFrame)  # One row per field and window that differ
+    duration: float = 0.0  # Seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.mismatches.empty
+
+    @property
+    def mismatched_fields(self) -> list:
+        return sorted(self.mismatches['field'].unique()) if not self.ok else []
+
+
+def _rfc3339(ts: pd.Timestamp) -> str:
+    return pd.Timestamp(ts).tz_convert('UTC').strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _floor_seconds(index: pd.DatetimeIndex) -> np.ndarray:
+    """Timestamps in nanoseconds since the epoch (UTC), truncated to seconds as written to the database"""
+    ns = pd.DatetimeIndex(index).as_unit('ns').asi8
+    return ns - ns % 1_000_000_000
+
+
+def local_checksums(var_df: DataFrame, field: str, window: str = VERIFY_WINDOW) -> DataFrame:
+    """Count, sum, minimum and maximum of *field* per time window
+
+    Args:
+        var_df: data with timezone-aware timestamp index and the column *field*,
+            missing values are not written and not counted
+        field: name of the column with variable data
+        window: size of the windows, pandas frequency string, aligned to UTC
+
+    Returns:
+        dataframe with one row per window and the columns 'field', 'window'
+        (start of the window, UTC) and the checksums
+    """
+    values = pd.to_numeric(var_df[field], errors='coerce').to_numpy(dtype='float64')
+    times = _floor_seconds(var_df.index)
+    valid = ~np.isnan(values)
+    values, times = values[valid], times[valid]
+    every = pd.Timedelta(window).value
+    windows, inverse = np.unique(times - times % every, return_inverse=True)
+    minimum = np.full(len(windows), np.inf)
+    maximum = np.full(len(windows), -np.inf)
+    np.minimum.at(minimum, inverse, values)
+    np.maximum.at(maximum, inverse, values)
+    return DataFrame({'field': field,
+                      'window': pd.to_datetime(windows, utc=True),
+                      'count': np.bincount(inverse, minlength=len(windows)),
+                      'sum': np.bincount(inverse, weights=values, minlength=len(windows)),
+                      'min': minimum,
+                      'max': maximum})
+
+
+def uploaded_range(var_df: DataFrame, field: str, measurement: str) -> UploadedRange or None:
+    """Uploaded time range of *field*, None if *var_df* has no values"""
+    valid = var_df[var_df[field].notna()]
+    if valid.empty:
+        return None
+    data_version = str(valid['data_version'].iloc[0]) if 'data_version' in valid.columns else None
+    return UploadedRange(measurement=measurement, field=field, start=valid.index.min(), stop=valid.index.max(),
+                         data_version=data_version)
+
+
+def checksum_query(bucket: str, ranges: list[UploadedRange], window: str = VERIFY_WINDOW) -> str:
+    """One query for the checksums of all *ranges*, per series and window"""
+    start = min(r.start for r in ranges)
+    stop = max(r.stop for r in ranges) + pd.Timedelta(seconds=1)
+    conditions = ' or '.join(r.condition() for r in ranges)
+    query = fluxql.FluxQuery(bucket=bucket, start=_rfc3339(start), stop=_rfc3339(stop), pivot=False) \
+        .where('_measurement', sorted({r.measurement for r in ranges})) \
+        .where('_field', [r.field for r in ranges]) \
+        .pipe(f'|> filter(fn: (r) => {conditions})',
+              f'|> window(every: {flux_duration(pd.Timedelta(window))})',
+              CHECKSUM_REDUCE)
+    return 'import "math"\n\n' + query.compile()
+
+
+def server_checksums(flux_tables: list, window: str = VERIFY_WINDOW) -> DataFrame:
+    """Checksums per field and window from the result of `checksum_query()` (`QueryApi.query()`)
+
+    Series of the same field (e.g. with different tags) are combined.
+    """
+    records = [record.values for table in flux_tables for record in table.records]
+    if not records:
+        return DataFrame(columns=['field', 'window', *CHECKSUMS])
+    df = DataFrame.from_records(records)
+    df['window'] = pd.to_datetime(df['_start'], utc=True).dt.floor(window)
+    df = df.rename(columns={'_field': 'field'})
+    return df.groupby(['field', 'window'], as_index=False).agg(
+        count=('count', 'sum'), sum=('sum', 'sum'), min=('min', 'min'), max=('max', 'max'))
+
+
+def verify_upload(query_api, bucket: str, checksums: list[DataFrame], ranges: list[UploadedRange],
+                  window: str = VERIFY_WINDOW) -> VerifyResult:
+    """Compare the checksums of uploaded data with the checksums on the server
+
+    Args:
+        query_api: QueryApi of the database client
+        bucket: name of bucket the data were uploaded to
+        checksums: results of `local_checksums()`, one per uploaded field
+        ranges: results of `uploaded_range()`, one per uploaded field
+        window: size of the compared windows, pandas frequency string
+
+    Returns:
+        VerifyResult with the windows whose checksums differ
+    """
+    tic = time.perf_counter()
+    ranges = [r for r in ranges if r is not None]
+    if not ranges:
+        return VerifyResult(bucket=bucket)
+    local = pd.concat(checksums, ignore_index=True)
+    server = server_checksums(query_api.query(checksum_query(bucket=bucket, ranges=ranges, window=window)),
+                              window=window)
+    result = compare(local=local, server=server, bucket=bucket)
+    result.duration = time.perf_counter() - tic
+    return result
+
+
+def compare(local: DataFrame, server: DataFrame, bucket: str, rtol: float = 1e-9) -> VerifyResult:
+    """Compare local and server checksums, windows that are missing on one side are mismatches"""
+    tic = time.perf_counter()
+    merged = local.merge(server, on=['field', 'window'], how='outer', suffixes=('_local', '_server'))
+    for side in ('_local', '_server'):
+        merged[f'count{side}'] = merged[f'count{side}'].fillna(0).astype('int64')
+    differs = merged['count_local'] != merged['count_server']
+    for name in ('sum', 'min', 'max'):
+        a, b = merged[f'{name}_local'].to_numpy(dtype=float), merged[f'{name}_server'].to_numpy(dtype=float)
+        differs |= ~np.isclose(a, b, rtol=rtol, atol=0, equal_nan=True)
+    mismatches = merged[differs].sort_values(['field', 'window']).reset_index(drop=True)
+    return VerifyResult(bucket=bucket, fields=local['field'].nunique(), windows=len(local),
+                        points=int(local['count'].sum()), mismatches=mismatches,
+                        duration=time.perf_counter() - tic)
@@ -0,0 +1,107 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.standin import InfluxStandIn
+from benchmarks.synthetic import file_frame, var_frames, write_dirconf
+from dbc_influxdb.aggregates import AggregateSpec, aggregate_functions, flux_duration, route, specs_from_conf
+from dbc_influxdb.main import dbcInflux
+
+
+class TestAggregateSpec(unittest.TestCase):
+    def test_flux_duration(self):
+        self.assertEqual(flux_duration(pd.Timedelta('30min')), '30m')
+        self.assertEqual(flux_duration(pd.Timedelta('1D')), '1d')
+        self.assertEqual(flux_duration(pd.Timedelta('-59min59s')), '-59m59s')
+
+    def test_functions(self):
+        functions = aggregate_functions(every='1D', timezone_offset_to_utc_hours=1)
+        self.assertIn('|> aggregateWindow(every: 1d, fn: mean, offset: 23h, createEmpty: false)', functions)
+        self.assertEqual(functions[-1], '|> set(key: "freq", value: "1D")')
+        self.assertNotIn('offset', aggregate_functions(every='30min', timezone_offset_to_utc_hours=1)[2])
+
+    def test_task_flux(self):
+        spec = AggregateSpec(bucket='test', every='30min', measurements=('TA',))
+        flux = spec.task_flux(org='org')
+        self.assertTrue(flux.startswith('import "date"\n\noption task = {name: "dbc-agg test 30min", every: 30m'))
+        self.assertIn('|> to(bucket: "test_agg30min", org: "org")', flux)
+        self.assertEqual(spec.backfill_start(pd.Timestamp('2024-01-01 10:10:00+01:00')), '2024-01-01T09:00:01Z')
+
+    def test_route(self):
+        specs = specs_from_conf(dict(aggregates=dict(test=dict(every=['1D', '30min'], measurements=['TA'], fn='max',
+                                                               timezone_offset_to_utc_hours=1))))
+        self.assertEqual([s.every for s in specs], ['30min', '1D'])
+        self.assertEqual(route(specs, bucket='test', every='2D', measurements=['TA'],
+                               timezone_offset_to_utc_hours=1).every, '1D')
+        self.assertEqual(route(specs, bucket='test', every='2D', measurements=['TA']).every, '30min')
+        self.assertEqual(route(specs, bucket='test', every='1h', measurements=['TA']).every, '30min')
+        self.assertIsNone(route(specs, bucket='test', every='1h', measurements=['TA', 'SW']))
+        self.assertIsNone(route(specs, bucket='test', every='45min', measurements=['TA']))
+        self.assertIsNone(route(specs, bucket='test', every='10min', measurements=['TA']))
+
+    def test_route_combinable_functions(self):
+        for fn, expected in (('mean', None), ('median', None), ('max', '30min'), ('count', '30min')):
+            specs = specs_from_conf(dict(aggregates=dict(test=dict(every=['1D', '30min'], fn=fn))))
+            self.assertEqual(route(specs, bucket='test', every='1D').every, '1D')
+            routed = route(specs, bucket='test', every='2h')
+            self.assertEqual(routed.every if routed else None, expected)
+
+
+class TestContinuousAggregates(unittest.TestCase):
+    def test_backfill_and_routing(self):
+        var_df, measurement = var_frames(file_df=file_frame(n_vars=1, periods=96))[0]
+        field = var_df.columns[0]
+        conf = dict(aggregates=dict(test=dict(every=['2h', '1D'], timezone_offset_to_utc_hours=1)))
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db={**server.conf_db(), **conf})
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='test', to_measurement=measurement,
+                                 timezone_offset_to_utc_hours=1)
+            dbc.create_aggregates(bucket='test', backfill_start='2024-01-01 00:00:00', timezone_offset_to_utc_hours=1)
+            self.assertEqual(sorted(t.name for t in dbc.aggregate_tasks(bucket='test')),
+                             ['dbc-agg test 1D', 'dbc-agg test 2h'])
+            self.assertIn('test_agg2h', server.store.buckets)
+
+            # Values are labelled with the end of their window
+            expected = var_df[field].resample('4h', closed='right', label='right').mean()
+            expected = expected[expected.index < '2024-01-03 00:00:00']
+            _, data_detailed, _ = dbc.download(bucket='test', start='2024-01-01 00:00:00', stop='2024-01-03 00:00:00',
+                                               timezone_offset_to_utc_hours=1, aggregate_every='4h')
+            downloaded = data_detailed[field]
+            self.assertEqual(downloaded[field].round(6).tolist(), expected.round(6).tolist())
+            self.assertEqual(downloaded.index.tolist(), expected.index.tolist())
+            self.assertEqual(set(downloaded['freq']), {'4h'})
+
+            # Existing tasks are updated, not duplicated
+            dbc.create_aggregates(bucket='test')
+            self.assertEqual(len(server.tasks), 2)
+            self.assertEqual(dbc.delete_aggregates(bucket='test'), 2)
+            self.assertEqual(server.tasks, {})
+
+    def test_routing_with_gaps(self):
+        var_df, measurement = var_frames(file_df=file_frame(n_vars=1, periods=96))[0]
+        field = var_df.columns[0]
+        # Windows with missing values, e.g. the mean of two 2h means is not the 4h mean
+        var_df = var_df.drop(var_df.index[[1, 2, 3, 50]])
+        for fn in ('mean', 'count', 'max'):
+            conf = dict(aggregates=dict(test=dict(every=['2h'], fn=fn, timezone_offset_to_utc_hours=1)))
+            with self.subTest(fn=fn), InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+                dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db={**server.conf_db(), **conf})
+                dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+                dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='test', to_measurement=measurement,
+                                     timezone_offset_to_utc_hours=1)
+                dbc.create_aggregates(bucket='test', backfill_start='2024-01-01 00:00:00',
+                                      timezone_offset_to_utc_hours=1)
+                expected = getattr(var_df[field].resample('4h', closed='right', label='right'), fn)()
+                expected = expected[expected.index < '2024-01-03 00:00:00']
+                _, data_detailed, _ = dbc.download(bucket='test', start='2024-01-01 00:00:00',
+                                                   stop='2024-01-03 00:00:00', timezone_offset_to_utc_hours=1,
+                                                   aggregate_every='4h')
+                downloaded = data_detailed[field][field].astype(float)
+                self.assertEqual(downloaded.round(6).tolist(), expected.astype(float).round(6).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import asyncio
+import unittest
+
+import pandas as pd
+
+from dbc_influxdb.aio import AsyncDbcInflux
+from dbc_influxdb.common import tags
+from dbc_influxdb.tagprofiles import PROFILES, RANGE_STOP, SIDECAR_MEASUREMENT
+
+
+class FakeQueryApi:
+    def __init__(self, tables, sidecar_tables=()):
+        self.tables = tables
+        self.sidecar_tables = sidecar_tables
+        self.queries = []
+
+    async def query_data_frame(self, query):
+        self.queries.append(query)
+        await asyncio.sleep(0)
+        tables = self.sidecar_tables if f'"{SIDECAR_MEASUREMENT}"' in query else self.tables
+        return [t.copy() for t in tables]
+
+
+class FakeWriteApi:
+    def __init__(self):
+        self.batches = []
+
+    async def write(self, bucket, record, write_precision):
+        await asyncio.sleep(0)
+        self.batches.append(record)
+
+
+class FakeDeleteApi:
+    def __init__(self):
+        self.requests = []
+
+    async def delete(self, start, stop, predicate, bucket):
+        await asyncio.sleep(0)
+        self.requests.append((start, stop, predicate))
+
+
+class FakeClient:
+    def __init__(self, tables=(), sidecar_tables=()):
+        self.query = FakeQueryApi(list(tables), list(sidecar_tables))
+        self.write = FakeWriteApi()
+        self.delete = FakeDeleteApi()
+
+    def query_api(self):
+        return self.query
+
+    def write_api(self):
+        return self.write
+
+    def delete_api(self):
+        return self.delete
+
+
+def make_dbc(client: FakeClient) -> AsyncDbcInflux:
+    dbc = AsyncDbcInflux.__new__(AsyncDbcInflux)
+    dbc.max_concurrency = 4
+    dbc.quiet = True
+    dbc.conf_db = {}
+    dbc._client = client
+    dbc._semaphore = asyncio.Semaphore(4)
+    return dbc
+
+
+def make_table(field: str, measurement: str) -> pd.DataFrame:
+    table = pd.DataFrame({'_time': pd.date_range('2024-01-01', periods=4, freq='30min', tz='UTC'),
+                          field: [1.0, 2.0, 3.0, 4.0], '_measurement': measurement})
+    for tag in tags:
+        table[tag] = f'-{tag}-'
+    table['varname'] = field
+    return table
+
+
+class TestAsyncDbcInflux(unittest.TestCase):
+    def test_concurrent_downloads_share_client(self):
+        client = FakeClient(tables=[make_table('TA_T1_2_1', 'TA'), make_table('SW_IN_T1_2_1', 'SW')])
+        dbc = make_dbc(client)
+
+        async def run():
+            return await asyncio.gather(*[dbc.download(bucket=b, start='2024-01-01 00:00:00',
+                                                       stop='2024-01-02 00:00:00', timezone_offset_to_utc_hours=1,
+                                                       fields=['TA_T1_2_1', 'SW_IN_T1_2_1'])
+                                          for b in ['ch-dav_raw', 'ch-cha_raw']])
+
+        results = asyncio.run(run())
+        self.assertEqual(len(client.query.queries), 2)
+        self.assertIn('from(bucket: "ch-cha_raw")', client.query.queries[1])
+        data_simple, data_detailed, assigned_measurements = results[0]
+        self.assertEqual(sorted(data_simple.columns), ['SW_IN_T1_2_1', 'TA_T1_2_1'])
+        self.assertEqual(assigned_measurements, {'TA_T1_2_1': 'TA', 'SW_IN_T1_2_1': 'SW'})
+
+    def test_upload_in_batches(self):
+        client = FakeClient()
+        dbc = make_dbc(client)
+        var_df = make_table('TA_T1_2_1', 'TA').set_index('_time').drop(columns='_measurement')
+        var_df.index = var_df.index.tz_localize(None)
+        report = asyncio.run(dbc.upload_singlevar(var_df=var_df, to_bucket='test', to_measurement='TA',
+                                                  timezone_offset_to_utc_hours=1,
+                                                  delete_from_db_before_upload=False, batch_size=3))
+        self.assertEqual(report.points_written, 4)
+        self.assertEqual(sorted(len(b.split('\n')) for b in client.write.batches), [1, 3])
+        self.assertTrue(client.write.batches[0].startswith('TA,'))
+
+    def test_delete_before_upload_in_timezone_of_data(self):
+        client = FakeClient()
+        dbc = make_dbc(client)
+        var_df = make_table('TA_T1_2_1', 'TA').set_index('_time').drop(columns='_measurement')
+        var_df.index = var_df.index.tz_localize(None)
+        asyncio.run(dbc.upload_singlevar(var_df=var_df, to_bucket='test', to_measurement='TA',
+                                         timezone_offset_to_utc_hours=8))
+        start, stop, _ = client.delete.requests[0]
+        self.assertEqual((start, stop), ('2024-01-01T00:00:00+08:00', '2024-01-01T01:30:00+08:00'))
+
+    def test_upload_sorted_without_duplicates(self):
+        client = FakeClient()
+        dbc = make_dbc(client)
+        var_df = make_table('TA_T1_2_1', 'TA').set_index('_time').drop(columns='_measurement')
+        var_df.index = var_df.index.tz_localize(None)
+        overlapping = pd.concat([var_df, var_df.iloc[:2].assign(TA_T1_2_1=[10.0, 20.0])]).iloc[::-1]
+        report = asyncio.run(dbc.upload_singlevar(var_df=overlapping, to_bucket='test', to_measurement='TA',
+                                                  timezone_offset_to_utc_hours=1, duplicates='first'))
+        self.assertEqual((report.duplicates, report.unsorted, report.points_written), (2, True, 4))
+        lines = client.write.batches[0].split('\n')
+        self.assertEqual([line.split()[1] for line in lines],
+                         ['TA_T1_2_1=10.0', 'TA_T1_2_1=20.0', 'TA_T1_2_1=3.0', 'TA_T1_2_1=4.0'])
+        start, stop, _ = client.delete.requests[0]
+        self.assertEqual((start, stop), ('2024-01-01T00:00:00+01:00', '2024-01-01T01:30:00+01:00'))
+        with self.assertRaises(ValueError):
+            asyncio.run(dbc.upload_singlevar(var_df=overlapping, to_bucket='test', to_measurement='TA',
+                                             timezone_offset_to_utc_hours=1, duplicates='error'))
+
+    def test_upload_with_tag_profile(self):
+        client = FakeClient()
+        dbc = make_dbc(client)
+        dbc.conf_db = dict(bucket_tag_profiles=dict(test='compact'))
+        var_df = make_table('TA_T1_2_1', 'TA').set_index('_time').drop(columns='_measurement')
+        var_df.index = var_df.index.tz_localize(None)
+        report = asyncio.run(dbc.upload_singlevar(var_df=var_df, to_bucket='test', to_measurement='TA',
+                                                  timezone_offset_to_utc_hours=1))
+        self.assertEqual(report.points_written, 4)
+        lines = '\n'.join(client.write.batches).split('\n')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(sum(line.startswith(f'{SIDECAR_MEASUREMENT},') for line in lines), 1)
+        self.assertTrue(all('raw_units' not in line for line in lines if line.startswith('TA,')))
+        self.assertTrue(any(f'"{SIDECAR_MEASUREMENT}"' in predicate for _, _, predicate in client.delete.requests))
+
+    def test_download_with_tag_profile(self):
+        profile = PROFILES['compact']
+        table = make_table('TA_T1_2_1', 'TA').drop(columns=list(profile.sidecar))
+        sidecar = make_table('TA_T1_2_1', SIDECAR_MEASUREMENT).iloc[[0]].drop(columns='TA_T1_2_1')
+        sidecar['raw_units'] = 'K'
+        sidecar[RANGE_STOP] = int(pd.Timestamp('2024-01-01 01:30Z').timestamp())
+        client = FakeClient(tables=[table], sidecar_tables=[sidecar])
+        dbc = make_dbc(client)
+        dbc.conf_db = dict(bucket_tag_profiles=dict(test='compact'))
+        _, data_detailed, _ = asyncio.run(dbc.download(bucket='test', start='2024-01-01 00:00:00',
+                                                       stop='2024-01-02 00:00:00', timezone_offset_to_utc_hours=1,
+                                                       fields=['TA_T1_2_1']))
+        self.assertEqual(len(client.query.queries), 2)
+        df = data_detailed['TA_T1_2_1']
+        self.assertEqual(df['raw_units'].tolist(), ['K'] * 4)
+        self.assertEqual(df['gain'].tolist(), ['-gain-'] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import threading
+import unittest
+from unittest import mock
+
+from dbc_influxdb.batching import AdaptiveBatchController, AdaptiveWriter, BatchingSettings
+
+
+class ThrottledError(Exception):
+    status = 429
+    retry_after = '0'
+
+
+class FakeWriteApi:
+    def __init__(self, throttle_first: int = 0):
+        self.throttle_first = throttle_first
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def write(self, bucket, record, write_precision):
+        with self.lock:
+            if self.throttle_first > 0:
+                self.throttle_first -= 1
+                raise ThrottledError()
+            self.batches.append(record.split('\n'))
+
+
+class TestAdaptiveBatchController(unittest.TestCase):
+    def test_fast_requests_increase_batch_size(self):
+        controller = AdaptiveBatchController(BatchingSettings(initial_batch_size=1000, max_in_flight=3))
+        for _ in range(5):
+            controller.record_success(latency=0.01)
+        self.assertGreater(controller.batch_size, 1000)
+        self.assertEqual(controller.in_flight_limit, 3)
+
+    def test_throttle_halves_batch_size(self):
+        controller = AdaptiveBatchController(BatchingSettings(initial_batch_size=1000, min_batch_size=100))
+        controller.record_throttle()
+        self.assertEqual(controller.batch_size, 500)
+        self.assertEqual(controller.in_flight_limit, 1)
+
+    def test_idle_time_allows_only_bounded_burst(self):
+        controller = AdaptiveBatchController(BatchingSettings(max_points_per_second=1000, burst_seconds=2.0))
+        clock = [0.0]
+        with mock.patch('dbc_influxdb.batching.time.monotonic', side_effect=lambda: clock[0]), \
+                mock.patch('dbc_influxdb.batching.time.sleep') as sleep:
+            controller.throttle_rate(points=2000)  # Burst
+            sleep.assert_not_called()
+            clock[0] = 3600.0  # Idle, e.g. while parsing the next file
+            controller.throttle_rate(points=5000)
+            sleep.assert_called_once_with(3.0)
+
+    def test_payload_limit(self):
+        controller = AdaptiveBatchController(BatchingSettings(initial_batch_size=1000, max_payload_bytes=5000))
+        self.assertEqual(controller.next_batch_size(avg_line_bytes=100), 50)
+
+
+class TestAdaptiveWriter(unittest.TestCase):
+    def test_all_lines_are_written_after_throttling(self):
+        lines = [f'TA,varname=TA_T1_2_1 TA_T1_2_1={i} {i}' for i in range(10_000)]
+        api = FakeWriteApi(throttle_first=2)
+        settings = BatchingSettings(initial_batch_size=1000, min_batch_size=100, retry_interval=0.0)
+        stats = AdaptiveWriter(write_api=api, settings=settings).write(bucket='test', record=lines)
+        written = sorted(l for b in api.batches for l in b)
+        self.assertEqual(written, sorted(lines))
+        self.assertEqual(stats.points, len(lines))
+        self.assertEqual(stats.throttled, 2)
+
+    def test_programming_error_is_not_retried(self):
+        class BrokenWriteApi:
+            calls = 0
+
+            def write(self, bucket, record, write_precision):
+                BrokenWriteApi.calls += 1
+                raise TypeError('unexpected argument')
+
+        settings = BatchingSettings(retry_interval=0.0)
+        with self.assertRaises(TypeError):
+            AdaptiveWriter(write_api=BrokenWriteApi(), settings=settings).write(bucket='test', record=['a'])
+        self.assertEqual(BrokenWriteApi.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+import pandas as pd
+
+from dbc_influxdb.cardinality import analyze_series, series_keys, series_query, simulate_series
+from dbc_influxdb.common import tags
+
+
+def make_var_df(field: str, gain, periods: int = 4) -> pd.DataFrame:
+    var_df = pd.DataFrame({field: range(periods)},
+                          index=pd.date_range('2024-01-01', periods=periods, freq='30min'))
+    for tag in tags:
+        var_df[tag] = f'-{tag}-'
+    var_df['varname'] = field
+    var_df['gain'] = gain
+    return var_df
+
+
+class TestCardinality(unittest.TestCase):
+    def test_series_query(self):
+        query = series_query(bucket='test', start='2024-01-01T00:00:00+01:00', stop='now()', fields=['TA_T1_2_1'])
+        self.assertIn('|> first() |> drop(columns: ["_start", "_stop", "_time", "_value"]) |> group()', query)
+        self.assertNotIn('pivot', query)
+
+    def test_tags_causing_series(self):
+        results = [pd.DataFrame({'result': '_result', 'table': [0, 0, 0, 0],
+                                 '_measurement': ['TA', 'TA', 'TA', 'SW'],
+                                 '_field': ['TA_T1_2_1', 'TA_T1_2_1', 'TA_T1_2_1', 'SW_T1_2_1'],
+                                 'gain': ['1', '1.0', '1.0', '1'],
+                                 'raw_units': ['degC', 'degC', 'C', 'W m-2'],
+                                 'offset': ['0', '0', '0', None]})]
+        report = analyze_series(keys=series_keys(results))
+        self.assertEqual(report.total_series, 4)
+        self.assertEqual(report.by_field.iloc[0].to_dict(),
+                         dict(measurement='TA', field='TA_T1_2_1', series=3, varying_tags=['gain', 'raw_units']))
+        by_tag = report.by_tag.set_index('tag')
+        self.assertEqual(by_tag.loc['gain', 'excess_series'], 1)
+        self.assertEqual(by_tag.loc['gain', 'equivalent_values'], 2)
+        self.assertEqual(by_tag.loc['raw_units', 'excess_series'], 1)
+        self.assertEqual(by_tag.loc['offset', 'fields_varying'], 0)
+        self.assertEqual(report.explosive_tags, ['gain', 'raw_units'])
+
+    def test_simulate_upload(self):
+        var_df = pd.concat([make_var_df('TA_T1_2_1', gain=1.0), make_var_df('TA_T1_2_1', gain=1.5)])
+        pending = simulate_series(var_df=var_df, measurement='TA')
+        self.assertEqual(pending['gain'].tolist(), ['1.0', '1.5'])
+
+        existing = pending.iloc[[0]].copy()
+        report = analyze_series(keys=pd.concat([existing, pending], ignore_index=True), existing=existing)
+        self.assertEqual(report.new_series, 1)
+        self.assertEqual(report.total_series, 2)
+
+        report = analyze_series(keys=pending, existing=series_keys([]))
+        self.assertEqual(report.new_series, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from benchmarks.standin import InfluxStandIn
+from benchmarks.synthetic import file_frame, var_frames, write_dirconf
+from dbc_influxdb.checkpoint import Checkpoint, Unit, read_table, write_table
+from dbc_influxdb.main import dbcInflux
+from dbc_influxdb.retag import RetagRules
+
+
+def complete_units(path: Path, field: str, n: int):
+    checkpoint = Checkpoint(path)
+    for ix in range(n):
+        checkpoint.complete(Unit(scope='s', field=field, start=str(ix), stop=str(ix + 1)))
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_persisted(self):
+        unit = Unit(scope='s', field='TA', start='2024-01-01', stop='2024-01-02')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'job.checkpoint'
+            checkpoint = Checkpoint(path)
+            self.assertFalse(checkpoint.is_done(unit))
+            checkpoint.complete(unit, result=10, tables=[pd.DataFrame({'a': [1]})])
+            checkpoint.complete(Unit(scope='s', field='SW', start='2024-01-01', stop='2024-01-02'))
+
+            resumed = Checkpoint(path)
+            self.assertEqual(len(resumed), 2)
+            self.assertTrue(resumed.is_done(unit))
+            self.assertEqual(resumed.result(unit), 10)
+            self.assertEqual(resumed.tables(unit)[0]['a'].tolist(), [1])
+            self.assertFalse(resumed.is_done(Unit(scope='other', field='TA', start='2024-01-01', stop='2024-01-02')))
+            self.assertEqual([p.name for p in Path(tmp).iterdir() if p.suffix == '.tmp'], [])
+
+            resumed.clear()
+            self.assertEqual(sorted(Path(tmp).iterdir()), [])
+
+    def test_tables_round_trip(self):
+        table = pd.DataFrame({'_time': pd.date_range('2024-01-01', periods=3, freq='30min', tz='UTC'),
+                              '_value': [1.5, None, 0.1 + 0.2], 'table': [0, 0, 1],
+                              'site': ['ch-dav', 'NA', None]})
+        indexed = table.set_index(pd.DatetimeIndex(['2024-01-01 00:30', '2024-01-01 01:00', '2024-01-01 01:30'],
+                                                   name='TIMESTAMP_END'))
+        for parquet in (True, False):
+            with self.subTest(parquet=parquet), tempfile.TemporaryDirectory() as tmp, \
+                    mock.patch('dbc_influxdb.checkpoint.pyarrow', mock.DEFAULT if parquet else None):
+                for ix, df in enumerate((table, indexed)):
+                    write_table(df=df, path=Path(tmp) / f'table-{ix}')
+                    file = Path(tmp) / f'table-{ix}{".parquet" if parquet else ".csv"}'
+                    pd.testing.assert_frame_equal(read_table(file), df)
+
+    def test_shared_between_processes(self):
+        with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(max_workers=4) as pool:
+            path = Path(tmp) / 'jobs.checkpoint'
+            futures = [pool.submit(complete_units, path, field, 10) for field in ('TA', 'SW', 'RH', 'PA')]
+            for future in futures:
+                future.result()
+            self.assertEqual(len(Checkpoint(path)), 40)
+
+    def test_cleared_by_other_process(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'job.checkpoint'
+            checkpoint = Checkpoint(path)
+            checkpoint.complete(Unit(scope='s', field='TA', start='0', stop='1'))
+            Checkpoint(path).clear()
+            # Units removed by the other process are not written again
+            checkpoint.complete(Unit(scope='s', field='SW', start='0', stop='1'))
+            self.assertEqual(len(checkpoint), 1)
+            self.assertEqual(len(Checkpoint(path)), 1)
+
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.server = InfluxStandIn().__enter__()
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        dirconf = write_dirconf(folder=self.tmp / 'configs', conf_db=self.server.conf_db())
+        self.dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+        self.frames = var_frames(file_df=file_frame(n_vars=3, periods=96))
+        self.period = dict(start='2024-01-01 00:00:00', stop='2024-01-03 01:00:00', timezone_offset_to_utc_hours=1)
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        self._tmp.cleanup()
+
+    def upload_all(self, checkpoint: Checkpoint = None) -> list:
+        return [self.dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='test', to_measurement=measurement,
+                                          timezone_offset_to_utc_hours=1, checkpoint=checkpoint).mode
+                for var_df, measurement in self.frames]
+
+    def test_upload_loop(self):
+        checkpoint = Checkpoint(self.tmp / 'upload.checkpoint')
+        var_df, measurement = self.frames[0]
+        self.dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='test', to_measurement=measurement,
+                                  timezone_offset_to_utc_hours=1, checkpoint=checkpoint)
+        # Rerun of the loop after a failure after the first variable
+        modes = self.upload_all(checkpoint=Checkpoint(self.tmp / 'upload.checkpoint'))
+        self.assertEqual(modes, ['checkpoint', 'delete-then-write', 'delete-then-write'])
+        self.assertEqual(self.server.store.points('test'), sum(len(df) for df, _ in self.frames))
+
+    def test_changed_data_uploaded_again(self):
+        var_df, measurement = self.frames[0]
+        checkpoint = Checkpoint(self.tmp / 'upload.checkpoint')
+        changed = var_df.copy()
+        changed.iloc[0, 0] += 1
+        other_version = var_df.assign(data_version='other')
+        modes = [self.dbc.upload_singlevar(var_df=df.copy(), to_bucket='test', to_measurement=measurement,
+                                           timezone_offset_to_utc_hours=1, checkpoint=checkpoint).mode
+                 for df in (var_df, var_df, changed, other_version)]
+        self.assertEqual(modes, ['delete-then-write', 'checkpoint', 'delete-then-write', 'delete-then-write'])
+
+    def test_download_chunks(self):
+        self.upload_all()
+        checkpoint = Checkpoint(self.tmp / 'download.checkpoint')
+        settings = dict(bucket='test', auto_chunk=True, max_rows_per_chunk=100, **self.period)
+        expected, _, measurements = self.dbc.download(**settings, checkpoint=checkpoint)
+        chunks = self.dbc.last_stats.counts['chunks']
+        self.assertGreater(chunks, 1)
+        self.assertEqual(len(checkpoint), chunks + 1)  # Chunks and the chunk plan
+
+        # Completed chunks are not queried again
+        self.server.store.buckets['test'].clear()
+        data_simple, _, resumed_measurements = self.dbc.download(**settings,
+                                                                 checkpoint=Checkpoint(checkpoint.path))
+        self.assertEqual(self.dbc.last_stats.counts['chunks_resumed'], chunks)
+        pd.testing.assert_frame_equal(data_simple, expected)
+        self.assertEqual(resumed_measurements, measurements)
+
+    def test_retag_chunks(self):
+        self.upload_all()
+        rules = RetagRules(set_tags={'data_version': 'copy'}, transform=lambda df: df)
+        checkpoint = Checkpoint(self.tmp / 'retag.checkpoint')
+        first = self.dbc.retag(from_bucket='test', to_bucket='copy', rules=rules, chunk='1D',
+                               checkpoint=checkpoint, **self.period)
+        second = self.dbc.retag(from_bucket='test', to_bucket='copy', rules=rules, chunk='1D',
+                                checkpoint=Checkpoint(checkpoint.path), **self.period)
+        self.assertEqual(second.chunks_resumed, first.chunks)
+        self.assertEqual(second.points, first.points)
+
+
+if __name__ == '__main__':
+    unittest.main()
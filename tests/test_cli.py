@@ -0,0 +1,142 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+import yaml
+
+from benchmarks.standin import InfluxStandIn
+from benchmarks.synthetic import file_frame, filetype_config, unitmapper, var_frames, write_dirconf
+from dbc_influxdb.cli import JobResult, expand_jobs, main, run_job, summary
+from dbc_influxdb.main import dbcInflux
+from dbc_influxdb.varscanner import VarScanner
+
+
+class TestJobFile(unittest.TestCase):
+    def test_expand(self):
+        jobfile = dict(dirconf='configs', defaults=dict(timezone_offset_to_utc_hours=1, bucket='raw'),
+                       jobs=[dict(name='export-{site}-{fields}', command='export', bucket='{site}_raw',
+                                  output='exports/{site}', foreach=dict(site=['a', 'b'], fields=['TA', 'SW'])),
+                             dict(command='show')])
+        jobs = expand_jobs(jobfile)
+        self.assertEqual([j['name'] for j in jobs],
+                         ['export-a-TA', 'export-a-SW', 'export-b-TA', 'export-b-SW', 'job2'])
+        self.assertEqual(jobs[2]['bucket'], 'b_raw')
+        self.assertEqual(jobs[2]['output'], 'exports/b')
+        self.assertEqual(jobs[2]['fields'], ['TA'])
+        self.assertNotIn('site', jobs[2])
+        self.assertEqual(jobs[4]['bucket'], 'raw')
+        self.assertEqual(jobs[4]['dirconf'], 'configs')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            expand_jobs(dict(dirconf='configs', jobs=[dict(command='copy')]))
+        with self.assertRaises(ValueError):
+            expand_jobs(dict(jobs=[dict(command='show')]))
+        with self.assertRaises(ValueError):
+            expand_jobs(dict(dirconf='configs', jobs=[dict(name='x', command='show')] * 2))
+
+    def test_summary(self):
+        text = summary([JobResult(name='a', command='show', ok=True, seconds=2, points=10),
+                        JobResult(name='b', command='show', ok=False, seconds=1, error='Error')])
+        self.assertIn('2 jobs, 1 failed, 10 points', text)
+        self.assertIn('FAILED', text)
+
+
+class TestRun(unittest.TestCase):
+    def test_export_upload_download(self):
+        frames = var_frames(file_df=file_frame(n_vars=2, periods=48))
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            dirconf = write_dirconf(folder=tmp / 'configs', conf_db=server.conf_db())
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            for var_df, measurement in frames:
+                dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='site', to_measurement=measurement,
+                                     timezone_offset_to_utc_hours=1)
+            period = dict(start='2024-01-01 00:00:00', stop='2024-01-02 01:00:00', timezone_offset_to_utc_hours=1)
+            jobfile = dict(dirconf=str(dirconf), concurrency=2, executor='thread', jobs=[
+                dict(name='export', command='export', bucket='site', output=str(tmp / 'export'), **period),
+                dict(name='show', command='show', what='buckets')])
+            with open(tmp / 'export.yaml', 'w', encoding='utf-8') as f:
+                yaml.safe_dump(jobfile, f)
+            self.assertEqual(main(['run', str(tmp / 'export.yaml')]), 0)
+            self.assertTrue((tmp / 'export' / 'measurements.yaml').exists())
+
+            jobfile['jobs'] = [dict(name='copy', command='upload', path=str(tmp / 'export'), to_bucket='copy',
+                                    timezone_offset_to_utc_hours=1, tags=dict(data_version='copy')),
+                               dict(name='missing', command='upload', path=str(tmp / 'missing'), to_bucket='copy',
+                                    timezone_offset_to_utc_hours=1)]
+            with open(tmp / 'upload.yaml', 'w', encoding='utf-8') as f:
+                yaml.safe_dump(jobfile, f)
+            self.assertEqual(main(['run', str(tmp / 'upload.yaml')]), 1)
+            self.assertEqual(main(['run', str(tmp / 'upload.yaml'), '--only', 'copy']), 0)
+
+            output = tmp / 'copy.csv'
+            self.assertEqual(main(['download', '--dirconf', str(dirconf), '--bucket', 'copy',
+                                   '--start', period['start'], '--stop', period['stop'],
+                                   '--data-version', 'copy', '--output', str(output)]), 0)
+            downloaded = pd.read_csv(output, index_col=0, parse_dates=[0])
+            original, _, _ = dbc.download(bucket='site', **period)
+            pd.testing.assert_frame_equal(downloaded, original, check_dtype=False, check_freq=False,
+                                          check_names=False, check_like=True)
+
+    def test_export_upload_varscanner_data(self):
+        file_df = file_frame(n_vars=2, periods=48)
+        data_vars, filetypeconf = filetype_config(file_df=file_df)
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            # Data uploaded by VarScanner have no tags 'site' and 'offset'
+            VarScanner(file_df=file_df, data_vars=data_vars, data_raw_freq='30min', freq='30min',
+                       config_filetype=filetypeconf['filetype'], filetypeconf=filetypeconf,
+                       conf_unitmapper=unitmapper(), to_bucket='scanner', conf_db=server.conf_db(),
+                       logger=logging.getLogger('test')).run()
+            dirconf = write_dirconf(folder=tmp / 'configs', conf_db=server.conf_db())
+            period = dict(start='2024-01-01 00:00:00', stop='2024-01-02 01:00:00', timezone_offset_to_utc_hours=1)
+            jobfile = dict(dirconf=str(dirconf), jobs=[
+                dict(name='export', command='export', bucket='scanner', output=str(tmp / 'export'), **period),
+                dict(name='copy', command='upload', path=str(tmp / 'export'), to_bucket='copy',
+                     timezone_offset_to_utc_hours=1)])
+            with open(tmp / 'jobs.yaml', 'w', encoding='utf-8') as f:
+                yaml.safe_dump(jobfile, f)
+            self.assertEqual(main(['run', str(tmp / 'jobs.yaml'), '--only', 'export']), 0)
+            self.assertEqual(main(['run', str(tmp / 'jobs.yaml'), '--only', 'copy']), 0)
+
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            _, original, _ = dbc.download(bucket='scanner', **period)
+            _, copied, _ = dbc.download(bucket='copy', **period)
+            self.assertEqual(sorted(copied), sorted(original))
+            for field, df in original.items():
+                self.assertNotIn('site', df.columns)
+                pd.testing.assert_frame_equal(copied[field], df)
+
+    def test_delete_needs_explicit_selection(self):
+        frames = var_frames(file_df=file_frame(n_vars=2, periods=48))
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db=server.conf_db())
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            for var_df, measurement in frames:
+                dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='site', to_measurement=measurement,
+                                     timezone_offset_to_utc_hours=1)
+            period = dict(start='2024-01-01 00:00:00', stop='2024-01-02 01:00:00', timezone_offset_to_utc_hours=1)
+            field = frames[0][0].columns[0]
+
+            # Nothing is deleted by default
+            job = dict(name='delete', command='delete', dirconf=str(dirconf), bucket='site', **period)
+            result = run_job(job)
+            self.assertFalse(result.ok)
+            self.assertIn("['data_version', 'measurements', 'fields']", result.error)
+            result = run_job(dict(job, data_version=['raw', 'other'], measurements='all', fields='all'))
+            self.assertFalse(result.ok)
+
+            # List settings in *foreach* are one-element lists, the data version is unwrapped
+            jobs = expand_jobs(dict(dirconf=str(dirconf), jobs=[dict(
+                job, measurements='all', fields=[field], foreach=dict(data_version=['raw']))]))
+            self.assertEqual(jobs[0]['data_version'], ['raw'])
+            self.assertTrue(run_job(jobs[0]).ok)
+            _, data_detailed, _ = dbc.download(bucket='site', **period)
+            self.assertEqual(list(data_detailed), [frames[1][0].columns[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
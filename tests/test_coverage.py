@@ -0,0 +1,47 @@
+import tempfile
+import unittest
+
+import pandas as pd
+
+from dbc_influxdb.coverage import CoverageCache, counts_to_long, coverage_query, flux_duration, merge_incremental, \
+    to_wide
+
+
+def make_results(days: list, field: str = 'TA_T1_2_1') -> pd.DataFrame:
+    """Counts as returned by the coverage query, two series of the same field"""
+    times = pd.to_datetime(days).tz_localize('UTC') - pd.Timedelta(hours=1)
+    one = pd.DataFrame({'_time': times, '_value': 24, '_field': field, '_measurement': 'TA'})
+    two = pd.DataFrame({'_time': times, '_value': 24, '_field': field, '_measurement': 'TA'})
+    return [one, two]
+
+
+class TestCoverage(unittest.TestCase):
+    def test_query(self):
+        q = coverage_query(bucket='test', start_iso='2024-01-01T00:00:00+01:00', stop_iso='now()',
+                           measurements=['TA'], data_version=None, resolution='1D', timezone_offset_to_utc_hours=1)
+        self.assertIn('aggregateWindow(every: 86400s, offset: -1h, fn: count', q)
+        self.assertIn('range(start: 2024-01-01T00:00:00+01:00, stop: now())', q)
+        self.assertEqual(flux_duration('30min'), '1800s')
+
+    def test_counts_of_series_are_summed_per_field_and_window(self):
+        long = counts_to_long(make_results(['2024-01-01', '2024-01-02']), timezone_offset_to_utc_hours=1)
+        wide = to_wide(long)
+        self.assertEqual(list(wide.index), [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02')])
+        self.assertEqual(wide['TA_T1_2_1'].tolist(), [48, 48])
+
+    def test_incremental_refresh(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = CoverageCache(cache_dir=tmpdir, bucket='test', measurements=None, data_version=None,
+                                  resolution='1D', timezone_offset_to_utc_hours=1)
+            cache.save(counts_to_long(make_results(['2024-01-01', '2024-01-02']), timezone_offset_to_utc_hours=1))
+            cached = cache.load()
+            since = CoverageCache.refresh_start(cached)
+            self.assertEqual(since, pd.Timestamp('2024-01-02'))
+            fresh = counts_to_long(make_results(['2024-01-02', '2024-01-03']), timezone_offset_to_utc_hours=1)
+            wide = to_wide(merge_incremental(cached=cached, fresh=fresh, since=since))
+            self.assertEqual(len(wide), 3)
+            self.assertEqual(wide['TA_T1_2_1'].tolist(), [48, 48, 48])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import threading
+import unittest
+
+from dbc_influxdb.deletion import plan_delete_predicates, run_delete_predicates
+
+
+class FakeDeleteApi:
+    def __init__(self, fail_on: str = None):
+        self.fail_on = fail_on
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def delete(self, start, stop, predicate, bucket):
+        with self.lock:
+            self.calls.append(predicate)
+        if self.fail_on and self.fail_on in predicate:
+            raise RuntimeError("server error")
+
+
+class TestDeletePlanning(unittest.TestCase):
+    def test_all_measurements_all_fields_needs_one_request(self):
+        plan = plan_delete_predicates(measurements=True, fields=True, data_version='raw',
+                                      start='a', stop='b')
+        self.assertEqual([p.predicate for p in plan], ['data_version="raw"'])
+
+    def test_fields_across_all_measurements_use_varname(self):
+        plan = plan_delete_predicates(measurements=True, fields=['TA_T1_1_1', 'SW_T1_1_1'],
+                                      data_version='raw', start='a', stop='b')
+        self.assertEqual([p.predicate for p in plan],
+                         ['varname="TA_T1_1_1" AND data_version="raw"',
+                          'varname="SW_T1_1_1" AND data_version="raw"'])
+
+    def test_many_fields_of_one_measurement(self):
+        plan = plan_delete_predicates(measurements='TA', fields=['A', 'B', 'C'],
+                                      data_version='raw', start='a', stop='b')
+        self.assertEqual(len(plan), 3)
+        self.assertTrue(all(p.predicate.startswith('_measurement="TA"') for p in plan))
+
+    def test_values_are_escaped(self):
+        plan = plan_delete_predicates(measurements=['T"A'], fields=True,
+                                      data_version='raw', start='a', stop='b')
+        self.assertEqual(plan[0].predicate, '_measurement="T\\"A" AND data_version="raw"')
+
+
+class TestDeleteExecution(unittest.TestCase):
+    def test_failures_are_collected(self):
+        plan = plan_delete_predicates(measurements='TA', fields=['A', 'B', 'C'],
+                                      data_version='raw', start='a', stop='b')
+        api = FakeDeleteApi(fail_on='varname="B"')
+        result = run_delete_predicates(delete_api=api, bucket='test', predicates=plan, max_workers=3)
+        self.assertEqual(len(api.calls), 3)
+        self.assertEqual(len(result.outcomes), 3)
+        self.assertFalse(result.ok)
+        self.assertEqual([f.predicate for f in result.failures], [plan[1].predicate])
+        with self.assertRaises(Exception):
+            result.raise_for_failures()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+import pandas as pd
+
+from dbc_influxdb.estimate import estimate_from_counts, plan_chunks
+
+
+class TestDownloadEstimate(unittest.TestCase):
+    def test_estimate_from_counts(self):
+        counts = pd.DataFrame({'_measurement': ['TA', 'TA', 'SW'],
+                               '_field': ['TA_T1_2_1', 'TA_T1_2_1', 'SW_IN_T1_2_1'],
+                               '_value': [1_000_000, 500_000, 1_500_000]})
+        estimate = estimate_from_counts(counts=counts, start='2020-01-01 00:00:00', stop='2023-01-01 00:00:00',
+                                        max_rows_per_chunk=1_000_000)
+        self.assertEqual(estimate.rows, 3_000_000)
+        self.assertEqual(estimate.series, 3)
+        self.assertEqual(estimate.fields, 2)
+        self.assertEqual(len(estimate.chunks), 3)
+        self.assertEqual(estimate.per_field.loc[('TA', 'TA_T1_2_1'), 'series'], 2)
+
+    def test_chunks_cover_range(self):
+        chunks = plan_chunks(start='2020-01-01 00:00:00', stop='2021-01-01 00:00:00', rows=10, max_rows_per_chunk=3)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[0][0], '2020-01-01 00:00:00')
+        self.assertEqual(chunks[-1][1], '2021-01-01 00:00:00')
+        for (_, stop), (start, _) in zip(chunks[:-1], chunks[1:]):
+            self.assertEqual(stop, start)
+
+    def test_empty_counts(self):
+        estimate = estimate_from_counts(counts=pd.DataFrame(), start='a', stop='b', max_rows_per_chunk=10)
+        self.assertEqual(estimate.rows, 0)
+        self.assertEqual(estimate.chunks, [('a', 'b')])
+
+
+if __name__ == '__main__':
+    unittest.main()
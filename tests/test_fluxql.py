@@ -0,0 +1,47 @@
+import unittest
+
+import dbc_influxdb.fluxql as fluxql
+
+
+class TestFluxQuery(unittest.TestCase):
+    def test_indexed_filters_first(self):
+        query = fluxql.FluxQuery(bucket='test', start='2024-01-01T00:00:00+01:00', stop='2024-02-01T00:00:00+01:00') \
+            .where('data_version', ['raw']) \
+            .where('_field', ['TA_T1_2_1']) \
+            .where('_measurement', ['TA'])
+        q = query.compile()
+        self.assertLess(q.index('_measurement'), q.index('_field'))
+        self.assertLess(q.index('_field'), q.index('data_version'))
+        self.assertTrue(q.startswith('from(bucket: "test") |> range(start: 2024-01-01T00:00:00+01:00'))
+        self.assertTrue(q.endswith(fluxql.pivotstring()))
+
+    def test_large_lists_use_anchored_regex(self):
+        fields = [f'TA_T1_{i}_1' for i in range(300)]
+        q = fluxql.FluxQuery(bucket='test', start='a', stop='b').where('_field', fields).compile()
+        self.assertIn('r["_field"] =~ /^(?:TA_T1_0_1|TA_T1_1_1|', q)
+        self.assertNotIn(' or ', q)
+
+    def test_small_lists_use_equality(self):
+        q = fluxql.FluxQuery(bucket='test', start='a', stop='b').where('_field', ['A', 'B']).compile()
+        self.assertIn('r["_field"] == "A" or r["_field"] == "B"', q)
+
+    def test_empty_values_add_no_filter(self):
+        q = fluxql.FluxQuery(bucket='test', start='a', stop='b').where('_field', None).compile()
+        self.assertNotIn('filter', q)
+
+    def test_values_are_escaped(self):
+        q = fluxql.FluxQuery(bucket='test', start='a', stop='b').where('_field', ['a"b']).compile()
+        self.assertIn(r'r["_field"] == "a\"b"', q)
+        self.assertEqual(fluxql.escape_regex('a.b/c'), r'a\.b\/c')
+
+    def test_template_is_reused_for_other_ranges(self):
+        query = fluxql.FluxQuery(bucket='test', start='a', stop='b').where('_field', ['A'])
+        query.compile()
+        hits = fluxql._compile_template.cache_info().hits
+        q = query.with_range(start='c', stop='d').compile()
+        self.assertEqual(fluxql._compile_template.cache_info().hits, hits + 1)
+        self.assertIn('range(start: c, stop: d)', q)
+
+
+if __name__ == '__main__':
+    unittest.main()
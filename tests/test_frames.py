@@ -0,0 +1,76 @@
+import unittest
+
+import pandas as pd
+
+from dbc_influxdb.common import tags
+from dbc_influxdb.frames import align_frames, assemble_download, field_measurements, version_periods
+
+
+def make_table(field: str, start: str, periods: int, measurement: str = 'TA', **tagvalues) -> pd.DataFrame:
+    """Table as returned by a pivoted query, one variable with one set of tags"""
+    table = pd.DataFrame({'_time': pd.date_range(start, periods=periods, freq='30min', tz='UTC'),
+                          field: range(periods)})
+    table['result'] = '_result'
+    table['table'] = 0
+    table['_measurement'] = measurement
+    for tag in tags:
+        table[tag] = tagvalues.get(tag, f'-{tag}-')
+    table['varname'] = field
+    return table
+
+
+class TestAssembleDownload(unittest.TestCase):
+    def test_tables_are_merged(self):
+        tables = [make_table('TA_T1_2_1', '2024-01-01 00:00', 10),
+                  make_table('TA_T1_2_1', '2024-01-01 05:00', 10, freq='10min'),
+                  make_table('SW_IN_T1_2_1', '2024-01-01 00:00', 10, measurement='SW'),
+                  pd.DataFrame()]
+        data_simple, data_detailed, found_measurements = assemble_download(tables=tables,
+                                                                           timezone_offset_to_utc_hours=1)
+        self.assertEqual(sorted(data_detailed.keys()), ['SW_IN_T1_2_1', 'TA_T1_2_1'])
+        self.assertEqual(len(data_detailed['TA_T1_2_1']), 20)
+        self.assertEqual(data_simple.index[0], pd.Timestamp('2024-01-01 01:00'))
+        self.assertEqual(sorted(set(found_measurements)), ['SW', 'TA'])
+
+    def test_measurements_from_tables(self):
+        tables = [make_table('TA_T1_2_1', '2024-01-01 00:00', 2),
+                  make_table('SW_IN_T1_2_1', '2024-01-01 00:00', 2, measurement='SW'),
+                  pd.DataFrame()]
+        self.assertEqual(field_measurements(tables), {'TA_T1_2_1': 'TA', 'SW_IN_T1_2_1': 'SW'})
+
+    def test_version_priority(self):
+        tables = [make_table('TA_T1_2_1', '2024-01-01 00:00', 10, data_version='diive'),
+                  make_table('TA_T1_2_1', '2024-01-01 02:00', 4, data_version='mst'),
+                  make_table('TA_T1_2_1', '2024-01-01 06:00', 2, data_version='other')]
+        tables[0].loc[1, 'TA_T1_2_1'] = float('nan')
+        data_simple, data_detailed, _ = assemble_download(tables=tables, timezone_offset_to_utc_hours=0,
+                                                          version_priority=['mst', 'diive'])
+        df = data_detailed['TA_T1_2_1']
+        self.assertEqual(len(df), 12)
+        self.assertFalse(df.index.duplicated().any())
+        self.assertEqual(df.loc['2024-01-01 02:00', 'data_version'], 'mst')
+        self.assertEqual(df.loc['2024-01-01 04:00', 'data_version'], 'diive')
+        self.assertEqual(df.loc['2024-01-01 06:00', 'data_version'], 'other')
+        # Missing value in the first version, no other version has data
+        self.assertEqual(df.loc['2024-01-01 00:30', 'data_version'], 'diive')
+        periods = version_periods(data_detailed)
+        self.assertEqual(periods['data_version'].tolist(), ['diive', 'mst', 'diive', 'other'])
+        self.assertEqual(periods['records'].tolist(), [4, 4, 2, 2])
+        self.assertEqual(list(data_simple.columns), ['TA_T1_2_1'])
+
+
+class TestAlignFrames(unittest.TestCase):
+    def test_sites_are_aligned_on_union_index(self):
+        one = pd.DataFrame({'TA': [1.0, 2.0]}, index=pd.date_range('2024-01-01 00:30', periods=2, freq='30min'))
+        two = pd.DataFrame({'TA': [3, 4], 'SW': [5, 6]},
+                           index=pd.date_range('2024-01-01 01:00', periods=2, freq='30min'))
+        wide = align_frames({'ch-dav': one, 'ch-cha': two, 'ch-lae': pd.DataFrame()})
+        self.assertEqual(list(wide.columns), [('ch-dav', 'TA'), ('ch-cha', 'TA'), ('ch-cha', 'SW')])
+        self.assertEqual(len(wide), 3)
+        self.assertEqual(wide[('ch-dav', 'TA')].tolist()[:2], [1.0, 2.0])
+        self.assertTrue(pd.isna(wide.loc['2024-01-01 00:30', ('ch-cha', 'SW')]))
+        self.assertEqual(wide.loc['2024-01-01 01:30', ('ch-cha', 'SW')], 6.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from dbc_influxdb.manifest import UploadManifest
+
+
+def make_df(periods: int = 48 * 4) -> pd.DataFrame:
+    index = pd.date_range('2024-01-01 00:30', periods=periods, freq='30min', tz='UTC+01:00')
+    df = pd.DataFrame(index=index, data={'TA_T1_2_1': np.arange(periods, dtype=float)})
+    df['varname'] = 'TA_T1_2_1'
+    df['units'] = 'degC'
+    return df
+
+
+class TestUploadManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.manifest = UploadManifest(path=Path(self.tmpdir.name) / 'manifest.sqlite')
+        self.kwargs = dict(bucket='test', measurement='TA', field='TA_T1_2_1', tag_columns=['varname', 'units'])
+
+    def tearDown(self):
+        self.manifest.close()
+        self.tmpdir.cleanup()
+
+    def _upload(self, df):
+        result = self.manifest.filter_unchanged(df=df, **self.kwargs)
+        self.manifest.commit(bucket='test', measurement='TA', field='TA_T1_2_1', entries=result.entries)
+        return result
+
+    def test_repeated_upload_is_skipped(self):
+        df = make_df()
+        first = self._upload(df)
+        self.assertEqual(first.points_written, len(df))
+        second = self._upload(df)
+        self.assertEqual(second.points_written, 0)
+        self.assertEqual(second.points_skipped, len(df))
+
+    def test_only_changed_blocks_are_written(self):
+        df = make_df()
+        self._upload(df)
+        df.iloc[60, 0] = -1.0
+        result = self._upload(df)
+        self.assertEqual(result.blocks_written, 1)
+        self.assertEqual(result.points_written, 48)
+
+    def test_files_covering_part_of_a_block_are_skipped(self):
+        df = make_df(periods=49).iloc[1:]  # One day in UTC
+        morning, afternoon = df.iloc[:24], df.iloc[24:]
+        self._upload(morning)
+        self._upload(afternoon)
+        self.assertEqual(self._upload(morning).points_written, 0)
+        self.assertEqual(self._upload(afternoon).points_written, 0)
+
+        # The whole block replaces the entries of its parts
+        self.assertEqual(self._upload(df).points_written, len(df))
+        self.assertEqual(self._upload(df).points_written, 0)
+        self.assertEqual(self._upload(morning).points_written, len(morning))
+
+    def test_changed_tag_is_written(self):
+        df = make_df()
+        self._upload(df)
+        df['units'] = 'K'
+        result = self._upload(df)
+        self.assertEqual(result.points_written, len(df))
+
+
+if __name__ == '__main__':
+    unittest.main()
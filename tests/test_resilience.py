@@ -0,0 +1,66 @@
+import unittest
+
+from influxdb_client.rest import ApiException
+from urllib3.exceptions import ReadTimeoutError
+
+from dbc_influxdb.resilience import CircuitBreaker, CircuitOpenError, ReadPolicy, call_with_retry
+
+POLICY = ReadPolicy(max_retries=2, retry_interval=0.0, failure_threshold=3, reset_timeout=60)
+
+
+class FlakyQuery:
+    def __init__(self, errors: list):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'result'
+
+
+class TestResilience(unittest.TestCase):
+    def test_transient_errors_are_retried(self):
+        query = FlakyQuery([ApiException(status=502), ReadTimeoutError(None, None, 'timeout')])
+        messages = []
+        self.assertEqual(call_with_retry(query, policy=POLICY, printer=messages.append), 'result')
+        self.assertEqual(query.calls, 3)
+        self.assertEqual(len(messages), 2)
+
+    def test_client_errors_are_not_retried(self):
+        query = FlakyQuery([ApiException(status=400)])
+        with self.assertRaises(ApiException):
+            call_with_retry(query, policy=POLICY)
+        self.assertEqual(query.calls, 1)
+
+    def test_retries_are_limited(self):
+        query = FlakyQuery([ApiException(status=503)] * 5)
+        with self.assertRaises(ApiException):
+            call_with_retry(query, policy=POLICY)
+        self.assertEqual(query.calls, 3)
+
+    def test_circuit_opens_and_fails_fast(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        with self.assertRaises(ApiException):
+            call_with_retry(FlakyQuery([ApiException(status=503)] * 3), policy=POLICY, breaker=breaker)
+        self.assertEqual(breaker.state, 'open')
+        query = FlakyQuery([])
+        with self.assertRaises(CircuitOpenError):
+            call_with_retry(query, policy=POLICY, breaker=breaker)
+        self.assertEqual(query.calls, 0)
+
+        breaker.reset_timeout = 0
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertEqual(call_with_retry(query, policy=POLICY, breaker=breaker), 'result')
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_timeouts_per_operation(self):
+        policy = ReadPolicy(timeouts={'download': 1800})
+        self.assertEqual(policy.timeout_ms('download'), 1_800_000)
+        self.assertEqual(policy.timeout_ms('show'), 60_000)
+        self.assertEqual(policy.timeout_ms('other'), 999_000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+import pandas as pd
+
+import dbc_influxdb.fluxql as fluxql
+from dbc_influxdb.retag import RetagRules, retag_query, time_chunks
+
+RULES = RetagRules(replace_in_fields={'_T1B2_': '_T1_'},
+                   map_tags={'freq': {'30T': '30min', '10S': '10s'}},
+                   set_tags={'site': 'ch-cha'})
+
+
+class TestRetag(unittest.TestCase):
+    def test_rules_compile_to_map(self):
+        mapfn = RULES.to_flux()
+        self.assertIn('_field: strings.replaceAll(v: r["_field"], t: "_T1B2_", u: "_T1_")', mapfn)
+        self.assertIn('varname: strings.replaceAll(', mapfn)
+        self.assertIn('freq: (if r["freq"] == "30T" then "30min" else if r["freq"] == "10S" then "10s" '
+                      'else r["freq"])', mapfn)
+        self.assertIn('site: "ch-cha"', mapfn)
+
+    def test_query_writes_on_server(self):
+        query = fluxql.FluxQuery(bucket='from', start='2023-01-01T00:00:00+01:00',
+                                 stop='2023-02-01T00:00:00+01:00', pivot=False).where('_measurement', ['TA'])
+        q = retag_query(query=query, to_bucket='to', rules=RULES)
+        self.assertTrue(q.startswith('import "strings" from(bucket: "from")'))
+        self.assertTrue(q.endswith('|> to(bucket: "to") |> count()'))
+        self.assertNotIn('pivot', q)
+
+    def test_client_side_apply_matches_rules(self):
+        df = pd.DataFrame({'_field': ['TA_T1B2_2_1', 'SW_IN_T1_1_1'], '_value': [1.0, 2.0],
+                           'varname': ['TA_T1B2_2_1', 'SW_IN_T1_1_1'], 'freq': ['30T', '10min']})
+        rules = RetagRules(rename_fields={'SW_IN_T1_1_1': 'SW_IN_T1_1_2'}, **{
+            k: getattr(RULES, k) for k in ['replace_in_fields', 'map_tags', 'set_tags']},
+                           transform=lambda d: d.assign(gain='1.0'))
+        out = rules.apply(df)
+        self.assertFalse(rules.server_side)
+        self.assertEqual(out['_field'].tolist(), ['TA_T1_2_1', 'SW_IN_T1_1_2'])
+        self.assertEqual(out['varname'].tolist(), ['TA_T1_2_1', 'SW_IN_T1_1_2'])
+        self.assertEqual(out['freq'].tolist(), ['30min', '10min'])
+        self.assertEqual(set(out['site']), {'ch-cha'})
+        self.assertEqual(set(out['gain']), {'1.0'})
+        with self.assertRaises(ValueError):
+            rules.to_flux()
+
+    def test_time_chunks(self):
+        chunks = time_chunks(start='2023-01-01 00:00:01', stop='2023-03-01 00:00:01', chunk='30D')
+        self.assertEqual(chunks, [('2023-01-01 00:00:01', '2023-01-31 00:00:01'),
+                                  ('2023-01-31 00:00:01', '2023-03-01 00:00:01')])
+
+
+if __name__ == '__main__':
+    unittest.main()
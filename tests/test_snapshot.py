@@ -0,0 +1,71 @@
+import tempfile
+import unittest
+
+import pandas as pd
+
+from dbc_influxdb.batching import WriteStats
+from dbc_influxdb.snapshot import SnapshotWriter, read_meta, restore_snapshot, snapshot_lines
+
+
+def make_results(field: str, start: str, periods: int) -> pd.DataFrame:
+    """Unpivoted query results of one series"""
+    return pd.DataFrame({'result': '_result', 'table': 0,
+                         '_start': pd.Timestamp('1970-01-01', tz='UTC'), '_stop': pd.Timestamp.now(tz='UTC'),
+                         '_time': pd.date_range(start, periods=periods, freq='30min', tz='UTC'),
+                         '_value': [float(v) for v in range(periods)], '_field': field,
+                         '_measurement': 'TA', 'data_version': 'raw', 'varname': field})
+
+
+class FakeWriter:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, bucket, record, write_precision='s'):
+        self.lines += record
+        return WriteStats(points=len(self.lines))
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_snapshot_is_partitioned_by_measurement_and_year(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with SnapshotWriter(path=tmp, bucket='test', part_rows=10) as writer:
+                writer.add(make_results('TA_T1_2_1', '2023-12-31 22:00', 8))
+                writer.add(make_results('TA_T1_5_1', '2024-01-01', 12))
+            meta = read_meta(tmp)
+            self.assertEqual(meta['points'], {'TA': 20})
+            self.assertEqual(sorted({f.rsplit('/', 1)[0] for f in meta['files']}), ['TA/2023', 'TA/2024'])
+            with self.assertRaises(FileExistsError):
+                SnapshotWriter(path=tmp, bucket='test')
+
+    def test_finished_measurement_is_written(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with SnapshotWriter(path=tmp, bucket='test') as writer:
+                writer.add(make_results('TA_T1_2_1', '2024-01-01', 5))
+                writer.add(make_results('SW_IN_T1_2_1', '2024-01-01', 5).assign(_measurement='SW'))
+                writer.finish_measurement('TA')
+                self.assertEqual(writer.points, {'TA': 5})
+                self.assertEqual(len(writer.files), 1)
+            self.assertEqual(read_meta(tmp)['points'], {'TA': 5, 'SW': 5})
+
+    def test_restore_with_tag_overrides(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with SnapshotWriter(path=tmp, bucket='test') as writer:
+                writer.add(make_results('TA_T1_2_1', '2024-01-01', 5))
+                writer.add(make_results('TA_T1_5_1', '2024-01-01', 5))
+            fake = FakeWriter()
+            result = restore_snapshot(path=tmp, writer=fake, to_bucket='other',
+                                      tag_overrides={'data_version': 'restored'})
+            self.assertEqual(result.points, 10)
+            self.assertEqual(len(fake.lines), 10)
+            self.assertTrue(all(l.startswith('TA,data_version=restored,varname=TA_T1_') for l in fake.lines))
+            self.assertTrue(fake.lines[0].endswith(' 1704067200000000000'))
+
+    def test_lines(self):
+        df = make_results('TA_T1_2_1', '2024-01-01', 1).drop(columns=['result', 'table', '_start', '_stop',
+                                                                      '_measurement'])
+        lines = snapshot_lines(df=df, measurement='TA', precision='s')
+        self.assertEqual(lines, ['TA,data_version=raw,varname=TA_T1_2_1 TA_T1_2_1=0.0 1704067200'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+
+import pandas as pd
+
+from dbc_influxdb.lineprotocol import frame_to_lines
+from dbc_influxdb.spool import WriteSpool
+
+
+class FakeWriteApi:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.written = []
+
+    def write(self, bucket, record, write_precision):
+        if self.fail:
+            raise ConnectionError("database not reachable")
+        self.written.append((bucket, write_precision, list(record)))
+
+
+class TestWriteSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.spool = WriteSpool(directory=self.tmpdir.name, segment_points=10)
+        index = pd.date_range('2024-01-01 00:30', periods=25, freq='30min', tz='UTC')
+        df = pd.DataFrame(index=index, data={'TA_T1_2_1': range(25)})
+        df['varname'] = 'TA_T1_2_1'
+        self.lines = frame_to_lines(df=df, measurement='TA', tag_columns=['varname', 'units'])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lines_are_serialized(self):
+        self.assertEqual(len(self.lines), 25)
+        self.assertTrue(self.lines[0].startswith('TA,varname=TA_T1_2_1 TA_T1_2_1=0i '))
+
+    def test_append_and_replay(self):
+        self.spool.append(bucket='test', lines=self.lines)
+        self.assertEqual(len(self.spool.segments()), 3)
+        self.assertEqual(self.spool.pending_points(), 25)
+        write_api = FakeWriteApi()
+        result = self.spool.replay(write_api=write_api)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.points_written, 25)
+        self.assertEqual(self.spool.segments(), [])
+        self.assertEqual([l for w in write_api.written for l in w[2]], self.lines)
+
+    def test_failed_replay_keeps_segments(self):
+        self.spool.append(bucket='test', lines=self.lines)
+        result = self.spool.replay(write_api=FakeWriteApi(fail=True))
+        self.assertFalse(result.ok)
+        self.assertEqual(result.segments_remaining, 3)
+        self.assertEqual(len(self.spool.segments()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
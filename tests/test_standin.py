@@ -0,0 +1,86 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.run import Result, compare
+from benchmarks.standin import InfluxStandIn, Query, Store, parse_line
+from benchmarks.synthetic import file_frame, var_frames, write_dirconf
+from dbc_influxdb.main import dbcInflux
+
+
+class TestLineProtocol(unittest.TestCase):
+    def test_parse_line(self):
+        self.assertEqual(parse_line('TA,varname=TA_T1_1_1,site=ch-dav TA_T1_1_1=1.5 1704067200'),
+                         ('TA', (('site', 'ch-dav'), ('varname', 'TA_T1_1_1')), {'TA_T1_1_1': 1.5}, 1704067200))
+
+    def test_parse_escaped_line(self):
+        measurement, tags, fields, timestamp = parse_line(
+            r'SW,units=W\ m-2,raw_varname=a\,b SW_1=2i,note="x, \"y\" z" 10')
+        self.assertEqual(measurement, 'SW')
+        self.assertEqual(dict(tags), {'units': 'W m-2', 'raw_varname': 'a,b'})
+        self.assertEqual(fields, {'SW_1': 2, 'note': 'x, "y" z'})
+        self.assertEqual(timestamp, 10)
+
+
+class TestStore(unittest.TestCase):
+    def test_filters_and_delete(self):
+        store = Store()
+        store.write('b', 'TA,varname=TA_1,data_version=raw TA_1=1 1704067200\n'
+                         'TA,varname=TA_1,data_version=raw TA_1=2 1704069000\n'
+                         'RH,varname=RH_1,data_version=raw RH_1=50 1704067200', precision='s')
+        query = Query('from(bucket: "b") |> range(start: 2024-01-01T00:00:00Z, stop: 2024-01-02T00:00:00Z) '
+                      '|> filter(fn: (r) => r["_measurement"] =~ /^(?:TA|SW)$/) '
+                      '|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")')
+        csv = store.query(query)
+        self.assertIn(',result,table,_start,_stop,_time,_measurement,data_version,varname,TA_1', csv)
+        self.assertNotIn('RH_1', csv)
+
+        store.delete('b', start='2024-01-01T00:00:00Z', stop='2024-01-01T00:00:00Z',
+                     predicate='_measurement="TA" AND data_version="raw"')
+        self.assertEqual(store.points('b'), 2)
+
+
+class TestRoundTrip(unittest.TestCase):
+    def test_upload_download_delete(self):
+        file_df = file_frame(n_vars=2, periods=48)
+        frames = var_frames(file_df=file_df)
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db=server.conf_db())
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            for var_df, measurement in frames:
+                dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='test', to_measurement=measurement,
+                                     timezone_offset_to_utc_hours=1)
+            uploaded = sum(len(var_df) for var_df, _ in frames)
+            self.assertEqual(server.store.points('test'), uploaded)
+
+            data_simple, data_detailed, measurements = dbc.download(
+                bucket='test', start='2024-01-01 00:00:00', stop='2024-01-02 01:00:00',
+                timezone_offset_to_utc_hours=1)
+            self.assertEqual(measurements, {'TA_T1_1_1': 'TA', 'RH_T1_1_1': 'RH'})
+            var_df = frames[0][0]
+            self.assertEqual(data_detailed['TA_T1_1_1']['TA_T1_1_1'].tolist(), var_df['TA_T1_1_1'].tolist())
+            self.assertEqual(data_detailed['TA_T1_1_1']['site'].iloc[0], 'ch-bench')
+            self.assertEqual(data_simple.index[0], var_df.index[0])
+
+            result = dbc.delete(bucket='test', measurements=True, start='2024-01-01 00:00:00',
+                                stop='2024-01-02 01:00:00', timezone_offset_to_utc_hours=1,
+                                data_version='raw', fields=True)
+            self.assertTrue(result.ok)
+            self.assertEqual(server.store.points('test'), 0)
+
+
+class TestCompare(unittest.TestCase):
+    def test_regressions(self):
+        baseline = dict(results=[dict(case='c', operation='upload', points_per_second=1000, peak_traced_mb=10),
+                                 dict(case='c', operation='download', points_per_second=1000, peak_traced_mb=10)])
+        results = [Result(case='c', operation='upload', freq='30min', variables=1, points=1, seconds=1,
+                          points_per_second=700, peak_traced_mb=10),
+                   Result(case='c', operation='download', freq='30min', variables=1, points=1, seconds=1,
+                          points_per_second=900, peak_traced_mb=11)]
+        regressions = compare(results=results, baseline=baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('c upload: throughput'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.standin import InfluxStandIn
+from benchmarks.synthetic import file_frame, var_frames, write_dirconf
+from dbc_influxdb.frames import assemble_download
+from dbc_influxdb.main import dbcInflux
+from dbc_influxdb.stats import LoggingSink, OperationStats, PrometheusTextSink, emit
+from tests.test_frames import make_table
+
+
+class TestStats(unittest.TestCase):
+    def test_phases_and_counts_accumulate(self):
+        stats = OperationStats(operation='download', labels=dict(bucket='test'))
+        for _ in range(2):
+            with stats.phase('query'):
+                pass
+            stats.add(rows=10)
+        stats.finish()
+        self.assertEqual(list(stats.phases), ['query'])
+        self.assertEqual(stats.counts, {'rows': 20})
+        self.assertGreaterEqual(stats.duration, stats.phases['query'])
+        self.assertEqual(stats.to_dict()['labels'], {'bucket': 'test'})
+
+    def test_assembly_phases(self):
+        stats = OperationStats(operation='download')
+        tables = [make_table('TA_T1_2_1', '2024-01-01 00:00', 10),
+                  make_table('TA_T1_2_1', '2024-01-01 05:00', 10, freq='10min')]
+        assemble_download(tables=tables, timezone_offset_to_utc_hours=1, stats=stats)
+        self.assertEqual(sorted(stats.phases), ['copy', 'merge_detailed', 'merge_simple', 'timezone'])
+        self.assertEqual(stats.memory, {})
+
+    def test_memory_profile(self):
+        stats = OperationStats(operation='download', profile_memory=True)
+        with stats.phase('query'):
+            kept = bytearray(4 * 1024 ** 2)
+            with stats.phase('copy'):
+                temporary = bytearray(8 * 1024 ** 2)
+                del temporary
+        tables = [make_table('TA_T1_2_1', '2024-01-01 00:00', 10), make_table('SW_T1_2_1', '2024-01-01 00:00', 10)]
+        assemble_download(tables=tables, timezone_offset_to_utc_hours=1, stats=stats)
+        stats.finish()
+        self.assertGreaterEqual(stats.memory['copy'].peak, 7.9)
+        self.assertLess(stats.memory['copy'].retained, 1)
+        self.assertGreaterEqual(stats.memory['query'].peak, 11.9)  # Includes the nested phase
+        self.assertGreaterEqual(stats.memory['query'].retained, 3.9)
+        self.assertEqual(stats.memory['copy'].calls, 5)
+        self.assertEqual(sorted(stats.memory_by_variable), ['SW_T1_2_1', 'TA_T1_2_1'])
+        self.assertIn('memory_by_variable', stats.to_dict())
+        self.assertIn('peak', str(stats))
+        del kept
+
+    def test_sinks(self):
+        stats = OperationStats(operation='upload', phases={'write': 1.5}, counts={'points': 100}).finish()
+        received = []
+        with tempfile.TemporaryDirectory() as tmp:
+            prometheus = PrometheusTextSink(path=Path(tmp) / 'dbc.prom')
+            with self.assertLogs('dbc_influxdb', level=logging.INFO) as logs:
+                emit(stats, sinks=[received.append, LoggingSink(), prometheus])
+            emit(stats, sinks=[prometheus])
+            text = (Path(tmp) / 'dbc.prom').read_text()
+        self.assertEqual(received, [stats])
+        self.assertIn('upload', logs.output[0])
+        self.assertIn('dbc_operations_total{operation="upload"} 2', text)
+        self.assertIn('dbc_phase_seconds_total{operation="upload",phase="write"} 3.000000', text)
+        self.assertIn('dbc_count_total{operation="upload",name="points"} 200', text)
+
+    def test_quiet_mode_prints_nothing(self):
+        var_df, measurement = var_frames(file_df=file_frame(n_vars=1, periods=48))[0]
+        output = io.StringIO()
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(output):
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db=server.conf_db())
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            dbc.upload_singlevar(var_df=var_df, to_bucket='test', to_measurement=measurement,
+                                 timezone_offset_to_utc_hours=1)
+            dbc.download(bucket='test', start='2024-01-01 00:00:00', stop='2024-01-02 01:00:00',
+                         timezone_offset_to_utc_hours=1)
+        self.assertEqual(output.getvalue(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
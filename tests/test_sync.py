@@ -0,0 +1,64 @@
+import tempfile
+import unittest
+
+import pandas as pd
+
+from dbc_influxdb.frames import assemble_download
+from dbc_influxdb.sync import SyncStore, series_watermarks
+
+SELECTION = dict(bucket='test', data_version=['raw'], measurements=None, fields=None,
+                 timezone_offset_to_utc_hours=1)
+
+
+def make_table(start: str, periods: int, field: str = 'TA_T1_2_1', freq: str = '30min') -> pd.DataFrame:
+    """Table as returned by the query (pivoted, projected to the download columns)"""
+    times = pd.date_range(start, periods=periods, freq=freq, tz='UTC')
+    return pd.DataFrame({'_time': times, '_measurement': 'TA', field: range(periods),
+                         'varname': field, 'data_version': 'raw', 'freq': freq})
+
+
+class TestSync(unittest.TestCase):
+    def test_watermark_per_series(self):
+        tables = [make_table('2024-01-01', 10), make_table('2024-01-01', 4, freq='10min')]
+        watermarks = series_watermarks(tables)
+        self.assertEqual(len(watermarks), 2)
+        self.assertEqual(max(watermarks.values()), '2024-01-01T04:30:00+00:00')
+
+    def test_append_and_read_with_overlap(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SyncStore(path=tmp, selection=SELECTION)
+            self.assertIsNone(store.query_start(overlap='1h'))
+            for table in [make_table('2024-01-01', 10), make_table('2024-01-01 04:00', 10)]:
+                watermarks = series_watermarks([table])
+                _, detailed, _ = assemble_download(tables=[table], timezone_offset_to_utc_hours=1)
+                store.append(data_detailed=detailed, watermarks=watermarks)
+            self.assertEqual(store.query_start(overlap='1h'), '2024-01-01T07:30:00+00:00')
+
+            reopened = SyncStore(path=tmp, selection=SELECTION)
+            data_simple, data_detailed = reopened.read()
+            df = data_detailed['TA_T1_2_1']
+            self.assertEqual(len(df), 18)
+            self.assertFalse(df.index.duplicated().any())
+            self.assertEqual(df.index[0], pd.Timestamp('2024-01-01 01:00'))
+            # Overlapping records are replaced by the later sync
+            self.assertEqual(df.loc['2024-01-01 05:00', 'TA_T1_2_1'], 0)
+            self.assertEqual(list(data_simple.columns), ['TA_T1_2_1'])
+
+    def test_stale_series_do_not_move_query_start(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SyncStore(path=tmp, selection=SELECTION)
+            store.append(data_detailed={}, watermarks={'old|units=degC': '2023-06-01T00:00:00+00:00',
+                                                       'new|units=K': '2024-01-02T00:00:00+00:00',
+                                                       'other': '2024-01-01T12:00:00+00:00'})
+            self.assertEqual(store.query_start(overlap='1h'), '2023-05-31T23:00:00+00:00')
+            self.assertEqual(store.query_start(overlap='1h', stale_after='1D'), '2024-01-01T11:00:00+00:00')
+
+    def test_store_is_bound_to_selection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            SyncStore(path=tmp, selection=SELECTION).append(data_detailed={}, watermarks={})
+            with self.assertRaises(ValueError):
+                SyncStore(path=tmp, selection=dict(SELECTION, bucket='other'))
+
+
+if __name__ == '__main__':
+    unittest.main()
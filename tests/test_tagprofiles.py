@@ -0,0 +1,195 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.standin import InfluxStandIn
+from benchmarks.synthetic import file_frame, var_frames, write_dirconf
+from dbc_influxdb.download import DownloadSpec
+from dbc_influxdb.lineprotocol import frame_to_lines
+from dbc_influxdb.main import dbcInflux
+from dbc_influxdb.tagprofiles import (PROFILES, SIDECAR_MEASUREMENT, TagProfile, reattach_metadata,
+                                      resolve_profile, sidecar_lines, split_metadata)
+
+
+def make_var_df(gains: list) -> pd.DataFrame:
+    index = pd.date_range('2024-01-01 00:30', periods=len(gains), freq='30min', tz='UTC+01:00')
+    return pd.DataFrame({'TA_T1_2_1': range(len(gains)), 'varname': 'TA_T1_2_1', 'site': 'ch-xyz',
+                         'data_version': 'raw', 'raw_units': 'C', 'gain': gains}, index=index)
+
+
+class TestTagProfile(unittest.TestCase):
+    def test_resolve(self):
+        conf_db = dict(tag_profiles=dict(lean=dict(fields=['gain'], sidecar=['raw_units'])),
+                       bucket_tag_profiles={'b1': 'lean', 'b2': 'compact'})
+        lean = resolve_profile(conf_db=conf_db, bucket='b1')
+        self.assertEqual(lean, TagProfile(name='lean', fields=('gain',), sidecar=('raw_units',)))
+        self.assertNotIn('gain', lean.tags)
+        self.assertIn('varname', lean.tags)
+        self.assertIs(resolve_profile(conf_db=conf_db, bucket='b2'), PROFILES['compact'])
+        self.assertIs(resolve_profile(conf_db=conf_db, bucket='other'), PROFILES['full'])
+        self.assertIs(resolve_profile(conf_db=conf_db, bucket='b1', name='full'), PROFILES['full'])
+        with self.assertRaises(ValueError):
+            resolve_profile(conf_db=conf_db, name='missing')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            TagProfile(name='x', sidecar=['varname'])
+        with self.assertRaises(ValueError):
+            TagProfile(name='x', fields=['gain'], sidecar=['gain'])
+        with self.assertRaises(ValueError):
+            TagProfile(name='x', fields=['unknown'])
+
+    def test_full_profile_unchanged(self):
+        var_df = make_var_df(gains=[1, 1])
+        points, sidecar = split_metadata(var_df=var_df, field='TA_T1_2_1', profile=PROFILES['full'])
+        self.assertTrue(points.equals(var_df))
+        self.assertTrue(sidecar.empty)
+
+
+class TestSidecar(unittest.TestCase):
+    def test_one_point_per_range(self):
+        profile = TagProfile(name='x', sidecar=['raw_units', 'gain'])
+        var_df = make_var_df(gains=[1, 1, 1.5, 1.5, 1])
+        points, sidecar = split_metadata(var_df=var_df, field='TA_T1_2_1', profile=profile)
+        self.assertNotIn('gain', points.columns)
+        self.assertEqual(sidecar['gain'].tolist(), ['1.0', '1.5', '1.0'])
+        self.assertEqual(list(sidecar.index), [var_df.index[0], var_df.index[2], var_df.index[4]])
+        self.assertEqual(sidecar['range_stop'].tolist(), [int(var_df.index[i].timestamp()) for i in (1, 3, 4)])
+        lines = sidecar_lines(sidecar=sidecar, profile=profile)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith(f'{SIDECAR_MEASUREMENT},'))
+        self.assertIn('raw_units="C"', lines[0])
+
+    def test_metadata_fields_only_with_value(self):
+        profile = TagProfile(name='x', fields=['gain'])
+        var_df = make_var_df(gains=[1, 1])
+        var_df.iloc[0, 0] = None
+        points, _ = split_metadata(var_df=var_df, field='TA_T1_2_1', profile=profile)
+        self.assertEqual(len(points), 1)
+
+    def test_metadata_fields_have_fixed_type(self):
+        profile = TagProfile(name='x', fields=['gain', 'raw_units'])
+        lines = []
+        for gain in (1, 0.5):
+            var_df = make_var_df(gains=[gain]).assign(raw_units=1)
+            points, _ = split_metadata(var_df=var_df, field='TA_T1_2_1', profile=profile)
+            lines += frame_to_lines(df=points, measurement='TA', tag_columns=profile.tags, precision='s')
+        self.assertIn('gain=1.0,raw_units="1"', lines[0])
+        self.assertIn('gain=0.5,raw_units="1"', lines[1])
+
+    def test_reattach(self):
+        profile = TagProfile(name='x', fields=['offset'], sidecar=['gain'])
+        index = pd.date_range('2024-01-01 00:30', periods=4, freq='30min', name='TIMESTAMP_END')
+        df = pd.DataFrame({'varname': 'TA_T1_2_1', 'site': 'ch-xyz', 'offset': 0.0, 'TA_T1_2_1': range(4)},
+                          index=index)
+        # Times are UTC, the data are in UTC+01:00
+        sidecar = pd.DataFrame({'_time': pd.to_datetime(['2023-12-31 23:30', '2024-01-01 00:30'], utc=True),
+                                '_measurement': SIDECAR_MEASUREMENT, 'varname': 'TA_T1_2_1',
+                                'site': ['ch-xyz', 'ch-xyz'], 'gain': ['1.0', '2.0'],
+                                'range_stop': [int(pd.Timestamp('2024-01-01 00:00Z').timestamp()),
+                                               int(pd.Timestamp('2024-01-01 01:00Z').timestamp())]})
+        data_detailed = reattach_metadata(data_detailed={'TA_T1_2_1': df}, sidecar_tables=[sidecar],
+                                          profile=profile, timezone_offset_to_utc_hours=1)
+        df = data_detailed['TA_T1_2_1']
+        self.assertEqual(list(df.columns), ['gain', 'offset', 'site', 'varname', 'TA_T1_2_1'])
+        self.assertEqual(df['gain'].tolist(), ['1.0', '1.0', '2.0', '2.0'])
+        self.assertEqual(df['offset'].tolist(), ['0.0'] * 4)
+
+
+class TestRoundTrip(unittest.TestCase):
+    def test_download_looks_the_same(self):
+        file_df = file_frame(n_vars=1, periods=48)
+        var_df, measurement = var_frames(file_df=file_df)[0]
+        conf = dict(tag_profiles=dict(lean=dict(fields=['offset'], sidecar=['raw_units', 'gain'])),
+                    bucket_tag_profiles=dict(lean='lean'))
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db={**server.conf_db(), **conf})
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            downloads = {}
+            for bucket in ('full', 'lean'):
+                dbc.upload_singlevar(var_df=var_df.copy(), to_bucket=bucket, to_measurement=measurement,
+                                     timezone_offset_to_utc_hours=1)
+                _, downloads[bucket], _ = dbc.download(bucket=bucket, start='2024-01-01 00:00:00',
+                                                       stop='2024-01-02 01:00:00', timezone_offset_to_utc_hours=1,
+                                                       fields=[var_df.columns[0]])
+            sidecar = {tags: fieldmap for (m, tags), fieldmap in server.store.buckets['lean'].items()
+                       if m == SIDECAR_MEASUREMENT}
+            self.assertEqual(len(sidecar), 1)
+            self.assertEqual(sorted(len(p) for p in list(sidecar.values())[0].values()), [1, 1, 1])
+            field = var_df.columns[0]
+            # Metadata fields are floats, the offset 0 (int) is returned as '0.0' instead of '0'
+            self.assertEqual(set(downloads['lean'][field]['offset']), {'0.0'})
+            downloads['full'][field]['offset'] = '0.0'
+            pd.testing.assert_frame_equal(downloads['lean'][field], downloads['full'][field], check_dtype=False)
+
+            # All measurements, the sidecar measurement is not returned as variable
+            _, data_detailed, measurements = dbc.download(bucket='lean', start='2024-01-01 00:00:00',
+                                                          stop='2024-01-02 01:00:00', timezone_offset_to_utc_hours=1)
+            self.assertEqual(measurements, {field: measurement})
+            pd.testing.assert_frame_equal(data_detailed[field], downloads['full'][field], check_dtype=False)
+
+    def test_download_many_and_sync_reattach_metadata(self):
+        file_df = file_frame(n_vars=1, periods=48)
+        var_df, measurement = var_frames(file_df=file_df)[0]
+        field = var_df.columns[0]
+        conf = dict(tag_profiles=dict(lean=dict(fields=['offset'], sidecar=['raw_units', 'gain'])),
+                    bucket_tag_profiles=dict(lean='lean'))
+        period = dict(start='2024-01-01 00:00:00', stop='2024-01-02 01:00:00')
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db={**server.conf_db(), **conf})
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='lean', to_measurement=measurement,
+                                 timezone_offset_to_utc_hours=1)
+            _, expected, _ = dbc.download(bucket='lean', timezone_offset_to_utc_hours=1, fields=[field], **period)
+            self.assertIn('raw_units', expected[field].columns)
+
+            _, many, _ = dbc.download_many(specs=[DownloadSpec(bucket='lean', fields=[field], **period)],
+                                           timezone_offset_to_utc_hours=1)
+            pd.testing.assert_frame_equal(many['lean'][field], expected[field], check_dtype=False)
+
+            _, synced = dbc.sync(bucket='lean', store=Path(tmp) / 'store', start=period['start'],
+                                 timezone_offset_to_utc_hours=1)
+            self.assertEqual(list(synced), [field])
+            pd.testing.assert_frame_equal(synced[field], expected[field], check_dtype=False, check_freq=False,
+                                          check_names=False)
+
+    def test_upsert_detects_changed_metadata(self):
+        file_df = file_frame(n_vars=1, periods=96)
+        var_df, measurement = var_frames(file_df=file_df)[0]
+        field = var_df.columns[0]
+        conf = dict(tag_profiles=dict(lean=dict(fields=['offset'], sidecar=['raw_units', 'gain'])),
+                    bucket_tag_profiles=dict(lean='lean'))
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db={**server.conf_db(), **conf})
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            report = dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='lean', to_measurement=measurement,
+                                          timezone_offset_to_utc_hours=1, upsert=True)
+            self.assertEqual(report.points_written, 96)
+            report = dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='lean', to_measurement=measurement,
+                                          timezone_offset_to_utc_hours=1, upsert=True)
+            self.assertEqual(report.points_written, 0)
+
+            # Metadata in the sidecar and in fields are compared, only changed blocks are written
+            changed = var_df.copy()
+            changed.loc[changed.index >= '2024-01-02 12:00', 'raw_units'] = 'K'
+            changed.loc[changed.index >= '2024-01-02 12:00', 'offset'] = 273
+            report = dbc.upload_singlevar(var_df=changed.copy(), to_bucket='lean', to_measurement=measurement,
+                                          timezone_offset_to_utc_hours=1, upsert=True)
+            self.assertEqual((report.blocks_skipped, report.points_written), (1, 49))
+            report = dbc.upload_singlevar(var_df=changed.copy(), to_bucket='lean', to_measurement=measurement,
+                                          timezone_offset_to_utc_hours=1, upsert=True)
+            self.assertEqual(report.points_written, 0)
+
+            _, data_detailed, _ = dbc.download(bucket='lean', start='2024-01-01 00:00:00',
+                                               stop='2024-01-03 01:00:00', timezone_offset_to_utc_hours=1,
+                                               fields=[field])
+            df = data_detailed[field]
+            expected = changed['raw_units'].reindex(df.index)
+            self.assertEqual(df['raw_units'].tolist(), expected.tolist())
+            self.assertEqual(set(df.loc[df.index >= '2024-01-02 12:00', 'offset']), {'273.0'})
+
+
+if __name__ == '__main__':
+    unittest.main()
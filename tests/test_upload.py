@@ -0,0 +1,164 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.standin import InfluxStandIn
+from benchmarks.synthetic import file_frame, filetype_config, unitmapper, write_dirconf
+from dbc_influxdb.common import tags
+from dbc_influxdb.main import dbcInflux
+from dbc_influxdb.upload import normalize_timestamps, plan_upsert
+from dbc_influxdb.varscanner import VarScanner
+
+
+def make_var_df(field: str = 'TA_T1_2_1', periods: int = 48 * 3) -> pd.DataFrame:
+    index = pd.date_range('2024-01-01 00:30', periods=periods, freq='30min', name='TIMESTAMP_END')
+    df = pd.DataFrame(index=index, data={field: np.arange(periods, dtype=float)})
+    for tag in tags:
+        df[tag] = f'-{tag}-'
+    df['varname'] = field
+    df['gain'] = 1.0
+    df['offset'] = 0.0
+    return df
+
+
+class TestDeleteBeforeUpload(unittest.TestCase):
+    def test_delete_in_timezone_of_data(self):
+        var_df = make_var_df(periods=4)
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db=server.conf_db())
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            results = []
+            delete = dbc.delete
+            dbc.delete = lambda **kwargs: results.append(delete(**kwargs)) or results[-1]
+            # A stored series with other tags is replaced over the same range
+            dbc.upload_singlevar(var_df=var_df.assign(units='K'), to_bucket='test', to_measurement='TA',
+                                 timezone_offset_to_utc_hours=8)
+            dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='test', to_measurement='TA',
+                                 timezone_offset_to_utc_hours=8)
+            outcome = results[-1].outcomes[0]
+            self.assertEqual((outcome.start, outcome.stop),
+                             ('2024-01-01T00:30:00+08:00', '2024-01-01T02:00:00+08:00'))
+            self.assertEqual(server.store.points('test'), 4)
+
+
+class TestPlanUpsert(unittest.TestCase):
+    field = 'TA_T1_2_1'
+
+    def test_unchanged_data_writes_nothing(self):
+        new = make_var_df()
+        existing = new.copy()
+        existing[['gain', 'offset']] = existing[['gain', 'offset']].astype(str)
+        plan = plan_upsert(new_df=new, existing_df=existing, field=self.field, tag_columns=tags)
+        self.assertTrue(plan.write_df.empty)
+        self.assertEqual(plan.stale_tagsets, [])
+        self.assertEqual(plan.num_blocks, 4)
+
+    def test_changed_value_writes_only_its_block(self):
+        new = make_var_df()
+        existing = new.copy()
+        new.iloc[100, 0] = -999.0
+        plan = plan_upsert(new_df=new, existing_df=existing, field=self.field, tag_columns=tags)
+        self.assertEqual(list(plan.changed_blocks), [pd.Timestamp('2024-01-03')])
+        self.assertTrue((plan.write_df.index.floor('1D') == pd.Timestamp('2024-01-03')).all())
+        self.assertEqual(len(plan.replace_blocks), 0)
+
+    def test_changed_tag_deletes_stale_series(self):
+        new = make_var_df()
+        existing = new.copy()
+        new['units'] = 'degC'
+        plan = plan_upsert(new_df=new, existing_df=existing, field=self.field, tag_columns=tags)
+        self.assertEqual(len(plan.write_df), len(new))
+        self.assertEqual(len(plan.stale_tagsets), 1)
+        self.assertEqual(plan.stale_tagsets[0]['units'], '-units-')
+
+    def test_removed_point_replaces_block(self):
+        new = make_var_df()
+        existing = new.copy()
+        new = new.drop(new.index[10])
+        plan = plan_upsert(new_df=new, existing_df=existing, field=self.field, tag_columns=tags)
+        self.assertEqual(list(plan.replace_blocks), [pd.Timestamp('2024-01-01')])
+        self.assertEqual(list(plan.changed_blocks), [pd.Timestamp('2024-01-01')])
+
+    def test_missing_value_replaces_block_with_stored_point(self):
+        new = make_var_df()
+        existing = new.copy()
+        new.iloc[10, 0] = np.nan
+        plan = plan_upsert(new_df=new, existing_df=existing, field=self.field, tag_columns=tags)
+        self.assertEqual(list(plan.replace_blocks), [pd.Timestamp('2024-01-01')])
+        self.assertEqual(list(plan.changed_blocks), [pd.Timestamp('2024-01-01')])
+
+    def test_missing_value_without_stored_point_is_unchanged(self):
+        new = make_var_df()
+        new.iloc[10, 0] = np.nan
+        existing = new.dropna(subset=[self.field])
+        plan = plan_upsert(new_df=new, existing_df=existing, field=self.field, tag_columns=tags)
+        self.assertTrue(plan.write_df.empty)
+        self.assertEqual(len(plan.replace_blocks), 0)
+
+    def test_no_existing_data_writes_everything(self):
+        new = make_var_df()
+        plan = plan_upsert(new_df=new, existing_df=None, field=self.field, tag_columns=tags)
+        self.assertEqual(len(plan.write_df), len(new))
+
+
+class TestNormalizeTimestamps(unittest.TestCase):
+    field = 'TA_T1_2_1'
+
+    def overlapping(self) -> pd.DataFrame:
+        """Two overlapping files, the second file has other values in the overlap"""
+        var_df = make_var_df(periods=6)
+        second = var_df.iloc[3:].copy()
+        second[self.field] += 100
+        return pd.concat([var_df, second]).iloc[::-1]
+
+    def test_sorted_data_unchanged(self):
+        var_df = make_var_df()
+        result, num_duplicates, unsorted = normalize_timestamps(var_df=var_df)
+        self.assertIs(result, var_df)
+        self.assertEqual((num_duplicates, unsorted), (0, False))
+
+    def test_policies(self):
+        # Rows are reversed: the last row of each timestamp is from the first file
+        last, num_duplicates, unsorted = normalize_timestamps(var_df=self.overlapping(), duplicates='last')
+        self.assertEqual((num_duplicates, unsorted), (3, True))
+        self.assertTrue(last.index.is_monotonic_increasing)
+        self.assertEqual(last[self.field].tolist(), [0, 1, 2, 3, 4, 5])
+        first, _, _ = normalize_timestamps(var_df=self.overlapping(), duplicates='first')
+        self.assertEqual(first[self.field].tolist(), [0, 1, 2, 103, 104, 105])
+        with self.assertRaises(ValueError):
+            normalize_timestamps(var_df=self.overlapping(), duplicates='error')
+        with self.assertRaises(ValueError):
+            normalize_timestamps(var_df=self.overlapping(), duplicates='mean')
+
+    def test_writers(self):
+        file_df = file_frame(n_vars=2, periods=48)
+        file_df = pd.concat([file_df, file_df.iloc[:10] + 100]).iloc[::-1]
+        data_vars, filetypeconf = filetype_config(file_df=file_df)
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            scanner = VarScanner(file_df=file_df, data_vars=data_vars, data_raw_freq='30min', freq='30min',
+                                 config_filetype=filetypeconf['filetype'], filetypeconf=filetypeconf,
+                                 conf_unitmapper=unitmapper(), to_bucket='scanner', conf_db=server.conf_db(),
+                                 logger=logging.getLogger('test'), duplicates='first', verify=True)
+            scanner.run()
+            self.assertTrue(scanner.verify_result.ok)
+            self.assertEqual(server.store.points('scanner'), int(file_df.iloc[10:].count().sum()))
+
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db=server.conf_db())
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            var_df = self.overlapping()
+            report = dbc.upload_singlevar(var_df=var_df, to_bucket='single', to_measurement='TA',
+                                          timezone_offset_to_utc_hours=1, verify=True)
+            self.assertEqual((report.duplicates, report.unsorted), (3, True))
+            self.assertEqual(report.points_written, 6)
+            self.assertTrue(report.verify.ok)
+            with self.assertRaises(ValueError):
+                dbc.upload_singlevar(var_df=self.overlapping(), to_bucket='single', to_measurement='TA',
+                                     timezone_offset_to_utc_hours=1, duplicates='error')
+
+
+if __name__ == '__main__':
+    unittest.main()
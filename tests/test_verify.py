@@ -0,0 +1,103 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.standin import InfluxStandIn
+from benchmarks.synthetic import file_frame, filetype_config, unitmapper, var_frames, write_dirconf
+from dbc_influxdb.db import get_client, get_query_api
+from dbc_influxdb.main import dbcInflux
+from dbc_influxdb.varscanner import VarScanner
+from dbc_influxdb.verify import UploadedRange, checksum_query, compare, local_checksums, verify_upload
+
+
+def make_var_df(values: list) -> pd.DataFrame:
+    index = pd.date_range('2024-01-01 22:30', periods=len(values), freq='30min', tz='UTC')
+    return pd.DataFrame({'TA_T1_2_1': values, 'data_version': 'raw'}, index=index)
+
+
+class TestChecksums(unittest.TestCase):
+    def test_local(self):
+        checksums = local_checksums(var_df=make_var_df([1.0, np.nan, 3.0, 4.0, -2.0]), field='TA_T1_2_1')
+        self.assertEqual(checksums['window'].tolist(), [pd.Timestamp('2024-01-01', tz='UTC'),
+                                                        pd.Timestamp('2024-01-02', tz='UTC')])
+        self.assertEqual(checksums['count'].tolist(), [2, 2])
+        self.assertEqual(checksums['sum'].tolist(), [4.0, 2.0])
+        self.assertEqual(checksums['min'].tolist(), [1.0, -2.0])
+        self.assertEqual(checksums['max'].tolist(), [3.0, 4.0])
+
+    def test_query(self):
+        ranges = [UploadedRange(measurement='TA', field='TA_T1_2_1', start=pd.Timestamp('2024-01-01 00:30Z'),
+                                stop=pd.Timestamp('2024-01-02 00:00Z'), data_version='raw'),
+                  UploadedRange(measurement='SW', field='SW_T1_2_1', start=pd.Timestamp('2024-01-01 01:00Z'),
+                                stop=pd.Timestamp('2024-01-03 00:00Z'))]
+        query = checksum_query(bucket='test', ranges=ranges)
+        self.assertTrue(query.startswith('import "math"\n\nfrom(bucket: "test") '
+                                         '|> range(start: 2024-01-01T00:30:00Z, stop: 2024-01-03T00:00:01Z)'))
+        self.assertIn('(r["_field"] == "TA_T1_2_1" and r["data_version"] == "raw" and '
+                      'r["_time"] >= 2024-01-01T00:30:00Z and r["_time"] <= 2024-01-02T00:00:00Z) or '
+                      '(r["_field"] == "SW_T1_2_1" and r["_time"] >= 2024-01-01T01:00:00Z', query)
+        self.assertIn('|> window(every: 1d) |> reduce(', query)
+        self.assertNotIn('pivot', query)
+
+    def test_compare(self):
+        local = local_checksums(var_df=make_var_df([1.0, 2.0, 3.0, 4.0]), field='TA_T1_2_1')
+        self.assertTrue(compare(local=local, server=local.copy(), bucket='test').ok)
+        server = local_checksums(var_df=make_var_df([1.0, 2.0, 3.0]), field='TA_T1_2_1')
+        result = compare(local=local, server=server, bucket='test')
+        self.assertEqual(result.mismatched_fields, ['TA_T1_2_1'])
+        self.assertEqual(result.mismatches['window'].tolist(), [pd.Timestamp('2024-01-02', tz='UTC')])
+        self.assertEqual(result.mismatches[['count_local', 'count_server']].values.tolist(), [[1, 0]])
+
+
+class TestVerifyUpload(unittest.TestCase):
+    def test_upload_singlevar(self):
+        var_df, measurement = var_frames(file_df=file_frame(n_vars=1, periods=96))[0]
+        field = var_df.columns[0]
+        with InfluxStandIn() as server, tempfile.TemporaryDirectory() as tmp:
+            dirconf = write_dirconf(folder=Path(tmp) / 'configs', conf_db=server.conf_db())
+            dbc = dbcInflux(dirconf=str(dirconf), quiet=True)
+            # Data of another data version in the same windows are not compared
+            other = var_df.assign(data_version='other')
+            dbc.upload_singlevar(var_df=other, to_bucket='test', to_measurement=measurement,
+                                 timezone_offset_to_utc_hours=1)
+            report = dbc.upload_singlevar(var_df=var_df.copy(), to_bucket='test', to_measurement=measurement,
+                                          timezone_offset_to_utc_hours=1, verify=True)
+            self.assertTrue(report.verify.ok)
+            self.assertEqual(report.verify.points, len(var_df))
+            self.assertEqual(report.verify.windows, 3)
+
+            # One point lost on the server
+            local = local_checksums(var_df=var_df.tz_localize('UTC+01:00'), field=field)
+            uploaded = UploadedRange(measurement=measurement, field=field, data_version='raw',
+                                     start=var_df.index[0].tz_localize('UTC+01:00'),
+                                     stop=var_df.index[-1].tz_localize('UTC+01:00'))
+            series = next(s for (m, tags), s in server.store.buckets['test'].items()
+                          if ('data_version', 'raw') in tags)
+            series[field].pop(max(series[field]))
+            client = get_client(server.conf_db())
+            result = verify_upload(query_api=get_query_api(client), bucket='test', checksums=[local],
+                                   ranges=[uploaded])
+            client.close()
+            self.assertEqual(result.mismatched_fields, [field])
+            self.assertEqual(len(result.mismatches), 1)
+
+    def test_varscanner(self):
+        file_df = file_frame(n_vars=3, periods=96)
+        data_vars, filetypeconf = filetype_config(file_df=file_df)
+        with InfluxStandIn() as server:
+            scanner = VarScanner(file_df=file_df, data_vars=data_vars, data_raw_freq='30min', freq='30min',
+                                 config_filetype=filetypeconf['filetype'], filetypeconf=filetypeconf,
+                                 conf_unitmapper=unitmapper(), to_bucket='test', conf_db=server.conf_db(),
+                                 logger=logging.getLogger('test'), verify=True)
+            scanner.run()
+        self.assertTrue(scanner.verify_result.ok)
+        self.assertEqual(scanner.verify_result.fields, 3)
+        self.assertEqual(scanner.verify_result.points, int(file_df.count().sum()))
+
+
+if __name__ == '__main__':
+    unittest.main()